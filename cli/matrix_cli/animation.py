@@ -0,0 +1,148 @@
+"""
+Sprite animations played by the device.
+
+The firmware keeps MAX_ANIMATIONS animations, each a list of sprite slots
+with per-frame durations, and advances them from its main loop with
+millis(). Once an animation is started the host sends nothing until it
+wants to stop or move it.
+"""
+
+from typing import Any, Iterable, List, Optional, Tuple
+from PIL import Image
+from .matrix import MatrixDisplay
+
+
+class Animation:
+    """An animation of sprites that are already set on the device.
+
+        animation = Animation.from_images(matrix, images, fps=10, x=24, y=24)
+        animation.start()
+        ...
+        animation.move(30, 24)
+        animation.stop(clear=True)
+
+    Frames are drawn without touching the sprites' own positions, so the
+    same slot can appear in several animations.
+    """
+
+    def __init__(
+        self,
+        matrix: MatrixDisplay,
+        animation_id: int = 0,
+        x: int = 0,
+        y: int = 0,
+        loop: bool = True,
+    ):
+        """Create an empty animation.
+
+        Args:
+            matrix: Display that plays the animation
+            animation_id: Animation ID (0-3)
+            x: X coordinate
+            y: Y coordinate
+            loop: Start over after the last frame instead of stopping on it
+        """
+        matrix._check_animation_id(animation_id)
+        self.matrix = matrix
+        self.animation_id = animation_id
+        self.x = x
+        self.y = y
+        self.loop = loop
+        self.frames: List[Tuple[int, int]] = []
+
+    @classmethod
+    def from_images(
+        cls,
+        matrix: MatrixDisplay,
+        images: Iterable[Image.Image],
+        fps: float = 10.0,
+        first_sprite: int = 0,
+        indexed: bool = False,
+        bpp: Optional[int] = None,
+        **kwargs: Any,
+    ) -> "Animation":
+        """Upload images into consecutive sprite slots and define them as
+        an animation.
+
+        Args:
+            matrix: Display to upload to
+            images: Frame images, all the same size
+            fps: Frames per second
+            first_sprite: Sprite slot of the first frame
+            indexed: Store the frames as palette indices
+            bpp: Bits per pixel when indexed; implies `indexed`
+            **kwargs: animation_id, x, y and loop, as for Animation()
+
+        Returns:
+            The animation, defined on the device but not started
+        """
+        images = [image.convert("RGB") for image in images]
+        if not 1 <= len(images) <= matrix.MAX_ANIMATION_FRAMES:
+            raise ValueError(
+                f"An animation has between 1 and {matrix.MAX_ANIMATION_FRAMES} frames"
+            )
+        if first_sprite + len(images) > matrix.MAX_SPRITES:
+            raise ValueError("Not enough sprite slots for the frames")
+
+        animation = cls(matrix, **kwargs)
+        duration = max(1, round(1000 / fps))
+        for sprite_id, image in enumerate(images, first_sprite):
+            width, height = image.size
+            if indexed or bpp is not None:
+                result = matrix.set_sprite_indexed(sprite_id, 0, 0, width, height, image, bpp)
+            else:
+                result = matrix.set_sprite(sprite_id, 0, 0, width, height, image)
+            if not result[0]:
+                raise RuntimeError(f"Failed to set sprite {sprite_id}: {result[1]}")
+            animation.add_frame(sprite_id, duration)
+
+        result = animation.upload()
+        if not result[0]:
+            raise RuntimeError(f"Failed to set animation: {result[1]}")
+        return animation
+
+    def add_frame(self, sprite_id: int, duration_ms: int) -> None:
+        """Append a frame; call upload() to send the change.
+
+        Args:
+            sprite_id: Sprite slot holding the frame
+            duration_ms: How long the frame is shown, in milliseconds
+        """
+        if len(self.frames) >= self.matrix.MAX_ANIMATION_FRAMES:
+            raise ValueError(
+                f"An animation has at most {self.matrix.MAX_ANIMATION_FRAMES} frames"
+            )
+        self.frames.append((sprite_id, duration_ms))
+
+    def upload(self) -> Tuple[bool, str]:
+        """Define the animation on the device, stopping it if it was playing.
+
+        Returns:
+            Tuple of (success, message)
+        """
+        return self.matrix.set_animation(
+            self.animation_id, self.x, self.y, self.frames, self.loop
+        )
+
+    def start(self) -> Tuple[bool, str]:
+        """Play from the first frame."""
+        return self.matrix.start_animation(self.animation_id)
+
+    def resume(self) -> Tuple[bool, str]:
+        """Play from the frame the animation was stopped on."""
+        return self.matrix.resume_animation(self.animation_id)
+
+    def stop(self, clear: bool = False) -> Tuple[bool, str]:
+        """Stop, leaving the current frame on screen unless `clear` is set."""
+        return self.matrix.stop_animation(self.animation_id, clear)
+
+    def move(self, x: int, y: int) -> Tuple[bool, str]:
+        """Move the animation; a frame on screen is redrawn at once."""
+        self.x = x
+        self.y = y
+        return self.matrix.move_animation(self.animation_id, x, y)
+
+    @property
+    def duration(self) -> int:
+        """Length of one pass through the frames, in milliseconds."""
+        return sum(duration for _, duration in self.frames)
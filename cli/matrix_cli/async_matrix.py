@@ -0,0 +1,700 @@
+"""
+Asyncio client for controlling LED matrix displays via serial.
+"""
+
+import asyncio
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Deque,
+    Dict,
+    Iterable,
+    List,
+    Optional,
+    Tuple,
+)
+import serial
+from .batch import CommandBatch
+from .framing import READY
+from .matrix import MatrixDisplay
+
+
+class _PendingAck:
+    """A command waiting for its acknowledgment."""
+
+    __slots__ = ("cmd", "size", "future")
+
+    def __init__(self, cmd: int, size: int, future: asyncio.Future):
+        self.cmd = cmd
+        self.size = size
+        self.future = future
+
+
+class AsyncMatrixDisplay(MatrixDisplay):
+    """Asyncio counterpart of MatrixDisplay.
+
+    Uses the same byte-level protocol, but every drawing and sprite method
+    returns a coroutine resolving to (success, message):
+
+        async with AsyncMatrixDisplay("/dev/ttyUSB0") as matrix:
+            await matrix.clear()
+            await asyncio.gather(*(matrix.draw_pixel(x, 0, 255, 0, 0) for x in range(64)))
+
+    The port is read by a background task that parses ACK frames and 0xFF
+    flow-control bytes, and is written without blocking the event loop.
+    Commands issued concurrently are kept in flight together, limited by the
+    firmware's serial receive buffer; ACKs are matched back to commands by
+    their command byte. Bitmap and sprite uploads wait for the link to be
+    idle and keep it to themselves until they are acknowledged. If the port
+    fails or goes away, every command waiting for an ACK fails and the
+    session is closed.
+
+    The transport uses `loop.add_reader()`, so it needs an event loop with
+    file descriptor support (any POSIX selector loop). Only plain packets
+    are sent (framing 1).
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the client; takes the same arguments as MatrixDisplay."""
+        super().__init__(*args, **kwargs)
+        if self.framing != 1:
+            raise ValueError("AsyncMatrixDisplay does not support framing 2")
+        self._fd = -1
+        self._reader_task: Optional[asyncio.Task] = None
+        self._incoming: Optional[asyncio.Queue] = None
+        self._ready: Optional[asyncio.Queue] = None
+        self._link: Optional[asyncio.Lock] = None
+        self._idle: Optional[asyncio.Event] = None
+        self._released: Optional[asyncio.Event] = None
+        self._pending: Deque[_PendingAck] = deque()
+        self._bytes_in_flight = 0
+        self._bulk_active = False
+        # Limits the commands in flight inside `pipelined()`
+        self._window: Optional[asyncio.Semaphore] = None
+        self._pipelined: List[asyncio.Task] = []
+        # Why the port stopped working, once the reader has given up on it
+        self._lost: Optional[str] = None
+        # Device (receive, render) seconds of timed ACKs, until collected
+        self._ack_timings: Dict[asyncio.Future, Tuple[float, float]] = {}
+
+    async def __aenter__(self) -> "AsyncMatrixDisplay":
+        return await self.open()
+
+    async def __aexit__(self, exc_type, exc_value, traceback) -> None:
+        await self.close()
+
+    def __enter__(self):
+        raise TypeError("Use 'async with' with AsyncMatrixDisplay")
+
+    async def open(self) -> "AsyncMatrixDisplay":
+        """Open the serial port and start the background reader.
+
+        Returns:
+            The display itself
+        """
+        if self._session:
+            return self
+        loop = asyncio.get_running_loop()
+        # Only used to open and configure the port; all I/O goes through the fd
+        self._ser = serial.Serial(self.port, self.baudrate, timeout=0)
+        self._fd = self._ser.fileno()
+        os.set_blocking(self._fd, False)
+
+        self._parser.clear()
+        self._lost = None
+        self._incoming = asyncio.Queue()
+        self._ready = asyncio.Queue()
+        self._link = asyncio.Lock()
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._released = asyncio.Event()
+        loop.add_reader(self._fd, self._on_readable)
+        self._reader_task = asyncio.create_task(self._read_loop())
+        self._session = True
+
+        chunk, credits, self.rx_buffer_size = self._parse_flow_reply(
+            *await self._send_command(self.CMD_FLOW_CONFIG, self._flow_request())
+        )
+        self._flow = chunk, credits
+        return self
+
+    async def close(self) -> None:
+        """Stop the background reader and close the serial port."""
+        if not self._session:
+            return
+        self._session = False
+        asyncio.get_running_loop().remove_reader(self._fd)
+        self._reader_task.cancel()
+        try:
+            await self._reader_task
+        except asyncio.CancelledError:
+            pass
+        for entry in self._pending:
+            entry.future.cancel()
+        self._pending.clear()
+        self._bytes_in_flight = 0
+        self._drop_connection()
+        self._fd = -1
+        self._flow = None
+        self.rx_buffer_size = self.RX_BUFFER_SIZE
+
+    @asynccontextmanager
+    async def pipelined(
+        self, window: int = MatrixDisplay.PIPELINE_WINDOW
+    ) -> AsyncIterator[None]:
+        """Start commands without waiting for each acknowledgment.
+
+        See MatrixDisplay.pipelined(). Inside the block the drawing methods
+        resolve to tasks, which in turn resolve to (success, message), as
+        soon as the command is started. Up to `window` commands are kept in
+        flight, and all of them are acknowledged when the block exits.
+
+        Args:
+            window: Maximum number of commands in flight
+        """
+        if self._window is not None:
+            raise RuntimeError("Pipelines cannot be nested")
+        self._window = asyncio.Semaphore(window)
+        try:
+            yield
+            await asyncio.gather(*self._pipelined)
+        finally:
+            for task in self._pipelined:
+                task.cancel()
+            self._pipelined = []
+            self._window = None
+
+    @asynccontextmanager
+    async def batch(self) -> AsyncIterator[CommandBatch]:
+        """Send drawing commands as CMD_BATCH packets.
+
+        See MatrixDisplay.batch(). Batchable drawing methods resolve to
+        (True, "Queued"); the one that fills a packet waits for it to be
+        sent. Batches can be used inside `pipelined()`.
+
+        Yields:
+            The batch; its `success`, `error_index` and `error_message`
+            report the outcome once the block has exited
+        """
+        if self._batch is not None:
+            raise RuntimeError("Batches cannot be nested")
+        # Keep whole packets within the firmware's serial receive buffer
+        max_packet_size = min(self.MAX_COMMAND_DATA, self.rx_buffer_size - 3)
+        batch = self._batch = CommandBatch(
+            lambda data: asyncio.ensure_future(self._send_command(self.CMD_BATCH, data)),
+            max_packet_size,
+        )
+        try:
+            yield batch
+            batch.flush()
+        finally:
+            self._batch = None
+        # Packet tasks resolve to the result, or to a task for it when pipelined
+        for index, (first, result) in enumerate(batch.results):
+            while isinstance(result, asyncio.Future):
+                result = await result
+            batch.results[index] = (first, result)
+
+    async def _flush_batch(self, add: Optional[Tuple[int, bytes]] = None) -> None:
+        """Queue a sub-command, or send the queued ones, and wait for the
+        packets this sends so that they stay ahead of later commands."""
+        sent = len(self._batch.results)
+        if add is None:
+            self._batch.flush()
+        else:
+            self._batch.add(*add)
+        for _, packet in self._batch.results[sent:]:
+            await packet
+
+    async def _submit(self, command: Awaitable) -> Any:
+        """Run a command, or start it as a task inside `pipelined()`."""
+        if self._window is None:
+            return await command
+        task = asyncio.ensure_future(self._windowed(self._window, command))
+        self._pipelined.append(task)
+        return task
+
+    @staticmethod
+    async def _windowed(window: asyncio.Semaphore, command: Awaitable) -> Any:
+        """Run a pipelined command once the window has room for it."""
+        async with window:
+            return await command
+
+    def _on_readable(self) -> None:
+        """Move whatever the port has to offer to the reader task."""
+        try:
+            data = os.read(self._fd, 4096)
+        except BlockingIOError:
+            return
+        except OSError as e:
+            data = e
+        if not data or isinstance(data, OSError):
+            # The port is gone (e.g. unplugged); stop watching it
+            asyncio.get_running_loop().remove_reader(self._fd)
+        self._incoming.put_nowait(data)
+
+    async def _read_loop(self) -> None:
+        """Parse ACK frames and flow-control bytes from the port."""
+        while True:
+            data = await self._incoming.get()
+            if not data:
+                self._connection_lost("Serial port closed")
+                return
+            if isinstance(data, OSError):
+                self._connection_lost(f"Serial error: {data}")
+                return
+
+            for event in self._parser.feed(data):
+                if event == READY:
+                    if self._bulk_active:
+                        self._ready.put_nowait(event)
+                    continue
+                timing = None
+                if event.timing is not None:
+                    self._set_device_timing(event.cmd, event.timing)
+                    timing = self.device_timing
+                self._resolve_ack(event.cmd, event.success, event.text, timing)
+
+    def _resolve_ack(
+        self,
+        cmd: int,
+        success: bool,
+        message: str,
+        timing: Optional[Tuple[float, float]] = None,
+    ) -> None:
+        """Match an ACK frame to the oldest pending command with that CMD byte."""
+        for index, entry in enumerate(self._pending):
+            if entry.cmd == cmd:
+                break
+        else:
+            return  # Stray ACK
+
+        for _ in range(index):
+            self._complete(self._pending.popleft(), False, self.ACK_TIMEOUT_MESSAGE)
+        entry = self._pending.popleft()
+        if timing is not None and self.metrics is not None:
+            self._ack_timings[entry.future] = timing
+        self._complete(entry, success, message)
+
+    def _connection_lost(self, message: str) -> None:
+        """Close the session after the port failed, failing every command."""
+        self._session = False
+        self._lost = message
+        self._fail_pending(message)
+        self._drop_connection()
+        self._fd = -1
+        self._flow = None
+        self.rx_buffer_size = self.RX_BUFFER_SIZE
+
+    def _fail_pending(self, message: str) -> None:
+        """Fail every command still waiting for an acknowledgment."""
+        while self._pending:
+            self._complete(self._pending.popleft(), False, message)
+
+    def _complete(self, entry: _PendingAck, success: bool, message: str) -> None:
+        """Resolve a pending command and release its share of the window."""
+        if not entry.future.done():
+            entry.future.set_result((success, message))
+        self._bytes_in_flight -= entry.size
+        self._released.set()
+        if not self._pending:
+            self._idle.set()
+
+    def _expect_ack(self, cmd: int, size: int) -> asyncio.Future:
+        """Register a command whose ACK is expected."""
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append(_PendingAck(cmd, size, future))
+        self._bytes_in_flight += size
+        self._idle.clear()
+        return future
+
+    def _forget(self, future: asyncio.Future) -> None:
+        """Drop a command that timed out so it no longer holds the window."""
+        for entry in self._pending:
+            if entry.future is future:
+                self._pending.remove(entry)
+                self._complete(entry, False, "Timed out")
+                return
+
+    async def _write(self, data: bytes) -> None:
+        """Write all of `data` without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        view = memoryview(data)
+        while view:
+            try:
+                written = os.write(self._fd, view)
+                view = view[written:]
+            except BlockingIOError:
+                writable = loop.create_future()
+                loop.add_writer(self._fd, writable.set_result, None)
+                try:
+                    await writable
+                finally:
+                    loop.remove_writer(self._fd)
+
+    async def _await_ack(self, future: asyncio.Future, timeout: float) -> Tuple[bool, str]:
+        """Wait for an acknowledgment, giving up after `timeout` seconds."""
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            self._forget(future)
+            return False, self.ACK_TIMEOUT_MESSAGE
+
+    async def _send_command(
+        self, cmd: int, data: bytes, payload: bytes = None
+    ) -> Tuple[bool, str]:
+        """Send a command and wait for its acknowledgment.
+
+        Args:
+            cmd: Command byte
+            data: Command data
+            payload: Additional payload to be sent
+        Returns:
+            Tuple of (success, message)
+        """
+        if not self._session:
+            raise RuntimeError("AsyncMatrixDisplay is not open")
+        if self.shadow is not None:
+            self.shadow.apply(cmd, data, payload)
+
+        if self._batch is not None and cmd != self.CMD_BATCH:
+            if cmd in self.BATCH_COMMANDS and self._batch.fits(data):
+                await self._flush_batch((cmd, data))
+                return True, "Queued"
+            await self._flush_batch()
+
+        return await self._submit(self._checked_request(cmd, data, payload))
+
+    async def _checked_request(
+        self, cmd: int, data: bytes, payload: bytes = None
+    ) -> Tuple[bool, str]:
+        """Send a mirrored command and forget the mirror if it failed."""
+        return self._check_shadow(await self._request(cmd, data, payload))
+
+    async def _request(self, cmd: int, data: bytes, payload: bytes = None) -> Tuple[bool, str]:
+        """Send a command without mirroring it and wait for its acknowledgment."""
+        if not self._session:
+            raise RuntimeError("AsyncMatrixDisplay is not open")
+
+        packet = bytes([self.START_BYTE, cmd, len(data)]) + data + (payload or b"")
+        started = time.perf_counter()
+        async with self._link:
+            # Keep unacknowledged bytes within the firmware's receive buffer
+            while (
+                self._pending
+                and self._bytes_in_flight + len(packet) > self.rx_buffer_size
+            ):
+                self._released.clear()
+                await self._released.wait()
+            if self._lost is not None:
+                return False, self._lost
+            future = self._expect_ack(cmd, len(packet))
+            await self._write(packet)
+
+        result = await self._await_ack(future, self.COMMAND_TIMEOUT)
+        if self.metrics is not None:
+            self._record(
+                cmd, len(packet), started, result, self._ack_timings.pop(future, None)
+            )
+        return result
+
+    async def _send_bitmap_with_flow_control(
+        self, cmd: int, data: bytes, payload: bytes
+    ) -> Tuple[bool, str]:
+        """Send bitmap command with flow control for large payloads.
+
+        Args:
+            cmd: Command byte
+            data: Command data (header)
+            payload: Bitmap payload data
+        Returns:
+            Tuple of (success, message), or a task resolving to it when
+            pipelined
+        """
+        if not self._session:
+            raise RuntimeError("AsyncMatrixDisplay is not open")
+        if self.shadow is not None:
+            self.shadow.apply(cmd, data, payload)
+        if self._batch is not None:
+            await self._flush_batch()
+        return await self._submit(self._bulk_transfer(cmd, data, payload))
+
+    async def _bulk_transfer(
+        self, cmd: int, data: bytes, payload: bytes
+    ) -> Tuple[bool, str]:
+        """Send a bulk command with flow control once the link is idle."""
+        chunk_size, credits = self._flow
+        started = time.perf_counter()
+        async with self._link:
+            # Flow control needs the link to itself
+            await self._idle.wait()
+            if self._lost is not None:
+                return False, self._lost
+            while not self._ready.empty():
+                self._ready.get_nowait()
+
+            self._bulk_active = True
+            try:
+                future = self._expect_ack(cmd, 0)
+                await self._write(bytes([self.START_BYTE, cmd, len(data)]) + data)
+
+                # `credits` chunks up front, one more per ready signal (0xFF)
+                granted = chunk_size * credits
+                total_sent = 0
+                while total_sent < len(payload):
+                    if total_sent >= granted:
+                        waited = time.perf_counter()
+                        ready = asyncio.ensure_future(self._ready.get())
+                        done, _ = await asyncio.wait(
+                            (ready, future),
+                            timeout=self.BULK_TIMEOUT,
+                            return_when=asyncio.FIRST_COMPLETED,
+                        )
+                        if ready not in done:
+                            ready.cancel()
+                        if future in done:
+                            # The device answered before taking the whole
+                            # payload, e.g. to reject it or after losing the port
+                            result = future.result()
+                            break
+                        if not done:
+                            self._forget(future)
+                            result = (False, self.FLOW_TIMEOUT_MESSAGE)
+                            break
+                        if self.metrics is not None:
+                            self.metrics.record_credit(cmd, time.perf_counter() - waited)
+                        granted += chunk_size
+                        continue
+
+                    end = min(granted, len(payload))
+                    await self._write(payload[total_sent:end])
+                    total_sent = end
+                else:
+                    result = await self._await_ack(future, self.BULK_TIMEOUT)
+            finally:
+                self._bulk_active = False
+
+        if self.metrics is not None:
+            self._record(
+                cmd,
+                3 + len(data) + len(payload),
+                started,
+                result,
+                self._ack_timings.pop(future, None),
+            )
+        return self._check_shadow(result)
+
+    def _check_shadow(self, result: Tuple[bool, str]) -> Tuple[bool, str]:
+        """Forget the mirrored panel contents if a command failed."""
+        if self.shadow is not None and not result[0]:
+            self.shadow.invalidate()
+        return result
+
+    async def push_frame(
+        self,
+        frame: Any,
+        x: int = 0,
+        y: int = 0,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+    ) -> Tuple[bool, str]:
+        """Show a frame, sending only the regions that changed.
+
+        See MatrixDisplay.push_frame().
+
+        Returns:
+            Tuple of (success, message)
+        """
+        updates = self._frame_updates(frame, x, y, width, height)
+        for data, payload in updates:
+            result = await self._send_bitmap_with_flow_control(
+                *self._bitmap_command(data, payload)
+            )
+            if isinstance(result, asyncio.Future):
+                result = await result
+            if not result[0]:
+                return result
+
+        if not updates:
+            return True, "Frame unchanged"
+        return True, f"Updated {len(updates)} regions"
+
+    async def ping(self, size: int = 8) -> Tuple[bool, str]:
+        """Check the link by having the device echo a random payload.
+
+        See MatrixDisplay.ping().
+
+        Returns:
+            Tuple of (success, message)
+        """
+        payload = self._ping_payload(size)
+        success, message = await self._request(self.CMD_PING, payload)
+        if success and message.encode("ascii", errors="ignore") != payload:
+            return False, "Ping echo mismatch"
+        return success, message
+
+    async def _upload_sprite(
+        self, cmd: int, data: bytes, payload: bytes, bpp: int
+    ) -> Tuple[bool, str]:
+        """Upload a sprite unless its slot already holds the same image.
+
+        See MatrixDisplay._upload_sprite().
+        """
+        sprite_id = data[0]
+        key = self._sprite_key(data, payload, bpp)
+        if self.sprite_cache and self._sprite_hashes.get(sprite_id, key) == key:
+            success, message = await self._request(
+                self.CMD_REUSE_SPRITE, self._reuse_data(data, key)
+            )
+            if success:
+                self._sprite_hashes[sprite_id] = key
+                if self.shadow is not None:
+                    self.shadow.apply(cmd, data, payload)
+                return success, message
+
+        self._sprite_hashes.pop(sprite_id, None)
+        result = await self._send_bitmap_with_flow_control(cmd, data, payload)
+        if isinstance(result, asyncio.Future):
+            result = await result
+        if result[0]:
+            self._sprite_hashes[sprite_id] = key
+        return result
+
+    async def query_sprites(self) -> Dict[int, Tuple[int, int, int, int]]:
+        """Read which images the device holds in its sprite slots.
+
+        See MatrixDisplay.query_sprites().
+
+        Returns:
+            Dict of sprite ID to (CRC-32, width, height, bpp) for active slots
+        """
+        replies = await asyncio.gather(
+            *(
+                self._request(self.CMD_QUERY_SPRITE, bytes([sprite_id]))
+                for sprite_id in range(self.MAX_SPRITES)
+            )
+        )
+        sprites = {}
+        for sprite_id, reply in enumerate(replies):
+            key = self._parse_sprite_reply(*reply)
+            if key is None:
+                self._sprite_hashes.pop(sprite_id, None)
+            else:
+                sprites[sprite_id] = self._sprite_hashes[sprite_id] = key
+        return sprites
+
+    async def query_stats(self) -> Dict[int, Dict[str, int]]:
+        """Read the device's cumulative per-opcode telemetry counters.
+
+        See MatrixDisplay.query_stats().
+
+        Returns:
+            Dict of command byte to its counters
+        """
+        success, message = await self._request(self.CMD_QUERY_STATS, b"")
+        if not success:
+            raise RuntimeError(f"Failed to query stats: {message}")
+        opcodes = self._parse_opcode_list(message)
+        replies = await asyncio.gather(
+            *(self._request(self.CMD_QUERY_STATS, bytes([cmd])) for cmd in opcodes)
+        )
+        return {
+            cmd: self._parse_stats_reply(*reply) for cmd, reply in zip(opcodes, replies)
+        }
+
+    async def set_baudrate(self, baudrate: int) -> Tuple[bool, str]:
+        """Switch the serial link to another baud rate.
+
+        See MatrixDisplay.set_baudrate(). Commands in flight are
+        acknowledged first, and the link is kept to this switch until the
+        new rate is verified or abandoned.
+
+        Args:
+            baudrate: New baud rate (9600-5000000)
+
+        Returns:
+            Tuple of (success, message)
+        """
+        if not 9600 <= baudrate <= 5000000:
+            raise ValueError("Baud rate must be between 9600 and 5000000")
+        if not self._session:
+            raise RuntimeError("AsyncMatrixDisplay is not open")
+        if baudrate == self.baudrate:
+            return True, f"Already at {baudrate} baud"
+
+        previous = self.baudrate
+        payload = self._ping_payload(16)
+        async with self._link:
+            await self._idle.wait()
+            if self._lost is not None:
+                return False, self._lost
+            success, message = await self._exclusive_request(
+                self.CMD_SET_BAUD, baudrate.to_bytes(4, "big"), self.COMMAND_TIMEOUT
+            )
+            if not success:
+                return False, message
+            switched = time.monotonic()
+
+            try:
+                self._ser.baudrate = baudrate
+                await asyncio.sleep(self.BAUD_SETTLE_TIME)
+                self._reset_input(self._ser)
+                # Leave the device time to answer before it gives up
+                success, message = await self._exclusive_request(
+                    self.CMD_PING, payload, self.BAUD_VERIFY_TIMEOUT / 2
+                )
+                if success and message.encode("ascii", errors="ignore") != payload:
+                    success, message = False, "Ping echo mismatch"
+            except (ValueError, serial.SerialException) as e:
+                # E.g. a rate the host's serial adapter does not support
+                success, message = False, str(e)
+            if success:
+                self.baudrate = baudrate
+                return True, f"Switched to {baudrate} baud"
+
+            # Wait for the device to fall back as well
+            self._ser.baudrate = previous
+            fallback = switched + self.BAUD_VERIFY_TIMEOUT + self.BAUD_SETTLE_TIME
+            await asyncio.sleep(max(0.0, fallback - time.monotonic()))
+            self._reset_input(self._ser)
+            return False, f"Link not stable at {baudrate} baud: {message}"
+
+    async def _exclusive_request(
+        self, cmd: int, data: bytes, timeout: float
+    ) -> Tuple[bool, str]:
+        """Send a command on the idle link while holding it and wait for its
+        acknowledgment."""
+        future = self._expect_ack(cmd, 3 + len(data))
+        await self._write(bytes([self.START_BYTE, cmd, len(data)]) + data)
+        return await self._await_ack(future, timeout)
+
+    async def probe_baudrate(
+        self,
+        baudrates: Iterable[int] = MatrixDisplay.PROBE_BAUDRATES,
+        pings: int = MatrixDisplay.PROBE_PINGS,
+    ) -> int:
+        """Switch to the highest baud rate at which the link is stable.
+
+        See MatrixDisplay.probe_baudrate().
+
+        Args:
+            baudrates: Candidate baud rates
+            pings: Full-size pings each rate must pass
+
+        Returns:
+            The baud rate in use afterwards
+        """
+        for baudrate in sorted(baudrates, reverse=True):
+            if not (await self.set_baudrate(baudrate))[0]:
+                continue
+            for _ in range(pings):
+                if not (await self.ping(self.MAX_COMMAND_DATA))[0]:
+                    break
+            else:
+                return baudrate
+        return self.baudrate
@@ -0,0 +1,169 @@
+"""
+Sprite sheets (atlases) for the matrix display.
+
+An atlas packs many small frames into one sprite, so a whole animation is a
+single upload. Each frame is then drawn with CMD_DRAW_SPRITE_RECT, a 10-byte
+packet that can also be batched.
+"""
+
+import os
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from PIL import Image
+from .framebuffer import Rect
+from .matrix import MatrixDisplay
+from .player import IMAGE_EXTENSIONS
+
+# Sprite width and height are single bytes
+MAX_ATLAS_SIZE = 255
+
+
+def pack_rects(
+    sizes: List[Tuple[int, int]],
+    max_width: int = MAX_ATLAS_SIZE,
+    max_height: int = MAX_ATLAS_SIZE,
+) -> Tuple[int, int, List[Tuple[int, int]]]:
+    """Pack rectangles into a small atlas.
+
+    Rectangles are placed tallest first on shelves; every atlas width that
+    fits is tried and the one with the smallest area is kept.
+
+    Args:
+        sizes: (width, height) of each rectangle
+        max_width: Largest atlas width
+        max_height: Largest atlas height
+
+    Returns:
+        Tuple of (atlas width, atlas height, (x, y) of each rectangle)
+    """
+    if not sizes:
+        raise ValueError("Nothing to pack")
+    order = sorted(range(len(sizes)), key=lambda i: (-sizes[i][1], -sizes[i][0]))
+
+    best = None
+    for width in range(max(w for w, _ in sizes), max_width + 1):
+        positions: List[Tuple[int, int]] = [(0, 0)] * len(sizes)
+        x = y = shelf_height = used_width = 0
+        for i in order:
+            w, h = sizes[i]
+            if x + w > width:
+                y += shelf_height
+                x = shelf_height = 0
+            positions[i] = (x, y)
+            x += w
+            shelf_height = max(shelf_height, h)
+            used_width = max(used_width, x)
+        height = y + shelf_height
+        if height <= max_height and (best is None or used_width * height < best[0] * best[1]):
+            best = (used_width, height, positions)
+
+    if best is None:
+        raise ValueError(f"Rectangles do not fit in a {max_width}x{max_height} atlas")
+    return best
+
+
+class Atlas:
+    """Frames packed into one sprite.
+
+        atlas = Atlas.from_directory("../resources/knight/idle")
+        atlas.upload(matrix, sprite_id=0, bpp=4)
+        for frame in range(len(atlas)):
+            atlas.draw(frame, 24, 24)
+
+    Identical frames share one rectangle of the atlas.
+    """
+
+    def __init__(self, frames: Iterable[Image.Image]):
+        """Pack frames into an atlas image.
+
+        Args:
+            frames: Frame images; frame handles are their positions
+        """
+        unique: Dict[Tuple[Tuple[int, int], bytes], int] = {}
+        images: List[Image.Image] = []
+        handles: List[int] = []
+        for frame in frames:
+            frame = frame.convert("RGB")
+            key = (frame.size, frame.tobytes())
+            if key not in unique:
+                unique[key] = len(images)
+                images.append(frame)
+            handles.append(unique[key])
+
+        width, height, positions = pack_rects([image.size for image in images])
+        self.image = Image.new("RGB", (width, height))
+        for image, position in zip(images, positions):
+            self.image.paste(image, position)
+
+        self.frames: List[Rect] = [
+            positions[index] + images[index].size for index in handles
+        ]
+        self.matrix: Optional[MatrixDisplay] = None
+        self.sprite_id: Optional[int] = None
+
+    @classmethod
+    def from_directory(cls, directory: str) -> "Atlas":
+        """Pack the images of a directory, in file name order."""
+        names = sorted(
+            name for name in os.listdir(directory) if name.lower().endswith(IMAGE_EXTENSIONS)
+        )
+        if not names:
+            raise ValueError(f"No frames found in {directory}")
+        frames = []
+        for name in names:
+            with Image.open(os.path.join(directory, name)) as img:
+                frames.append(img.convert("RGB"))
+        return cls(frames)
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """Atlas (width, height)."""
+        return self.image.size
+
+    def upload(
+        self,
+        matrix: MatrixDisplay,
+        sprite_id: int,
+        indexed: bool = False,
+        bpp: Optional[int] = None,
+    ) -> Tuple[bool, str]:
+        """Upload the atlas into a sprite slot.
+
+        Large atlases may only fit the device's sprite memory as palette
+        indices.
+
+        Args:
+            matrix: Display to upload to
+            sprite_id: Sprite slot for the atlas
+            indexed: Store the atlas as palette indices
+            bpp: Bits per pixel when indexed; implies `indexed`
+
+        Returns:
+            Tuple of (success, message)
+        """
+        width, height = self.size
+        if indexed or bpp is not None:
+            result = matrix.set_sprite_indexed(sprite_id, 0, 0, width, height, self.image, bpp)
+        else:
+            result = matrix.set_sprite(sprite_id, 0, 0, width, height, self.image)
+        self.matrix = matrix
+        self.sprite_id = sprite_id
+        return result
+
+    def draw(self, frame: int, x: int, y: int) -> Any:
+        """Draw one frame of the uploaded atlas.
+
+        Args:
+            frame: Frame handle
+            x: X coordinate
+            y: Y coordinate
+
+        Returns:
+            Tuple of (success, message), as returned by draw_sprite_rect()
+        """
+        if self.matrix is None:
+            raise RuntimeError("Upload the atlas before drawing from it")
+        src_x, src_y, width, height = self.frames[frame]
+        return self.matrix.draw_sprite_rect(self.sprite_id, src_x, src_y, width, height, x, y)
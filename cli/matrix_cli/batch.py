@@ -0,0 +1,97 @@
+"""
+Command batching for the matrix display.
+
+A batch packs several small drawing commands into CMD_BATCH packets so the
+firmware executes them back to back and answers with a single ACK.
+"""
+
+from concurrent.futures import Future
+from typing import Callable, List, Optional, Tuple, Union
+
+Result = Union[Tuple[bool, str], Future]
+PacketSender = Callable[[bytes], Result]
+
+
+class CommandBatch:
+    """Collects sub-commands and splits them into CMD_BATCH packets.
+
+    Each sub-command is encoded as CMD + LEN + DATA. A packet is sent as soon
+    as the next sub-command would no longer fit into it, and the remainder
+    when the batch is flushed.
+    """
+
+    def __init__(self, send_packet: PacketSender, max_packet_size: int):
+        """Create an empty batch.
+
+        Args:
+            send_packet: Sends the data of one CMD_BATCH packet
+            max_packet_size: Largest data section the firmware accepts
+        """
+        self.send_packet = send_packet
+        self.max_packet_size = max_packet_size
+        self.buffer = bytearray()
+        self.buffered = 0
+        self.sent = 0
+        # (index of the first sub-command, result) for each packet sent
+        self.results: List[Tuple[int, Result]] = []
+
+    def fits(self, data: bytes) -> bool:
+        """Check whether a sub-command can be carried by a batch packet at all."""
+        return len(data) + 2 <= self.max_packet_size
+
+    def add(self, cmd: int, data: bytes) -> None:
+        """Queue a sub-command, sending the current packet first if it is full.
+
+        Args:
+            cmd: Command byte
+            data: Command data
+        """
+        if len(self.buffer) + len(data) + 2 > self.max_packet_size:
+            self.flush()
+        self.buffer += bytes([cmd, len(data)])
+        self.buffer += data
+        self.buffered += 1
+
+    def flush(self) -> None:
+        """Send any queued sub-commands."""
+        if not self.buffer:
+            return
+        result = self.send_packet(bytes(self.buffer))
+        self.results.append((self.sent, result))
+        self.sent += self.buffered
+        self.buffer = bytearray()
+        self.buffered = 0
+
+    @property
+    def success(self) -> bool:
+        """Whether every packet sent so far was executed successfully."""
+        return self.error_index is None
+
+    @property
+    def error_index(self) -> Optional[int]:
+        """Index of the first failed sub-command, or None if all succeeded.
+
+        Waits for pipelined packets to be acknowledged.
+        """
+        for first, result in self.results:
+            success, message = _resolve(result)
+            if not success:
+                index, _, _ = message.partition(":")
+                return first + int(index) if index.isdigit() else first
+        return None
+
+    @property
+    def error_message(self) -> Optional[str]:
+        """Firmware message for the first failed sub-command, if any."""
+        for _, result in self.results:
+            success, message = _resolve(result)
+            if not success:
+                return message.partition(": ")[2] or message
+        return None
+
+
+def _resolve(result: Result) -> Tuple[bool, str]:
+    """Return the (success, message) tuple of a possibly pipelined result."""
+    if isinstance(result, Future):
+        return result.result()
+    return result
@@ -0,0 +1,450 @@
+"""
+Benchmarks for the matrix display client.
+
+These are meant to be run against the simulator PTY (or real hardware) to
+compare the throughput of different transport strategies.
+
+run_suite() measures the whole stack end to end and returns flat metrics
+that can be saved as JSON and compared against a baseline, so changes to the
+client or the firmware can be gated on latency and throughput.
+"""
+
+import json
+import os
+import platform
+import subprocess
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+from .codec import HAS_NUMPY, rgb888_to_rgb565
+from .matrix import MatrixDisplay
+
+CODEC_SIZES = ((64, 64), (128, 64), (256, 256))
+FLOW_WINDOWS = (128, 256, 512, 1024, 2048, 4096)
+
+# Built by `make simulator` in the repository root
+SIMULATOR_PATH = os.path.join(
+    os.path.dirname(__file__), "..", "..", "build", "wfx-led-panel-sim"
+)
+SIMULATOR_TIMEOUT = 5.0
+
+BITMAP_SIZES = ((8, 8), (16, 16), (32, 32), (64, 64))
+SUITE_VERSION = 1
+# Relative change beyond which a metric counts as a regression
+REGRESSION_TOLERANCE = 0.1
+# Tail latencies swing with the host's scheduling; they are reported only
+UNGATED_SUFFIXES = (".p95_ms",)
+
+
+def _commands_per_second(matrix: MatrixDisplay, count: int) -> float:
+    """Send `count` pixel commands and return the achieved command rate."""
+    start = time.perf_counter()
+    for i in range(count):
+        success, message = matrix.draw_pixel(i % 64, (i // 64) % 64, 255, 0, 0)
+        if not success:
+            raise RuntimeError(f"Command {i} failed: {message}")
+    return count / (time.perf_counter() - start)
+
+
+def benchmark_session(port: str, count: int = 200) -> Dict[str, float]:
+    """Compare command throughput with and without a persistent session.
+
+    Args:
+        port: Serial port of the display or simulator
+        count: Number of commands to send for each mode
+
+    Returns:
+        Dictionary mapping mode name to commands per second
+    """
+    matrix = MatrixDisplay(port)
+    results = {"per-command port": _commands_per_second(matrix, count)}
+    with matrix:
+        results["persistent session"] = _commands_per_second(matrix, count)
+    return results
+
+
+def _pipelined_per_second(matrix: MatrixDisplay, count: int, window: int) -> float:
+    """Send `count` pixel commands pipelined and return the achieved command rate."""
+    start = time.perf_counter()
+    with matrix.pipelined(window):
+        futures = [
+            matrix.draw_pixel(i % 64, (i // 64) % 64, 0, 255, 0) for i in range(count)
+        ]
+    elapsed = time.perf_counter() - start
+    for i, future in enumerate(futures):
+        success, message = future.result()
+        if not success:
+            raise RuntimeError(f"Command {i} failed: {message}")
+    return count / elapsed
+
+
+def _batched_per_second(matrix: MatrixDisplay, count: int) -> Tuple[float, int]:
+    """Send `count` pixel commands batched.
+
+    Returns:
+        Tuple of (commands per second, packets sent)
+    """
+    start = time.perf_counter()
+    with matrix.batch() as batch:
+        for i in range(count):
+            matrix.draw_pixel(i % 64, (i // 64) % 64, 0, 0, 255)
+    elapsed = time.perf_counter() - start
+    if not batch.success:
+        raise RuntimeError(f"Command {batch.error_index} failed: {batch.error_message}")
+    return count / elapsed, len(batch.results)
+
+
+def benchmark_pipeline(
+    port: str, count: int = 200, window: int = MatrixDisplay.PIPELINE_WINDOW
+) -> Dict[str, float]:
+    """Compare command throughput with and without pipelining.
+
+    Both modes use a persistent session so only the effect of keeping
+    several commands in flight is measured.
+
+    Args:
+        port: Serial port of the display or simulator
+        count: Number of commands to send for each mode
+        window: Pipeline window size
+
+    Returns:
+        Dictionary mapping mode name to commands per second
+    """
+    with MatrixDisplay(port) as matrix:
+        results = {"sequential": _commands_per_second(matrix, count)}
+        results[f"pipelined (window {window})"] = _pipelined_per_second(
+            matrix, count, window
+        )
+    return results
+
+
+def benchmark_batch(port: str, count: int = 200) -> Dict[str, float]:
+    """Compare command throughput with and without CMD_BATCH packets.
+
+    Args:
+        port: Serial port of the display or simulator
+        count: Number of commands to send for each mode
+
+    Returns:
+        Dictionary mapping mode name to commands per second
+    """
+    with MatrixDisplay(port) as matrix:
+        results = {"one ACK per command": _commands_per_second(matrix, count)}
+        rate, packets = _batched_per_second(matrix, count)
+        results[f"batched ({packets} packets)"] = rate
+    return results
+
+
+def benchmark_flow_window(
+    port: str, windows: Iterable[int] = FLOW_WINDOWS, count: int = 10
+) -> Dict[int, Tuple[int, float]]:
+    """Measure full-frame bitmap upload time for different flow windows.
+
+    Uploads a 64x64 bitmap of noise (so RLE does not apply) `count` times per
+    requested window.
+
+    Args:
+        port: Serial port of the display or simulator
+        windows: Requested flow windows in bytes
+        count: Uploads per window
+
+    Returns:
+        Dictionary mapping requested window to (granted window in bytes,
+        average milliseconds per upload)
+    """
+    frame = os.urandom(64 * 64 * 3)
+    results = {}
+    for window in windows:
+        with MatrixDisplay(port, rle=False, flow_window=window) as matrix:
+            chunk, credits = matrix.flow_control
+            start = time.perf_counter()
+            for i in range(count):
+                success, message = matrix.draw_bitmap(0, 0, 64, 64, frame)
+                if not success:
+                    raise RuntimeError(f"Upload {i} failed: {message}")
+            elapsed = time.perf_counter() - start
+        results[window] = (chunk * credits, elapsed / count * 1000)
+    return results
+
+
+def benchmark_codec(
+    sizes: Iterable[Tuple[int, int]] = CODEC_SIZES, duration: float = 0.5
+) -> Dict[Tuple[str, int, int], float]:
+    """Measure RGB888 to RGB565 conversion speed in frames per second.
+
+    Args:
+        sizes: Frame sizes (width, height) to measure
+        duration: Minimum time to spend on each measurement in seconds
+
+    Returns:
+        Dictionary mapping (backend, width, height) to frames per second
+    """
+    backends = {"python": False}
+    if HAS_NUMPY:
+        backends["numpy"] = True
+
+    results = {}
+    for width, height in sizes:
+        frame = os.urandom(width * height * 3)
+        for name, use_numpy in backends.items():
+            frames = 0
+            start = time.perf_counter()
+            elapsed = 0.0
+            while elapsed < duration:
+                rgb888_to_rgb565(frame, use_numpy=use_numpy)
+                frames += 1
+                elapsed = time.perf_counter() - start
+            results[(name, width, height)] = frames / elapsed
+    return results
+
+
+@contextmanager
+def simulator(
+    path: str = SIMULATOR_PATH,
+    timeout: float = SIMULATOR_TIMEOUT,
+    headless: bool = True,
+    dump: Optional[str] = None,
+) -> Iterator[str]:
+    """Run the simulator for the duration of a block.
+
+    Headless, the simulator opens no window and handles packets as fast as
+    they arrive instead of at most one per 16 ms frame, so only then do its
+    timings mean anything.
+
+    Args:
+        path: Simulator executable
+        timeout: Seconds to wait for it to create its serial port
+        headless: Run without a window or frame delay
+        dump: Write the final framebuffer to this PPM file when stopped
+
+    Yields:
+        Serial port (PTY) of the simulator
+    """
+    command = [path]
+    if headless:
+        command.append("--headless")
+    if dump is not None:
+        command += ["--dump", dump]
+    process = subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        stdin=subprocess.DEVNULL,
+        text=True,
+    )
+    ready = threading.Event()
+    ports: List[str] = []
+
+    def read_output() -> None:
+        # Keep reading so the simulator never blocks on a full pipe
+        for line in process.stdout:
+            if not ready.is_set() and "Serial port:" in line:
+                ports.append(line.rsplit(":", 1)[1].strip())
+                ready.set()
+        ready.set()
+
+    threading.Thread(target=read_output, daemon=True).start()
+    try:
+        if not ready.wait(timeout) or not ports:
+            raise RuntimeError(f"Simulator {path} did not report its serial port")
+        yield ports[0]
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def _percentile(samples: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def _check(result: Tuple[bool, str], what: str) -> None:
+    """Raise if a command failed, so a broken link does not look fast."""
+    if not result[0]:
+        raise RuntimeError(f"{what} failed: {result[1]}")
+
+
+def _timed(send: Callable[[], Tuple[bool, str]], count: int, what: str) -> List[float]:
+    """Run `send` `count` times and return each round trip in seconds."""
+    samples = []
+    for _ in range(count):
+        start = time.perf_counter()
+        result = send()
+        samples.append(time.perf_counter() - start)
+        _check(result, what)
+    return samples
+
+
+def _latency_commands(matrix: MatrixDisplay) -> Dict[str, Callable[[], Tuple[bool, str]]]:
+    """One representative call per opcode, for round-trip latency."""
+    return {
+        "draw_pixel": lambda: matrix.draw_pixel(1, 1, 255, 0, 0),
+        "fill_screen": lambda: matrix.fill_screen(0, 0, 0),
+        "draw_line": lambda: matrix.draw_line(0, 0, 63, 63, 0, 255, 0),
+        "draw_rect": lambda: matrix.draw_rect(4, 4, 56, 56, 0, 0, 255),
+        "clear": matrix.clear,
+        "set_brightness": lambda: matrix.set_brightness(32),
+        "print_text": lambda: matrix.print_text("A"),
+        "set_cursor": lambda: matrix.set_cursor(0, 0),
+        "fill_rect": lambda: matrix.fill_rect(8, 8, 16, 16, 255, 255, 0),
+        "draw_fast_vline": lambda: matrix.draw_fast_vline(2, 0, 64, 255, 0, 255),
+        "draw_fast_hline": lambda: matrix.draw_fast_hline(0, 2, 64, 0, 255, 255),
+        "draw_sprite": lambda: matrix.draw_sprite(0, 24, 24),
+        "move_sprite": lambda: matrix.move_sprite(0, 25, 24),
+        "draw_sprite_rect": lambda: matrix.draw_sprite_rect(0, 0, 0, 8, 8, 40, 40),
+        "ping": matrix.ping,
+    }
+
+
+def run_suite(
+    port: str, quick: bool = False, progress: Optional[Callable[[str], None]] = None
+) -> Dict[str, float]:
+    """Measure the display stack end to end.
+
+    Metric names end in their unit: `_ms` metrics are better when lower,
+    `_per_s` and `_fps` metrics when higher.
+
+    Args:
+        port: Serial port of the display or simulator
+        quick: Take fewer samples, e.g. for a smoke test
+        progress: Called with the name of each section as it starts
+
+    Returns:
+        Dictionary mapping metric name to value
+    """
+    samples = 10 if quick else 50
+    commands = 50 if quick else 300
+    uploads = 3 if quick else 10
+    duration = 0.5 if quick else 2.0
+    report = progress or (lambda section: None)
+    metrics: Dict[str, float] = {}
+
+    with MatrixDisplay(port, rle=False, sprite_cache=False) as matrix:
+        sprite = os.urandom(16 * 16 * 3)
+        _check(matrix.set_sprite(0, 24, 24, 16, 16, sprite), "Sprite upload")
+
+        report("latency")
+        for name, send in _latency_commands(matrix).items():
+            times = _timed(send, samples, name)
+            metrics[f"latency.{name}.p50_ms"] = _percentile(times, 0.50) * 1000
+            metrics[f"latency.{name}.p95_ms"] = _percentile(times, 0.95) * 1000
+
+        report("throughput")
+        metrics["throughput.sequential_per_s"] = _commands_per_second(matrix, commands)
+        metrics["throughput.pipelined_per_s"] = _pipelined_per_second(
+            matrix, commands, matrix.PIPELINE_WINDOW
+        )
+        metrics["throughput.batched_per_s"] = _batched_per_second(matrix, commands)[0]
+
+        report("bitmap")
+        for width, height in BITMAP_SIZES:
+            data = os.urandom(width * height * 3)
+            times = _timed(
+                lambda: matrix.draw_bitmap(0, 0, width, height, data), uploads, "Bitmap"
+            )
+            metrics[f"bitmap.{width}x{height}_ms"] = sum(times) / len(times) * 1000
+
+        report("sprite")
+        times = _timed(
+            lambda: matrix.set_sprite(1, 0, 0, 16, 16, sprite), uploads, "Sprite upload"
+        )
+        metrics["sprite.upload_per_s"] = len(times) / sum(times)
+        times = _timed(lambda: matrix.draw_sprite(1, 40, 40), commands, "Sprite draw")
+        metrics["sprite.draw_per_s"] = len(times) / sum(times)
+        positions = iter(range(commands))
+        times = _timed(
+            lambda: matrix.move_sprite(1, next(positions) % 48, 40), commands, "Sprite move"
+        )
+        metrics["sprite.move_per_s"] = len(times) / sum(times)
+
+        report("animation")
+        frame = os.urandom(64 * 64 * 3)
+        metrics["animation.bitmap_fps"] = _sustained_fps(
+            lambda i: matrix.draw_bitmap(0, 0, 64, 64, frame), duration
+        )
+        for slot in range(1, 9):
+            image = os.urandom(16 * 16 * 3)
+            _check(matrix.set_sprite(slot, 0, 0, 16, 16, image), "Sprite upload")
+        metrics["animation.sprite_fps"] = _sustained_fps(
+            lambda i: matrix.draw_sprite(1 + i % 8, 24, 24), duration
+        )
+        for slot in range(9):
+            matrix.clear_sprite(slot)
+    return metrics
+
+
+def _sustained_fps(draw: Callable[[int], Tuple[bool, str]], duration: float) -> float:
+    """Draw frames back to back for `duration` seconds and return frames per second."""
+    frames = 0
+    start = time.perf_counter()
+    elapsed = 0.0
+    while elapsed < duration:
+        _check(draw(frames), f"Frame {frames}")
+        frames += 1
+        elapsed = time.perf_counter() - start
+    return frames / elapsed
+
+
+def save_results(path: str, metrics: Dict[str, float], **info: Any) -> None:
+    """Write suite metrics to a JSON file.
+
+    Args:
+        path: Output file
+        metrics: Metrics returned by run_suite()
+        **info: Extra context to record, e.g. port and baudrate
+    """
+    document = {
+        "version": SUITE_VERSION,
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        **info,
+        "metrics": metrics,
+    }
+    with open(path, "w") as f:
+        json.dump(document, f, indent=2, sort_keys=True)
+
+
+def load_results(path: str) -> Dict[str, float]:
+    """Read the metrics of a JSON file written by save_results()."""
+    with open(path) as f:
+        document = json.load(f)
+    if document.get("version") != SUITE_VERSION:
+        raise ValueError(f"{path} is not a version {SUITE_VERSION} benchmark result")
+    return document["metrics"]
+
+
+def compare_results(
+    baseline: Dict[str, float],
+    current: Dict[str, float],
+    tolerance: float = REGRESSION_TOLERANCE,
+) -> List[Tuple[str, float, float, float, bool]]:
+    """Compare metrics present in both runs.
+
+    Args:
+        baseline: Metrics of the reference run
+        current: Metrics of the new run
+        tolerance: Relative change allowed before a metric regresses
+
+    Returns:
+        List of (metric, baseline, current, relative change, regressed);
+        positive changes are improvements. Metrics ending in one of
+        UNGATED_SUFFIXES never count as regressed.
+    """
+    rows = []
+    for name in sorted(baseline.keys() & current.keys()):
+        old, new = baseline[name], current[name]
+        if not old:
+            continue
+        change = (new - old) / old
+        if name.endswith("_ms"):
+            change = -change
+        regressed = change < -tolerance and not name.endswith(UNGATED_SUFFIXES)
+        rows.append((name, old, new, change, regressed))
+    return rows
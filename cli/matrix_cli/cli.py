@@ -1,3 +1,6 @@
+import sys
+import time
+from contextlib import ExitStack
 import click
 from rich.console import Console
 from rich.table import Table
@@ -5,7 +8,26 @@ from .matrix import MatrixDisplay
 from .image_utils import load_and_process_image, create_test_pattern
 from .sprite_test import run_sprite_test
 from .sprite_image_example import run_sprite_image_example
-from .sprite_animation import run_sprite_animation
+from .sprite_animation import load_frames, run_sprite_animation
+from .player import FramePlayer, image_frames, raw_rgb_frames
+from .animation import Animation
+from .atlas import Atlas
+from .wall import MatrixWall, parse_panel
+from .emulator import CostModel, FirmwareEmulator
+from .benchmarks import (
+    REGRESSION_TOLERANCE,
+    SIMULATOR_PATH,
+    benchmark_batch,
+    benchmark_codec,
+    benchmark_flow_window,
+    benchmark_pipeline,
+    benchmark_session,
+    compare_results,
+    load_results,
+    run_suite,
+    save_results,
+    simulator,
+)
 
 console = Console()
 
@@ -29,15 +51,48 @@ CMD_SET_SPRITE = 0x0E
 CMD_CLEAR_SPRITE = 0x0F
 CMD_DRAW_SPRITE = 0x10
 CMD_MOVE_SPRITE = 0x11
+CMD_BATCH = 0x12
+CMD_DRAW_BITMAP_RLE = 0x13
+CMD_DRAW_BITMAP_INDEXED = 0x14
+CMD_SET_SPRITE_INDEXED = 0x15
+CMD_FLOW_CONFIG = 0x16
+CMD_SET_BAUD = 0x17
+CMD_PING = 0x18
+CMD_QUERY_SPRITE = 0x19
+CMD_REUSE_SPRITE = 0x1A
+CMD_DRAW_SPRITE_RECT = 0x1B
+CMD_SET_ANIMATION = 0x1C
+CMD_ANIMATION_CONTROL = 0x1D
+CMD_MOVE_ANIMATION = 0x1E
+CMD_SET_TELEMETRY = 0x1F
+CMD_QUERY_STATS = 0x20
 
 
 @click.group()
-@click.option("--port", required=True, help="Serial port (e.g., /dev/ttyUSB0)")
+@click.option("--port", help="Serial port (e.g., /dev/ttyUSB0)")
+@click.option(
+    "--baudrate",
+    default=115200,
+    help="Baud rate the device is currently at (default: 115200)",
+)
+@click.option(
+    "--framing",
+    default=1,
+    type=click.IntRange(1, 2),
+    help="1: plain packets; 2: sequence numbers and CRC-16, with corrupted "
+    "packets and payload chunks sent again (default: 1)",
+)
 @click.pass_context
-def cli(ctx, port):
+def cli(ctx, port, baudrate, framing):
     """Matrix CLI - Control LED matrix displays via serial."""
+    # `wall` names its ports itself; `bench` checks per benchmark; `emulator`
+    # serves one
+    if port is None and ctx.invoked_subcommand not in ("ports", "wall", "bench", "emulator"):
+        raise click.UsageError("Missing option '--port'.")
     ctx.ensure_object(dict)
     ctx.obj["port"] = port
+    ctx.obj["baudrate"] = baudrate
+    ctx.obj["framing"] = framing
 
 
 @cli.command()
@@ -61,8 +116,13 @@ def ports():
 )
 @click.option("--x", default=0, help="X position (default: 0)")
 @click.option("--y", default=0, help="Y position (default: 0)")
+@click.option(
+    "--bpp",
+    type=click.Choice(["1", "2", "4", "8"]),
+    help="Send as a palette with this many bits per pixel",
+)
 @click.pass_context
-def bitmap(ctx, filename, x, y):
+def bitmap(ctx, filename, x, y, bpp):
     """Display an image file on the matrix display.
 
     Supports common image formats: PNG, JPG, JPEG, GIF, BMP, etc.
@@ -73,8 +133,13 @@ def bitmap(ctx, filename, x, y):
         width, height, rgb_data = load_and_process_image(filename)
 
         # Send to matrix
-        matrix = MatrixDisplay(ctx.obj["port"])
-        success, message = matrix.draw_bitmap(x, y, width, height, rgb_data)
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
+        if bpp:
+            success, message = matrix.draw_bitmap_indexed(
+                x, y, width, height, rgb_data, int(bpp)
+            )
+        else:
+            success, message = matrix.draw_bitmap(x, y, width, height, rgb_data)
 
         if success:
             console.print(f"[green]✓ {message}")
@@ -90,8 +155,13 @@ def bitmap(ctx, filename, x, y):
 @click.option("--y", default=0, help="Y position (default: 0)")
 @click.option("--width", default=32, help="Pattern width (default: 32)")
 @click.option("--height", default=16, help="Pattern height (default: 16)")
+@click.option(
+    "--bpp",
+    type=click.Choice(["1", "2", "4", "8"]),
+    help="Send as a palette with this many bits per pixel",
+)
 @click.pass_context
-def pattern(ctx, pattern, x, y, width, height):
+def pattern(ctx, pattern, x, y, width, height, bpp):
     """Display a test pattern on the matrix display."""
     try:
         # Create test pattern
@@ -99,8 +169,13 @@ def pattern(ctx, pattern, x, y, width, height):
         width, height, rgb_data = create_test_pattern(width, height, pattern)
 
         # Send to matrix
-        matrix = MatrixDisplay(ctx.obj["port"])
-        success, message = matrix.draw_bitmap(x, y, width, height, rgb_data)
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
+        if bpp:
+            success, message = matrix.draw_bitmap_indexed(
+                x, y, width, height, rgb_data, int(bpp)
+            )
+        else:
+            success, message = matrix.draw_bitmap(x, y, width, height, rgb_data)
 
         if success:
             console.print(f"[green]✓ {message}")
@@ -123,7 +198,7 @@ def pattern(ctx, pattern, x, y, width, height):
 def pixel(ctx, x, y, r, g, b):
     """Draw a single pixel at (x, y) with RGB color."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
         success, message = matrix.draw_pixel(x, y, r, g, b)
         if success:
             console.print(f"[green]✓ {message}")
@@ -147,7 +222,7 @@ def pixel(ctx, x, y, r, g, b):
 def line(ctx, x0, y0, x1, y1, r, g, b):
     """Draw a line from (x0, y0) to (x1, y1) with RGB color."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
         success, message = matrix.draw_line(x0, y0, x1, y1, r, g, b)
         if success:
             console.print(f"[green]✓ {message}")
@@ -171,7 +246,7 @@ def line(ctx, x0, y0, x1, y1, r, g, b):
 def draw_rect(ctx, x, y, width, height, r, g, b):
     """Draw rectangle outline at (x, y) with size width x height and RGB color."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
         success, message = matrix.draw_rect(x, y, width, height, r, g, b)
         if success:
             console.print(f"[green]✓ {message}")
@@ -194,7 +269,7 @@ def draw_rect(ctx, x, y, width, height, r, g, b):
 def vline(ctx, x, y, height, r, g, b):
     """Draw fast vertical line at x from y to y+height with RGB color."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
         success, message = matrix.draw_fast_vline(x, y, height, r, g, b)
         if success:
             console.print(f"[green]✓ {message}")
@@ -217,7 +292,7 @@ def vline(ctx, x, y, height, r, g, b):
 def hline(ctx, x, y, width, r, g, b):
     """Draw fast horizontal line at y from x to x+width with RGB color."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
         success, message = matrix.draw_fast_hline(x, y, width, r, g, b)
         if success:
             console.print(f"[green]✓ {message}")
@@ -235,7 +310,7 @@ def hline(ctx, x, y, width, r, g, b):
 def brightness(ctx, brightness):
     """Set display brightness (0-255)."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
         success, message = matrix.set_brightness(brightness)
         if success:
             console.print(f"[green]✓ {message}")
@@ -253,7 +328,7 @@ def brightness(ctx, brightness):
 def print_text(ctx, text):
     """Print text at current cursor position."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
         success, message = matrix.print_text(text)
         if success:
             console.print(f"[green]✓ {message}")
@@ -270,7 +345,7 @@ def print_text(ctx, text):
 def cursor(ctx, x, y):
     """Set cursor position."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
         success, message = matrix.set_cursor(x, y)
         if success:
             console.print(f"[green]✓ {message}")
@@ -288,7 +363,7 @@ def cursor(ctx, x, y):
 def fill(ctx, r, g, b):
     """Fill entire screen with color."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
         success, message = matrix.fill_screen(r, g, b)
         if success:
             console.print(f"[green]✓ {message}")
@@ -312,7 +387,7 @@ def fill(ctx, r, g, b):
 def rect(ctx, x, y, width, height, r, g, b):
     """Fill rectangle with color."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
         success, message = matrix.fill_rect(x, y, width, height, r, g, b)
         if success:
             console.print(f"[green]✓ {message}")
@@ -329,7 +404,7 @@ def rect(ctx, x, y, width, height, r, g, b):
 def clear(ctx):
     """Clear the screen."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
         success, message = matrix.clear()
         if success:
             console.print(f"[green]✓ {message}")
@@ -340,14 +415,19 @@ def clear(ctx):
 
 
 @cli.command()
-@click.argument("sprite_id", type=click.IntRange(0, 15))
+@click.argument("sprite_id", type=click.IntRange(0, MatrixDisplay.MAX_SPRITES - 1))
 @click.argument(
     "filename", type=click.Path(exists=True, file_okay=True, dir_okay=False)
 )
 @click.option("--x", default=0, help="Initial X position (default: 0)")
 @click.option("--y", default=0, help="Initial Y position (default: 0)")
+@click.option(
+    "--bpp",
+    type=click.Choice(["1", "2", "4", "8"]),
+    help="Store as a palette with this many bits per pixel",
+)
 @click.pass_context
-def set_sprite(ctx, sprite_id, filename, x, y):
+def set_sprite(ctx, sprite_id, filename, x, y, bpp):
     """Set a sprite with image data from a file.
 
     Supports common image formats: PNG, JPG, JPEG, GIF, BMP, etc.
@@ -358,10 +438,15 @@ def set_sprite(ctx, sprite_id, filename, x, y):
         img_width, img_height, rgb_data = load_and_process_image(filename)
 
         # Send to matrix
-        matrix = MatrixDisplay(ctx.obj["port"])
-        success, message = matrix.set_sprite(
-            sprite_id, x, y, img_width, img_height, rgb_data
-        )
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
+        if bpp:
+            success, message = matrix.set_sprite_indexed(
+                sprite_id, x, y, img_width, img_height, rgb_data, int(bpp)
+            )
+        else:
+            success, message = matrix.set_sprite(
+                sprite_id, x, y, img_width, img_height, rgb_data
+            )
 
         if success:
             console.print(f"[green]✓ {message}")
@@ -372,12 +457,12 @@ def set_sprite(ctx, sprite_id, filename, x, y):
 
 
 @cli.command()
-@click.argument("sprite_id", type=click.IntRange(0, 15))
+@click.argument("sprite_id", type=click.IntRange(0, MatrixDisplay.MAX_SPRITES - 1))
 @click.pass_context
 def clear_sprite(ctx, sprite_id):
     """Clear a sprite from memory and screen."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
         success, message = matrix.clear_sprite(sprite_id)
         if success:
             console.print(f"[green]✓ {message}")
@@ -388,14 +473,14 @@ def clear_sprite(ctx, sprite_id):
 
 
 @cli.command()
-@click.argument("sprite_id", type=click.IntRange(0, 15))
+@click.argument("sprite_id", type=click.IntRange(0, MatrixDisplay.MAX_SPRITES - 1))
 @click.argument("x", type=int)
 @click.argument("y", type=int)
 @click.pass_context
 def draw_sprite(ctx, sprite_id, x, y):
     """Draw a sprite at a specific location."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
         success, message = matrix.draw_sprite(sprite_id, x, y)
         if success:
             console.print(f"[green]✓ {message}")
@@ -406,14 +491,14 @@ def draw_sprite(ctx, sprite_id, x, y):
 
 
 @cli.command()
-@click.argument("sprite_id", type=click.IntRange(0, 15))
+@click.argument("sprite_id", type=click.IntRange(0, MatrixDisplay.MAX_SPRITES - 1))
 @click.argument("x", type=int)
 @click.argument("y", type=int)
 @click.pass_context
 def move_sprite(ctx, sprite_id, x, y):
     """Move a sprite to a new location and update its stored position."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
         success, message = matrix.move_sprite(sprite_id, x, y)
         if success:
             console.print(f"[green]✓ {message}")
@@ -423,13 +508,129 @@ def move_sprite(ctx, sprite_id, x, y):
         console.print(f"[red]Error: {e}")
 
 
+@cli.command()
+@click.pass_context
+def sprites(ctx):
+    """List the sprites held by the device."""
+    try:
+        with MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"]) as matrix:
+            slots = matrix.query_sprites()
+        table = Table(title=f"Sprites ({len(slots)} of {MatrixDisplay.MAX_SPRITES} slots)")
+        table.add_column("ID", style="cyan", justify="right")
+        table.add_column("Size", style="green")
+        table.add_column("Format", style="yellow")
+        table.add_column("CRC-32", style="magenta")
+        for sprite_id, (crc, width, height, bpp) in slots.items():
+            fmt = "RGB565" if bpp == 16 else f"{bpp}-bit indexed"
+            table.add_row(str(sprite_id), f"{width}x{height}", fmt, f"{crc:08x}")
+        console.print(table)
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+
+
+@cli.command()
+@click.option("--off", is_flag=True, help="Stop timing commands")
+@click.option("--reset", is_flag=True, help="Zero the device's per-command counters")
+@click.pass_context
+def telemetry(ctx, off, reset):
+    """Have the device time every command it executes."""
+    try:
+        with MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"]) as matrix:
+            success, message = matrix.set_telemetry(not off, reset)
+        if success:
+            console.print(f"[green]✓ {message}")
+        else:
+            console.print(f"[red]✗ Error: {message}")
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+
+
+@cli.command()
+@click.pass_context
+def device_stats(ctx):
+    """Show the device's per-command timing counters."""
+    try:
+        with MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"]) as matrix:
+            stats = matrix.query_stats()
+        names = MatrixDisplay.command_names()
+        table = Table(title="Device timing (averages per command)")
+        table.add_column("Command", style="cyan")
+        table.add_column("Count", style="green", justify="right")
+        table.add_column("Failures", style="red", justify="right")
+        table.add_column("Receive (ms)", style="yellow", justify="right")
+        table.add_column("Render (ms)", style="yellow", justify="right")
+        table.add_column("Max (ms)", style="magenta", justify="right")
+        for cmd, values in stats.items():
+            count = values["count"] or 1
+            table.add_row(
+                names.get(cmd, f"0x{cmd:02x}"),
+                str(values["count"]),
+                str(values["failures"]),
+                f"{values['receive'] / count / 1000:.3f}",
+                f"{values['render'] / count / 1000:.3f}",
+                f"{values['max'] / 1000:.3f}",
+            )
+        console.print(table)
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+
+
+@cli.command()
+@click.option("--size", default=8, type=click.IntRange(0, 255), help="Payload bytes (default: 8)")
+@click.pass_context
+def ping(ctx, size):
+    """Check the link by having the device echo a payload."""
+    try:
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
+        success, message = matrix.ping(size)
+        if success:
+            console.print(f"[green]✓ Echo received ({size} bytes)")
+        else:
+            console.print(f"[red]✗ Error: {message}")
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+
+
+@cli.command()
+@click.argument("rate", type=click.IntRange(9600, 5000000))
+@click.pass_context
+def baud(ctx, rate):
+    """Switch the link to another baud rate until the device resets.
+
+    Pass --baudrate RATE to later commands.
+    """
+    try:
+        matrix = MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"])
+        success, message = matrix.set_baudrate(rate)
+        if success:
+            console.print(f"[green]✓ {message}")
+            console.print(f"[blue]Use --baudrate {rate} for the next commands")
+        else:
+            console.print(f"[red]✗ Error: {message}")
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+
+
+@cli.command()
+@click.pass_context
+def probe_baud(ctx):
+    """Switch to the highest baud rate at which the link is stable."""
+    try:
+        with MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"]) as matrix:
+            rate = matrix.probe_baudrate()
+        console.print(f"[green]✓ Link stable at {rate} baud")
+        console.print(f"[blue]Use --baudrate {rate} for the next commands")
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+
+
 @cli.command()
 @click.pass_context
 def sprite_test(ctx):
     """Test sprite functionality."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
-        run_sprite_test(matrix)
+        with MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"]) as matrix:
+            run_sprite_test(matrix)
     except Exception as e:
         console.print(f"[red]Error: {e}")
 
@@ -439,8 +640,8 @@ def sprite_test(ctx):
 def sprite_image_example(ctx):
     """Test sprite image functionality."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
-        run_sprite_image_example(matrix)
+        with MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"]) as matrix:
+            run_sprite_image_example(matrix)
     except Exception as e:
         console.print(f"[red]Error: {e}")
 
@@ -450,11 +651,429 @@ def sprite_image_example(ctx):
 def sprite_animation(ctx):
     """Test sprite animation functionality."""
     try:
-        matrix = MatrixDisplay(ctx.obj["port"])
-        run_sprite_animation(matrix)
+        with MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"]) as matrix:
+            run_sprite_animation(matrix)
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+
+
+@cli.command()
+@click.argument(
+    "directory", type=click.Path(exists=True, file_okay=False, dir_okay=True)
+)
+@click.option("--sprite-id", default=0, type=click.IntRange(0, MatrixDisplay.MAX_SPRITES - 1),
+              help="Sprite slot for the atlas (default: 0)")
+@click.option(
+    "--bpp",
+    type=click.Choice(["1", "2", "4", "8"]),
+    help="Store the atlas as a palette with this many bits per pixel",
+)
+@click.option("--fps", default=10.0, help="Frames per second (default: 10)")
+@click.option("--loops", default=3, help="Times to play the frames (default: 3)")
+@click.pass_context
+def atlas(ctx, directory, sprite_id, bpp, fps, loops):
+    """Upload the frames in DIRECTORY as one sprite sheet and play them."""
+    try:
+        sheet = Atlas.from_directory(directory)
+        width, height = sheet.size
+        console.print(f"[blue]Packed {len(sheet)} frames into a {width}x{height} atlas")
+
+        with MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"]) as matrix:
+            success, message = sheet.upload(
+                matrix, sprite_id, bpp=int(bpp) if bpp else None
+            )
+            if not success:
+                console.print(f"[red]✗ Error: {message}")
+                return
+
+            frame_width, frame_height = sheet.frames[0][2:]
+            x = (matrix.width - frame_width) // 2
+            y = (matrix.height - frame_height) // 2
+            for _ in range(loops):
+                for frame in range(len(sheet)):
+                    sheet.draw(frame, x, y)
+                    time.sleep(1 / fps)
+        console.print(f"[green]✓ Played {len(sheet)} frames {loops} times")
+    except KeyboardInterrupt:
+        console.print("[yellow]Playback stopped")
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+
+
+@cli.command()
+@click.argument(
+    "directory", type=click.Path(exists=True, file_okay=False, dir_okay=True)
+)
+@click.option("--animation-id", default=0,
+              type=click.IntRange(0, MatrixDisplay.MAX_ANIMATIONS - 1),
+              help="Animation slot (default: 0)")
+@click.option("--first-sprite", default=0, type=click.IntRange(0, MatrixDisplay.MAX_SPRITES - 1),
+              help="Sprite slot of the first frame (default: 0)")
+@click.option("-x", "--x", type=int, help="X coordinate (default: centered)")
+@click.option("-y", "--y", type=int, help="Y coordinate (default: centered)")
+@click.option(
+    "--bpp",
+    type=click.Choice(["1", "2", "4", "8"]),
+    help="Store the frames as a palette with this many bits per pixel",
+)
+@click.option("--fps", default=10.0, help="Frames per second (default: 10)")
+@click.option("--once", is_flag=True, help="Stop on the last frame instead of looping")
+@click.pass_context
+def animate(ctx, directory, animation_id, first_sprite, x, y, bpp, fps, once):
+    """Upload the frames in DIRECTORY and let the device play them."""
+    try:
+        frames = load_frames(directory)
+        with MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"]) as matrix:
+            if x is None:
+                x = (matrix.width - frames[0].width) // 2
+            if y is None:
+                y = (matrix.height - frames[0].height) // 2
+            animation = Animation.from_images(
+                matrix,
+                frames,
+                fps=fps,
+                first_sprite=first_sprite,
+                bpp=int(bpp) if bpp else None,
+                animation_id=animation_id,
+                x=x,
+                y=y,
+                loop=not once,
+            )
+            success, message = animation.start()
+            if success:
+                console.print(
+                    f"[green]✓ Playing {len(frames)} frames as animation {animation_id}"
+                )
+            else:
+                console.print(f"[red]✗ Error: {message}")
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+
+
+@cli.command()
+@click.argument("animation_id", type=click.IntRange(0, MatrixDisplay.MAX_ANIMATIONS - 1))
+@click.option("--clear", is_flag=True, help="Clear the current frame from the screen")
+@click.pass_context
+def stop_animation(ctx, animation_id, clear):
+    """Stop an animation the device is playing."""
+    try:
+        with MatrixDisplay(ctx.obj["port"], ctx.obj["baudrate"], framing=ctx.obj["framing"]) as matrix:
+            success, message = matrix.stop_animation(animation_id, clear)
+            if success:
+                console.print(f"[green]✓ {message}")
+            else:
+                console.print(f"[red]✗ Error: {message}")
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+
+
+@cli.command()
+@click.argument("source")
+@click.option("--fps", default=30.0, help="Target frames per second (default: 30)")
+@click.option("--x", default=0, help="X position (default: 0)")
+@click.option("--y", default=0, help="Y position (default: 0)")
+@click.option("--width", default=64, help="Frame width (default: 64)")
+@click.option("--height", default=64, help="Frame height (default: 64)")
+@click.option(
+    "--delta/--full",
+    default=False,
+    help="Send only changed regions (requires NumPy) or full frames (default)",
+)
+@click.pass_context
+def play(ctx, source, fps, x, y, width, height, delta):
+    """Play frames from SOURCE at a fixed frame rate.
+
+    SOURCE is an image directory, an image file (animated GIFs play every
+    frame) or "-" for raw RGB24 frames on stdin, e.g.:
+
+    ffmpeg -i video.mp4 -vf scale=64:64 -f rawvideo -pix_fmt rgb24 - |
+    matrix-cli --port /dev/ttyUSB0 play -
+    """
+    try:
+        if source == "-":
+            frames = raw_rgb_frames(sys.stdin.buffer, width, height)
+        else:
+            frames = image_frames(source, width, height)
+
+        with MatrixDisplay(
+            ctx.obj["port"], ctx.obj["baudrate"], shadow=delta, framing=ctx.obj["framing"]
+        ) as matrix:
+            player = FramePlayer(matrix, fps, x, y, width, height)
+            stats = player.play(frames)
+
+        table = Table(title="Playback")
+        table.add_column("Metric", style="cyan")
+        table.add_column("Value", style="green", justify="right")
+        table.add_row("Frames shown", str(stats.frames_shown))
+        table.add_row("Frames dropped", str(stats.frames_dropped))
+        table.add_row("Frames failed", str(stats.frames_failed))
+        table.add_row("Achieved fps", f"{stats.fps:.1f} / {fps:g}")
+        table.add_row("Link utilization", f"{stats.link_utilization:.0%}")
+        console.print(table)
+    except KeyboardInterrupt:
+        console.print("[yellow]Playback stopped")
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+
+
+@cli.command()
+@click.argument("source")
+@click.argument("panels", nargs=-1, required=True)
+@click.option("--fps", default=10.0, help="Target frames per second (default: 10)")
+@click.option(
+    "--delta/--full",
+    default=False,
+    help="Send only changed regions (requires NumPy) or full frames (default)",
+)
+@click.pass_context
+def wall(ctx, source, panels, fps, delta):
+    """Play frames from SOURCE across several boards at once.
+
+    PANELS are given as PORT=X,Y or PORT=X,Y,WxH (64x64 by default), e.g.:
+
+    matrix-cli wall video.gif /dev/ttyUSB0=0,0 /dev/ttyUSB1=64,0
+    """
+    try:
+        layout = dict(parse_panel(panel) for panel in panels)
+        with MatrixWall(
+            layout, ctx.obj["baudrate"], shadow=delta, framing=ctx.obj["framing"]
+        ) as matrix_wall:
+            frames = image_frames(source, matrix_wall.width, matrix_wall.height)
+            console.print(
+                f"[blue]Playing on a {matrix_wall.width}x{matrix_wall.height} wall "
+                f"of {len(layout)} panels"
+            )
+            shown = 0
+            slowest = 0.0
+            start = time.perf_counter()
+            for index, frame in enumerate(frames):
+                delay = start + index / fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                if delta:
+                    success, message = matrix_wall.push_frame(frame)
+                else:
+                    success, message = matrix_wall.draw_bitmap(
+                        0, 0, matrix_wall.width, matrix_wall.height, frame
+                    )
+                if not success:
+                    console.print(f"[red]✗ Error: {message}")
+                    return
+                shown += 1
+                slowest = max(slowest, *matrix_wall.timings.values())
+            # The last frame is shown for a whole frame time too
+            elapsed = max(time.perf_counter() - start, shown / fps)
+
+        console.print(
+            f"[green]✓ Showed {shown} frames at {shown / elapsed if elapsed else 0:.1f} fps "
+            f"(slowest board update: {slowest * 1000:.0f} ms)"
+        )
+    except KeyboardInterrupt:
+        console.print("[yellow]Playback stopped")
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+
+
+@cli.group()
+@click.pass_context
+def bench(ctx):
+    """Benchmark the display link (use the simulator PTY or real hardware)."""
+    if ctx.obj["port"] is None and ctx.invoked_subcommand not in ("codec", "suite"):
+        raise click.UsageError("Missing option '--port'.")
+
+
+@bench.command()
+@click.option("--count", default=200, help="Commands per mode (default: 200)")
+@click.pass_context
+def session(ctx, count):
+    """Compare commands/sec with per-command ports vs a persistent session."""
+    try:
+        results = benchmark_session(ctx.obj["port"], count)
+        table = Table(title=f"Session benchmark ({count} commands)")
+        table.add_column("Mode", style="cyan")
+        table.add_column("Commands/sec", style="green", justify="right")
+        for mode, rate in results.items():
+            table.add_row(mode, f"{rate:.1f}")
+        console.print(table)
     except Exception as e:
         console.print(f"[red]Error: {e}")
 
 
+@bench.command()
+@click.option("--count", default=200, help="Commands per mode (default: 200)")
+@click.option(
+    "--window",
+    default=MatrixDisplay.PIPELINE_WINDOW,
+    help=f"Commands in flight (default: {MatrixDisplay.PIPELINE_WINDOW})",
+)
+@click.pass_context
+def pipeline(ctx, count, window):
+    """Compare commands/sec with and without pipelining."""
+    try:
+        results = benchmark_pipeline(ctx.obj["port"], count, window)
+        table = Table(title=f"Pipeline benchmark ({count} commands)")
+        table.add_column("Mode", style="cyan")
+        table.add_column("Commands/sec", style="green", justify="right")
+        for mode, rate in results.items():
+            table.add_row(mode, f"{rate:.1f}")
+        console.print(table)
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+
+
+@bench.command()
+@click.option("--count", default=200, help="Commands per mode (default: 200)")
+@click.pass_context
+def batch(ctx, count):
+    """Compare commands/sec with one ACK per command vs CMD_BATCH packets."""
+    try:
+        results = benchmark_batch(ctx.obj["port"], count)
+        table = Table(title=f"Batch benchmark ({count} commands)")
+        table.add_column("Mode", style="cyan")
+        table.add_column("Commands/sec", style="green", justify="right")
+        for mode, rate in results.items():
+            table.add_row(mode, f"{rate:.1f}")
+        console.print(table)
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+
+
+@bench.command()
+@click.option("--count", default=10, help="Uploads per window (default: 10)")
+@click.pass_context
+def window(ctx, count):
+    """Compare 64x64 bitmap upload time across flow control windows."""
+    try:
+        results = benchmark_flow_window(ctx.obj["port"], count=count)
+        table = Table(title=f"Flow window benchmark ({count} uploads)")
+        table.add_column("Requested window", style="cyan", justify="right")
+        table.add_column("Granted window", style="yellow", justify="right")
+        table.add_column("ms/upload", style="green", justify="right")
+        for requested, (granted, ms) in results.items():
+            table.add_row(f"{requested} B", f"{granted} B", f"{ms:.1f}")
+        console.print(table)
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+
+
+@bench.command()
+def codec():
+    """Measure RGB888 to RGB565 conversion frames/sec (no device needed)."""
+    results = benchmark_codec()
+    table = Table(title="RGB565 codec benchmark")
+    table.add_column("Backend", style="cyan")
+    table.add_column("Frame size", style="yellow")
+    table.add_column("Frames/sec", style="green", justify="right")
+    for (backend, width, height), fps in results.items():
+        table.add_row(backend, f"{width}x{height}", f"{fps:.1f}")
+    console.print(table)
+
+
+
+@bench.command()
+@click.option(
+    "--simulator",
+    "simulator_path",
+    is_flag=False,
+    flag_value=SIMULATOR_PATH,
+    default=None,
+    help="Start the simulator (optionally at this path) instead of using --port",
+)
+@click.option("--output", "-o", type=click.Path(dir_okay=False),
+              help="Write the metrics to this JSON file")
+@click.option("--compare", "baseline", type=click.Path(exists=True, dir_okay=False),
+              help="Compare with a baseline JSON file; exit with status 1 on regressions")
+@click.option("--tolerance", default=REGRESSION_TOLERANCE,
+              help=f"Relative change counted as a regression (default: {REGRESSION_TOLERANCE})")
+@click.option("--quick", is_flag=True, help="Take fewer samples")
+@click.pass_context
+def suite(ctx, simulator_path, output, baseline, tolerance, quick):
+    """Measure latency per opcode, throughput, bitmap, sprite and animation
+    rates end to end."""
+    try:
+        if simulator_path is None and ctx.obj["port"] is None:
+            raise click.UsageError("Give --port or --simulator")
+        with ExitStack() as stack:
+            port = ctx.obj["port"]
+            if simulator_path is not None:
+                port = stack.enter_context(simulator(simulator_path))
+                console.print(f"[blue]Simulator started on {port}")
+            metrics = run_suite(
+                port, quick, lambda section: console.print(f"[blue]Measuring {section}...")
+            )
+    except click.UsageError:
+        raise
+    except Exception as e:
+        console.print(f"[red]Error: {e}")
+        ctx.exit(1)
+
+    if output:
+        save_results(output, metrics, port=port, baudrate=ctx.obj["baudrate"])
+        console.print(f"[green]✓ Wrote {len(metrics)} metrics to {output}")
+
+    if not baseline:
+        table = Table(title="Benchmark suite")
+        table.add_column("Metric", style="cyan")
+        table.add_column("Value", style="green", justify="right")
+        for name, value in metrics.items():
+            table.add_row(name, f"{value:.2f}")
+        console.print(table)
+        return
+
+    rows = compare_results(load_results(baseline), metrics, tolerance)
+    table = Table(title=f"Benchmark suite vs {baseline}")
+    table.add_column("Metric", style="cyan")
+    table.add_column("Baseline", justify="right")
+    table.add_column("Current", justify="right")
+    table.add_column("Change", justify="right")
+    for name, old, new, change, regressed in rows:
+        style = "red" if regressed else "green" if change > tolerance else "white"
+        table.add_row(name, f"{old:.2f}", f"{new:.2f}", f"[{style}]{change:+.0%}")
+    console.print(table)
+    regressions = [row[0] for row in rows if row[4]]
+    if regressions:
+        console.print(f"[red]✗ {len(regressions)} metrics regressed by more than {tolerance:.0%}")
+        ctx.exit(1)
+    console.print("[green]✓ No regressions")
+
+
+@cli.command()
+@click.option("--no-throttle", is_flag=True,
+              help="Deliver bytes at once instead of at the link's baud rate")
+@click.option("--no-cost", is_flag=True, help="Execute commands in no device time")
+@click.option("--dump", type=click.Path(dir_okay=False),
+              help="Write the panel contents to this PPM file on exit")
+@click.option("--errors", default=0.0, type=click.FloatRange(0, 1, max_open=True),
+              help="Chance of a bit error in each byte sent either way (default: 0)")
+@click.pass_context
+def emulator(ctx, no_throttle, no_cost, dump, errors):
+    """Run the firmware emulator on a pseudo-terminal until Ctrl+C.
+
+    It starts at --baudrate, so the CLI can then use the same rate.
+    """
+    try:
+        firmware = FirmwareEmulator(
+            throttle=not no_throttle,
+            cost=None if no_cost else CostModel(),
+            baud_rate=ctx.obj["baudrate"],
+            error_rate=errors,
+        )
+    except (RuntimeError, ValueError) as e:
+        console.print(f"[red]Error: {e}")
+        return
+    try:
+        console.print(f"[green]✓ Emulator ready. Serial port: {firmware.serve_pty()}")
+        console.print("Press Ctrl+C to stop")
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        console.print("[yellow]Emulator stopped")
+    finally:
+        firmware.stop()
+        if dump:
+            firmware.save_ppm(dump)
+            console.print(f"[green]✓ Wrote the panel contents to {dump}")
+
+
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,383 @@
+"""
+Color conversion between RGB888 input data and the RGB565 wire format.
+
+NumPy is used when it is installed; otherwise a pure Python implementation
+based on `array` is used. Both produce big-endian RGB565 (high byte first),
+which is what the firmware expects.
+"""
+
+import sys
+from array import array
+from typing import Any, List, Optional, Tuple
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is an optional dependency
+    np = None
+
+HAS_NUMPY = np is not None
+
+
+def rgb888_size(data: Any) -> int:
+    """Return the size in bytes of RGB888 data.
+
+    Args:
+        data: bytes-like object, PIL image or NumPy array
+
+    Returns:
+        Number of RGB888 bytes (3 per pixel)
+    """
+    if isinstance(data, Image.Image):
+        return data.width * data.height * 3
+    if HAS_NUMPY and isinstance(data, np.ndarray):
+        return data.size
+    return memoryview(data).nbytes
+
+
+def _rgb565_numpy_array(data: Any) -> "np.ndarray":
+    """Convert RGB888 data to a flat array of native-endian RGB565 values."""
+    if isinstance(data, Image.Image):
+        if data.mode != "RGB":
+            data = data.convert("RGB")
+        pixels = np.asarray(data)
+    elif isinstance(data, np.ndarray):
+        pixels = data
+    else:
+        # Wraps the buffer without copying it
+        pixels = np.frombuffer(data, dtype=np.uint8)
+    pixels = pixels.reshape(-1, 3)
+
+    r = pixels[:, 0].astype(np.uint16)
+    g = pixels[:, 1].astype(np.uint16)
+    b = pixels[:, 2].astype(np.uint16)
+    return ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+
+
+def _rgb565_numpy(data: Any) -> bytes:
+    """Convert RGB888 data to big-endian RGB565 using NumPy."""
+    return _rgb565_numpy_array(data).astype(">u2").tobytes()
+
+
+def _rgb565_python(data: Any) -> bytes:
+    """Convert RGB888 data to big-endian RGB565 without NumPy."""
+    if isinstance(data, Image.Image):
+        if data.mode != "RGB":
+            data = data.convert("RGB")
+        data = data.tobytes()
+
+    view = memoryview(data).cast("B")
+    colors = array(
+        "H",
+        [
+            ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+            for r, g, b in zip(view[0::3], view[1::3], view[2::3])
+        ],
+    )
+    if sys.byteorder == "little":
+        colors.byteswap()
+    return colors.tobytes()
+
+
+def rgb888_to_rgb565(data: Any, use_numpy: Optional[bool] = None) -> bytes:
+    """Convert RGB888 pixel data to big-endian RGB565.
+
+    Args:
+        data: RGB888 data as bytes, bytearray, memoryview, PIL image or
+            NumPy array of shape (..., 3)
+        use_numpy: Force the NumPy (True) or pure Python (False)
+            implementation. Defaults to NumPy when it is available.
+
+    Returns:
+        RGB565 data (2 bytes per pixel, high byte first)
+    """
+    if use_numpy is None:
+        use_numpy = HAS_NUMPY
+    if use_numpy:
+        if not HAS_NUMPY:
+            raise RuntimeError("NumPy is not installed")
+        return _rgb565_numpy(data)
+    return _rgb565_python(data)
+
+
+def rgb888_to_rgb565_array(data: Any, width: int, height: int) -> "np.ndarray":
+    """Convert RGB888 pixel data to a 2D array of RGB565 values (NumPy only).
+
+    Args:
+        data: RGB888 data as bytes-like object, PIL image or NumPy array
+        width: Image width
+        height: Image height
+
+    Returns:
+        uint16 array of shape (height, width) in native byte order
+    """
+    if not HAS_NUMPY:
+        raise RuntimeError("NumPy is not installed")
+    return _rgb565_numpy_array(data).reshape(height, width)
+
+
+# Run-length encoding of RGB565 data (CMD_DRAW_BITMAP_RLE). Each run starts
+# with a control byte: 0x80 | (n - 1) is followed by one pixel repeated n
+# times, n - 1 (below 0x80) by n literal pixels. Runs hold 1 to 128 pixels.
+RLE_MAX_RUN = 128
+
+
+def _rle_runs_numpy(data: bytes) -> Tuple["np.ndarray", "np.ndarray"]:
+    """Find runs of equal RGB565 pixels using NumPy."""
+    pixels = np.frombuffer(data, dtype=np.uint16)
+    if not len(pixels):
+        return np.zeros(0, dtype=np.intp), np.zeros(0, dtype=np.intp)
+    starts = np.flatnonzero(np.concatenate(([True], pixels[1:] != pixels[:-1])))
+    lengths = np.diff(np.append(starts, len(pixels)))
+    return starts, lengths
+
+
+def _rle_runs_python(data: bytes) -> Tuple[List[int], List[int]]:
+    """Find runs of equal RGB565 pixels without NumPy."""
+    # Byte order does not matter for equality
+    pixels = array("H", data)
+    starts = [i for i in range(len(pixels)) if i == 0 or pixels[i] != pixels[i - 1]]
+    lengths = [end - start for start, end in zip(starts, starts[1:] + [len(pixels)])]
+    return starts, lengths
+
+
+def _rle_size(lengths: Any) -> int:
+    """Encoded size of a sequence of run lengths."""
+    if HAS_NUMPY and isinstance(lengths, np.ndarray):
+        single = lengths == 1
+        repeats = lengths[~single]
+        # Consecutive single pixels are grouped into literal runs
+        edges = np.flatnonzero(np.diff(np.concatenate(([0], single.view(np.int8), [0]))))
+        literals = edges[1::2] - edges[0::2]
+        return int(
+            (-(-repeats // RLE_MAX_RUN) * 3).sum()
+            + (literals * 2 + -(-literals // RLE_MAX_RUN)).sum()
+        )
+
+    size = literal = 0
+    for length in list(lengths) + [0]:
+        if length == 1:
+            literal += 1
+            continue
+        if literal:
+            size += literal * 2 + -(-literal // RLE_MAX_RUN)
+            literal = 0
+        size += -(-length // RLE_MAX_RUN) * 3
+    return size
+
+
+def _rle_runs(data: bytes, use_numpy: Optional[bool]) -> Tuple[Any, Any]:
+    """Return the start and length of each run of equal pixels."""
+    if len(data) % 2:
+        raise ValueError("RGB565 data must have an even number of bytes")
+    if use_numpy is None:
+        use_numpy = HAS_NUMPY
+    if use_numpy:
+        if not HAS_NUMPY:
+            raise RuntimeError("NumPy is not installed")
+        return _rle_runs_numpy(data)
+    return _rle_runs_python(data)
+
+
+def rgb565_rle_size(data: bytes, use_numpy: Optional[bool] = None) -> int:
+    """Return the size RGB565 data would have after run-length encoding.
+
+    Args:
+        data: Big-endian RGB565 data
+        use_numpy: Force the NumPy (True) or pure Python (False)
+            implementation. Defaults to NumPy when it is available.
+    """
+    return _rle_size(_rle_runs(data, use_numpy)[1])
+
+
+def rgb565_rle_encode(data: bytes, use_numpy: Optional[bool] = None) -> bytes:
+    """Run-length encode big-endian RGB565 data for CMD_DRAW_BITMAP_RLE.
+
+    Run detection is vectorized with NumPy when it is available.
+
+    Args:
+        data: Big-endian RGB565 data
+        use_numpy: Force the NumPy (True) or pure Python (False)
+            implementation. Defaults to NumPy when it is available.
+
+    Returns:
+        Encoded data
+    """
+    starts, lengths = _rle_runs(data, use_numpy)
+    out = bytearray()
+
+    # Literal runs copy pixels [start, end) from the input
+    def literal(start: int, end: int) -> None:
+        for first in range(start, end, RLE_MAX_RUN):
+            count = min(RLE_MAX_RUN, end - first)
+            out.append(count - 1)
+            out.extend(data[first * 2 : (first + count) * 2])
+
+    if not isinstance(starts, list):
+        starts, lengths = starts.tolist(), lengths.tolist()
+
+    # Consecutive single pixels are collected into literal runs
+    literal_start = None
+    for start, length in zip(starts, lengths):
+        if length == 1:
+            if literal_start is None:
+                literal_start = start
+            continue
+        if literal_start is not None:
+            literal(literal_start, start)
+            literal_start = None
+        pixel = data[start * 2 : start * 2 + 2]
+        while length > 0:
+            count = min(RLE_MAX_RUN, length)
+            out.append(0x80 | (count - 1))
+            out += pixel
+            length -= count
+    if literal_start is not None:
+        literal(literal_start, len(data) // 2)
+    return bytes(out)
+
+
+def rgb565_rle_decode(data: bytes) -> bytes:
+    """Decode CMD_DRAW_BITMAP_RLE data back to big-endian RGB565.
+
+    Args:
+        data: Encoded data
+
+    Returns:
+        RGB565 data
+    """
+    out = bytearray()
+    pos = 0
+    while pos < len(data):
+        control = data[pos]
+        count = (control & 0x7F) + 1
+        if control & 0x80:
+            pixel = data[pos + 1 : pos + 3]
+            pos += 3
+            out += pixel * count
+        else:
+            pixels = data[pos + 1 : pos + 1 + count * 2]
+            pos += 1 + count * 2
+            out += pixels
+        if pos > len(data):
+            raise ValueError("Truncated RLE data")
+    return bytes(out)
+
+
+# Bits per palette index supported by the indexed commands
+INDEXED_BPP = (1, 2, 4, 8)
+
+
+def _rgb565_values(data: Any) -> List[int]:
+    """Convert RGB888 data to a list of RGB565 values without NumPy."""
+    colors = array("H", _rgb565_python(data))
+    if sys.byteorder == "little":
+        colors.byteswap()
+    return colors.tolist()
+
+
+def _pack_indices(indices: Any, bpp: int) -> bytes:
+    """Pack palette indices MSB first, `bpp` bits each."""
+    per_byte = 8 // bpp
+    if HAS_NUMPY and isinstance(indices, np.ndarray):
+        padded = np.zeros(-(-len(indices) // per_byte) * per_byte, dtype=np.uint8)
+        padded[: len(indices)] = indices
+        groups = padded.reshape(-1, per_byte)
+        shifts = np.arange(8 - bpp, -1, -bpp, dtype=np.uint8)
+        return np.bitwise_or.reduce(groups << shifts, axis=1).astype(np.uint8).tobytes()
+
+    out = bytearray(-(-len(indices) // per_byte))
+    for i, index in enumerate(indices):
+        out[i // per_byte] |= index << (8 - bpp - (i % per_byte) * bpp)
+    return bytes(out)
+
+
+def _unpack_indices(data: bytes, bpp: int, count: int) -> List[int]:
+    """Unpack `count` MSB-first palette indices of `bpp` bits each."""
+    mask = (1 << bpp) - 1
+    return [
+        (data[(i * bpp) >> 3] >> (8 - bpp - ((i * bpp) & 7))) & mask
+        for i in range(count)
+    ]
+
+
+def rgb888_to_indexed(
+    data: Any, width: int, height: int, bpp: Optional[int] = None
+) -> Tuple[int, bytes, bytes]:
+    """Convert RGB888 pixel data to a palette and packed indices.
+
+    Images with few enough colors keep their exact RGB565 colors; others are
+    quantized with PIL's median cut.
+
+    Args:
+        data: RGB888 data as bytes-like object, PIL image or NumPy array
+        width: Image width
+        height: Image height
+        bpp: Bits per index (1, 2, 4 or 8). Defaults to the smallest that
+            holds every color of the image, or 8.
+
+    Returns:
+        Tuple of (bpp, big-endian RGB565 palette, packed indices)
+    """
+    if bpp is not None and bpp not in INDEXED_BPP:
+        raise ValueError(f"bpp must be one of {INDEXED_BPP}")
+
+    # Exact palette from the distinct RGB565 colors
+    if HAS_NUMPY:
+        colors565 = _rgb565_numpy_array(data)
+        palette, indices = np.unique(colors565, return_inverse=True)
+        palette = palette.tolist()
+    else:
+        colors565 = _rgb565_values(data)
+        palette = sorted(set(colors565))
+        lookup = {color: i for i, color in enumerate(palette)}
+        indices = [lookup[color] for color in colors565]
+
+    if bpp is None:
+        bpp = next((b for b in INDEXED_BPP if len(palette) <= 1 << b), 8)
+
+    if len(palette) > 1 << bpp:
+        # Too many colors: quantize the image to the palette size
+        if isinstance(data, Image.Image):
+            image = data.convert("RGB")
+        elif HAS_NUMPY and isinstance(data, np.ndarray):
+            image = Image.fromarray(data.reshape(height, width, 3).astype(np.uint8))
+        else:
+            image = Image.frombytes("RGB", (width, height), bytes(data))
+        quantized = image.quantize(colors=1 << bpp, method=Image.Quantize.MEDIANCUT)
+        rgb_palette = quantized.getpalette()[: (1 << bpp) * 3]
+        palette = [
+            ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+            for r, g, b in zip(rgb_palette[0::3], rgb_palette[1::3], rgb_palette[2::3])
+        ]
+        indices = quantized.tobytes()
+        if HAS_NUMPY:
+            indices = np.frombuffer(indices, dtype=np.uint8)
+        else:
+            indices = list(indices)
+        palette = palette[: int(max(indices)) + 1]
+
+    palette_bytes = b"".join(color.to_bytes(2, "big") for color in palette)
+    return bpp, palette_bytes, _pack_indices(indices, bpp)
+
+
+def indexed_to_rgb565(palette: bytes, indices: bytes, bpp: int, count: int) -> bytes:
+    """Expand a palette and packed indices back to big-endian RGB565.
+
+    Indices beyond the palette expand to black.
+
+    Args:
+        palette: Big-endian RGB565 palette
+        indices: Packed indices
+        bpp: Bits per index
+        count: Number of pixels
+
+    Returns:
+        RGB565 data (2 bytes per pixel)
+    """
+    colors = [palette[i : i + 2] for i in range(0, len(palette), 2)]
+    black = b"\x00\x00"
+    return b"".join(
+        colors[index] if index < len(colors) else black
+        for index in _unpack_indices(indices, bpp, count)
+    )
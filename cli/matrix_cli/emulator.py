@@ -0,0 +1,1533 @@
+"""
+Pure-Python emulator of the firmware's CommandHandler.
+
+FirmwareEmulator implements the same serial protocol as the device: every
+opcode, the sprite slots and their memory, animations, bulk transfers with
+0xFF flow control credits, telemetry, plain or timed ACK frames and framing
+v2 with its chunk requests and retransmissions. It draws into a NumPy RGB888
+framebuffer the same way the simulator does, so dumps of both can be
+compared pixel for pixel.
+
+The link is modelled rather than instantaneous: bytes reach the other end
+after 10 bits per byte at the current baud rate, and a CostModel charges the
+device time per command and per pixel drawn. Host-side timings therefore
+look like those of a real board while the emulator itself runs as fast as
+Python allows. An error rate makes the link flip bits, in both directions,
+to exercise error handling. Connect to it in-process with a pySerial URL:
+
+    emulator = FirmwareEmulator(name="test")
+    with MatrixDisplay(emulator.url) as matrix:   # "emulator://test"
+        matrix.fill_screen(255, 0, 0)
+    emulator.image().save("frame.png")
+
+or through a PTY for other processes and AsyncMatrixDisplay:
+
+    port = emulator.serve_pty()
+"""
+
+import itertools
+import os
+import random
+import select
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+from PIL import Image
+from serial import SerialException
+from serial.serialutil import PortNotOpenError, SerialBase
+from .framing import CHUNK_REQUEST_BYTE, FRAMED_START_BYTE, NAK_BYTE, crc8, crc16
+from .matrix import MatrixDisplay
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is an optional dependency
+    np = None
+
+# pySerial URL scheme of in-process emulators (see protocol_emulator.py)
+URL_SCHEME = "emulator"
+
+# Firmware limits (command_handler.h)
+DEFAULT_BAUD_RATE = 115200
+MIN_BAUD_RATE = 9600
+MAX_BAUD_RATE = 5000000
+BAUD_VERIFY_TIMEOUT = 1.0
+STREAM_TIMEOUT = 1.0  # Arduino's Stream::readBytes() default
+SERIAL_RX_BUFFER_SIZE = 4096
+FLOW_CONTROL_CHUNK = 128
+MIN_FLOW_CHUNK = 16
+SPRITE_MEMORY_SIZE = 16 * 64 * 64 * 2
+MAX_STATS_OPCODE = 0x3F
+ACK_HISTORY = 16
+MAX_CHUNK_RETRIES = 16
+CHUNK_RESEND = 0.1
+SKIP_QUIET = 0.05
+# Indexed bitmaps are drawn as they arrive, this many index bytes at a time
+INDEX_CHUNK = 64
+
+# UART frame of one byte: start bit, 8 data bits, stop bit
+BITS_PER_BYTE = 10
+
+
+class CostModel:
+    """Device time charged for executing commands.
+
+    Every packet costs `command` seconds (or its entry in `overrides`) for
+    parsing and dispatch, and every pixel written to the framebuffer costs
+    `pixel` seconds. The defaults are rough estimates for an ESP32 drawing
+    into the HUB75 DMA buffer; from_stats() calibrates the per-command part
+    against a real board.
+    """
+
+    def __init__(
+        self,
+        command: float = 20e-6,
+        pixel: float = 0.5e-6,
+        overrides: Optional[Dict[int, float]] = None,
+    ):
+        """Create a cost model.
+
+        Args:
+            command: Seconds per packet
+            pixel: Seconds per pixel drawn
+            overrides: Seconds per packet of specific command bytes
+        """
+        self.command = command
+        self.pixel = pixel
+        self.overrides = dict(overrides or {})
+
+    def command_cost(self, cmd: int) -> float:
+        """Seconds charged for one packet of a command."""
+        return self.overrides.get(cmd, self.command)
+
+    @classmethod
+    def from_stats(
+        cls, stats: Dict[int, Dict[str, int]], pixel: float = 0.0
+    ) -> "CostModel":
+        """Build a model from a real device's telemetry counters.
+
+        Each command costs its average render time, which already includes
+        its drawing, so `pixel` defaults to 0.
+
+        Args:
+            stats: Result of MatrixDisplay.query_stats()
+            pixel: Seconds per pixel drawn on top of that
+        """
+        overrides = {
+            cmd: values["render"] / values["count"] / 1e6
+            for cmd, values in stats.items()
+            if values["count"]
+        }
+        return cls(command=0.0, pixel=pixel, overrides=overrides)
+
+
+class _Channel:
+    """Bytes travelling one way over the serial link.
+
+    Each write is stamped with when its bytes arrive at the other end: once
+    the previous write has cleared the line, one byte per `byte_time`.
+    Callers hold the emulator's condition.
+    """
+
+    def __init__(self, condition: threading.Condition):
+        self._condition = condition
+        # [start, byte_time, data, bytes already taken]
+        self._chunks: Deque[List[Any]] = deque()
+        self.line_free = 0.0
+        self.size = 0  # Bytes written and not yet taken
+
+    def put(self, data: bytes, now: float, byte_time: float) -> None:
+        """Send bytes, the first leaving at `now` or when the line is free."""
+        if not data:
+            return
+        start = max(now, self.line_free)
+        self._chunks.append([start, byte_time, bytes(data), 0])
+        self.line_free = start + len(data) * byte_time
+        self.size += len(data)
+        self._condition.notify_all()
+
+    def arrived(self, now: float) -> int:
+        """Number of unread bytes that have arrived by `now`."""
+        total = 0
+        for start, byte_time, data, taken in self._chunks:
+            if now < start + byte_time:
+                break
+            count = len(data) if byte_time == 0 else int((now - start) / byte_time)
+            count = min(count, len(data)) - taken
+            total += count
+            if taken + count < len(data):
+                break
+        return total
+
+    def next_arrival(self, count: int) -> float:
+        """When the `count`th unread byte arrives (count <= size)."""
+        for start, byte_time, data, taken in self._chunks:
+            if count <= len(data) - taken:
+                return start + (taken + count) * byte_time
+            count -= len(data) - taken
+        return self.line_free
+
+    def take(self, count: int) -> Tuple[bytes, float]:
+        """Remove up to `count` bytes, whether they have arrived or not.
+
+        Returns:
+            The bytes and when the last of them arrives
+        """
+        parts = []
+        arrival = 0.0
+        while count > 0 and self._chunks:
+            chunk = self._chunks[0]
+            start, byte_time, data, taken = chunk
+            n = min(count, len(data) - taken)
+            parts.append(data[taken : taken + n])
+            chunk[3] = taken = taken + n
+            arrival = start + taken * byte_time
+            if taken == len(data):
+                self._chunks.popleft()
+            count -= n
+            self.size -= n
+        return b"".join(parts), arrival
+
+    def clear(self) -> None:
+        """Drop every unread byte."""
+        self._chunks.clear()
+        self.size = 0
+
+
+class _Payload:
+    """Progress through a bulk payload received with flow control."""
+
+    __slots__ = ("total", "received")
+
+    def __init__(self, total: int):
+        self.total = total
+        self.received = 0
+
+
+class _Sprite:
+    """A sprite slot: its payload, decoded pixels and draw position."""
+
+    __slots__ = (
+        "active", "x", "y", "width", "height", "bpp", "size", "crc", "pixels", "opaque",
+        "last_x", "last_y",
+    )
+
+    def __init__(self) -> None:
+        self.active = False
+        self.size = 0  # Bytes of sprite memory in use
+
+
+class _Animation:
+    """An animation slot, as in the firmware's Animation struct."""
+
+    def __init__(self) -> None:
+        self.defined = False
+        self.playing = False
+        self.loop = False
+        self.x = self.y = 0
+        self.frame_count = 0
+        self.sprite_ids = [0] * MatrixDisplay.MAX_ANIMATION_FRAMES
+        self.durations = [0] * MatrixDisplay.MAX_ANIMATION_FRAMES
+        self.current = 0
+        self.frame_started = 0
+        self.drawn_x = self.drawn_y = 0
+        self.drawn_width = self.drawn_height = 0
+
+
+def _rgb888(pixels: "np.ndarray") -> "np.ndarray":
+    """Expand RGB565 values to RGB888 the way the simulator does."""
+    rgb = np.empty(pixels.shape + (3,), dtype=np.uint8)
+    rgb[..., 0] = ((pixels >> 11) & 0x1F) << 3
+    rgb[..., 1] = ((pixels >> 5) & 0x3F) << 2
+    rgb[..., 2] = (pixels & 0x1F) << 3
+    return rgb
+
+
+def _color565(r: int, g: int, b: int) -> int:
+    """RGB888 to RGB565, as the firmware's color565()."""
+    return ((r >> 3) << 11) | ((g >> 2) << 5) | (b >> 3)
+
+
+def _unpack_indices(packed: bytes, bpp: int, count: int) -> "np.ndarray":
+    """Palette indices packed MSB-first at `bpp` bits each."""
+    data = np.frombuffer(packed, dtype=np.uint8)
+    if bpp == 8:
+        return data[:count].astype(np.int32)
+    bits = np.unpackbits(data)
+    bits = bits[: len(bits) // bpp * bpp].reshape(-1, bpp).astype(np.int32)
+    weights = 1 << np.arange(bpp - 1, -1, -1, dtype=np.int32)
+    return (bits @ weights)[:count]
+
+
+def _indexed_format(header: bytes) -> Optional[Tuple[int, int]]:
+    """BPP and color count of an indexed header, or None if invalid."""
+    bpp, colors = header[0], header[1] + 1
+    if bpp not in (1, 2, 4, 8) or colors > (1 << bpp):
+        return None
+    return bpp, colors
+
+
+class FirmwareEmulator:
+    """The device firmware, emulated in a background thread.
+
+    `framebuffer` holds the panel contents as a (height, width, 3) RGB888
+    array. Device state (sprites, animations, flow control, telemetry and
+    the baud rate) persists across connections, as on a real board.
+    """
+
+    _registry: Dict[str, "FirmwareEmulator"] = {}
+    _registry_lock = threading.Lock()
+    _names = itertools.count(1)
+
+    def __init__(
+        self,
+        width: int = 64,
+        height: int = 64,
+        throttle: bool = True,
+        cost: Optional[CostModel] = CostModel(),
+        name: Optional[str] = None,
+        baud_rate: int = DEFAULT_BAUD_RATE,
+        error_rate: float = 0.0,
+    ):
+        """Create an emulator; it runs once started or connected to.
+
+        Args:
+            width: Panel width in pixels (default: 64)
+            height: Panel height in pixels (default: 64)
+            throttle: Deliver bytes at the link's baud rate instead of at once
+            cost: Device time charged per command and pixel (None: free)
+            name: Name in emulator:// URLs (default: a unique one)
+            baud_rate: Rate the device starts at (default: 115200, as after
+                a reset)
+            error_rate: Probability that a byte on the link arrives with a
+                flipped bit (default: 0, an error-free link)
+        """
+        if np is None:
+            raise RuntimeError("The firmware emulator requires NumPy")
+        self.width = width
+        self.height = height
+        self.throttle = throttle
+        self.cost = cost
+        self.name = name or f"emulator-{next(self._names)}"
+        self.framebuffer = np.zeros((height, width, 3), dtype=np.uint8)
+
+        if not MIN_BAUD_RATE <= baud_rate <= MAX_BAUD_RATE:
+            raise ValueError(f"Baud rate must be {MIN_BAUD_RATE}-{MAX_BAUD_RATE}")
+        if not 0.0 <= error_rate < 1.0:
+            raise ValueError("Error rate must be at least 0 and below 1")
+        self.error_rate = error_rate
+        self._random = random.Random()
+
+        # Firmware state
+        self.baud_rate = baud_rate
+        self.flow_chunk = FLOW_CONTROL_CHUNK
+        self.flow_credits = 1
+        self.telemetry = False
+        self.stats = [[0, 0, 0, 0, 0] for _ in range(MAX_STATS_OPCODE + 1)]
+        self.sprites = [_Sprite() for _ in range(MatrixDisplay.MAX_SPRITES)]
+        self.sprite_memory_used = 0
+        self.animations = [_Animation() for _ in range(MatrixDisplay.MAX_ANIMATIONS)]
+        self.cursor_x = self.cursor_y = 0
+        self.brightness = 32
+        # Framing v2: the current packet and the ACKs of recent ones
+        self._framed = False
+        self._resync_framed = False
+        self._framed_seq = 0
+        self._framed_crc = 0
+        self._acks: Deque[Tuple[int, int, bytes]] = deque(maxlen=ACK_HISTORY)
+        # Bulk payload of a framed packet (readFramedPayload())
+        self._chunks_started = False
+        self._chunks_granted = 0
+        self._chunks_read = 0
+        self._chunk_queue: Deque[int] = deque()
+        self._chunk_slots: Dict[int, bytes] = {}
+        self._chunk_retries = 0
+        self._chunk = b""
+        self._chunk_pos = 0
+
+        # Device time: when everything done so far would have finished
+        self._clock = 0.0
+        self._packet_started = 0.0
+        self._receive_time = 0.0
+
+        self._condition = threading.Condition()
+        self._to_device = _Channel(self._condition)
+        self._to_host = _Channel(self._condition)
+        self._running = False
+        self._threads: List[threading.Thread] = []
+        self._pty_fds: List[int] = []
+        self._started = time.monotonic()
+
+        with self._registry_lock:
+            self._registry[self.name] = self
+
+    def __enter__(self) -> "FirmwareEmulator":
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb) -> None:
+        self.stop()
+
+    @property
+    def url(self) -> str:
+        """pySerial URL that connects to this emulator."""
+        return f"{URL_SCHEME}://{self.name}"
+
+    @classmethod
+    def from_url(cls, url: str) -> "FirmwareEmulator":
+        """The running emulator named in an emulator:// URL.
+
+        An emulator that does not exist yet is created and started with the
+        URL's options, e.g. "emulator://bench?throttle=0&cost=0":
+        throttle=0 delivers bytes at once, cost=0 makes commands free,
+        baud sets the starting baud rate, errors the error rate and
+        width/height the panel size.
+        """
+        parts = urlsplit(url)
+        if parts.scheme != URL_SCHEME:
+            raise SerialException(f"Expected an {URL_SCHEME}:// URL, got {url!r}")
+        name = parts.netloc or "default"
+        with cls._registry_lock:
+            emulator = cls._registry.get(name)
+        if emulator is None:
+            options = {key: values[-1] for key, values in parse_qs(parts.query).items()}
+            unknown = set(options) - {"throttle", "cost", "baud", "errors", "width", "height"}
+            if unknown:
+                raise SerialException(f"Unknown emulator options: {', '.join(sorted(unknown))}")
+            emulator = cls(
+                width=int(options.get("width", 64)),
+                height=int(options.get("height", 64)),
+                throttle=options.get("throttle", "1") != "0",
+                cost=None if options.get("cost", "1") == "0" else CostModel(),
+                name=name,
+                baud_rate=int(options.get("baud", DEFAULT_BAUD_RATE)),
+                error_rate=float(options.get("errors", 0)),
+            )
+        return emulator.start()
+
+    def start(self) -> "FirmwareEmulator":
+        """Start executing commands (does nothing if already running)."""
+        with self._condition:
+            if self._running:
+                return self
+            self._running = True
+        self._spawn(self._run)
+        return self
+
+    def stop(self) -> None:
+        """Stop the emulator and close its PTY, if any."""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join()
+        self._threads = []
+        for fd in self._pty_fds:
+            os.close(fd)
+        self._pty_fds = []
+        with self._registry_lock:
+            if self._registry.get(self.name) is self:
+                del self._registry[self.name]
+
+    def _spawn(self, target) -> None:
+        thread = threading.Thread(target=target, name=f"{self.name}-{target.__name__}", daemon=True)
+        self._threads.append(thread)
+        thread.start()
+
+    def serve_pty(self) -> str:
+        """Also accept connections on a new pseudo-terminal.
+
+        Returns:
+            Path of the PTY to open as the serial port
+        """
+        import tty  # POSIX only, like PTYs
+
+        master, slave = os.openpty()
+        tty.setraw(slave)
+        # Keep the slave open so the PTY survives clients closing it
+        self._pty_fds += [master, slave]
+        self.start()
+        self._spawn(lambda: self._pty_input(master))
+        self._spawn(lambda: self._pty_output(master))
+        return os.ttyname(slave)
+
+    def _pty_input(self, master: int) -> None:
+        while self._running:
+            if select.select([master], [], [], 0.1)[0]:
+                self.host_write(os.read(master, 4096))
+
+    def _pty_output(self, master: int) -> None:
+        while self._running:
+            data = self.host_read(4096, 0.1, partial=True)
+            if data:
+                os.write(master, data)
+
+    def image(self) -> Image.Image:
+        """Copy of the panel contents."""
+        return Image.fromarray(self.framebuffer.copy(), "RGB")
+
+    def save_ppm(self, path: str) -> None:
+        """Write the panel contents as a binary PPM, like the simulator."""
+        with open(path, "wb") as f:
+            f.write(b"P6\n%d %d\n255\n" % (self.width, self.height))
+            f.write(self.framebuffer.tobytes())
+
+    # Host side of the link
+
+    def _byte_time(self) -> float:
+        return BITS_PER_BYTE / self.baud_rate if self.throttle else 0.0
+
+    def _corrupt(self, data: bytes) -> bytes:
+        """Flip one random bit of each byte hit by a link error."""
+        if not self.error_rate:
+            return data
+        data = bytearray(data)
+        for i in range(len(data)):
+            if self._random.random() < self.error_rate:
+                data[i] ^= 1 << self._random.randrange(8)
+        return bytes(data)
+
+    def host_write(self, data: bytes, baudrate: Optional[int] = None) -> None:
+        """Send bytes to the device.
+
+        Args:
+            data: Bytes to send
+            baudrate: Host port rate; bytes sent at another rate than the
+                device's arrive garbled (None: a PTY, which has no rate)
+        """
+        with self._condition:
+            if baudrate is not None and baudrate != self.baud_rate:
+                data = bytes(len(data))
+            self._to_device.put(self._corrupt(data), time.monotonic(), self._byte_time())
+
+    def host_read(self, size: int, timeout: Optional[float], partial: bool = False) -> bytes:
+        """Receive bytes from the device, as pySerial's read().
+
+        Args:
+            size: Bytes wanted
+            timeout: Seconds to wait for them (None: forever)
+            partial: Return as soon as any have arrived
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                arrived = self._to_host.arrived(now)
+                wanted = 1 if partial else size
+                if arrived >= wanted or (deadline is not None and now >= deadline):
+                    return self._to_host.take(min(arrived, size))[0]
+                wait = None if deadline is None else deadline - now
+                if self._to_host.size > arrived:
+                    # Bytes are on the wire; sleep until enough have arrived
+                    needed = min(wanted, self._to_host.size)
+                    until = self._to_host.next_arrival(needed) - now
+                    wait = until if wait is None else min(wait, until)
+                self._condition.wait(wait)
+
+    def host_in_waiting(self) -> int:
+        """Bytes from the device that have arrived and not been read."""
+        with self._condition:
+            return self._to_host.arrived(time.monotonic())
+
+    def host_flush(self) -> None:
+        """Wait until everything the host sent has left the line."""
+        with self._condition:
+            wait = self._to_device.line_free - time.monotonic()
+        if wait > 0:
+            time.sleep(wait)
+
+    def host_reset_input(self) -> None:
+        """Discard bytes from the device that have arrived."""
+        with self._condition:
+            self._to_host.take(self._to_host.arrived(time.monotonic()))
+
+    # Device side of the link, as the firmware's Serial
+
+    def _millis(self) -> int:
+        return int((time.monotonic() - self._started) * 1000)
+
+    def _available(self) -> int:
+        with self._condition:
+            return self._to_device.size
+
+    def _read_bytes(self, size: int, timeout: float = STREAM_TIMEOUT) -> bytes:
+        """Serial.readBytes(): wait up to `timeout` for `size` bytes."""
+        deadline = time.monotonic() + timeout
+        with self._condition:
+            while self._to_device.size < size and self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._condition.wait(remaining)
+            data, arrival = self._to_device.take(size)
+        # The device cannot have read bytes before they arrived
+        self._clock = max(self._clock, arrival)
+        return data
+
+    def _write(self, data: bytes) -> None:
+        with self._condition:
+            self._to_host.put(self._corrupt(data), self._clock, self._byte_time())
+
+    def _charge(self, seconds: float) -> None:
+        self._clock += seconds
+
+    # CommandHandler
+
+    def _run(self) -> None:
+        while self._running:
+            with self._condition:
+                if self._to_device.size < 3:
+                    playing = any(animation.playing for animation in self.animations)
+                    self._condition.wait(0.001 if playing else 0.05)
+            self._handle_command()
+            self._update()
+
+    def _send_ack(self, cmd: int, success: bool, message: bytes = b"") -> None:
+        timing = b""
+        if self.telemetry:
+            total_us = max(0, int((self._clock - self._packet_started) * 1e6))
+            receive_us = min(int(self._receive_time * 1e6), total_us)
+            render_us = total_us - receive_us
+            if cmd <= MAX_STATS_OPCODE:
+                entry = self.stats[cmd]
+                entry[0] += 1
+                entry[1] += not success
+                entry[2] += receive_us
+                entry[3] += render_us
+                entry[4] = max(entry[4], total_us)
+            timing = (receive_us & 0xFFFFFFFF).to_bytes(4, "big") + (
+                render_us & 0xFFFFFFFF
+            ).to_bytes(4, "big")
+
+        ack = MatrixDisplay.TIMED_ACK_BYTE if self.telemetry else MatrixDisplay.ACK_BYTE
+        message = message[:255]
+        body = bytes([cmd, 0x01 if success else 0x00, len(message)]) + message + timing
+        if not self._framed:
+            self._write(bytes([MatrixDisplay.START_BYTE, ack]) + body)
+            return
+
+        # Kept so a retransmission of the packet gets the same answer
+        header = bytes([ack, self._framed_seq]) + body[:3]
+        frame = bytes([FRAMED_START_BYTE]) + header + bytes([crc8(header)]) + body[3:]
+        frame += crc16(frame[1:]).to_bytes(2, "big")
+        self._acks.append((self._framed_seq, self._framed_crc, frame))
+        self._write(frame)
+
+    def _send_nak(self, kind: int, number: int) -> None:
+        body = bytes([kind]) + number.to_bytes(2 if kind == CHUNK_REQUEST_BYTE else 1, "big")
+        self._write(bytes([FRAMED_START_BYTE]) + body + crc16(body).to_bytes(2, "big"))
+
+    def _start_timing(self) -> None:
+        self._packet_started = self._clock
+        self._receive_time = 0.0
+
+    def _read_packet(self, reply: bool = True) -> Optional[Tuple[int, bytes]]:
+        """readPacket(): (cmd, data) of the next packet, or None if there is
+        nothing to execute."""
+        start = self._read_bytes(1)
+        if start != bytes([FRAMED_START_BYTE]) and (
+            start != bytes([MatrixDisplay.START_BYTE]) or self._resync_framed
+        ):
+            # Once the rest of a corrupted framed packet is skipped, plain
+            # packets are accepted again
+            if not self._available():
+                self._resync_framed = False
+            return None
+        self._framed = start[0] == FRAMED_START_BYTE
+
+        header = self._read_bytes(4 if self._framed else 2)
+        if len(header) < (4 if self._framed else 2):
+            return None
+        if self._framed:
+            self._framed_seq = header[0]
+            if crc8(header[:3]) != header[3]:
+                # LEN cannot be trusted; skip to the next framed packet
+                if reply:
+                    self._send_nak(NAK_BYTE, self._framed_seq)
+                self._resync_framed = True
+                return None
+            self._resync_framed = False
+        cmd, length = header[-3:-1] if self._framed else header
+        if self.telemetry:
+            self._start_timing()
+
+        data = self._read_bytes(length)
+        if len(data) < length:
+            if reply and self._framed:
+                self._send_nak(NAK_BYTE, self._framed_seq)
+            elif reply:
+                self._send_ack(cmd, False, b"Incomplete command data")
+            return None
+
+        if self._framed:
+            crc = self._read_bytes(2)
+            self._framed_crc = crc16(data, crc16(header))
+            if crc != self._framed_crc.to_bytes(2, "big"):
+                if reply:
+                    self._send_nak(NAK_BYTE, self._framed_seq)
+                return None
+            for seq, packet_crc, frame in self._acks:
+                if seq == self._framed_seq and packet_crc == self._framed_crc:
+                    self._write(frame)
+                    return None
+            self._chunks_started = False
+        if self.telemetry:
+            self._receive_time = self._clock - self._packet_started
+        return cmd, data
+
+    def _handle_command(self) -> None:
+        if self._available() < 3:
+            return
+        packet = self._read_packet()
+        if packet is None:
+            return
+
+        cmd, data = packet
+        if self.cost is not None:
+            self._charge(self.cost.command_cost(cmd))
+
+        handler = {
+            MatrixDisplay.CMD_DRAW_BITMAP: self._handle_bitmap,
+            MatrixDisplay.CMD_SET_SPRITE: self._handle_set_sprite,
+            MatrixDisplay.CMD_SET_SPRITE_INDEXED: self._handle_set_sprite,
+            MatrixDisplay.CMD_DRAW_BITMAP_INDEXED: self._handle_bitmap_indexed,
+            MatrixDisplay.CMD_BATCH: self._handle_batch,
+            MatrixDisplay.CMD_DRAW_BITMAP_RLE: self._handle_bitmap_rle,
+            MatrixDisplay.CMD_SET_BAUD: self._handle_set_baud,
+        }.get(cmd)
+        if handler is not None:
+            handler(cmd, data)
+        else:
+            success, message = self._execute(cmd, data)
+            self._send_ack(cmd, success, message)
+
+    def _read_payload(self, reader: _Payload, size: int) -> Optional[bytes]:
+        """Read part of a bulk payload, granting credits as chunks complete."""
+        if self._framed:
+            return self._read_framed_payload(reader, size)
+        parts = []
+        while size > 0:
+            chunk = min(self.flow_chunk - reader.received % self.flow_chunk, size)
+            started = self._clock
+            data = self._read_bytes(chunk)
+            if self.telemetry:
+                self._receive_time += self._clock - started
+            if len(data) < chunk:
+                return None
+            parts.append(data)
+            size -= chunk
+            reader.received += chunk
+
+            # Credits are only sent while the sender has not got all it needs
+            if (
+                reader.received % self.flow_chunk == 0
+                and reader.received + (self.flow_credits - 1) * self.flow_chunk < reader.total
+            ):
+                self._write(b"\xff")
+        return b"".join(parts)
+
+    def _read_framed_payload(self, reader: _Payload, size: int) -> Optional[bytes]:
+        """Read part of a framed bulk payload, chunk by checked chunk."""
+        if not self._chunks_started:
+            # Even the first chunks are granted, once the header is accepted
+            self._chunks_started = True
+            self._chunks_granted = self._chunks_read = 0
+            self._chunk_queue.clear()
+            self._chunk_slots.clear()
+            self._chunk_retries = 0
+            self._chunk, self._chunk_pos = b"", 0
+            for _ in range(self.flow_credits):
+                self._grant_chunk(reader)
+
+        parts = []
+        while size > 0:
+            if self._chunk_pos == len(self._chunk) and not self._next_chunk(reader):
+                return None
+            count = min(size, len(self._chunk) - self._chunk_pos)
+            parts.append(self._chunk[self._chunk_pos : self._chunk_pos + count])
+            self._chunk_pos += count
+            size -= count
+            reader.received += count
+            if self._chunk_pos == len(self._chunk):
+                self._grant_chunk(reader)
+        return b"".join(parts)
+
+    def _grant_chunk(self, reader: _Payload) -> None:
+        if self._chunks_granted * self.flow_chunk >= reader.total:
+            return
+        self._send_nak(CHUNK_REQUEST_BYTE, self._chunks_granted)
+        self._chunk_queue.append(self._chunks_granted)
+        self._chunks_granted += 1
+
+    def _next_chunk(self, reader: _Payload) -> bool:
+        """nextChunk(): read numbered chunks, whichever order they come in,
+        until the next one in payload order has arrived intact."""
+        wanted = self._chunks_read
+        frame_size = 2 + self.flow_chunk + 2
+        while wanted not in self._chunk_slots:
+            if not self._wait_for_chunk():
+                return False
+            started = self._clock
+            frame = self._read_bytes(frame_size)
+            if self.telemetry:
+                self._receive_time += self._clock - started
+            if len(frame) < frame_size:
+                return False
+
+            number = int.from_bytes(frame[:2], "big")
+            if crc16(frame[:-2]) == int.from_bytes(frame[-2:], "big"):
+                self._chunk_retries = 0
+                # Anything else is a retransmission that was not needed
+                if self._chunks_read <= number < self._chunks_granted:
+                    size = min(self.flow_chunk, reader.total - number * self.flow_chunk)
+                    self._chunk_slots.setdefault(number, frame[2 : 2 + size])
+                    if number in self._chunk_queue:
+                        self._chunk_queue.remove(number)
+                continue
+
+            # The number is most likely intact; if not, it was probably the
+            # chunk asked for first
+            self._chunk_retries += 1
+            if self._chunk_retries > MAX_CHUNK_RETRIES or not self._chunk_queue:
+                return False
+            if number not in self._chunk_queue:
+                number = self._chunk_queue[0]
+            self._chunk_queue.remove(number)
+            self._chunk_queue.append(number)
+            self._send_nak(CHUNK_REQUEST_BYTE, number)
+
+        self._chunk, self._chunk_pos = self._chunk_slots.pop(wanted), 0
+        self._chunks_read += 1
+        return True
+
+    def _wait_for_chunk(self) -> bool:
+        """waitForChunk(): request every chunk still due again while nothing
+        arrives, in the device's time."""
+        started = asked = max(self._clock, time.monotonic())
+        deadline = started + STREAM_TIMEOUT
+        while True:
+            until = min(asked + CHUNK_RESEND, deadline)
+            with self._condition:
+                # Whatever the host has not written by then arrives later
+                while not self._to_device.size and self._running:
+                    remaining = until - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._condition.wait(remaining)
+                if self._to_device.size and self._to_device.next_arrival(1) <= until:
+                    return True
+            if not self._running or until >= deadline:
+                return False
+            self._clock = asked = until
+            for number in self._chunk_queue:
+                self._send_nak(CHUNK_REQUEST_BYTE, number)
+
+    def _skip_payload(self, reader: _Payload) -> None:
+        if self._framed and not self._chunks_started:
+            return  # Nothing is sent before it is requested
+        while reader.received < reader.total:
+            size = min(reader.total - reader.received, FLOW_CONTROL_CHUNK)
+            if self._read_payload(reader, size) is None:
+                return
+
+    def _skip_granted_payload(self) -> None:
+        """skipGrantedPayload(): after a rejected header, drop what the host
+        sends of its initial credits until the line goes quiet, in the
+        device's time."""
+        if self._framed:
+            return  # Nothing is sent before it is requested
+        remaining = self.flow_credits * self.flow_chunk
+        last = max(self._clock, time.monotonic())
+        while remaining > 0:
+            until = last + SKIP_QUIET
+            with self._condition:
+                while not self._to_device.size and self._running:
+                    wait = until - time.monotonic()
+                    if wait <= 0:
+                        break
+                    self._condition.wait(wait)
+                if not self._to_device.size or self._to_device.next_arrival(1) > until:
+                    self._clock = max(self._clock, until)
+                    return
+                _, arrival = self._to_device.take(1)
+            self._clock = last = max(self._clock, arrival)
+            remaining -= 1
+
+    def _update(self) -> None:
+        now = self._millis()
+        for animation in self.animations:
+            if not animation.playing:
+                continue
+
+            # Advance by whole frame durations so the timing does not drift
+            advanced = False
+            for _ in range(animation.frame_count):
+                duration = animation.durations[animation.current]
+                if now - animation.frame_started < duration:
+                    break
+                animation.frame_started += duration
+                advanced = True
+                if animation.current + 1 < animation.frame_count:
+                    animation.current += 1
+                elif animation.loop:
+                    animation.current = 0
+                else:
+                    animation.playing = False  # The last frame stays up
+                    break
+
+            if advanced:
+                # Skip ahead rather than race to catch up after a long stall
+                if now - animation.frame_started >= animation.durations[animation.current]:
+                    animation.frame_started = now
+                self._clock = max(self._clock, time.monotonic())
+                self._draw_animation_frame(animation)
+
+    def _handle_set_baud(self, cmd: int, data: bytes) -> None:
+        if len(data) < 4:
+            self._send_ack(cmd, False, b"Invalid baud rate data")
+            return
+        baud = int.from_bytes(data[:4], "big")
+        if not MIN_BAUD_RATE <= baud <= MAX_BAUD_RATE:
+            self._send_ack(cmd, False, b"Unsupported baud rate")
+            return
+
+        # Acknowledge at the old rate, then switch before the host can
+        # read the ACK and answer at the new one
+        with self._condition:
+            self._send_ack(cmd, True, b"Switching baud rate")
+            previous = self.baud_rate
+            self.baud_rate = baud
+
+        # Keep the new rate only if the host confirms it with a ping
+        if not self._wait_for_ping(BAUD_VERIFY_TIMEOUT):
+            with self._condition:
+                self.baud_rate = previous
+                self._to_device.clear()  # Discard what arrived at the wrong rate
+
+    def _wait_for_ping(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline and self._running:
+            if self._available() < 3:
+                time.sleep(0.001)
+                continue
+
+            # Skip anything else, e.g. garbage from the rate switch
+            packet = self._read_packet(reply=False)
+            if packet is None or packet[0] != MatrixDisplay.CMD_PING:
+                continue
+            cmd, data = packet
+            if self.cost is not None:
+                self._charge(self.cost.command_cost(cmd))
+
+            success, message = self._execute(MatrixDisplay.CMD_PING, data)
+            self._send_ack(MatrixDisplay.CMD_PING, success, message)
+            return True
+        return False
+
+    def _handle_bitmap(self, cmd: int, data: bytes) -> None:
+        if len(data) < 4:
+            self._skip_granted_payload()
+            self._send_ack(cmd, False, b"Invalid bitmap header")
+            return
+        x, y, width, height = data[:4]
+        reader = _Payload(width * height * 2)
+
+        # One row at a time, drawn before the next is read
+        for row in range(height):
+            payload = self._read_payload(reader, width * 2)
+            if payload is None:
+                self._send_ack(cmd, False, b"Bitmap data read timeout")
+                return
+            pixels = np.frombuffer(payload, dtype=">u2").reshape(1, width)
+            self._blit(x, y + row, pixels)
+        self._send_ack(cmd, True)
+
+    def _handle_bitmap_rle(self, cmd: int, data: bytes) -> None:
+        if len(data) < 6:
+            self._skip_granted_payload()
+            self._send_ack(cmd, False, b"Invalid bitmap header")
+            return
+        x, y, width, height = data[:4]
+        reader = _Payload(int.from_bytes(data[4:6], "big"))
+
+        # A control byte with the high bit set is followed by one pixel
+        # repeated (control & 0x7F) + 1 times, otherwise by control + 1
+        # literal pixels
+        pixel_count = width * height
+        pixel_index = 0
+        while reader.received < reader.total:
+            control = self._read_payload(reader, 1)
+            if control is None:
+                self._send_ack(cmd, False, b"Bitmap data read timeout")
+                return
+            run = (control[0] & 0x7F) + 1
+            pixels = self._read_payload(reader, 2 if control[0] & 0x80 else 2 * run)
+            if pixels is None:
+                self._send_ack(cmd, False, b"Bitmap data read timeout")
+                return
+
+            if control[0] & 0x80:
+                rgb = self._rgb(int.from_bytes(pixels, "big"))
+                # Draw the run one row segment at a time
+                while run > 0 and pixel_index < pixel_count:
+                    px, py = pixel_index % width, pixel_index // width
+                    segment = min(run, width - px)
+                    self._fill(x + px, y + py, segment, 1, rgb)
+                    pixel_index += segment
+                    run -= segment
+                pixel_index += run  # Overflow past the bitmap is counted, not drawn
+            else:
+                colors = np.frombuffer(pixels, dtype=">u2")
+                positions = np.arange(pixel_index, pixel_index + run)
+                keep = positions < pixel_count
+                self._plot(x + positions[keep] % width, y + positions[keep] // width, colors[keep])
+                pixel_index += run
+
+        if pixel_index != pixel_count:
+            self._send_ack(cmd, False, b"RLE pixel count mismatch")
+            return
+        self._send_ack(cmd, True)
+
+    def _handle_bitmap_indexed(self, cmd: int, data: bytes) -> None:
+        indexed = _indexed_format(data[4:6]) if len(data) >= 6 else None
+        if indexed is None:
+            self._skip_granted_payload()
+            self._send_ack(cmd, False, b"Invalid bitmap header")
+            return
+        bpp, colors = indexed
+        x, y, width, height = data[:4]
+        pixel_count = width * height
+        reader = _Payload(colors * 2 + (pixel_count * bpp + 7) // 8)
+
+        # Palette first, then the packed indices, expanded as they arrive
+        palette = self._read_payload(reader, colors * 2)
+        if palette is None:
+            self._send_ack(cmd, False, b"Bitmap data read timeout")
+            return
+        palette = np.frombuffer(palette, dtype=">u2")
+
+        pixel_index = 0
+        while reader.received < reader.total:
+            chunk = min(reader.total - reader.received, INDEX_CHUNK)
+            packed = self._read_payload(reader, chunk)
+            if packed is None:
+                self._send_ack(cmd, False, b"Bitmap data read timeout")
+                return
+            count = min(chunk * 8 // bpp, pixel_count - pixel_index)
+            indices = _unpack_indices(packed, bpp, count)
+            positions = np.arange(pixel_index, pixel_index + len(indices))
+            opaque = indices < colors
+            positions = positions[opaque]
+            self._plot(x + positions % width, y + positions // width, palette[indices[opaque]])
+            pixel_index += len(indices)
+        self._send_ack(cmd, True)
+
+    def _handle_batch(self, cmd: int, data: bytes) -> None:
+        # Sub-commands are executed in order until the first failure
+        offset = index = 0
+        while offset < len(data):
+            if offset + 2 > len(data) or offset + 2 + data[offset + 1] > len(data):
+                success, message = False, b"Truncated sub-command"
+            else:
+                sub_cmd, sub_len = data[offset], data[offset + 1]
+                if sub_cmd in (
+                    MatrixDisplay.CMD_DRAW_BITMAP,
+                    MatrixDisplay.CMD_SET_SPRITE,
+                    MatrixDisplay.CMD_BATCH,
+                ):
+                    success, message = False, b"Command not allowed in batch"
+                else:
+                    sub_data = data[offset + 2 : offset + 2 + sub_len]
+                    success, message = self._execute(sub_cmd, sub_data)
+                offset += 2 + sub_len
+            if not success:
+                self._send_ack(cmd, False, b"%d: %s" % (index, message))
+                return
+            index += 1
+        self._send_ack(cmd, True, b"Batch executed")
+
+    def _handle_set_sprite(self, cmd: int, data: bytes) -> None:
+        indexed = cmd == MatrixDisplay.CMD_SET_SPRITE_INDEXED
+        if len(data) < (7 if indexed else 5):
+            self._skip_granted_payload()
+            self._send_ack(cmd, False, b"Invalid sprite data")
+            return
+        sprite_id, x, y, width, height = data[:5]
+
+        bpp, colors = 16, 0
+        if indexed:
+            indexed_format = _indexed_format(data[5:7])
+            if indexed_format is None:
+                self._skip_granted_payload()
+                self._send_ack(cmd, False, b"Invalid palette format")
+                return
+            bpp, colors = indexed_format
+
+        # Indexed sprites keep their palette in front of the packed indices
+        size = (
+            colors * 2 + (width * height * bpp + 7) // 8 if indexed else width * height * 2
+        )
+        reader = _Payload(size)
+        if sprite_id >= len(self.sprites):
+            self._skip_payload(reader)
+            self._send_ack(cmd, False, b"Invalid sprite ID")
+            return
+
+        sprite = self.sprites[sprite_id]
+        if sprite.active:
+            self._clear_sprite_area(sprite)
+            sprite.active = False
+        self.sprite_memory_used -= sprite.size
+        sprite.size = 0
+
+        if size > SPRITE_MEMORY_SIZE - self.sprite_memory_used:
+            self._skip_payload(reader)
+            self._send_ack(cmd, False, b"Sprite too large")
+            return
+        payload = self._read_payload(reader, size)
+        if payload is None:
+            self._send_ack(cmd, False, b"Sprite data read timeout")
+            return
+
+        if indexed:
+            palette = np.frombuffer(payload[: colors * 2], dtype=">u2")
+            indices = _unpack_indices(payload[colors * 2 :], bpp, width * height)
+            indices = indices.reshape(height, width)
+            sprite.opaque = indices < colors
+            sprite.pixels = palette[np.where(sprite.opaque, indices, 0)]
+        else:
+            sprite.pixels = np.frombuffer(payload, dtype=">u2").reshape(height, width)
+            sprite.opaque = None
+        sprite.size = size
+        self.sprite_memory_used += size
+        sprite.active = True
+        sprite.x = sprite.last_x = x
+        sprite.y = sprite.last_y = y
+        sprite.width, sprite.height, sprite.bpp = width, height, bpp
+        sprite.crc = zlib.crc32(payload)
+        self._send_ack(cmd, True, b"Sprite set")
+
+    def _execute(self, cmd: int, data: bytes) -> Tuple[bool, bytes]:
+        """executeCommand(): commands without a bulk payload."""
+        length = len(data)
+        if cmd == MatrixDisplay.CMD_DRAW_PIXEL:
+            if length < 5:
+                return False, b"Invalid pixel data"
+            self._fill(data[0], data[1], 1, 1, tuple(data[2:5]))
+            return True, b"Pixel drawn"
+
+        if cmd == MatrixDisplay.CMD_FILL_SCREEN:
+            if length < 3:
+                return False, b"Invalid fill data"
+            self._fill(0, 0, self.width, self.height, tuple(data[:3]))
+            return True, b"Screen filled"
+
+        if cmd == MatrixDisplay.CMD_DRAW_LINE:
+            if length < 7:
+                return False, b"Invalid line data"
+            self._line(*data[:4], self._rgb(_color565(*data[4:7])))
+            return True, b"Line drawn"
+
+        if cmd == MatrixDisplay.CMD_DRAW_RECT:
+            if length < 7:
+                return False, b"Invalid rectangle data"
+            x, y, w, h = data[:4]
+            rgb = self._rgb(_color565(*data[4:7]))
+            self._fill(x, y, w, 1, rgb)
+            self._fill(x, y + h - 1, w, 1, rgb)
+            self._fill(x, y, 1, h, rgb)
+            self._fill(x + w - 1, y, 1, h, rgb)
+            return True, b"Rectangle drawn"
+
+        if cmd == MatrixDisplay.CMD_CLEAR:
+            self._fill(0, 0, self.width, self.height, (0, 0, 0))
+            return True, b"Screen cleared"
+
+        if cmd == MatrixDisplay.CMD_SET_BRIGHTNESS:
+            if length < 1:
+                return False, b"Invalid brightness data"
+            self.brightness = data[0]
+            return True, b"Brightness set"
+
+        if cmd == MatrixDisplay.CMD_PRINT:
+            if length < 1:
+                return False, b"Invalid text data"
+            self._print(data.split(b"\0")[0])
+            return True, b"Text printed"
+
+        if cmd == MatrixDisplay.CMD_SET_CURSOR:
+            if length < 2:
+                return False, b"Invalid cursor data"
+            self.cursor_x, self.cursor_y = data[:2]
+            return True, b"Cursor set"
+
+        if cmd == MatrixDisplay.CMD_FILL_RECT:
+            if length < 7:
+                return False, b"Invalid rectangle data"
+            self._fill(*data[:4], self._rgb(_color565(*data[4:7])))
+            return True, b"Rectangle filled"
+
+        if cmd in (MatrixDisplay.CMD_DRAW_FAST_VLINE, MatrixDisplay.CMD_DRAW_FAST_HLINE):
+            vertical = cmd == MatrixDisplay.CMD_DRAW_FAST_VLINE
+            name = b"Vertical line" if vertical else b"Horizontal line"
+            if length < 6:
+                return False, b"Invalid " + name.lower() + b" data"
+            x, y, size = data[:3]
+            rgb = self._rgb(_color565(*data[3:6]))
+            self._fill(x, y, 1, size, rgb) if vertical else self._fill(x, y, size, 1, rgb)
+            return True, name + b" drawn"
+
+        if cmd == MatrixDisplay.CMD_CLEAR_SPRITE:
+            sprite = self._sprite(data, 1)
+            if isinstance(sprite, bytes):
+                return False, sprite
+            self._clear_sprite_area(sprite)
+            sprite.active = False
+            self.sprite_memory_used -= sprite.size
+            sprite.size = 0
+            return True, b"Sprite cleared"
+
+        if cmd in (MatrixDisplay.CMD_DRAW_SPRITE, MatrixDisplay.CMD_MOVE_SPRITE):
+            move = cmd == MatrixDisplay.CMD_MOVE_SPRITE
+            if length < 3:
+                return False, b"Invalid move sprite data" if move else b"Invalid draw sprite data"
+            sprite = self._sprite(data, 3)
+            if isinstance(sprite, bytes):
+                return False, sprite
+            x, y = data[1:3]
+            if (sprite.last_x, sprite.last_y) != (x, y):
+                self._clear_sprite_area(sprite)
+            self._draw_sprite_rect(sprite, 0, 0, sprite.width, sprite.height, x, y)
+            sprite.last_x, sprite.last_y = x, y
+            if move:
+                sprite.x, sprite.y = x, y
+                return True, b"Sprite moved"
+            return True, b"Sprite drawn"
+
+        if cmd == MatrixDisplay.CMD_QUERY_SPRITE:
+            sprite = self._sprite(data, 1)
+            if isinstance(sprite, bytes):
+                return False, sprite
+            return True, b"crc=%08x w=%d h=%d bpp=%d" % (
+                sprite.crc, sprite.width, sprite.height, sprite.bpp,
+            )
+
+        if cmd == MatrixDisplay.CMD_REUSE_SPRITE:
+            if length < 10:
+                return False, b"Invalid reuse sprite data"
+            if data[0] >= len(self.sprites):
+                return False, b"Invalid sprite ID"
+            # Only if the slot already holds this exact image
+            sprite = self.sprites[data[0]]
+            key = (sprite.width, sprite.height, sprite.bpp, sprite.crc) if sprite.active else None
+            if key != (data[3], data[4], data[5], int.from_bytes(data[6:10], "big")):
+                return False, b"Sprite not cached"
+            self._clear_sprite_area(sprite)
+            sprite.x = sprite.last_x = data[1]
+            sprite.y = sprite.last_y = data[2]
+            return True, b"Sprite unchanged"
+
+        if cmd == MatrixDisplay.CMD_DRAW_SPRITE_RECT:
+            if length < 7:
+                return False, b"Invalid sprite rect data"
+            sprite = self._sprite(data, 7)
+            if isinstance(sprite, bytes):
+                return False, sprite
+            self._draw_sprite_rect(sprite, *data[1:7])
+            return True, b"Sprite rect drawn"
+
+        if cmd == MatrixDisplay.CMD_SET_ANIMATION:
+            return self._set_animation(data)
+
+        if cmd == MatrixDisplay.CMD_ANIMATION_CONTROL:
+            if length < 2:
+                return False, b"Invalid animation control data"
+            if data[0] >= len(self.animations) or not self.animations[data[0]].defined:
+                return False, b"Animation not set"
+            animation = self.animations[data[0]]
+            if data[1] in (MatrixDisplay.ANIMATION_STOP, MatrixDisplay.ANIMATION_STOP_CLEAR):
+                animation.playing = False
+                if data[1] == MatrixDisplay.ANIMATION_STOP_CLEAR:
+                    self._clear_animation_area(animation)
+                return True, b"Animation stopped"
+            if data[1] in (MatrixDisplay.ANIMATION_START, MatrixDisplay.ANIMATION_RESUME):
+                if data[1] == MatrixDisplay.ANIMATION_START:
+                    animation.current = 0
+                animation.playing = True
+                animation.frame_started = self._millis()
+                self._draw_animation_frame(animation)
+                return True, b"Animation started"
+            return False, b"Invalid animation action"
+
+        if cmd == MatrixDisplay.CMD_MOVE_ANIMATION:
+            if length < 3:
+                return False, b"Invalid move animation data"
+            if data[0] >= len(self.animations) or not self.animations[data[0]].defined:
+                return False, b"Animation not set"
+            animation = self.animations[data[0]]
+            animation.x, animation.y = data[1:3]
+            # Redraw right away if the frame is on screen
+            if animation.drawn_width > 0:
+                self._draw_animation_frame(animation)
+            return True, b"Animation moved"
+
+        if cmd == MatrixDisplay.CMD_FLOW_CONFIG:
+            if length < 3:
+                return False, b"Invalid flow config data"
+            # Clamp the requested chunk size and credits to the receive buffer
+            chunk = min(max(int.from_bytes(data[:2], "big"), MIN_FLOW_CHUNK), SERIAL_RX_BUFFER_SIZE)
+            credits = min(max(data[2], 1), SERIAL_RX_BUFFER_SIZE // chunk)
+            self.flow_chunk, self.flow_credits = chunk, credits
+            return True, b"chunk=%d credits=%d buffer=%d" % (chunk, credits, SERIAL_RX_BUFFER_SIZE)
+
+        if cmd == MatrixDisplay.CMD_PING:
+            # Echo the data back so the host can check the link
+            return True, data.split(b"\0")[0]
+
+        if cmd == MatrixDisplay.CMD_SET_TELEMETRY:
+            if length < 1:
+                return False, b"Invalid telemetry data"
+            if data[0] & MatrixDisplay.TELEMETRY_RESET:
+                self.stats = [[0, 0, 0, 0, 0] for _ in range(MAX_STATS_OPCODE + 1)]
+            enable = bool(data[0] & MatrixDisplay.TELEMETRY_ENABLE)
+            if enable and not self.telemetry:
+                self._start_timing()  # This packet's own ACK is timed from here
+            self.telemetry = enable
+            return True, b"Telemetry on" if enable else b"Telemetry off"
+
+        if cmd == MatrixDisplay.CMD_QUERY_STATS:
+            if length == 0:
+                # List the opcodes that have counters, e.g. "01 0d 12"
+                return True, b" ".join(
+                    b"%02x" % opcode for opcode, entry in enumerate(self.stats) if entry[0]
+                )
+            if data[0] > MAX_STATS_OPCODE:
+                return False, b"Invalid opcode"
+            return True, b"count=%d failures=%d receive=%d render=%d max=%d" % tuple(
+                self.stats[data[0]]
+            )
+
+        return False, b"Unknown command"
+
+    def _sprite(self, data: bytes, length: int) -> Any:
+        """The active sprite addressed by data[0], or the error message."""
+        if len(data) < length or data[0] >= len(self.sprites):
+            return b"Invalid sprite ID"
+        sprite = self.sprites[data[0]]
+        if not sprite.active:
+            return b"Sprite not active"
+        return sprite
+
+    def _set_animation(self, data: bytes) -> Tuple[bool, bytes]:
+        # ANIM_ID X Y FLAGS COUNT, then SPRITE_ID + DURATION (2 bytes) per frame
+        if len(data) < 5 or len(data) < 5 + data[4] * 3:
+            return False, b"Invalid animation data"
+        animation_id, x, y, flags, frame_count = data[:5]
+        if animation_id >= len(self.animations):
+            return False, b"Invalid animation ID"
+        if not 1 <= frame_count <= MatrixDisplay.MAX_ANIMATION_FRAMES:
+            return False, b"Invalid frame count"
+
+        animation = self.animations[animation_id]
+        for i, offset in enumerate(range(5, 5 + frame_count * 3, 3)):
+            # Frames before an invalid one are already replaced, as on the device
+            if data[offset] >= len(self.sprites):
+                return False, b"Invalid sprite ID"
+            animation.sprite_ids[i] = data[offset]
+            animation.durations[i] = max(1, int.from_bytes(data[offset + 1 : offset + 3], "big"))
+
+        animation.defined = True
+        animation.playing = False
+        animation.loop = bool(flags & 0x01)
+        animation.x, animation.y = x, y
+        animation.frame_count = frame_count
+        animation.current = 0
+        return True, b"Animation set"
+
+    def _draw_animation_frame(self, animation: _Animation) -> None:
+        sprite = self.sprites[animation.sprite_ids[animation.current]]
+
+        # Frames may differ in size or the animation may have moved
+        if not sprite.active or (
+            animation.drawn_x, animation.drawn_y, animation.drawn_width, animation.drawn_height
+        ) != (animation.x, animation.y, sprite.width, sprite.height):
+            self._clear_animation_area(animation)
+        if not sprite.active:
+            return  # The slot was cleared since the animation was set
+
+        self._draw_sprite_rect(sprite, 0, 0, sprite.width, sprite.height, animation.x, animation.y)
+        animation.drawn_x, animation.drawn_y = animation.x, animation.y
+        animation.drawn_width, animation.drawn_height = sprite.width, sprite.height
+
+    def _clear_animation_area(self, animation: _Animation) -> None:
+        if animation.drawn_width > 0 and animation.drawn_height > 0:
+            self._fill(
+                animation.drawn_x, animation.drawn_y,
+                animation.drawn_width, animation.drawn_height, (0, 0, 0),
+            )
+        animation.drawn_width = animation.drawn_height = 0
+
+    # Drawing, as the simulator's SimMatrixPanel
+
+    @staticmethod
+    def _rgb(color: int) -> Tuple[int, int, int]:
+        """RGB565 to the RGB888 stored in the framebuffer."""
+        return ((color >> 11) & 0x1F) << 3, ((color >> 5) & 0x3F) << 2, (color & 0x1F) << 3
+
+    def _fill(self, x: int, y: int, w: int, h: int, rgb: Tuple[int, int, int]) -> None:
+        """fillRect(): normalize negative sizes, clip and fill."""
+        if w < 0:
+            x, w = x + w + 1, -w
+        if h < 0:
+            y, h = y + h + 1, -h
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, self.width), min(y + h, self.height)
+        if x0 < x1 and y0 < y1:
+            self.framebuffer[y0:y1, x0:x1] = rgb
+            self._charge_pixels((x1 - x0) * (y1 - y0))
+
+    def _blit(self, x: int, y: int, pixels: "np.ndarray", opaque: Any = None) -> None:
+        """drawRGBBitmap(): copy RGB565 pixels, clipped, skipping transparent ones."""
+        height, width = pixels.shape
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + width, self.width), min(y + height, self.height)
+        if x0 >= x1 or y0 >= y1:
+            return
+        source = (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+        rgb = _rgb888(pixels[source])
+        if opaque is None:
+            self.framebuffer[y0:y1, x0:x1] = rgb
+            self._charge_pixels((x1 - x0) * (y1 - y0))
+        else:
+            mask = opaque[source]
+            self.framebuffer[y0:y1, x0:x1][mask] = rgb[mask]
+            self._charge_pixels(int(mask.sum()))
+
+    def _plot(self, xs: "np.ndarray", ys: "np.ndarray", colors: "np.ndarray") -> None:
+        """drawPixel() for arrays of coordinates and RGB565 colors."""
+        inside = (xs < self.width) & (ys < self.height)
+        self.framebuffer[ys[inside], xs[inside]] = _rgb888(colors[inside])
+        self._charge_pixels(int(inside.sum()))
+
+    def _charge_pixels(self, count: int) -> None:
+        if self.cost is not None:
+            self._charge(count * self.cost.pixel)
+
+    def _line(self, x0: int, y0: int, x1: int, y1: int, rgb: Tuple[int, int, int]) -> None:
+        """Adafruit_GFX::drawLine()."""
+        if x0 == x1:
+            y0, y1 = min(y0, y1), max(y0, y1)
+            self._fill(x0, y0, 1, y1 - y0 + 1, rgb)
+            return
+        if y0 == y1:
+            x0, x1 = min(x0, x1), max(x0, x1)
+            self._fill(x0, y0, x1 - x0 + 1, 1, rgb)
+            return
+
+        steep = abs(y1 - y0) > abs(x1 - x0)
+        if steep:
+            x0, y0, x1, y1 = y0, x0, y1, x1
+        if x0 > x1:
+            x0, x1, y0, y1 = x1, x0, y1, y0
+        dx, dy = x1 - x0, abs(y1 - y0)
+        err = dx // 2
+        ystep = 1 if y0 < y1 else -1
+        for x in range(x0, x1 + 1):
+            if steep:
+                self._fill(y0, x, 1, 1, rgb)
+            else:
+                self._fill(x, y0, 1, 1, rgb)
+            err -= dy
+            if err < 0:
+                y0 += ystep
+                err += dx
+
+    def _print(self, text: bytes) -> None:
+        """The simulator's print(): one white pixel per character."""
+        white = self._rgb(_color565(255, 255, 255))
+        x, y = self.cursor_x, self.cursor_y
+        for char in text:
+            if char == ord("\n"):
+                x = self.cursor_x
+                y += 8
+            elif char == ord("\r"):
+                x = self.cursor_x
+            else:
+                self._fill(x, y, 1, 1, white)
+                x += 6  # Character width
+                if x >= self.width:
+                    x = self.cursor_x
+                    y += 8
+        self.cursor_x, self.cursor_y = x, y
+
+    def _clear_sprite_area(self, sprite: _Sprite) -> None:
+        if sprite.active:
+            self._fill(sprite.last_x, sprite.last_y, sprite.width, sprite.height, (0, 0, 0))
+
+    def _draw_sprite_rect(
+        self, sprite: _Sprite, src_x: int, src_y: int, width: int, height: int, x: int, y: int
+    ) -> None:
+        # Clip the source rectangle to the sprite
+        width = min(width, sprite.width - src_x)
+        height = min(height, sprite.height - src_y)
+        if width <= 0 or height <= 0:
+            return
+        region = (slice(src_y, src_y + height), slice(src_x, src_x + width))
+        opaque = None if sprite.opaque is None else sprite.opaque[region]
+        self._blit(x, y, sprite.pixels[region], opaque)
+
+
+class EmulatorSerial(SerialBase):
+    """pySerial port of an in-process FirmwareEmulator.
+
+    pySerial's serial_for_url() creates it for emulator:// URLs, which
+    MatrixDisplay accepts as its port.
+    """
+
+    def __init__(self, *args: Any, **kwargs: Any):
+        self._emulator: Optional[FirmwareEmulator] = None
+        super().__init__(*args, **kwargs)
+
+    def open(self) -> None:
+        if self.is_open:
+            raise SerialException("Port is already open.")
+        if self._port is None:
+            raise SerialException("Port must be configured before it can be used.")
+        self._emulator = FirmwareEmulator.from_url(self._port)
+        self.is_open = True
+
+    def close(self) -> None:
+        # The emulator keeps running, like a board whose port was closed
+        self.is_open = False
+        self._emulator = None
+
+    def _reconfigure_port(self, *args: Any) -> None:
+        """Settings are read when used: the rate by write(), timeout by read()."""
+
+    def _check_open(self) -> FirmwareEmulator:
+        if not self.is_open:
+            raise PortNotOpenError()
+        return self._emulator
+
+    @property
+    def in_waiting(self) -> int:
+        return self._check_open().host_in_waiting()
+
+    def read(self, size: int = 1) -> bytes:
+        return self._check_open().host_read(size, self._timeout)
+
+    def write(self, data: bytes) -> int:
+        data = bytes(data)
+        self._check_open().host_write(data, self._baudrate)
+        return len(data)
+
+    def flush(self) -> None:
+        self._check_open().host_flush()
+
+    def reset_input_buffer(self) -> None:
+        self._check_open().host_reset_input()
+
+    def reset_output_buffer(self) -> None:
+        self._check_open()
@@ -0,0 +1,309 @@
+"""
+Client-side shadow framebuffer for the matrix display.
+
+The shadow framebuffer mirrors the panel contents in a NumPy RGB565 array by
+replaying every command the client sends. Frames can then be diffed against
+the mirror so only the changed regions are transferred.
+"""
+
+from typing import Dict, List, Tuple
+from .codec import indexed_to_rgb565, rgb565_rle_decode
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is an optional dependency
+    np = None
+
+# Command bytes (see MatrixDisplay)
+CMD_DRAW_PIXEL = 0x01
+CMD_FILL_SCREEN = 0x02
+CMD_DRAW_LINE = 0x03
+CMD_DRAW_RECT = 0x04
+CMD_CLEAR = 0x06
+CMD_PRINT = 0x08
+CMD_FILL_RECT = 0x0A
+CMD_DRAW_FAST_VLINE = 0x0B
+CMD_DRAW_FAST_HLINE = 0x0C
+CMD_DRAW_BITMAP = 0x0D
+CMD_SET_SPRITE = 0x0E
+CMD_CLEAR_SPRITE = 0x0F
+CMD_DRAW_SPRITE = 0x10
+CMD_MOVE_SPRITE = 0x11
+CMD_DRAW_BITMAP_RLE = 0x13
+CMD_DRAW_BITMAP_INDEXED = 0x14
+CMD_SET_SPRITE_INDEXED = 0x15
+CMD_DRAW_SPRITE_RECT = 0x1B
+CMD_SET_ANIMATION = 0x1C
+CMD_ANIMATION_CONTROL = 0x1D
+CMD_MOVE_ANIMATION = 0x1E
+
+# Rectangle as (x, y, width, height)
+Rect = Tuple[int, int, int, int]
+
+
+def color565(r: int, g: int, b: int) -> int:
+    """Convert an RGB888 color to RGB565, as the firmware does."""
+    return ((r & 0xF8) << 8) | ((g & 0xFC) << 3) | (b >> 3)
+
+
+class _ShadowSprite:
+    """Host copy of a sprite slot."""
+
+    __slots__ = ("pixels", "last_x", "last_y")
+
+    def __init__(self, pixels: "np.ndarray", x: int, y: int):
+        self.pixels = pixels
+        self.last_x = x
+        self.last_y = y
+
+
+class ShadowFramebuffer:
+    """NumPy RGB565 mirror of the panel.
+
+    `pixels` holds the expected panel contents and `valid` marks the pixels
+    whose contents are actually known. Pixels start out unknown, and become
+    unknown again after commands the host cannot replay exactly (text) or
+    after a command failed.
+    """
+
+    def __init__(self, width: int, height: int):
+        """Create a mirror for a panel of the given size.
+
+        Args:
+            width: Panel width in pixels
+            height: Panel height in pixels
+        """
+        if np is None:
+            raise RuntimeError("The shadow framebuffer requires NumPy")
+        self.width = width
+        self.height = height
+        self.pixels = np.zeros((height, width), dtype=np.uint16)
+        self.valid = np.zeros((height, width), dtype=bool)
+        self.sprites: Dict[int, _ShadowSprite] = {}
+
+    def invalidate(self) -> None:
+        """Forget the panel contents, e.g. after a command failed."""
+        self.valid[:] = False
+
+    def apply(self, cmd: int, data: bytes, payload: bytes = None) -> None:
+        """Replay a command on the mirror.
+
+        Args:
+            cmd: Command byte
+            data: Command data
+            payload: RGB565, RLE or indexed payload of bitmap and sprite commands
+        """
+        if cmd == CMD_DRAW_PIXEL and len(data) >= 5:
+            x, y, r, g, b = data[:5]
+            self._fill(x, y, 1, 1, color565(r, g, b))
+        elif cmd == CMD_FILL_SCREEN and len(data) >= 3:
+            self._fill(0, 0, self.width, self.height, color565(*data[:3]))
+        elif cmd == CMD_CLEAR:
+            self._fill(0, 0, self.width, self.height, 0)
+        elif cmd == CMD_DRAW_LINE and len(data) >= 7:
+            self._line(*data[:4], color565(*data[4:7]))
+        elif cmd == CMD_DRAW_RECT and len(data) >= 7:
+            x, y, w, h = data[:4]
+            color = color565(*data[4:7])
+            self._fill(x, y, w, 1, color)
+            self._fill(x, y + h - 1, w, 1, color)
+            self._fill(x, y, 1, h, color)
+            self._fill(x + w - 1, y, 1, h, color)
+        elif cmd == CMD_FILL_RECT and len(data) >= 7:
+            self._fill(*data[:4], color565(*data[4:7]))
+        elif cmd == CMD_DRAW_FAST_VLINE and len(data) >= 6:
+            x, y, h = data[:3]
+            self._fill(x, y, 1, h, color565(*data[3:6]))
+        elif cmd == CMD_DRAW_FAST_HLINE and len(data) >= 6:
+            x, y, w = data[:3]
+            self._fill(x, y, w, 1, color565(*data[3:6]))
+        elif cmd == CMD_PRINT:
+            # Glyph rendering is not replayed on the host
+            self.invalidate()
+        elif cmd in (CMD_ANIMATION_CONTROL, CMD_MOVE_ANIMATION):
+            # The device draws animation frames on its own schedule
+            self.invalidate()
+        elif cmd == CMD_DRAW_BITMAP and len(data) >= 4 and payload:
+            x, y, w, h = data[:4]
+            self._blit(x, y, _rgb565_pixels(payload, w, h))
+        elif cmd == CMD_DRAW_BITMAP_RLE and len(data) >= 4 and payload:
+            x, y, w, h = data[:4]
+            self._blit(x, y, _rgb565_pixels(rgb565_rle_decode(payload), w, h))
+        elif cmd == CMD_DRAW_BITMAP_INDEXED and len(data) >= 6 and payload:
+            x, y, w, h = data[:4]
+            self._blit(x, y, _rgb565_pixels(_expand_indexed(data[4:6], payload, w * h), w, h))
+        elif cmd == CMD_SET_SPRITE and len(data) >= 5 and payload:
+            sprite_id, x, y, w, h = data[:5]
+            self._clear_sprite_area(sprite_id)
+            self.sprites[sprite_id] = _ShadowSprite(_rgb565_pixels(payload, w, h), x, y)
+        elif cmd == CMD_SET_SPRITE_INDEXED and len(data) >= 7 and payload:
+            sprite_id, x, y, w, h = data[:5]
+            self._clear_sprite_area(sprite_id)
+            pixels = _expand_indexed(data[5:7], payload, w * h)
+            self.sprites[sprite_id] = _ShadowSprite(_rgb565_pixels(pixels, w, h), x, y)
+        elif cmd == CMD_CLEAR_SPRITE and len(data) >= 1:
+            self._clear_sprite_area(data[0])
+            self.sprites.pop(data[0], None)
+        elif cmd in (CMD_DRAW_SPRITE, CMD_MOVE_SPRITE) and len(data) >= 3:
+            sprite_id, x, y = data[:3]
+            sprite = self.sprites.get(sprite_id)
+            if sprite is None:
+                return
+            if (sprite.last_x, sprite.last_y) != (x, y):
+                self._clear_sprite_area(sprite_id)
+            self._blit(x, y, sprite.pixels)
+            sprite.last_x, sprite.last_y = x, y
+        elif cmd == CMD_DRAW_SPRITE_RECT and len(data) >= 7:
+            sprite = self.sprites.get(data[0])
+            if sprite is None:
+                return
+            src_x, src_y, w, h, x, y = data[1:7]
+            self._blit(x, y, sprite.pixels[src_y : src_y + h, src_x : src_x + w])
+
+    def diff(self, frame: "np.ndarray", x: int = 0, y: int = 0) -> "np.ndarray":
+        """Return a mask of the pixels of `frame` that differ from the panel.
+
+        Args:
+            frame: RGB565 array of shape (height, width)
+            x: X coordinate of the frame on the panel
+            y: Y coordinate of the frame on the panel
+        """
+        height, width = frame.shape
+        region = self.pixels[y : y + height, x : x + width]
+        valid = self.valid[y : y + height, x : x + width]
+        return (region != frame) | ~valid
+
+    def _fill(self, x: int, y: int, w: int, h: int, color: int) -> None:
+        """Fill a rectangle, clipped to the panel."""
+        x0, y0 = max(x, 0), max(y, 0)
+        x1, y1 = min(x + w, self.width), min(y + h, self.height)
+        if x0 < x1 and y0 < y1:
+            self.pixels[y0:y1, x0:x1] = color
+            self.valid[y0:y1, x0:x1] = True
+
+    def _blit(self, x: int, y: int, pixels: "np.ndarray") -> None:
+        """Copy an RGB565 array onto the mirror, clipped to the panel."""
+        height, width = pixels.shape
+        w = min(width, self.width - x)
+        h = min(height, self.height - y)
+        if w > 0 and h > 0:
+            self.pixels[y : y + h, x : x + w] = pixels[:h, :w]
+            self.valid[y : y + h, x : x + w] = True
+
+    def _line(self, x0: int, y0: int, x1: int, y1: int, color: int) -> None:
+        """Bresenham line, matching Adafruit_GFX::writeLine."""
+        steep = abs(y1 - y0) > abs(x1 - x0)
+        if steep:
+            x0, y0 = y0, x0
+            x1, y1 = y1, x1
+        if x0 > x1:
+            x0, x1 = x1, x0
+            y0, y1 = y1, y0
+
+        dx = x1 - x0
+        dy = abs(y1 - y0)
+        err = dx // 2
+        ystep = 1 if y0 < y1 else -1
+        for x in range(x0, x1 + 1):
+            if steep:
+                self._fill(y0, x, 1, 1, color)
+            else:
+                self._fill(x, y0, 1, 1, color)
+            err -= dy
+            if err < 0:
+                y0 += ystep
+                err += dx
+
+    def _clear_sprite_area(self, sprite_id: int) -> None:
+        """Blank the area where a sprite was last drawn, as the firmware does."""
+        sprite = self.sprites.get(sprite_id)
+        if sprite is not None:
+            height, width = sprite.pixels.shape
+            self._fill(sprite.last_x, sprite.last_y, width, height, 0)
+
+
+def _rgb565_pixels(payload: bytes, width: int, height: int) -> "np.ndarray":
+    """Decode a big-endian RGB565 payload into a native uint16 array."""
+    return np.frombuffer(payload, dtype=">u2").astype(np.uint16).reshape(height, width)
+
+
+def _expand_indexed(header: bytes, payload: bytes, count: int) -> bytes:
+    """Expand an indexed payload given its BPP + COLORS header to RGB565."""
+    bpp, colors = header[0], header[1] + 1
+    return indexed_to_rgb565(payload[: colors * 2], payload[colors * 2 :], bpp, count)
+
+
+def dirty_rects(mask: "np.ndarray", tile: int = 8, overhead: int = 64) -> List[Rect]:
+    """Cover the set pixels of a mask with a small number of rectangles.
+
+    The mask is first reduced to a grid of `tile` x `tile` tiles. Horizontal
+    runs of dirty tiles are merged with identical runs on the rows below, each
+    resulting rectangle is shrunk to the changed pixels it contains, and
+    rectangles are then merged while that is cheaper than sending them apart.
+
+    Args:
+        mask: Boolean array of changed pixels
+        tile: Tile size used to group changes
+        overhead: Estimated cost of an extra transfer, in payload bytes
+
+    Returns:
+        List of (x, y, width, height) rectangles
+    """
+    height, width = mask.shape
+    rows = -(-height // tile)
+    cols = -(-width // tile)
+    padded = np.zeros((rows * tile, cols * tile), dtype=bool)
+    padded[:height, :width] = mask
+    tiles = padded.reshape(rows, tile, cols, tile).any(axis=(1, 3))
+
+    # Horizontal runs of dirty tiles, merged downwards when they line up
+    open_runs: Dict[Tuple[int, int], int] = {}
+    tile_rects: List[Tuple[int, int, int, int]] = []
+    for row in range(rows + 1):
+        runs = set()
+        if row < rows:
+            line = np.concatenate(([False], tiles[row], [False])).astype(np.int8)
+            edges = np.flatnonzero(np.diff(line))
+            runs = set(zip(edges[0::2], edges[1::2]))
+        for run in list(open_runs):
+            if run not in runs:
+                tile_rects.append((run[0], open_runs.pop(run), run[1], row))
+        for run in runs:
+            open_runs.setdefault(run, row)
+
+    # Shrink each rectangle to the pixels that actually changed
+    rects = []
+    for c0, r0, c1, r1 in tile_rects:
+        x0, y0 = c0 * tile, r0 * tile
+        sub = mask[y0 : r1 * tile, x0 : c1 * tile]
+        ys = np.flatnonzero(sub.any(axis=1))
+        xs = np.flatnonzero(sub.any(axis=0))
+        rects.append(
+            (x0 + xs[0], y0 + ys[0], x0 + xs[-1] + 1, y0 + ys[-1] + 1)
+        )
+
+    # Greedily merge rectangles while the union is cheaper than both
+    def cost(r):
+        return (r[2] - r[0]) * (r[3] - r[1]) * 2 + overhead
+
+    merged = True
+    while merged and len(rects) > 1:
+        merged = False
+        for i in range(len(rects)):
+            for j in range(i + 1, len(rects)):
+                a, b = rects[i], rects[j]
+                union = (
+                    min(a[0], b[0]),
+                    min(a[1], b[1]),
+                    max(a[2], b[2]),
+                    max(a[3], b[3]),
+                )
+                if cost(union) <= cost(a) + cost(b):
+                    rects[i] = union
+                    del rects[j]
+                    merged = True
+                    break
+            if merged:
+                break
+
+    return [(int(x0), int(y0), int(x1 - x0), int(y1 - y0)) for x0, y0, x1, y1 in rects]
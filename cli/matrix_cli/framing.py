@@ -0,0 +1,293 @@
+"""
+Incremental parser of what the device sends back.
+
+The device answers every packet with an ACK frame and grants bulk payload
+chunks with single 0xFF bytes. A FrameParser reads whatever the port has
+to offer into one reusable buffer and turns it into events: READY for each
+0xFF byte and an AckFrame, whose fields are memoryviews into the buffer,
+for each frame. Bytes that start neither are skipped, so the parser
+resynchronizes on the next start byte after noise or a partial frame.
+
+Packets sent with framing v2 (FRAMED_START_BYTE) carry a sequence number
+and a CRC-16 and are answered in kind: framed ACKs echo the SEQ, a NakFrame
+asks for a corrupted packet to be sent again and, instead of 0xFF credits,
+one asks for a bulk payload chunk by number.
+Framed frames whose CRC does not match are skipped like noise.
+
+    parser = FrameParser(0xAA, 0xAC, 0xAD)
+    while True:
+        event = parser.next_event()
+        if event is None and not parser.fill(ser):
+            break  # Timed out
+        ...
+"""
+
+import binascii
+from typing import Iterator, Optional, Union
+import serial
+
+# Event for a flow control credit; it is the byte itself
+READY = 0xFF
+# Framing v2 (FRAMED_START_BYTE, NAK_BYTE and CHUNK_REQUEST_BYTE in
+# command_handler.h)
+FRAMED_START_BYTE = 0xAB
+NAK_BYTE = 0xAE
+CHUNK_REQUEST_BYTE = 0xAF
+# RECEIVE_US + RENDER_US after the message of a timed ACK
+TIMING_SIZE = 8
+CRC_SIZE = 2
+# Largest frame: framed header, a 255 byte message, the timing and the CRC
+MAX_FRAME_SIZE = 7 + 255 + TIMING_SIZE + CRC_SIZE
+BUFFER_SIZE = 4096
+
+
+def crc16(data: bytes, crc: int = 0xFFFF) -> int:
+    """CRC-16/CCITT-FALSE of data, continuing from `crc`."""
+    return binascii.crc_hqx(data, crc)
+
+
+def crc8(data: bytes) -> int:
+    """CRC-8/SMBUS (poly 0x07, init 0x00) of data, which checks the header
+    of a framed packet or ACK before its length is trusted."""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = ((crc << 1) ^ 0x07 if crc & 0x80 else crc << 1) & 0xFF
+    return crc
+
+
+def framed_packet(seq: int, cmd: int, data: bytes) -> bytes:
+    """FRAMED_START_BYTE + SEQ + CMD + LEN + CRC-8 of SEQ to LEN + DATA +
+    CRC-16 of SEQ to DATA."""
+    header = bytes([seq, cmd, len(data)])
+    body = header + bytes([crc8(header)]) + data
+    return bytes([FRAMED_START_BYTE]) + body + crc16(body).to_bytes(2, "big")
+
+
+def framed_chunk(number: int, data: bytes, size: int) -> bytes:
+    """CHUNK (2 bytes, big-endian) + DATA + CRC-16 of both, for a bulk
+    payload chunk of a framed packet.
+
+    DATA is padded with zeros to `size`, the negotiated chunk size, so every
+    chunk frame has the same length.
+    """
+    body = (number & 0xFFFF).to_bytes(2, "big") + data + bytes(size - len(data))
+    return body + crc16(body).to_bytes(2, "big")
+
+
+class AckFrame:
+    """One ACK frame: 0xAA ACK CMD SUCCESS MSGLEN MSG [RECEIVE_US RENDER_US].
+
+    Framed ACKs (0xAB) have the packet's SEQ after the ACK byte, a CRC-8 of
+    the header after MSGLEN and a CRC-16 at the end; `seq` is None for the
+    others. `message` and `timing` are
+    views into the parser's buffer; they are only valid until the parser
+    reads more data.
+    """
+
+    __slots__ = ("seq", "cmd", "success", "message", "timing")
+
+    def __init__(self, frame: memoryview, timed: bool):
+        if frame[0] == FRAMED_START_BYTE:
+            self.seq = frame[2]
+            frame = frame[1:-CRC_SIZE]
+            start = 6  # After the header's CRC-8
+        else:
+            self.seq = None
+            start = 5
+        self.cmd = frame[2]
+        self.success = frame[3] == 0x01
+        end = start + frame[4]
+        self.message = frame[start:end]
+        self.timing = frame[end:] if timed else None
+
+    @property
+    def text(self) -> str:
+        """The message decoded as UTF-8, ignoring invalid bytes."""
+        return str(self.message, "utf-8", "ignore")
+
+
+class NakFrame:
+    """A framed packet that failed its CRC (`chunk` False) or a bulk payload
+    chunk the device asks for, the first time or again after a CRC failure;
+    `number` is the SEQ or chunk number."""
+
+    __slots__ = ("chunk", "number")
+
+    def __init__(self, frame: memoryview):
+        self.chunk = frame[1] == CHUNK_REQUEST_BYTE
+        self.number = int.from_bytes(frame[2:-CRC_SIZE], "big")
+
+
+Event = Union[AckFrame, NakFrame, int]
+
+
+class FrameParser:
+    """Splits the device's byte stream into ACK and NAK frames and credits.
+
+    Parsed bytes are dropped by moving the buffer's start; the unparsed rest
+    (at most a partial frame) is moved to the front only when less than a
+    frame's worth of space is left at the end, so frames are always
+    contiguous and never copied.
+    """
+
+    def __init__(
+        self,
+        start_byte: int,
+        ack_byte: int,
+        timed_ack_byte: int,
+        size: int = BUFFER_SIZE,
+    ):
+        """Create a parser.
+
+        Args:
+            start_byte: First byte of every frame
+            ack_byte: Second byte of an ACK frame
+            timed_ack_byte: Second byte of an ACK frame with device timing
+            size: Buffer size in bytes (at least twice MAX_FRAME_SIZE)
+        """
+        if size < 2 * MAX_FRAME_SIZE:
+            raise ValueError(f"Buffer size must be at least {2 * MAX_FRAME_SIZE} bytes")
+        self.start_byte = start_byte
+        self.ack_byte = ack_byte
+        self.timed_ack_byte = timed_ack_byte
+        self._buffer = bytearray(size)
+        self._view = memoryview(self._buffer)
+        self._head = 0  # First unparsed byte
+        self._tail = 0  # End of the data read so far
+        # Bytes skipped while looking for a start byte
+        self.skipped = 0
+
+    def clear(self) -> None:
+        """Forget any buffered data."""
+        self._head = self._tail = 0
+
+    def writable(self) -> memoryview:
+        """Free space after the buffered data, to read into."""
+        if self._head == self._tail:
+            self._head = self._tail = 0
+        elif len(self._buffer) - self._tail < MAX_FRAME_SIZE:
+            remaining = self._tail - self._head
+            self._buffer[:remaining] = self._view[self._head : self._tail]
+            self._head, self._tail = 0, remaining
+        return self._view[self._tail :]
+
+    def commit(self, count: int) -> None:
+        """Mark `count` bytes read into writable() as buffered."""
+        self._tail += count
+
+    def fill(self, ser: serial.Serial, block: bool = True) -> int:
+        """Read what the port has to offer into the buffer.
+
+        Args:
+            ser: Serial connection
+            block: Wait (up to the port's timeout) for a byte if none has
+                arrived yet
+
+        Returns:
+            Number of bytes read; 0 on timeout or, without block, when
+            nothing was waiting
+        """
+        waiting = ser.in_waiting
+        if not waiting and not block:
+            return 0
+        space = self.writable()
+        count = ser.readinto(space[: max(1, min(waiting, len(space)))])
+        self._tail += count
+        return count
+
+    def feed(self, data: bytes) -> Iterator[Event]:
+        """Add data and yield the events it completes.
+
+        Each event has to be used before the next one is taken.
+        """
+        data = memoryview(data)
+        while data:
+            space = self.writable()
+            count = min(len(space), len(data))
+            space[:count] = data[:count]
+            self._tail += count
+            data = data[count:]
+            while True:
+                event = self.next_event()
+                if event is None:
+                    break
+                yield event
+
+    def _frame_size(self, pos: int) -> int:
+        """Size of the frame starting at `pos`.
+
+        Returns:
+            The size once the whole frame is buffered, 0 if more bytes are
+            needed and -1 if no frame starts there
+        """
+        buffer = self._buffer
+        available = self._tail - pos
+        framed = buffer[pos] == FRAMED_START_BYTE
+        if buffer[pos] != self.start_byte and not framed:
+            return -1
+        if available < 2:
+            return 0
+        kind = buffer[pos + 1]
+        if framed and kind == NAK_BYTE:
+            size = 5
+        elif framed and kind == CHUNK_REQUEST_BYTE:
+            size = 6
+        elif kind == self.ack_byte or kind == self.timed_ack_byte:
+            header = 7 if framed else 5
+            if available < header:
+                return 0
+            if framed and crc8(self._view[pos + 1 : pos + 6]) != buffer[pos + 6]:
+                return -1  # MSGLEN cannot be trusted
+            size = header + buffer[pos + 5 if framed else pos + 4]
+            if kind == self.timed_ack_byte:
+                size += TIMING_SIZE
+            if framed:
+                size += CRC_SIZE
+        else:
+            return -1
+        if available < size:
+            return 0
+        if framed:
+            # A corrupted frame is skipped as if it was noise
+            end = pos + size - CRC_SIZE
+            if crc16(self._view[pos + 1 : end]) != int.from_bytes(buffer[end : end + 2], "big"):
+                return -1
+        return size
+
+    def next_event(self) -> Optional[Event]:
+        """The next buffered event: READY, an AckFrame or NakFrame, or None if
+        none is complete."""
+        while self._head < self._tail:
+            pos = self._head
+            if self._buffer[pos] == READY:
+                self._head += 1
+                return READY
+            size = self._frame_size(pos)
+            if size == 0:
+                return None
+            if size < 0:
+                # Noise or the rest of a frame we lost track of
+                self._head += 1
+                self.skipped += 1
+                continue
+            self._head += size
+            kind = self._buffer[pos + 1]
+            frame = self._view[pos : pos + size]
+            if self._buffer[pos] == FRAMED_START_BYTE and kind in (NAK_BYTE, CHUNK_REQUEST_BYTE):
+                return NakFrame(frame)
+            return AckFrame(frame, kind == self.timed_ack_byte)
+        return None
+
+    def frame_ready(self) -> bool:
+        """Whether a complete ACK or NAK frame is buffered, without consuming
+        anything."""
+        pos = self._head
+        while pos < self._tail:
+            if self._buffer[pos] != READY:
+                size = self._frame_size(pos)
+                if size >= 0:
+                    return size > 0
+            pos += 1
+        return False
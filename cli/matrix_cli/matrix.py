@@ -2,9 +2,55 @@
 Matrix display client library for controlling LED matrix displays via serial.
 """
 
-from typing import List, Tuple
+import math
+import os
+import time
+import zlib
+from concurrent.futures import Future
+from contextlib import contextmanager
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+)
 import serial
 import serial.tools.list_ports
+from PIL import Image
+from .batch import CommandBatch
+from .codec import (
+    rgb565_rle_encode,
+    rgb565_rle_size,
+    rgb888_size,
+    rgb888_to_indexed,
+    rgb888_to_rgb565,
+    rgb888_to_rgb565_array,
+)
+from .framebuffer import ShadowFramebuffer, dirty_rects
+from .framing import (
+    CHUNK_REQUEST_BYTE,
+    FRAMED_START_BYTE,
+    MAX_FRAME_SIZE,
+    NAK_BYTE,
+    READY,
+    AckFrame,
+    Event,
+    FrameParser,
+    NakFrame,
+    framed_chunk,
+    framed_packet,
+)
+from .metrics import MetricsRegistry
+from .pipeline import CommandPipeline
+
+# Let serial_for_url() open emulator:// ports (protocol_emulator.py)
+if __package__ not in serial.protocol_handler_packages:
+    serial.protocol_handler_packages.append(__package__)
 
 
 class MatrixDisplay:
@@ -13,6 +59,13 @@ class MatrixDisplay:
     # Command bytes
     START_BYTE = 0xAA
     ACK_BYTE = 0xAC
+    # ACK followed by the device's receive and render time (telemetry mode)
+    TIMED_ACK_BYTE = 0xAD
+    # Framing v2: packets with a sequence number and CRC-16, NAKs and chunk
+    # requests
+    FRAMED_START_BYTE = FRAMED_START_BYTE
+    NAK_BYTE = NAK_BYTE
+    CHUNK_REQUEST_BYTE = CHUNK_REQUEST_BYTE
     CMD_DRAW_PIXEL = 0x01
     CMD_FILL_SCREEN = 0x02
     CMD_DRAW_LINE = 0x03
@@ -31,67 +84,590 @@ class MatrixDisplay:
     CMD_CLEAR_SPRITE = 0x0F
     CMD_DRAW_SPRITE = 0x10
     CMD_MOVE_SPRITE = 0x11
-
-    def __init__(self, port: str, baudrate: int = 115200):
+    # Several drawing commands in one packet
+    CMD_BATCH = 0x12
+    # Run-length encoded bitmap
+    CMD_DRAW_BITMAP_RLE = 0x13
+    # Palette-indexed bitmap and sprite
+    CMD_DRAW_BITMAP_INDEXED = 0x14
+    CMD_SET_SPRITE_INDEXED = 0x15
+    # Bulk transfer flow control window
+    CMD_FLOW_CONFIG = 0x16
+    # Link management
+    CMD_SET_BAUD = 0x17
+    CMD_PING = 0x18
+    # Sprite cache
+    CMD_QUERY_SPRITE = 0x19
+    CMD_REUSE_SPRITE = 0x1A
+    # Part of a sprite, e.g. one frame of a sprite sheet
+    CMD_DRAW_SPRITE_RECT = 0x1B
+    # Device-side animation playback
+    CMD_SET_ANIMATION = 0x1C
+    CMD_ANIMATION_CONTROL = 0x1D
+    CMD_MOVE_ANIMATION = 0x1E
+    # Execution timing
+    CMD_SET_TELEMETRY = 0x1F
+    CMD_QUERY_STATS = 0x20
+
+    # CMD_ANIMATION_CONTROL actions
+    ANIMATION_STOP = 0
+    ANIMATION_START = 1
+    ANIMATION_RESUME = 2
+    ANIMATION_STOP_CLEAR = 3
+
+    # CMD_SET_TELEMETRY flags
+    TELEMETRY_ENABLE = 0x01
+    TELEMETRY_RESET = 0x02
+
+    # Sprite slots (MAX_SPRITES in command_handler.h)
+    MAX_SPRITES = 64
+
+    # Animation slots and frames per animation (MAX_ANIMATIONS and
+    # MAX_ANIMATION_FRAMES in command_handler.h)
+    MAX_ANIMATIONS = 4
+    MAX_ANIMATION_FRAMES = 32
+
+    # Largest data section of a packet (MAX_COMMAND_DATA in command_handler.h)
+    MAX_COMMAND_DATA = 255
+
+    # Commands that can be carried inside a CMD_BATCH packet
+    BATCH_COMMANDS = frozenset(
+        {
+            CMD_DRAW_PIXEL,
+            CMD_FILL_SCREEN,
+            CMD_DRAW_LINE,
+            CMD_DRAW_RECT,
+            CMD_CLEAR,
+            CMD_SET_BRIGHTNESS,
+            CMD_PRINT,
+            CMD_SET_CURSOR,
+            CMD_FILL_RECT,
+            CMD_DRAW_FAST_VLINE,
+            CMD_DRAW_FAST_HLINE,
+            CMD_CLEAR_SPRITE,
+            CMD_DRAW_SPRITE,
+            CMD_MOVE_SPRITE,
+            CMD_DRAW_SPRITE_RECT,
+            CMD_SET_ANIMATION,
+            CMD_ANIMATION_CONTROL,
+            CMD_MOVE_ANIMATION,
+        }
+    )
+
+    # Serial timeouts (seconds)
+    COMMAND_TIMEOUT = 2
+    BULK_TIMEOUT = 10  # Longer timeout for large data
+    # Results of commands that timed out
+    ACK_TIMEOUT_MESSAGE = "No acknowledgment received"
+    FLOW_TIMEOUT_MESSAGE = "Flow control error: no ready signal"
+
+    # Session reconnect behaviour
+    RECONNECT_ATTEMPTS = 2
+    RECONNECT_DELAY = 0.5
+
+    # Pipelining: commands in flight, bounded by the firmware's serial
+    # receive buffer (SERIAL_RX_BUFFER_SIZE in command_handler.h). The
+    # device reports its buffer when flow control is negotiated; firmware
+    # without CMD_FLOW_CONFIG gets RX_BUFFER_SIZE.
+    PIPELINE_WINDOW = 8
+    RX_BUFFER_SIZE = 256
+
+    # Bulk transfer flow control: payload bytes per credit (0xFF byte) and
+    # the bytes in flight requested from the device; it grants at most its
+    # receive buffer
+    FLOW_CHUNK = 128
+    FLOW_WINDOW = 2048
+
+    # Baud rate switching: the device falls back to the old rate unless it
+    # is pinged at the new one within BAUD_VERIFY_TIMEOUT
+    # (BAUD_VERIFY_TIMEOUT_MS in command_handler.h)
+    BAUD_VERIFY_TIMEOUT = 1.0
+    BAUD_SETTLE_TIME = 0.05
+    PROBE_BAUDRATES = (2000000, 1500000, 1000000, 921600, 460800, 230400, 115200)
+    PROBE_PINGS = 5
+
+    # Framing v2: a packet is sent again when the device NAKs it or nothing
+    # arrives for FRAMED_REPLY_TIMEOUT plus the time the link needs for the
+    # bytes in flight, at least FRAMED_RETRIES times and for longer than
+    # STREAM_TIMEOUT, so a device stuck on a corrupted packet has given up on
+    # it before the host does. The device answers
+    # retransmissions of the last ACK_HISTORY packets from memory
+    # (ACK_HISTORY in command_handler.h)
+    FRAMED_REPLY_TIMEOUT = 0.1
+    FRAMED_RETRIES = 4
+    ACK_HISTORY = 16
+    # The device gives up on a bulk payload that stops arriving for this
+    # long (STREAM_TIMEOUT_MS in command_handler.h)
+    STREAM_TIMEOUT = 1.0
+
+    def __init__(
+        self,
+        port: str,
+        baudrate: int = 115200,
+        shadow: bool = False,
+        width: int = 64,
+        height: int = 64,
+        rle: bool = True,
+        flow_window: int = FLOW_WINDOW,
+        sprite_cache: bool = True,
+        metrics: Optional[MetricsRegistry] = None,
+        framing: int = 1,
+    ):
         """Initialize the matrix display client.
 
         Args:
             port: Serial port (e.g., '/dev/ttyUSB0')
             baudrate: Serial baudrate (default: 115200)
+            shadow: Keep a client-side mirror of the panel (requires NumPy),
+                needed by push_frame()
+            width: Panel width in pixels (default: 64)
+            height: Panel height in pixels (default: 64)
+            rle: Send bitmaps run-length encoded when that is smaller
+                (default: True)
+            flow_window: Bulk payload bytes to keep in flight, negotiated
+                with the device (default: 2048)
+            sprite_cache: Skip sprite uploads when the slot already holds
+                the same image (default: True)
+            metrics: Registry to record per-command metrics in (default:
+                none, nothing is recorded)
+            framing: 2 to send packets and bulk payload chunks with a
+                sequence number and CRC-16, so corrupted ones are sent again
+                instead of timing out (default: 1, plain packets)
         """
+        if framing not in (1, 2):
+            raise ValueError("Framing must be 1 or 2")
         self.port = port
         self.baudrate = baudrate
+        self.width = width
+        self.height = height
+        self.rle = rle
+        self.flow_window = flow_window
+        self.sprite_cache = sprite_cache
+        self.shadow = ShadowFramebuffer(width, height) if shadow else None
+        self.metrics = metrics
+        if metrics is not None:
+            metrics.names.update(self.command_names())
+        self.framing = framing
+        # SEQ of the last framed packet; a random start keeps a new client
+        # from matching ACKs the device remembers from an earlier one
+        self._seq = os.urandom(1)[0]
+        # Device (receive, render) seconds of the last timed ACK
+        self.device_timing: Optional[Tuple[float, float]] = None
+        self._ack_timing: Optional[Tuple[int, float, float]] = None
+        self._session = False
+        self._ser: Optional[serial.Serial] = None
+        self._pipeline: Optional[CommandPipeline] = None
+        self._batch: Optional[CommandBatch] = None
+        # Negotiated (chunk size, credits) and the port handle it applies to
+        self._flow: Optional[Tuple[int, int]] = None
+        # The device's serial receive buffer in bytes, as reported with _flow
+        self.rx_buffer_size = self.RX_BUFFER_SIZE
+        self._flow_ser: Optional[serial.Serial] = None
+        # What the device sent and has not been parsed yet, and its port handle
+        self._parser = FrameParser(self.START_BYTE, self.ACK_BYTE, self.TIMED_ACK_BYTE)
+        self._parser_ser: Optional[serial.Serial] = None
+        # (CRC-32, width, height, bpp) of the image believed to be in each
+        # sprite slot; the device confirms it before an upload is skipped
+        self._sprite_hashes: Dict[int, Tuple[int, int, int, int]] = {}
+
+    def __enter__(self) -> "MatrixDisplay":
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    @property
+    def is_open(self) -> bool:
+        """Whether a persistent serial session is active."""
+        return self._session
+
+    def open(self) -> "MatrixDisplay":
+        """Start a persistent serial session.
+
+        While the session is open every command reuses a single port handle
+        instead of opening and closing the port per command. The port is
+        reopened automatically if an I/O error occurs.
 
-    def _wait_for_ack(self, ser: serial.Serial, expected_cmd: int) -> Tuple[bool, str]:
-        """Wait for and parse acknowledgment response.
+        Returns:
+            The display itself, so it can be used as a context manager
+        """
+        if not self._session:
+            self._ser = self._open_serial()
+            self._session = True
+            self._transact(self.COMMAND_TIMEOUT, self._flow_control)
+        return self
+
+    @property
+    def flow_control(self) -> Optional[Tuple[int, int]]:
+        """Negotiated bulk flow control as (chunk size, credits).
+
+        The device lets the host send `credits` chunks of a bulk payload
+        before the first 0xFF byte, and one more chunk per 0xFF after that.
+        None until negotiated.
+        """
+        return self._flow
+
+    def _flow_request(self) -> bytes:
+        """CMD_FLOW_CONFIG data asking for the configured flow window."""
+        credits = max(1, min(255, self.flow_window // self.FLOW_CHUNK))
+        return self.FLOW_CHUNK.to_bytes(2, "big") + bytes([credits])
+
+    def _parse_flow_reply(self, success: bool, message: str) -> Tuple[int, int, int]:
+        """Read (chunk size, credits, receive buffer size) from a
+        CMD_FLOW_CONFIG acknowledgment.
+
+        Devices without CMD_FLOW_CONFIG get the original one chunk of 128
+        bytes per 0xFF and a receive buffer of RX_BUFFER_SIZE.
+        """
+        if success:
+            fields = dict(field.partition("=")[::2] for field in message.split())
+            if fields.get("chunk", "").isdigit() and fields.get("credits", "").isdigit():
+                buffer = fields.get("buffer", "")
+                return (
+                    int(fields["chunk"]),
+                    int(fields["credits"]),
+                    int(buffer) if buffer.isdigit() else self.RX_BUFFER_SIZE,
+                )
+        return self.FLOW_CHUNK, 1, self.RX_BUFFER_SIZE
+
+    def _flow_control(self, ser: serial.Serial) -> Tuple[int, int]:
+        """Negotiate the flow control window once per port handle.
 
         Args:
             ser: Serial connection
-            expected_cmd: Expected command that was sent
 
+        Returns:
+            Tuple of (chunk size, credits)
+        """
+        if self._flow is None or self._flow_ser is not ser:
+            chunk, credits, self.rx_buffer_size = self._parse_flow_reply(
+                *self._exchange(ser, self.CMD_FLOW_CONFIG, self._flow_request())
+            )
+            self._flow = chunk, credits
+            self._flow_ser = ser
+        return self._flow
+
+    def close(self) -> None:
+        """End the persistent serial session and release the port."""
+        self._session = False
+        self._drop_connection()
+
+    @contextmanager
+    def pipelined(self, window: int = PIPELINE_WINDOW) -> Iterator[CommandPipeline]:
+        """Send commands without waiting for each acknowledgment.
+
+        Inside the block up to `window` commands are kept in flight and the
+        drawing methods return futures resolving to (success, message)
+        instead of the tuple itself. Bitmap and sprite uploads first wait for
+        all in-flight commands, since their flow control needs the link to
+        itself. All commands are acknowledged when the block exits.
+
+        With framing v2 the window is at most ACK_HISTORY, and a NAKed or
+        unanswered packet is sent again on its own.
+
+        A session is opened for the duration of the block if none is active.
+
+        Args:
+            window: Maximum number of commands in flight
+
+        Yields:
+            The command pipeline
+        """
+        opened = not self._session
+        self.open()
+        if self.framing == 2:
+            window = min(window, self.ACK_HISTORY)
+            self._ser.timeout = self._reply_timeout(self.rx_buffer_size)
+        self._pipeline = CommandPipeline(
+            self._ser,
+            self._read_ack if self.framing == 1 else self._read_reply,
+            self._ack_ready,
+            self._encode,
+            window,
+            self.rx_buffer_size,
+            0 if self.framing == 1 else self._framed_retries(self._ser.timeout),
+        )
+        try:
+            yield self._pipeline
+            self._pipeline.drain()
+        finally:
+            self._pipeline.cancel()
+            self._pipeline = None
+            if opened:
+                self.close()
+
+    @contextmanager
+    def batch(self) -> Iterator[CommandBatch]:
+        """Send drawing commands as CMD_BATCH packets.
+
+        Inside the block the batchable drawing methods (pixels, lines,
+        rectangles, fills, text, cursor, brightness, clear and sprite
+        draw/move/clear) queue their command and return (True, "Queued").
+        Queued commands are packed into as few packets as fit the firmware's
+        command buffer and each packet is acknowledged once. Any other
+        command sends the queued ones first and is then sent as usual.
+
+        Batches can be used inside `pipelined()` to keep several batch
+        packets in flight.
+
+        Yields:
+            The batch; its `success`, `error_index` and `error_message`
+            report the outcome once the block has exited
+        """
+        if self._batch is not None:
+            raise RuntimeError("Batches cannot be nested")
+        # Keep whole packets within the firmware's serial receive buffer
+        max_packet_size = min(self.MAX_COMMAND_DATA, self.rx_buffer_size - 3)
+        self._batch = CommandBatch(
+            lambda data: self._send_command(self.CMD_BATCH, data), max_packet_size
+        )
+        try:
+            yield self._batch
+            self._batch.flush()
+        finally:
+            self._batch = None
+
+    def _open_serial(self, timeout: float = COMMAND_TIMEOUT) -> serial.Serial:
+        """Open the serial port (or emulator:// URL) with the configured settings."""
+        return serial.serial_for_url(self.port, self.baudrate, timeout=timeout)
+
+    def _drop_connection(self) -> None:
+        """Close the session port handle, ignoring errors from a dead port."""
+        if self._ser is not None:
+            try:
+                self._ser.close()
+            except (serial.SerialException, OSError):
+                pass
+            self._ser = None
+
+    def _transact(
+        self, timeout: float, transaction: Callable[[serial.Serial], Tuple[bool, str]]
+    ) -> Tuple[bool, str]:
+        """Run a request/response transaction on the serial port.
+
+        Outside a session the port is opened for this transaction only. Inside
+        a session the shared handle is used and, on I/O errors, the port is
+        reopened and the transaction retried once the device has dropped
+        whatever part of it got through.
+
+        Args:
+            timeout: Read timeout for this transaction; framed transactions
+                use the shorter reply timeout and retransmit instead
+            transaction: Callable performing the writes and reads
         Returns:
             Tuple of (success, message)
         """
+        if self.framing == 2:
+            timeout = self._reply_timeout()
+        if not self._session:
+            with self._open_serial(timeout) as ser:
+                return transaction(ser)
+
+        for _ in range(self.RECONNECT_ATTEMPTS):
+            try:
+                return self._session_transaction(timeout, transaction)
+            except (serial.SerialException, OSError):
+                # The device reads a partly sent packet or payload until
+                # STREAM_TIMEOUT passes without data; a retry any sooner
+                # would be taken as the rest of it
+                time.sleep(max(self.RECONNECT_DELAY, self.STREAM_TIMEOUT))
+        return self._session_transaction(timeout, transaction)
+
+    def _session_transaction(
+        self, timeout: float, transaction: Callable[[serial.Serial], Tuple[bool, str]]
+    ) -> Tuple[bool, str]:
+        """Run a transaction on the session handle, dropping it on I/O errors."""
         try:
-            # Wait for start byte
-            if ser.read(1) != bytes([self.START_BYTE]):
-                return False, "Invalid response start byte"
-
-            # Check for ACK byte
-            if ser.read(1) != bytes([self.ACK_BYTE]):
-                return False, "Invalid ACK byte"
-
-            # Read command byte
-            cmd_bytes = ser.read(1)
-            if not cmd_bytes:
-                return False, "No command byte received"
-            cmd = cmd_bytes[0]
-
-            # Read success byte
-            success_bytes = ser.read(1)
-            if not success_bytes:
-                return False, "No success byte received"
-            success = success_bytes[0] == 0x01
-
-            # Read message length
-            msg_len_bytes = ser.read(1)
-            if not msg_len_bytes:
-                return False, "No message length received"
-            msg_len = msg_len_bytes[0]
-
-            # Read message if present
-            message = ""
-            if msg_len > 0:
-                message_bytes = ser.read(msg_len)
-                if len(message_bytes) == msg_len:
-                    message = message_bytes.decode("utf-8", errors="ignore")
-                else:
-                    return False, "Incomplete message received"
-
-            return success, message
+            if self._ser is None:
+                self._ser = self._open_serial()
+                # Discard anything left over from before the reconnect
+                self._ser.reset_input_buffer()
+            self._ser.timeout = timeout
+            return transaction(self._ser)
+        except (serial.SerialException, OSError):
+            self._drop_connection()
+            raise
+
+    def _frame_parser(self, ser: serial.Serial) -> FrameParser:
+        """The parser of a port handle's input, emptied when the handle changes."""
+        if self._parser_ser is not ser:
+            self._parser.clear()
+            self._parser_ser = ser
+        return self._parser
+
+    def _reset_input(self, ser: serial.Serial) -> None:
+        """Discard everything received so far, parsed or not."""
+        ser.reset_input_buffer()
+        self._frame_parser(ser).clear()
+
+    def _discard_input(self, ser: serial.Serial) -> None:
+        """Discard what has arrived so far, without the cost of a port flush."""
+        parser = self._frame_parser(ser)
+        parser.fill(ser, block=False)
+        parser.clear()
+
+    def _next_event(self, ser: serial.Serial) -> Optional[Event]:
+        """Wait for the next ACK frame or flow control credit.
+
+        Reads whatever has arrived at once rather than byte by byte, and
+        skips noise up to the next start byte.
+
+        Returns:
+            An AckFrame, READY for a credit, or None on timeout
+        """
+        parser = self._frame_parser(ser)
+        while True:
+            event = parser.next_event()
+            if event is not None or not parser.fill(ser):
+                return event
 
+    def _ack_ready(self, ser: serial.Serial) -> bool:
+        """Whether a complete ACK frame has arrived, without blocking."""
+        parser = self._frame_parser(ser)
+        parser.fill(ser, block=False)
+        return parser.frame_ready()
+
+    def _ack_result(self, frame: AckFrame) -> Tuple[int, bool, str]:
+        """(command, success, message) of an ACK frame, keeping its device timing."""
+        if frame.timing is not None:
+            self._set_device_timing(frame.cmd, frame.timing)
+        return frame.cmd, frame.success, frame.text
+
+    def _read_ack(self, ser: serial.Serial) -> Tuple[Optional[int], bool, str]:
+        """Read one acknowledgment frame.
+
+        Flow control credits left over from an earlier transfer are skipped.
+
+        Args:
+            ser: Serial connection
+
+        Returns:
+            Tuple of (command, success, message). The command is None when no
+            valid frame could be read; the message then describes the error.
+        """
+        try:
+            while True:
+                event = self._next_event(ser)
+                if event is None:
+                    return None, False, self.ACK_TIMEOUT_MESSAGE
+                if event != READY:
+                    return self._ack_result(event)
+
+        except serial.SerialException:
+            # Let port failures reach _transact so a session can reconnect
+            raise
         except Exception as e:
-            return False, f"Error reading ACK: {str(e)}"
+            return None, False, f"Error reading ACK: {str(e)}"
+
+    def _read_reply(self, ser: serial.Serial) -> Tuple[Optional[int], Optional[bool], str]:
+        """Read the ACK or NAK of a framed packet.
+
+        Args:
+            ser: Serial connection
+
+        Returns:
+            Tuple of (SEQ, success, message); success is None for a NAK,
+            and SEQ is None when no valid frame could be read
+        """
+        try:
+            while True:
+                event = self._next_event(ser)
+                if event is None:
+                    return None, False, self.ACK_TIMEOUT_MESSAGE
+                if isinstance(event, NakFrame):
+                    if not event.chunk:
+                        return event.number, None, ""
+                elif event != READY and event.seq is not None:
+                    return (event.seq,) + self._ack_result(event)[1:]
+
+        except serial.SerialException:
+            raise
+        except Exception as e:
+            return None, False, f"Error reading ACK: {str(e)}"
+
+    def _reply_timeout(self, in_flight: int = RX_BUFFER_SIZE) -> float:
+        """Time to wait for a reply to a framed packet before sending it again.
+
+        Args:
+            in_flight: Bytes the reply may be queued behind on the link
+        """
+        line_time = (in_flight + MAX_FRAME_SIZE) * 10 / self.baudrate
+        return self.FRAMED_REPLY_TIMEOUT + line_time
+
+    def _framed_retries(self, timeout: float) -> int:
+        """Retransmissions of a framed packet, each after `timeout` seconds.
+
+        Enough to outlast STREAM_TIMEOUT, after which the device has dropped
+        whatever it mistook for a payload and reads packets again.
+        """
+        return max(self.FRAMED_RETRIES, math.ceil(self.STREAM_TIMEOUT / timeout) + 1)
+
+    def _next_seq(self) -> int:
+        self._seq = (self._seq + 1) & 0xFF
+        return self._seq
+
+    def _encode(self, cmd: int, data: bytes) -> Tuple[int, bytes]:
+        """A packet and the key its reply is matched by: the SEQ of a framed
+        packet, else the command."""
+        if self.framing == 1:
+            return cmd, bytes([self.START_BYTE, cmd, len(data)]) + data
+        seq = self._next_seq()
+        return seq, framed_packet(seq, cmd, data)
+
+    def _exchange(
+        self, ser: serial.Serial, cmd: int, data: bytes, payload: Optional[bytes] = None
+    ) -> Tuple[bool, str]:
+        """Send a packet and wait for its acknowledgment.
+
+        A framed packet is sent again when the device NAKs it or nothing
+        comes back within the reply timeout. If it had already been executed
+        the device answers with the ACK it sent the first time.
+
+        Args:
+            ser: Serial connection
+            cmd: Command byte
+            data: Command data
+            payload: Additional payload to be sent, without flow control
+                (plain packets only)
+        Returns:
+            Tuple of (success, message)
+        """
+        key, packet = self._encode(cmd, data)
+        if self.framing == 1:
+            ser.write(packet + (payload or b""))
+            ser.flush()
+            return self._wait_for_ack(ser, cmd)
+        if payload:
+            raise ValueError("Framed packets send payloads with flow control")
+
+        for _ in range(self._framed_retries(ser.timeout) + 1):
+            ser.write(packet)
+            ser.flush()
+            while True:
+                seq, success, message = self._read_reply(ser)
+                if seq is None or seq == key:
+                    break
+            if seq is not None and success is not None:
+                return success, message
+        return False, self.ACK_TIMEOUT_MESSAGE
+
+    def _wait_for_ack(self, ser: serial.Serial, expected_cmd: int) -> Tuple[bool, str]:
+        """Wait for and parse acknowledgment response.
+
+        ACKs for other commands are left over from earlier ones (e.g. one
+        that timed out) and are skipped.
+
+        Args:
+            ser: Serial connection
+            expected_cmd: Expected command that was sent
+
+        Returns:
+            Tuple of (success, message)
+        """
+        while True:
+            cmd, success, message = self._read_ack(ser)
+            if cmd is None or cmd == expected_cmd:
+                return success, message
 
     def _send_command(
         self, cmd: int, data: bytes, payload: bytes = None
@@ -103,18 +679,33 @@ class MatrixDisplay:
             data: Command data
             payload: Additional payload to be sent
         Returns:
-            Tuple of (success, message)
+            Tuple of (success, message), or a future resolving to it when
+            pipelined
         """
-        with serial.Serial(self.port, self.baudrate, timeout=2) as ser:
-            # Send start byte, command
-            ser.write(bytes([self.START_BYTE, cmd, len(data)]))
-            # Send data
-            ser.write(data)
-            if payload:
-                ser.write(payload)
-            # Wait for acknowledgment
-            ser.flush()
-            return self._wait_for_ack(ser, cmd)
+        if self.shadow is not None:
+            self.shadow.apply(cmd, data, payload)
+
+        if self._batch is not None and cmd != self.CMD_BATCH:
+            if cmd in self.BATCH_COMMANDS and self._batch.fits(data):
+                self._batch.add(cmd, data)
+                return True, "Queued"
+            self._batch.flush()
+
+        if self._pipeline is not None:
+            future = self._track_shadow(
+                lambda: self._pipeline.submit(cmd, data, payload)
+            )
+            if self.metrics is not None:
+                self._meter_future(cmd, 3 + len(data) + len(payload or b""), future)
+            return future
+
+        def transaction(ser: serial.Serial) -> Tuple[bool, str]:
+            return self._exchange(ser, cmd, data, payload)
+
+        transaction = self._metered(cmd, 3 + len(data) + len(payload or b""), transaction)
+        return self._track_shadow(
+            lambda: self._transact(self.COMMAND_TIMEOUT, transaction)
+        )
 
     def _send_bitmap_with_flow_control(
         self, cmd: int, data: bytes, payload: bytes
@@ -126,45 +717,290 @@ class MatrixDisplay:
             data: Command data (header)
             payload: Bitmap payload data
         Returns:
-            Tuple of (success, message)
+            Tuple of (success, message), or a future resolving to it when
+            pipelined
         """
-        with serial.Serial(
-            self.port, self.baudrate, timeout=10
-        ) as ser:  # Longer timeout for large data
+        if self.shadow is not None:
+            self.shadow.apply(cmd, data, payload)
+
+        metrics = self.metrics
+
+        def transaction(ser: serial.Serial) -> Tuple[bool, str]:
+            if self.framing == 2:
+                return self._framed_bulk(ser, cmd, data, payload)
+            chunk_size, credits = self._flow_control(ser)
+            # Credits still pending belong to an aborted transfer and would
+            # let this one overrun the device's receive buffer
+            self._discard_input(ser)
+
             # Send start byte, command, and header data
-            ser.write(bytes([self.START_BYTE, cmd, len(data)]))
-            ser.write(data)
-            ser.flush()
+            ser.write(bytes([self.START_BYTE, cmd, len(data)]) + data)
 
-            # Send payload in chunks with flow control
-            chunk_size = 128  # 64 pixels * 2 bytes per pixel
+            # The device grants `credits` chunks up front and one more chunk
+            # per ready signal (0xFF), so several chunks can be in flight
+            granted = chunk_size * credits
             total_sent = 0
-
             while total_sent < len(payload):
-                # Calculate how much to send in this chunk
-                remaining = len(payload) - total_sent
-                current_chunk_size = min(chunk_size, remaining)
-
-                # Send the chunk
-                chunk = payload[total_sent : total_sent + current_chunk_size]
-                ser.write(chunk)
-                ser.flush()
-                total_sent += current_chunk_size
-
-                # Wait for ready signal (0xFF) if not the last chunk
-                if total_sent < len(payload):
+                if total_sent >= granted:
                     try:
-                        ready_signal = ser.read(1)
-                        if not ready_signal or ready_signal[0] != 0xFF:
-                            return (
-                                False,
-                                f"Flow control error: expected 0xFF, got {ready_signal}",
-                            )
+                        waited = time.perf_counter() if metrics is not None else 0.0
+                        event = self._next_event(ser)
+                        if event is None:
+                            return False, self.FLOW_TIMEOUT_MESSAGE
+                        if event != READY:
+                            # The device answered before taking the whole
+                            # payload, e.g. to reject it
+                            ack_cmd, success, message = self._ack_result(event)
+                            if ack_cmd == cmd:
+                                return success, message
+                            continue  # Left over from an earlier command
+                        if metrics is not None:
+                            metrics.record_credit(cmd, time.perf_counter() - waited)
+                    except serial.SerialException:
+                        raise
                     except Exception as e:
                         return False, f"Error reading flow control signal: {str(e)}"
+                    granted += chunk_size
+                    continue
+
+                # Send everything granted so far
+                end = min(granted, len(payload))
+                ser.write(payload[total_sent:end])
+                total_sent = end
 
+            ser.flush()
             return self._wait_for_ack(ser, cmd)
 
+        # Flow control needs the link to itself
+        transaction = self._metered(cmd, 3 + len(data) + len(payload), transaction)
+        return self._pipelined_result(
+            self._track_shadow(lambda: self._exclusive(self.BULK_TIMEOUT, transaction))
+        )
+
+    def _framed_bulk(
+        self, ser: serial.Serial, cmd: int, data: bytes, payload: bytes
+    ) -> Tuple[bool, str]:
+        """Send a framed bulk command, retransmitting what the device NAKs.
+
+        Once it has accepted the header, the device requests every chunk by
+        number with a CRC-checked frame instead of a 0xFF credit. Each chunk
+        carries its number and a CRC-16; a corrupted one is requested again
+        and sent on its own, while the device keeps the chunks that followed
+        it. A request past the next unsent chunk means earlier requests were
+        lost, and those chunks are sent first.
+
+        Args:
+            ser: Serial connection
+            cmd: Command byte
+            data: Command data (header)
+            payload: Bulk payload
+        Returns:
+            Tuple of (success, message)
+        """
+        chunk_size, credits = self._flow_control(ser)
+        self._discard_input(ser)
+        metrics = self.metrics
+        seq, packet = self._encode(cmd, data)
+        chunk_count = (len(payload) + chunk_size - 1) // chunk_size
+        # Once chunks are sent, a reply can be queued behind a whole window
+        patience = self._reply_timeout(chunk_size * credits)
+        max_retries = self._framed_retries(patience)
+
+        def chunk(number: int) -> bytes:
+            start = number * chunk_size
+            return framed_chunk(number, payload[start : start + chunk_size], chunk_size)
+
+        ser.write(packet)
+        sent = 0  # Chunks sent at least once
+        retries = 0
+        heard = time.monotonic()
+        waited = time.perf_counter()
+        try:
+            while True:
+                event = self._next_event(ser)
+                now = time.monotonic()
+                if event is None:
+                    # Replies can be queued behind a window of chunks, and
+                    # the device gives up on a payload that stops arriving
+                    # (the ACK saying so may be lost too)
+                    if sent == 0:
+                        wait = 0.0
+                    elif sent < chunk_count:
+                        wait = patience + self.STREAM_TIMEOUT
+                    else:
+                        wait = patience
+                    if now - heard < wait:
+                        continue
+                    # The device missed the header or we missed its ACK;
+                    # if it finished with the packet it sends the ACK again
+                    if retries == max_retries:
+                        if 0 < sent < chunk_count:
+                            return False, self.FLOW_TIMEOUT_MESSAGE
+                        return False, self.ACK_TIMEOUT_MESSAGE
+                    retries += 1
+                    heard = now
+                    ser.write(packet)
+                    continue
+
+                heard = now
+                if event == READY:
+                    continue  # Corrupted bytes; credits are not used here
+                if isinstance(event, NakFrame):
+                    if event.chunk and event.number < sent:
+                        ser.write(chunk(event.number))
+                    elif event.chunk and event.number < chunk_count:
+                        if metrics is not None:
+                            metrics.record_credit(cmd, time.perf_counter() - waited)
+                        ser.write(b"".join(chunk(n) for n in range(sent, event.number + 1)))
+                        sent = event.number + 1
+                        waited = time.perf_counter()
+                    elif not event.chunk and event.number == seq and sent == 0:
+                        if retries == max_retries:
+                            return False, "Packet corrupted too often"
+                        retries += 1
+                        ser.write(packet)
+                elif event.seq == seq:
+                    # Possibly before the whole payload, e.g. to reject it
+                    return self._ack_result(event)[1:]
+        except serial.SerialException:
+            raise
+        except Exception as e:
+            return False, f"Error reading flow control signal: {str(e)}"
+
+    def _pipelined_result(self, result: Tuple[bool, str]) -> Any:
+        """Return a result as a future inside `pipelined()`, like other commands."""
+        if self._pipeline is None:
+            return result
+        future: Future = Future()
+        future.set_result(result)
+        return future
+
+    def _request(self, cmd: int, data: bytes) -> Tuple[bool, str]:
+        """Send a command that does not draw and return its result directly."""
+
+        def transaction(ser: serial.Serial) -> Tuple[bool, str]:
+            return self._exchange(ser, cmd, data)
+
+        transaction = self._metered(cmd, 3 + len(data), transaction)
+        return self._exclusive(self.COMMAND_TIMEOUT, transaction)
+
+    @classmethod
+    def command_names(cls) -> Dict[int, str]:
+        """Command bytes and their names, e.g. 0x01: "draw_pixel"."""
+        return {
+            value: name[4:].lower()
+            for name, value in vars(MatrixDisplay).items()
+            if name.startswith("CMD_")
+        }
+
+    def _set_device_timing(self, cmd: int, timing: bytes) -> None:
+        """Keep the RECEIVE_US + RENDER_US of a timed ACK."""
+        receive = int.from_bytes(timing[:4], "big") / 1e6
+        render = int.from_bytes(timing[4:], "big") / 1e6
+        self.device_timing = (receive, render)
+        self._ack_timing = (cmd, receive, render)
+
+    def _take_device_timing(self, cmd: int) -> Optional[Tuple[float, float]]:
+        """Device timing of the ACK just read for `cmd`, if it was timed."""
+        timing, self._ack_timing = self._ack_timing, None
+        if timing is None or timing[0] != cmd:
+            return None
+        return timing[1:]
+
+    def _record(
+        self,
+        cmd: int,
+        written: int,
+        started: float,
+        result: Tuple[bool, str],
+        device: Optional[Tuple[float, float]] = None,
+    ) -> None:
+        """Record a completed command in the metrics registry.
+
+        Args:
+            cmd: Command byte
+            written: Bytes written for the command
+            started: time.perf_counter() when the command was sent
+            result: Its (success, message)
+            device: Device (receive, render) seconds from a timed ACK
+        """
+        success, message = result
+        timeout = message in (self.ACK_TIMEOUT_MESSAGE, self.FLOW_TIMEOUT_MESSAGE)
+        # ACK frame: START, ACK, CMD, SUCCESS, MSGLEN, MSG (+ 8 timing bytes)
+        read = 0 if timeout else 5 + len(message.encode("utf-8"))
+        if device is not None:
+            read += 8
+        self.metrics.record(
+            cmd, written, read, time.perf_counter() - started, success, timeout, device
+        )
+
+    def _metered(
+        self,
+        cmd: int,
+        written: int,
+        transaction: Callable[[serial.Serial], Tuple[bool, str]],
+    ) -> Callable[[serial.Serial], Tuple[bool, str]]:
+        """Wrap a transaction so it is recorded in the metrics registry.
+
+        Without a registry the transaction is returned unchanged.
+        """
+        if self.metrics is None:
+            return transaction
+
+        def metered(ser: serial.Serial) -> Tuple[bool, str]:
+            started = time.perf_counter()
+            try:
+                result = transaction(ser)
+            except (serial.SerialException, OSError):
+                self.metrics.record_error(cmd)
+                raise
+            self._record(cmd, written, started, result, self._take_device_timing(cmd))
+            return result
+
+        return metered
+
+    def _meter_future(self, cmd: int, written: int, future: Future) -> None:
+        """Record a pipelined command once it is acknowledged."""
+        started = time.perf_counter()
+
+        def done(future: Future) -> None:
+            if not future.cancelled():
+                self._record(
+                    cmd, written, started, future.result(), self._take_device_timing(cmd)
+                )
+
+        future.add_done_callback(done)
+
+    def _track_shadow(self, send: Callable[[], Any]) -> Any:
+        """Run a send, forgetting the mirrored panel contents if it fails.
+
+        Commands are replayed on the shadow framebuffer before they are sent,
+        so a command that fails (or whose outcome is unknown) leaves the
+        mirror out of step with the panel.
+
+        Args:
+            send: Sends the command; returns a result tuple or future
+        Returns:
+            The result of `send`
+        """
+        if self.shadow is None:
+            return send()
+        try:
+            result = send()
+        except Exception:
+            self.shadow.invalidate()
+            raise
+        if isinstance(result, Future):
+            result.add_done_callback(self._check_shadow_future)
+        elif not result[0]:
+            self.shadow.invalidate()
+        return result
+
+    def _check_shadow_future(self, future: Future) -> None:
+        """Forget the mirrored panel contents if a pipelined command failed."""
+        if future.cancelled() or not future.result()[0]:
+            self.shadow.invalidate()
+
     def draw_pixel(self, x: int, y: int, r: int, g: int, b: int) -> Tuple[bool, str]:
         """Draw a single pixel.
 
@@ -271,7 +1107,7 @@ class MatrixDisplay:
         )
 
     def draw_bitmap(
-        self, x: int, y: int, width: int, height: int, bitmap_data: bytes
+        self, x: int, y: int, width: int, height: int, bitmap_data: Any
     ) -> Tuple[bool, str]:
         """Draw bitmap at specified location using RGB565 format.
 
@@ -280,36 +1116,202 @@ class MatrixDisplay:
             y: Y coordinate
             width: Bitmap width
             height: Bitmap height
-            bitmap_data: RGB888 data for bitmap (width * height * 3 bytes)
+            bitmap_data: RGB888 data for bitmap (width * height * 3 bytes) as
+                bytes-like object, PIL image or NumPy array
 
         Returns:
             Tuple of (success, message)
         """
-        expected_size = width * height * 3
-        if len(bitmap_data) != expected_size:
+        return self.draw_bitmap_rgb565(
+            x, y, width, height, self._rgb565_payload(width, height, bitmap_data)
+        )
+
+    def draw_bitmap_rgb565(
+        self, x: int, y: int, width: int, height: int, data: bytes
+    ) -> Tuple[bool, str]:
+        """Draw a bitmap that is already in the RGB565 wire format.
+
+        Args:
+            x: X coordinate
+            y: Y coordinate
+            width: Bitmap width
+            height: Bitmap height
+            data: Big-endian RGB565 data (width * height * 2 bytes)
+
+        Returns:
+            Tuple of (success, message)
+        """
+        expected_size = width * height * 2
+        if len(data) != expected_size:
             raise ValueError(
-                f"Bitmap data size mismatch. Expected {expected_size} bytes, got {len(bitmap_data)}"
+                f"Bitmap data size mismatch. Expected {expected_size} bytes, got {len(data)}"
             )
 
-        # Convert RGB888 to RGB565
-        data = bytes()
-        for i in range(0, len(bitmap_data), 3):
-            if i + 2 < len(bitmap_data):
-                r, g, b = bitmap_data[i], bitmap_data[i + 1], bitmap_data[i + 2]
-                # Convert to RGB565: R(5 bits) + G(6 bits) + B(5 bits)
-                r565 = (r >> 3) & 0x1F  # 5 bits
-                g565 = (g >> 2) & 0x3F  # 6 bits
-                b565 = (b >> 3) & 0x1F  # 5 bits
-                color = (r565 << 11) | (g565 << 5) | b565
-                color_h = int((color >> 8) & 0xFF)
-                color_l = int(color & 0xFF)
-                data = data + bytes([int(color_h) & 0xFF, int(color_l) & 0xFF])
-
         # Use flow control for bitmap data
         return self._send_bitmap_with_flow_control(
-            self.CMD_DRAW_BITMAP, bytes([x, y, width, height]), data
+            *self._bitmap_command(bytes([x, y, width, height]), data)
+        )
+
+    def draw_bitmap_indexed(
+        self,
+        x: int,
+        y: int,
+        width: int,
+        height: int,
+        bitmap_data: Any,
+        bpp: Optional[int] = None,
+    ) -> Tuple[bool, str]:
+        """Draw a bitmap sent as a palette plus packed palette indices.
+
+        The image is reduced to a palette of at most 2**bpp colors on the
+        host; the firmware expands the indices to RGB565 while drawing.
+
+        Args:
+            x: X coordinate
+            y: Y coordinate
+            width: Bitmap width
+            height: Bitmap height
+            bitmap_data: RGB888 data for bitmap (width * height * 3 bytes) as
+                bytes-like object, PIL image or NumPy array
+            bpp: Bits per pixel (1, 2, 4 or 8); defaults to the smallest that
+                keeps every color
+
+        Returns:
+            Tuple of (success, message)
+        """
+        header, payload = self._indexed_payload(width, height, bitmap_data, bpp)
+        return self._send_bitmap_with_flow_control(
+            self.CMD_DRAW_BITMAP_INDEXED, bytes([x, y, width, height]) + header, payload
         )
 
+    @staticmethod
+    def _rgb565_payload(width: int, height: int, bitmap_data: Any) -> bytes:
+        """Check the size of RGB888 data and convert it to RGB565."""
+        expected_size = width * height * 3
+        data_size = rgb888_size(bitmap_data)
+        if data_size != expected_size:
+            raise ValueError(
+                f"Bitmap data size mismatch. Expected {expected_size} bytes, got {data_size}"
+            )
+
+        return rgb888_to_rgb565(bitmap_data)
+
+    def _indexed_payload(
+        self, width: int, height: int, bitmap_data: Any, bpp: Optional[int]
+    ) -> Tuple[bytes, bytes]:
+        """Build the BPP + COLORS header and palette + indices payload."""
+        expected_size = width * height * 3
+        data_size = rgb888_size(bitmap_data)
+        if data_size != expected_size:
+            raise ValueError(
+                f"Bitmap data size mismatch. Expected {expected_size} bytes, got {data_size}"
+            )
+
+        bpp, palette, indices = rgb888_to_indexed(bitmap_data, width, height, bpp)
+        return bytes([bpp, len(palette) // 2 - 1]), palette + indices
+
+    def _bitmap_command(self, header: bytes, payload: bytes) -> Tuple[int, bytes, bytes]:
+        """Pick the smaller of the raw and run-length encoded bitmap commands.
+
+        Args:
+            header: X, Y, WIDTH, HEIGHT bytes
+            payload: Big-endian RGB565 data
+
+        Returns:
+            Tuple of (command, data, payload)
+        """
+        if self.rle:
+            size = rgb565_rle_size(payload)
+            # The encoded size is sent as 2 bytes
+            if size < len(payload) and size <= 0xFFFF:
+                return (
+                    self.CMD_DRAW_BITMAP_RLE,
+                    header + size.to_bytes(2, "big"),
+                    rgb565_rle_encode(payload),
+                )
+        return self.CMD_DRAW_BITMAP, header, payload
+
+    def push_frame(
+        self,
+        frame: Any,
+        x: int = 0,
+        y: int = 0,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+    ) -> Tuple[bool, str]:
+        """Show a frame, sending only the regions that changed.
+
+        The frame is compared with the shadow framebuffer, the changed pixels
+        are merged into a few dirty rectangles, and only those are sent with
+        CMD_DRAW_BITMAP (or its run-length encoded form). Parts of the frame
+        outside the panel are not sent. Requires a display created with
+        `shadow=True`.
+
+        Args:
+            frame: RGB888 frame as bytes-like object, PIL image or NumPy array
+            x: X coordinate of the frame on the panel
+            y: Y coordinate of the frame on the panel
+            width: Frame width (default: image width, or the panel width)
+            height: Frame height (default: image height, or the panel height)
+
+        Returns:
+            Tuple of (success, message)
+        """
+        updates = self._frame_updates(frame, x, y, width, height)
+        for data, payload in updates:
+            result = self._send_bitmap_with_flow_control(*self._bitmap_command(data, payload))
+            if isinstance(result, Future):
+                result = result.result()
+            if not result[0]:
+                return result
+
+        if not updates:
+            return True, "Frame unchanged"
+        return True, f"Updated {len(updates)} regions"
+
+    def _frame_updates(
+        self,
+        frame: Any,
+        x: int,
+        y: int,
+        width: Optional[int],
+        height: Optional[int],
+    ) -> List[Tuple[bytes, bytes]]:
+        """Diff a frame against the shadow framebuffer.
+
+        Returns:
+            List of (CMD_DRAW_BITMAP data, RGB565 payload) for the dirty regions
+        """
+        if self.shadow is None:
+            raise RuntimeError("push_frame requires a display created with shadow=True")
+
+        if width is None or height is None:
+            if isinstance(frame, Image.Image):
+                width, height = frame.size
+            elif hasattr(frame, "shape") and len(frame.shape) == 3:
+                height, width = frame.shape[:2]
+            else:
+                width, height = self.width - x, self.height - y
+
+        expected_size = width * height * 3
+        data_size = rgb888_size(frame)
+        if data_size != expected_size:
+            raise ValueError(
+                f"Frame data size mismatch. Expected {expected_size} bytes, got {data_size}"
+            )
+
+        pixels = rgb888_to_rgb565_array(frame, width, height)
+        # The device clips bitmaps to the panel, so only that part can change
+        pixels = pixels[: max(self.height - y, 0), : max(self.width - x, 0)]
+        rects = dirty_rects(self.shadow.diff(pixels, x, y))
+        return [
+            (
+                bytes([x + rx, y + ry, rw, rh]),
+                pixels[ry : ry + rh, rx : rx + rw].astype(">u2").tobytes(),
+            )
+            for rx, ry, rw, rh in rects
+        ]
+
     def set_brightness(self, brightness: int) -> Tuple[bool, str]:
         """Set display brightness.
 
@@ -399,92 +1401,537 @@ class MatrixDisplay:
         y: int,
         width: int,
         height: int,
-        bitmap_data: bytes,
+        bitmap_data: Any,
     ) -> Tuple[bool, str]:
         """Set a sprite with image data.
 
         Args:
-            sprite_id: Sprite ID (0-15)
+            sprite_id: Sprite ID (0-63)
             x: Initial X coordinate
             y: Initial Y coordinate
             width: Sprite width
             height: Sprite height
-            bitmap_data: RGB888 data for sprite (width * height * 3 bytes)
+            bitmap_data: RGB888 data for sprite (width * height * 3 bytes) as
+                bytes-like object, PIL image or NumPy array
 
         Returns:
             Tuple of (success, message)
         """
-        if not 0 <= sprite_id <= 15:
-            raise ValueError("Sprite ID must be between 0 and 15")
+        self._check_sprite_id(sprite_id)
+        data = self._rgb565_payload(width, height, bitmap_data)
+        return self._upload_sprite(
+            self.CMD_SET_SPRITE, bytes([sprite_id, x, y, width, height]), data, 16
+        )
 
-        expected_size = width * height * 3
-        if len(bitmap_data) != expected_size:
-            raise ValueError(
-                f"Bitmap data size mismatch. Expected {expected_size} bytes, got {len(bitmap_data)}"
-            )
+    def set_sprite_indexed(
+        self,
+        sprite_id: int,
+        x: int,
+        y: int,
+        width: int,
+        height: int,
+        bitmap_data: Any,
+        bpp: Optional[int] = None,
+    ) -> Tuple[bool, str]:
+        """Set a sprite that is stored on the device as palette indices.
 
-        # Convert RGB888 to RGB565
-        data = bytes()
-        for i in range(0, len(bitmap_data), 3):
-            if i + 2 < len(bitmap_data):
-                r, g, b = bitmap_data[i], bitmap_data[i + 1], bitmap_data[i + 2]
-                # Convert to RGB565: R(5 bits) + G(6 bits) + B(5 bits)
-                r565 = (r >> 3) & 0x1F  # 5 bits
-                g565 = (g >> 2) & 0x3F  # 6 bits
-                b565 = (b >> 3) & 0x1F  # 5 bits
-                color = (r565 << 11) | (g565 << 5) | b565
-                color_h = int((color >> 8) & 0xFF)
-                color_l = int(color & 0xFF)
-                data = data + bytes([int(color_h) & 0xFF, int(color_l) & 0xFF])
-
-        # Use flow control for sprite data
-        return self._send_bitmap_with_flow_control(
-            self.CMD_SET_SPRITE, bytes([sprite_id, x, y, width, height]), data
+        The image is reduced to a palette of at most 2**bpp colors on the
+        host. A 16-color sprite takes a quarter of the RGB565 size, both on
+        the link and in the device's sprite memory.
+
+        Args:
+            sprite_id: Sprite ID (0-63)
+            x: Initial X coordinate
+            y: Initial Y coordinate
+            width: Sprite width
+            height: Sprite height
+            bitmap_data: RGB888 data for sprite (width * height * 3 bytes) as
+                bytes-like object, PIL image or NumPy array
+            bpp: Bits per pixel (1, 2, 4 or 8); defaults to the smallest that
+                keeps every color
+
+        Returns:
+            Tuple of (success, message)
+        """
+        self._check_sprite_id(sprite_id)
+        header, payload = self._indexed_payload(width, height, bitmap_data, bpp)
+        return self._upload_sprite(
+            self.CMD_SET_SPRITE_INDEXED,
+            bytes([sprite_id, x, y, width, height]) + header,
+            payload,
+            header[0],
         )
 
+    def _upload_sprite(
+        self,
+        cmd: int,
+        data: bytes,
+        payload: bytes,
+        bpp: int,
+        key: Optional[Tuple[int, int, int, int]] = None,
+    ) -> Any:
+        """Upload a sprite unless its slot already holds the same image.
+
+        Args:
+            cmd: CMD_SET_SPRITE or CMD_SET_SPRITE_INDEXED
+            data: Command data, starting with SPRITE_ID X Y WIDTH HEIGHT
+            payload: Sprite payload
+            bpp: Bits per pixel of the stored sprite
+            key: The image's _sprite_key(), if the caller already has it
+
+        Returns:
+            Tuple of (success, message), or a future resolving to it when
+            pipelined
+        """
+        sprite_id = data[0]
+        if key is None:
+            key = self._sprite_key(data, payload, bpp)
+        # Unknown slots are worth asking about, e.g. after a restart
+        if self.sprite_cache and self._sprite_hashes.get(sprite_id, key) == key:
+            success, message = self._request(
+                self.CMD_REUSE_SPRITE, self._reuse_data(data, key)
+            )
+            if success:
+                self._sprite_hashes[sprite_id] = key
+                if self.shadow is not None:
+                    self.shadow.apply(cmd, data, payload)
+                return self._pipelined_result((success, message))
+
+        self._sprite_hashes.pop(sprite_id, None)
+        result = self._send_bitmap_with_flow_control(cmd, data, payload)
+        if (result.result() if isinstance(result, Future) else result)[0]:
+            self._sprite_hashes[sprite_id] = key
+        return result
+
+    @staticmethod
+    def _sprite_key(data: bytes, payload: bytes, bpp: int) -> Tuple[int, int, int, int]:
+        """(CRC-32, width, height, bpp) identifying a sprite image."""
+        return zlib.crc32(payload), data[3], data[4], bpp
+
+    @staticmethod
+    def _reuse_data(data: bytes, key: Tuple[int, int, int, int]) -> bytes:
+        """CMD_REUSE_SPRITE data for a sprite command's data and image key."""
+        crc, width, height, bpp = key
+        return bytes(data[:3]) + bytes([width, height, bpp]) + crc.to_bytes(4, "big")
+
+    @staticmethod
+    def _parse_sprite_reply(
+        success: bool, message: str
+    ) -> Optional[Tuple[int, int, int, int]]:
+        """Read (CRC-32, width, height, bpp) from a CMD_QUERY_SPRITE reply."""
+        if not success:
+            return None
+        fields = dict(field.partition("=")[::2] for field in message.split())
+        try:
+            return (
+                int(fields["crc"], 16),
+                int(fields["w"]),
+                int(fields["h"]),
+                int(fields["bpp"]),
+            )
+        except (KeyError, ValueError):
+            return None
+
+    def query_sprites(self) -> Dict[int, Tuple[int, int, int, int]]:
+        """Read which images the device holds in its sprite slots.
+
+        Also refreshes the sprite upload cache, so find_sprite() knows about
+        sprites uploaded by an earlier process.
+
+        Returns:
+            Dict of sprite ID to (CRC-32, width, height, bpp) for active slots
+        """
+        sprites = {}
+        for sprite_id in range(self.MAX_SPRITES):
+            key = self._parse_sprite_reply(
+                *self._request(self.CMD_QUERY_SPRITE, bytes([sprite_id]))
+            )
+            if key is None:
+                self._sprite_hashes.pop(sprite_id, None)
+            else:
+                sprites[sprite_id] = self._sprite_hashes[sprite_id] = key
+        return sprites
+
+    def find_sprite(self, width: int, height: int, bitmap_data: Any) -> Optional[int]:
+        """Find a sprite slot that already holds an RGB565 image.
+
+        Only slots set by this client or seen by query_sprites() are known.
+
+        Args:
+            width: Sprite width
+            height: Sprite height
+            bitmap_data: RGB888 data as accepted by set_sprite()
+
+        Returns:
+            The sprite ID, or None
+        """
+        key = (zlib.crc32(rgb888_to_rgb565(bitmap_data)), width, height, 16)
+        for sprite_id, cached in self._sprite_hashes.items():
+            if cached == key:
+                return sprite_id
+        return None
+
+    def _check_sprite_id(self, sprite_id: int) -> None:
+        """Raise ValueError for sprite IDs the firmware does not have."""
+        if not 0 <= sprite_id < self.MAX_SPRITES:
+            raise ValueError(f"Sprite ID must be between 0 and {self.MAX_SPRITES - 1}")
+
     def clear_sprite(self, sprite_id: int) -> Tuple[bool, str]:
         """Clear a sprite from memory and screen.
 
         Args:
-            sprite_id: Sprite ID (0-15)
+            sprite_id: Sprite ID (0-63)
 
         Returns:
             Tuple of (success, message)
         """
-        if not 0 <= sprite_id <= 15:
-            raise ValueError("Sprite ID must be between 0 and 15")
+        self._check_sprite_id(sprite_id)
+        self._sprite_hashes.pop(sprite_id, None)
         return self._send_command(self.CMD_CLEAR_SPRITE, bytes([sprite_id]))
 
     def draw_sprite(self, sprite_id: int, x: int, y: int) -> Tuple[bool, str]:
         """Draw a sprite at a specific location.
 
         Args:
-            sprite_id: Sprite ID (0-15)
+            sprite_id: Sprite ID (0-63)
             x: X coordinate
             y: Y coordinate
 
         Returns:
             Tuple of (success, message)
         """
-        if not 0 <= sprite_id <= 15:
-            raise ValueError("Sprite ID must be between 0 and 15")
+        self._check_sprite_id(sprite_id)
         return self._send_command(self.CMD_DRAW_SPRITE, bytes([sprite_id, x, y]))
 
+    def draw_sprite_rect(
+        self,
+        sprite_id: int,
+        src_x: int,
+        src_y: int,
+        width: int,
+        height: int,
+        x: int,
+        y: int,
+    ) -> Tuple[bool, str]:
+        """Draw part of a sprite, e.g. one frame of a sprite sheet.
+
+        Unlike draw_sprite(), this does not clear or track the position the
+        sprite was drawn at.
+
+        Args:
+            sprite_id: Sprite ID (0-63)
+            src_x: X coordinate of the part within the sprite
+            src_y: Y coordinate of the part within the sprite
+            width: Width of the part
+            height: Height of the part
+            x: X coordinate on the panel
+            y: Y coordinate on the panel
+
+        Returns:
+            Tuple of (success, message)
+        """
+        self._check_sprite_id(sprite_id)
+        return self._send_command(
+            self.CMD_DRAW_SPRITE_RECT,
+            bytes([sprite_id, src_x, src_y, width, height, x, y]),
+        )
+
     def move_sprite(self, sprite_id: int, x: int, y: int) -> Tuple[bool, str]:
         """Move a sprite to a new location and update its stored position.
 
         Args:
-            sprite_id: Sprite ID (0-15)
+            sprite_id: Sprite ID (0-63)
             x: New X coordinate
             y: New Y coordinate
 
         Returns:
             Tuple of (success, message)
         """
-        if not 0 <= sprite_id <= 15:
-            raise ValueError("Sprite ID must be between 0 and 15")
+        self._check_sprite_id(sprite_id)
         return self._send_command(self.CMD_MOVE_SPRITE, bytes([sprite_id, x, y]))
 
+    def ping(self, size: int = 8) -> Tuple[bool, str]:
+        """Check the link by having the device echo a random payload.
+
+        Args:
+            size: Payload size in bytes (0-255)
+
+        Returns:
+            Tuple of (success, message)
+        """
+        payload = self._ping_payload(size)
+        transaction = self._metered(
+            self.CMD_PING,
+            3 + len(payload),
+            lambda ser: self._ping_transaction(ser, payload),
+        )
+        return self._exclusive(self.COMMAND_TIMEOUT, transaction)
+
+    @staticmethod
+    def _ping_payload(size: int) -> bytes:
+        """Random printable payload; the device echoes it as its ACK message."""
+        if not 0 <= size <= MatrixDisplay.MAX_COMMAND_DATA:
+            raise ValueError(
+                f"Ping size must be between 0 and {MatrixDisplay.MAX_COMMAND_DATA}"
+            )
+        return os.urandom((size + 1) // 2).hex()[:size].encode("ascii")
+
+    def _ping_transaction(self, ser: serial.Serial, payload: bytes) -> Tuple[bool, str]:
+        """Send CMD_PING and check the echo."""
+        success, message = self._exchange(ser, self.CMD_PING, payload)
+        if success and message.encode("ascii", errors="ignore") != payload:
+            return False, "Ping echo mismatch"
+        return success, message
+
+    def _exclusive(
+        self, timeout: float, transaction: Callable[[serial.Serial], Tuple[bool, str]]
+    ) -> Tuple[bool, str]:
+        """Run a transaction that needs the link to itself.
+
+        Queued batch commands are sent and pipelined commands acknowledged
+        first. The result is returned directly, even inside `pipelined()`.
+        """
+        if self._batch is not None:
+            self._batch.flush()
+        if self._pipeline is not None:
+            self._pipeline.drain()
+        result = self._transact(timeout, transaction)
+        if self._pipeline is not None:
+            self._pipeline.ser = self._ser  # The session may have reconnected
+        return result
+
+    def set_baudrate(self, baudrate: int) -> Tuple[bool, str]:
+        """Switch the serial link to another baud rate.
+
+        The device acknowledges CMD_SET_BAUD at the current rate and then
+        switches. The host follows and pings at the new rate; without that
+        ping the device falls back to the old rate after
+        BAUD_VERIFY_TIMEOUT, and so does the host. The rate the device
+        starts with after a reset is not changed.
+
+        Args:
+            baudrate: New baud rate (9600-5000000)
+
+        Returns:
+            Tuple of (success, message)
+        """
+        if not 9600 <= baudrate <= 5000000:
+            raise ValueError("Baud rate must be between 9600 and 5000000")
+        if baudrate == self.baudrate:
+            return True, f"Already at {baudrate} baud"
+
+        previous = self.baudrate
+        payload = self._ping_payload(16)
+
+        def transaction(ser: serial.Serial) -> Tuple[bool, str]:
+            success, message = self._exchange(
+                ser, self.CMD_SET_BAUD, baudrate.to_bytes(4, "big")
+            )
+            if not success:
+                return False, message
+            switched = time.monotonic()
+
+            try:
+                ser.baudrate = baudrate
+                time.sleep(self.BAUD_SETTLE_TIME)
+                self._reset_input(ser)
+                # Leave the device time to answer before it gives up
+                ser.timeout = self.BAUD_VERIFY_TIMEOUT / 2
+                success, message = self._ping_transaction(ser, payload)
+            except (ValueError, serial.SerialException) as e:
+                # E.g. a rate the host's serial adapter does not support
+                success, message = False, str(e)
+            if success:
+                self.baudrate = baudrate
+                return True, f"Switched to {baudrate} baud"
+
+            # Wait for the device to fall back as well
+            ser.baudrate = previous
+            fallback = switched + self.BAUD_VERIFY_TIMEOUT + self.BAUD_SETTLE_TIME
+            time.sleep(max(0.0, fallback - time.monotonic()))
+            self._reset_input(ser)
+            return False, f"Link not stable at {baudrate} baud: {message}"
+
+        return self._exclusive(self.COMMAND_TIMEOUT, transaction)
+
+    def probe_baudrate(
+        self, baudrates: Iterable[int] = PROBE_BAUDRATES, pings: int = PROBE_PINGS
+    ) -> int:
+        """Switch to the highest baud rate at which the link is stable.
+
+        Rates are tried from highest to lowest. A rate is kept once the
+        device acknowledged the switch and echoed `pings` full-size pings.
+
+        Args:
+            baudrates: Candidate baud rates
+            pings: Full-size pings each rate must pass
+
+        Returns:
+            The baud rate in use afterwards
+        """
+        for baudrate in sorted(baudrates, reverse=True):
+            if not self.set_baudrate(baudrate)[0]:
+                continue
+            if all(self.ping(self.MAX_COMMAND_DATA)[0] for _ in range(pings)):
+                return baudrate
+        return self.baudrate
+
+    def set_animation(
+        self,
+        animation_id: int,
+        x: int,
+        y: int,
+        frames: Sequence[Tuple[int, int]],
+        loop: bool = True,
+    ) -> Tuple[bool, str]:
+        """Define an animation that the device plays on its own.
+
+        Frames are sprites that are already set. Defining an animation stops
+        it if it was playing; start it with start_animation().
+
+        Args:
+            animation_id: Animation ID (0-3)
+            x: X coordinate
+            y: Y coordinate
+            frames: (sprite ID, duration in milliseconds) of each frame,
+                at most 32
+            loop: Start over after the last frame instead of stopping on it
+
+        Returns:
+            Tuple of (success, message)
+        """
+        self._check_animation_id(animation_id)
+        if not 1 <= len(frames) <= self.MAX_ANIMATION_FRAMES:
+            raise ValueError(
+                f"An animation has between 1 and {self.MAX_ANIMATION_FRAMES} frames"
+            )
+        data = bytearray([animation_id, x, y, 0x01 if loop else 0x00, len(frames)])
+        for sprite_id, duration in frames:
+            self._check_sprite_id(sprite_id)
+            if not 1 <= duration <= 0xFFFF:
+                raise ValueError("Frame duration must be between 1 and 65535 ms")
+            data.append(sprite_id)
+            data += duration.to_bytes(2, "big")
+        return self._send_command(self.CMD_SET_ANIMATION, bytes(data))
+
+    def start_animation(self, animation_id: int) -> Tuple[bool, str]:
+        """Play an animation from its first frame.
+
+        Args:
+            animation_id: Animation ID (0-3)
+
+        Returns:
+            Tuple of (success, message)
+        """
+        return self._animation_control(animation_id, self.ANIMATION_START)
+
+    def resume_animation(self, animation_id: int) -> Tuple[bool, str]:
+        """Play an animation from the frame it was stopped on.
+
+        Args:
+            animation_id: Animation ID (0-3)
+
+        Returns:
+            Tuple of (success, message)
+        """
+        return self._animation_control(animation_id, self.ANIMATION_RESUME)
+
+    def stop_animation(self, animation_id: int, clear: bool = False) -> Tuple[bool, str]:
+        """Stop an animation.
+
+        Args:
+            animation_id: Animation ID (0-3)
+            clear: Clear the current frame from the screen instead of
+                leaving it up
+
+        Returns:
+            Tuple of (success, message)
+        """
+        action = self.ANIMATION_STOP_CLEAR if clear else self.ANIMATION_STOP
+        return self._animation_control(animation_id, action)
+
+    def move_animation(self, animation_id: int, x: int, y: int) -> Tuple[bool, str]:
+        """Move an animation, redrawing it at once if it is on screen.
+
+        Args:
+            animation_id: Animation ID (0-3)
+            x: New X coordinate
+            y: New Y coordinate
+
+        Returns:
+            Tuple of (success, message)
+        """
+        self._check_animation_id(animation_id)
+        return self._send_command(self.CMD_MOVE_ANIMATION, bytes([animation_id, x, y]))
+
+    def _animation_control(self, animation_id: int, action: int) -> Tuple[bool, str]:
+        """Send CMD_ANIMATION_CONTROL."""
+        self._check_animation_id(animation_id)
+        return self._send_command(self.CMD_ANIMATION_CONTROL, bytes([animation_id, action]))
+
+    def _check_animation_id(self, animation_id: int) -> None:
+        """Raise ValueError for animation IDs the firmware does not have."""
+        if not 0 <= animation_id < self.MAX_ANIMATIONS:
+            raise ValueError(
+                f"Animation ID must be between 0 and {self.MAX_ANIMATIONS - 1}"
+            )
+
+    def set_telemetry(self, enabled: bool = True, reset: bool = False) -> Tuple[bool, str]:
+        """Switch the device's execution timing on or off.
+
+        With telemetry on, every ACK carries the time the device spent
+        receiving the command (header, data and any bulk payload, including
+        waiting for it to arrive) and the rest of the time up to the ACK,
+        mostly drawing. The latest figures are in `device_timing`, and a
+        metrics registry adds them to its per-command breakdown. The device
+        also accumulates per-opcode counters; see query_stats().
+
+        Args:
+            enabled: Time commands and send timed ACKs
+            reset: Zero the device's per-opcode counters
+
+        Returns:
+            Tuple of (success, message)
+        """
+        flags = (self.TELEMETRY_ENABLE if enabled else 0) | (
+            self.TELEMETRY_RESET if reset else 0
+        )
+        return self._request(self.CMD_SET_TELEMETRY, bytes([flags]))
+
+    def query_stats(self) -> Dict[int, Dict[str, int]]:
+        """Read the device's cumulative per-opcode telemetry counters.
+
+        Counters only advance while telemetry is on (see set_telemetry()).
+
+        Returns:
+            Dict of command byte to its count, failures, receive and render
+            (total microseconds) and max (slowest command, microseconds)
+        """
+        success, message = self._request(self.CMD_QUERY_STATS, b"")
+        if not success:
+            raise RuntimeError(f"Failed to query stats: {message}")
+        stats = {}
+        for cmd in self._parse_opcode_list(message):
+            stats[cmd] = self._parse_stats_reply(
+                *self._request(self.CMD_QUERY_STATS, bytes([cmd]))
+            )
+        return stats
+
+    @staticmethod
+    def _parse_opcode_list(message: str) -> List[int]:
+        """Read the opcodes listed by CMD_QUERY_STATS without data."""
+        return [int(field, 16) for field in message.split()]
+
+    @staticmethod
+    def _parse_stats_reply(success: bool, message: str) -> Dict[str, int]:
+        """Read one opcode's counters from a CMD_QUERY_STATS acknowledgment."""
+        if not success:
+            raise RuntimeError(f"Failed to query stats: {message}")
+        return {
+            key: int(value)
+            for key, _, value in (field.partition("=") for field in message.split())
+        }
+
     @staticmethod
     def list_ports() -> List[Tuple[str, str, str]]:
         """List available serial ports.
@@ -0,0 +1,296 @@
+"""
+Client-side metrics for the matrix display.
+
+A MetricsRegistry records, per command, how many packets were sent, bytes
+written and read, acknowledgment latency, failed and timed out commands, and
+how long bulk transfers waited for flow control credits. Pass a registry to
+MatrixDisplay to enable it; without one the client only checks for it once
+per command.
+"""
+
+import threading
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Upper bounds of the latency histogram buckets, in seconds
+LATENCY_BUCKETS = (
+    0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0, 2.0, 5.0, 10.0,
+)
+QUANTILES = (0.5, 0.95, 0.99)
+
+
+class Histogram:
+    """Counts of observations per bucket, as in a Prometheus histogram."""
+
+    __slots__ = ("bounds", "counts", "count", "sum")
+
+    def __init__(self, bounds: Sequence[float] = LATENCY_BUCKETS):
+        self.bounds = tuple(bounds)
+        # One more bucket for observations above the last bound
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        """Add an observation."""
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Estimate a quantile by interpolating within its bucket.
+
+        Observations above the last bound are reported as the last bound.
+        Returns 0.0 without observations.
+        """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, count in enumerate(self.counts):
+            if count and seen + count >= rank:
+                if index == len(self.bounds):
+                    return self.bounds[-1]
+                lower = self.bounds[index - 1] if index else 0.0
+                return lower + (self.bounds[index] - lower) * (rank - seen) / count
+            seen += count
+        return self.bounds[-1]
+
+
+class CommandMetrics:
+    """Counters of one command."""
+
+    __slots__ = (
+        "count",
+        "failures",
+        "timeouts",
+        "errors",
+        "bytes_written",
+        "bytes_read",
+        "stall_time",
+        "latency",
+        "device_count",
+        "device_receive",
+        "device_render",
+        "device_latency",
+    )
+
+    def __init__(self, buckets: Sequence[float]):
+        self.count = 0
+        # Commands answered with a failure ACK, or not answered at all
+        self.failures = 0
+        # Failures where no ACK or flow control credit arrived in time
+        self.timeouts = 0
+        # Serial I/O errors
+        self.errors = 0
+        self.bytes_written = 0
+        self.bytes_read = 0
+        # Time spent waiting for flow control credits
+        self.stall_time = 0.0
+        self.latency = Histogram(buckets)
+        # Commands whose ACK carried device timing (telemetry mode), the
+        # device's receive and render time for them and their latency here
+        self.device_count = 0
+        self.device_receive = 0.0
+        self.device_render = 0.0
+        self.device_latency = 0.0
+
+
+class MetricsRegistry:
+    """Per-command metrics shared by one or more displays.
+
+        metrics = MetricsRegistry()
+        with MatrixDisplay("/dev/ttyUSB0", metrics=metrics) as matrix:
+            ...
+        print(metrics.snapshot()["draw_bitmap"]["latency_p95"])
+        metrics.serve(9100)  # Prometheus endpoint at http://host:9100/metrics
+
+    Recording is thread-safe, so a registry can be shared by the displays of
+    a MatrixWall.
+    """
+
+    def __init__(self, buckets: Sequence[float] = LATENCY_BUCKETS):
+        """Create an empty registry.
+
+        Args:
+            buckets: Upper bounds of the latency histogram buckets in seconds
+        """
+        self.buckets = tuple(buckets)
+        self.names: Dict[int, str] = {}
+        self._commands: Dict[int, CommandMetrics] = {}
+        self._lock = threading.Lock()
+
+    def _command(self, cmd: int) -> CommandMetrics:
+        """Counters of a command, created on first use; call with the lock held."""
+        metrics = self._commands.get(cmd)
+        if metrics is None:
+            metrics = self._commands[cmd] = CommandMetrics(self.buckets)
+        return metrics
+
+    def name(self, cmd: int) -> str:
+        """Name of a command byte, e.g. "draw_pixel", or its hex value."""
+        return self.names.get(cmd, f"0x{cmd:02x}")
+
+    def record(
+        self,
+        cmd: int,
+        written: int,
+        read: int,
+        latency: float,
+        success: bool,
+        timeout: bool = False,
+        device: Optional[Tuple[float, float]] = None,
+    ) -> None:
+        """Record a completed command.
+
+        Args:
+            cmd: Command byte
+            written: Bytes written for the command
+            read: Bytes of its acknowledgment
+            latency: Seconds from sending to the acknowledgment
+            success: Whether the device reported success
+            timeout: Whether the acknowledgment never arrived
+            device: Seconds the device spent receiving and rendering the
+                command, from a timed ACK
+        """
+        with self._lock:
+            metrics = self._command(cmd)
+            metrics.count += 1
+            metrics.bytes_written += written
+            metrics.bytes_read += read
+            metrics.latency.observe(latency)
+            if not success:
+                metrics.failures += 1
+                if timeout:
+                    metrics.timeouts += 1
+            if device is not None:
+                metrics.device_count += 1
+                metrics.device_receive += device[0]
+                metrics.device_render += device[1]
+                metrics.device_latency += latency
+
+    def record_credit(self, cmd: int, waited: float) -> None:
+        """Record a flow control credit (one 0xFF byte) and the wait for it."""
+        with self._lock:
+            metrics = self._command(cmd)
+            metrics.bytes_read += 1
+            metrics.stall_time += waited
+
+    def record_error(self, cmd: int) -> None:
+        """Record a serial I/O error during a command."""
+        with self._lock:
+            self._command(cmd).errors += 1
+
+    def reset(self) -> None:
+        """Forget everything recorded so far."""
+        with self._lock:
+            self._commands.clear()
+
+    def snapshot(self) -> Dict[str, Dict[str, float]]:
+        """Current values per command name.
+
+        Returns:
+            Dictionary mapping command name to its count, failures, timeouts,
+            errors, bytes_written, bytes_read, stall_time, latency_sum and
+            latency_p50/p95/p99 (seconds, estimated from the histogram).
+            Commands timed by the device also break their latency down:
+            device_count of them spent device_receive_time receiving and
+            device_render_time rendering, and other_time in neither (host,
+            ACK transfer and the packet header)
+        """
+        with self._lock:
+            snapshot = {}
+            for cmd, metrics in sorted(self._commands.items()):
+                values = {
+                    "count": metrics.count,
+                    "failures": metrics.failures,
+                    "timeouts": metrics.timeouts,
+                    "errors": metrics.errors,
+                    "bytes_written": metrics.bytes_written,
+                    "bytes_read": metrics.bytes_read,
+                    "stall_time": metrics.stall_time,
+                    "latency_sum": metrics.latency.sum,
+                }
+                for q in QUANTILES:
+                    values[f"latency_p{round(q * 100)}"] = metrics.latency.quantile(q)
+                if metrics.device_count:
+                    values["device_count"] = metrics.device_count
+                    values["device_receive_time"] = metrics.device_receive
+                    values["device_render_time"] = metrics.device_render
+                    values["other_time"] = max(
+                        0.0,
+                        metrics.device_latency - metrics.device_receive - metrics.device_render,
+                    )
+                snapshot[self.name(cmd)] = values
+            return snapshot
+
+    def prometheus(self, prefix: str = "matrix") -> str:
+        """Render the metrics in the Prometheus text exposition format."""
+        counters = (
+            ("commands_total", "count", "Commands sent."),
+            ("command_failures_total", "failures", "Commands that failed or got no ACK."),
+            ("command_timeouts_total", "timeouts", "Commands whose ACK or credit timed out."),
+            ("command_errors_total", "errors", "Serial I/O errors during commands."),
+            ("bytes_written_total", "bytes_written", "Bytes written to the serial port."),
+            ("bytes_read_total", "bytes_read", "Bytes read from the serial port."),
+            ("flow_stall_seconds_total", "stall_time", "Time spent waiting for flow control credits."),
+            ("device_timed_commands_total", "device_count", "Commands timed by the device."),
+            ("device_receive_seconds_total", "device_receive", "Device time spent receiving commands."),
+            ("device_render_seconds_total", "device_render", "Device time spent executing commands."),
+        )
+        lines: List[str] = []
+        with self._lock:
+            commands = sorted(self._commands.items())
+            for metric, attribute, help_text in counters:
+                lines.append(f"# HELP {prefix}_{metric} {help_text}")
+                lines.append(f"# TYPE {prefix}_{metric} counter")
+                for cmd, metrics in commands:
+                    value = getattr(metrics, attribute)
+                    lines.append(f'{prefix}_{metric}{{command="{self.name(cmd)}"}} {value}')
+
+            metric = f"{prefix}_ack_latency_seconds"
+            lines.append(f"# HELP {metric} Time from sending a command to its ACK.")
+            lines.append(f"# TYPE {metric} histogram")
+            for cmd, metrics in commands:
+                label = f'command="{self.name(cmd)}"'
+                histogram = metrics.latency
+                cumulative = 0
+                for bound, count in zip(histogram.bounds + (float("inf"),), histogram.counts):
+                    cumulative += count
+                    le = "+Inf" if bound == float("inf") else f"{bound:g}"
+                    lines.append(f'{metric}_bucket{{{label},le="{le}"}} {cumulative}')
+                lines.append(f"{metric}_sum{{{label}}} {histogram.sum}")
+                lines.append(f"{metric}_count{{{label}}} {histogram.count}")
+        return "\n".join(lines) + "\n"
+
+    def serve(self, port: int, host: str = "") -> ThreadingHTTPServer:
+        """Serve the metrics at http://host:port/metrics from a daemon thread.
+
+        Args:
+            port: TCP port (0 picks a free one)
+            host: Address to bind (default: all interfaces)
+
+        Returns:
+            The server; call shutdown() on it to stop serving
+        """
+        registry = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self) -> None:
+                if self.path.split("?")[0] != "/metrics":
+                    self.send_error(404)
+                    return
+                body = registry.prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format: str, *args) -> None:
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
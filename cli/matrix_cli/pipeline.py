@@ -0,0 +1,177 @@
+"""
+Pipelined command submission for the matrix display.
+
+Instead of waiting for the acknowledgment of every command before sending the
+next one, a pipeline keeps several commands in flight and matches the ACK
+frames that come back to the pending commands. With framing v2 replies are
+matched by sequence number, and a command whose packet was NAKed or not
+answered is sent again on its own.
+"""
+
+from collections import deque
+from concurrent.futures import Future
+from typing import Callable, Deque, Optional, Tuple
+import serial
+
+AckReader = Callable[[serial.Serial], Tuple[Optional[int], Optional[bool], str]]
+AckReady = Callable[[serial.Serial], bool]
+Encoder = Callable[[int, bytes], Tuple[int, bytes]]
+
+
+class _PendingCommand:
+    """A command that has been written but not acknowledged yet."""
+
+    __slots__ = ("key", "packet", "retries", "future")
+
+    def __init__(self, key: int, packet: bytes):
+        self.key = key
+        self.packet = packet
+        self.retries = 0
+        self.future: Future = Future()
+
+    @property
+    def size(self) -> int:
+        return len(self.packet)
+
+
+class CommandPipeline:
+    """Keeps up to `window` commands in flight on a serial connection.
+
+    Commands are written immediately as long as both the number of pending
+    commands and the number of unacknowledged bytes stay within limits; the
+    byte limit keeps the host from overrunning the firmware's serial receive
+    buffer. ACK frames are read whenever a slot is needed (or on `poll()` /
+    `drain()`) and matched to the oldest pending command with the same key,
+    the CMD byte or, for framed packets, the SEQ. Without retries, pending
+    commands sent before the matched one have lost their ACK and are
+    failed; with retries, a command is sent again when its packet is NAKed
+    or when nothing arrives while it is the oldest one.
+
+    Results are delivered as `concurrent.futures.Future` objects resolving to
+    the usual (success, message) tuple; use `add_done_callback` for callbacks.
+    """
+
+    def __init__(
+        self,
+        ser: serial.Serial,
+        read_ack: AckReader,
+        ack_ready: AckReady,
+        encode: Encoder,
+        window: int,
+        buffer_size: int,
+        retries: int = 0,
+    ):
+        """Create a pipeline on an open serial connection.
+
+        Args:
+            ser: Open serial connection
+            read_ack: Function reading one reply as (key, success, message);
+                the key is None on timeout and success None for a NAK
+            ack_ready: Function telling whether read_ack would return without
+                waiting
+            encode: Function building the packet of (cmd, data) and
+                returning it with its key
+            window: Maximum number of commands in flight
+            buffer_size: Maximum number of unacknowledged bytes in flight
+            retries: Times a command may be sent again (0: never)
+        """
+        if window < 1:
+            raise ValueError("Pipeline window must be at least 1")
+        self.ser = ser
+        self.read_ack = read_ack
+        self.ack_ready = ack_ready
+        self.encode = encode
+        self.window = window
+        self.buffer_size = buffer_size
+        self.retries = retries
+        self.pending: Deque[_PendingCommand] = deque()
+        self.bytes_in_flight = 0
+
+    def submit(self, cmd: int, data: bytes, payload: bytes = None) -> Future:
+        """Write a command without waiting for its acknowledgment.
+
+        Args:
+            cmd: Command byte
+            data: Command data
+            payload: Additional payload to be sent
+        Returns:
+            Future resolving to (success, message)
+        """
+        key, packet = self.encode(cmd, data)
+        packet += payload or b""
+
+        # Make room: a packet larger than the whole buffer is sent on its own
+        while self.pending and (
+            len(self.pending) >= self.window
+            or self.bytes_in_flight + len(packet) > self.buffer_size
+        ):
+            self._read_one()
+
+        entry = _PendingCommand(key, packet)
+        self.ser.write(packet)
+        self.pending.append(entry)
+        self.bytes_in_flight += entry.size
+        self.poll()
+        return entry.future
+
+    def poll(self) -> None:
+        """Process any ACK frames that have already arrived, without blocking."""
+        while self.pending and self.ack_ready(self.ser):
+            self._read_one()
+
+    def drain(self) -> None:
+        """Wait until every pending command has been acknowledged."""
+        self.ser.flush()
+        while self.pending:
+            self._read_one()
+
+    def cancel(self) -> None:
+        """Cancel every pending command without waiting for its ACK."""
+        while self.pending:
+            entry = self.pending.popleft()
+            self.bytes_in_flight -= entry.size
+            entry.future.cancel()
+
+    def _read_one(self) -> None:
+        """Read one reply and resolve or resend the matching pending command."""
+        key, success, message = self.read_ack(self.ser)
+        if key is None:
+            # Timeout or garbage: the oldest command was lost on the way
+            # there or back, and without retries will never be answered
+            if not self._resend(self.pending[0]):
+                self._resolve(self.pending.popleft(), False, message)
+            return
+
+        for index, entry in enumerate(self.pending):
+            if entry.key == key:
+                break
+        else:
+            # Stray ACK that does not belong to anything we sent
+            return
+
+        if success is None:
+            # NAK: the packet was corrupted on the way
+            if not self._resend(entry):
+                del self.pending[index]
+                self._resolve(entry, False, "Packet corrupted too often")
+            return
+
+        if not self.retries:
+            for _ in range(index):
+                self._resolve(self.pending.popleft(), False, "No acknowledgment received")
+            index = 0
+        del self.pending[index]
+        self._resolve(entry, success, message)
+
+    def _resend(self, entry: _PendingCommand) -> bool:
+        """Write a pending command again, unless it is out of retries."""
+        if entry.retries >= self.retries:
+            return False
+        entry.retries += 1
+        self.ser.write(entry.packet)
+        return True
+
+    def _resolve(self, entry: _PendingCommand, success: bool, message: str) -> None:
+        """Complete a pending command and release its window slot."""
+        self.bytes_in_flight -= entry.size
+        entry.future.set_result((success, message))
@@ -0,0 +1,241 @@
+"""
+Streaming frame player for the matrix display.
+
+Frames come from any iterable of RGB888 frames: raw RGB24 from a pipe (e.g.
+ffmpeg), a directory of images, an animated GIF or a Python generator. They
+are decoded and converted to RGB565 in a background thread and handed to the
+serial writer through a small bounded queue. The writer keeps to a fixed
+frame schedule and drops frames that are already late rather than drifting.
+"""
+
+import os
+import queue
+import threading
+import time
+from typing import Any, BinaryIO, Iterable, Iterator, Optional
+from PIL import Image, ImageSequence
+from .codec import rgb888_size, rgb888_to_rgb565
+from .matrix import MatrixDisplay
+
+# Image file extensions picked up from a directory
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".gif", ".bmp")
+
+# Marks the end of the frame source in the queue
+_END = object()
+
+
+def raw_rgb_frames(stream: BinaryIO, width: int, height: int) -> Iterator[bytes]:
+    """Read raw RGB24 frames from a binary stream until it ends.
+
+    Suitable for `ffmpeg -i video.mp4 -vf scale=64:64 -f rawvideo
+    -pix_fmt rgb24 -` piped to stdin.
+
+    Args:
+        stream: Binary stream, e.g. `sys.stdin.buffer`
+        width: Frame width
+        height: Frame height
+
+    Yields:
+        One frame of width * height * 3 bytes at a time
+    """
+    frame_size = width * height * 3
+    while True:
+        frame = stream.read(frame_size)
+        # Pipes may return short reads before the end of the stream
+        while frame and len(frame) < frame_size:
+            more = stream.read(frame_size - len(frame))
+            if not more:
+                break
+            frame += more
+        if len(frame) < frame_size:
+            return
+        yield frame
+
+
+def image_frames(path: str, width: int, height: int) -> Iterator[Image.Image]:
+    """Load frames from an image file or a directory of images.
+
+    A directory yields its images in file name order; an animated image
+    (e.g. GIF) yields each of its frames. Frames are resized to fit.
+
+    Args:
+        path: Image file or directory
+        width: Frame width
+        height: Frame height
+
+    Yields:
+        RGB images of the requested size
+    """
+    if os.path.isdir(path):
+        files = [
+            os.path.join(path, name)
+            for name in sorted(os.listdir(path))
+            if name.lower().endswith(IMAGE_EXTENSIONS)
+        ]
+    else:
+        files = [path]
+
+    for filename in files:
+        with Image.open(filename) as img:
+            for frame in ImageSequence.Iterator(img):
+                frame = frame.convert("RGB")
+                if frame.size != (width, height):
+                    frame = frame.resize((width, height))
+                yield frame
+
+
+class PlaybackStats:
+    """Outcome of a playback run."""
+
+    def __init__(self, fps: float):
+        self.target_fps = fps
+        self.frames_shown = 0
+        self.frames_dropped = 0
+        self.frames_failed = 0
+        self.elapsed = 0.0
+        # Time spent sending frames over the serial link
+        self.busy = 0.0
+
+    @property
+    def fps(self) -> float:
+        """Frames shown per second."""
+        return self.frames_shown / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def link_utilization(self) -> float:
+        """Fraction of the playback time the serial link was busy."""
+        return self.busy / self.elapsed if self.elapsed else 0.0
+
+
+class FramePlayer:
+    """Plays a stream of frames on the display at a fixed frame rate.
+
+    Frame `n` is due at `start + n / fps`. A frame that arrives after the
+    next one is already due is dropped, so a slow link lowers the frame rate
+    instead of stretching the playback.
+    """
+
+    def __init__(
+        self,
+        matrix: MatrixDisplay,
+        fps: float = 30.0,
+        x: int = 0,
+        y: int = 0,
+        width: Optional[int] = None,
+        height: Optional[int] = None,
+        queue_size: int = 4,
+    ):
+        """Create a player.
+
+        If the display was created with `shadow=True`, frames are sent with
+        push_frame() so only the changed regions go over the link.
+
+        Args:
+            matrix: Display to play on
+            fps: Target frames per second
+            x: X coordinate of the frames on the panel
+            y: Y coordinate of the frames on the panel
+            width: Frame width (default: panel width)
+            height: Frame height (default: panel height)
+            queue_size: Frames decoded ahead of the writer
+        """
+        if fps <= 0:
+            raise ValueError("fps must be positive")
+        self.matrix = matrix
+        self.fps = fps
+        self.x = x
+        self.y = y
+        self.width = width if width is not None else matrix.width - x
+        self.height = height if height is not None else matrix.height - y
+        self.queue_size = queue_size
+
+    def play(self, frames: Iterable[Any]) -> PlaybackStats:
+        """Play frames until the source is exhausted.
+
+        Args:
+            frames: RGB888 frames as bytes-like objects, PIL images or NumPy
+                arrays of the player's frame size
+
+        Returns:
+            Playback statistics
+        """
+        stats = PlaybackStats(self.fps)
+        frame_queue: queue.Queue = queue.Queue(self.queue_size)
+        stop = threading.Event()
+        decoder = threading.Thread(
+            target=self._decode, args=(frames, frame_queue, stop), daemon=True
+        )
+        decoder.start()
+
+        period = 1.0 / self.fps
+        start = time.perf_counter()
+        index = 0
+        try:
+            while True:
+                item = frame_queue.get()
+                if item is _END:
+                    break
+                if isinstance(item, BaseException):
+                    raise item
+
+                # Every source frame has its own slot; drop the frame if
+                # its slot has passed
+                now = time.perf_counter()
+                if now >= start + (index + 1) * period:
+                    stats.frames_dropped += 1
+                    index += 1
+                    continue
+
+                delay = start + index * period - now
+                if delay > 0:
+                    time.sleep(delay)
+
+                sent = time.perf_counter()
+                success, _ = self._send(item)
+                stats.busy += time.perf_counter() - sent
+                if success:
+                    stats.frames_shown += 1
+                else:
+                    stats.frames_failed += 1
+                index += 1
+        finally:
+            stop.set()
+            # The last frame shown stays up for a full period
+            stats.elapsed = max(time.perf_counter() - start, index * period)
+
+        return stats
+
+    def _decode(self, frames: Iterable[Any], frame_queue: queue.Queue, stop: threading.Event):
+        """Decoder thread: convert frames and feed them to the writer."""
+        expected_size = self.width * self.height * 3
+        try:
+            for frame in frames:
+                if rgb888_size(frame) != expected_size:
+                    raise ValueError(
+                        f"Frame data size mismatch. Expected {expected_size} bytes, "
+                        f"got {rgb888_size(frame)}"
+                    )
+                # Delta updates diff in RGB565 themselves
+                item = frame if self.matrix.shadow is not None else rgb888_to_rgb565(frame)
+                if not self._put(frame_queue, item, stop):
+                    return
+            self._put(frame_queue, _END, stop)
+        except Exception as e:
+            self._put(frame_queue, e, stop)
+
+    @staticmethod
+    def _put(frame_queue: queue.Queue, item: Any, stop: threading.Event) -> bool:
+        """Queue an item, giving up once playback has stopped."""
+        while not stop.is_set():
+            try:
+                frame_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _send(self, item: Any):
+        """Send one decoded frame."""
+        if self.matrix.shadow is not None:
+            return self.matrix.push_frame(item, self.x, self.y, self.width, self.height)
+        return self.matrix.draw_bitmap_rgb565(self.x, self.y, self.width, self.height, item)
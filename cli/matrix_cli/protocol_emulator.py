@@ -0,0 +1,8 @@
+"""
+pySerial URL handler for emulator:// ports.
+
+serial_for_url("emulator://NAME") looks up this module, as matrix.py adds the
+package to serial.protocol_handler_packages; see emulator.py.
+"""
+
+from .emulator import EmulatorSerial as Serial  # noqa: F401
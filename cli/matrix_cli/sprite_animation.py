@@ -7,7 +7,9 @@ import time
 import glob
 from typing import List
 from PIL import Image
+from .animation import Animation
 from .matrix import MatrixDisplay
+from .sprite_manager import SpriteManager
 
 
 def load_frames(directory: str = "../resources/knight/idle") -> List[Image.Image]:
@@ -56,49 +58,82 @@ def load_frames(directory: str = "../resources/knight/idle") -> List[Image.Image
 def run_animation(matrix: MatrixDisplay, frame_delay: float = 0.1):
     """Run the animation in the center of the screen.
 
+    Animations that fit the device's animation and sprite slots are played
+    by the device, leaving the link idle. Longer ones are handed to a
+    SpriteManager; frames that do not fit are uploaded again when they come
+    up.
+
     Args:
         matrix: Matrix display instance
         frame_delay: Delay between frames in seconds
-        cycles: Number of animation cycles to run
     """
-    try:
-        # Load frames
-        print("Loading animation frames...")
-        frames = load_frames()
+    # Load frames
+    print("Loading animation frames...")
+    frames = load_frames()
 
-        # Clear the screen
-        print("Clearing screen...")
-        success, msg = matrix.clear()
-        print(f"Clear: {success} - {msg}")
-        time.sleep(1)
+    # Clear the screen
+    print("Clearing screen...")
+    success, msg = matrix.clear()
+    print(f"Clear: {success} - {msg}")
+    time.sleep(1)
 
-        center_x = int((64 - frames[0].width) / 2)
-        center_y = int((64 - frames[0].height) / 2)
+    center_x = int((64 - frames[0].width) / 2)
+    center_y = int((64 - frames[0].height) / 2)
 
-        # Set up sprites for each frame (we'll use sprites 0-11 for the 12 frames)
+    if len(frames) <= matrix.MAX_ANIMATION_FRAMES:
+        try:
+            run_device_animation(matrix, frames, frame_delay, center_x, center_y)
+            return
+        except RuntimeError as e:
+            print(f"Playing on the host instead: {e}")
+    run_host_animation(matrix, frames, frame_delay, center_x, center_y)
+
+
+def run_device_animation(
+    matrix: MatrixDisplay, frames: List[Image.Image], frame_delay: float, x: int, y: int
+):
+    """Upload the frames and let the device play them until interrupted."""
+    print("Setting up sprite frames...")
+    animation = Animation.from_images(matrix, frames, fps=1 / frame_delay, x=x, y=y)
+    animation.start()
+    print("Playing on the device, press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    finally:
+        animation.stop()
+
+
+def run_host_animation(
+    matrix: MatrixDisplay, frames: List[Image.Image], frame_delay: float, x: int, y: int
+):
+    """Draw every frame from the host, swapping frames through the sprite slots."""
+    manager = SpriteManager(matrix)
+    try:
+        # Upload as many frames as fit before the animation starts
         print("Setting up sprite frames...")
-        for i, frame in enumerate(frames):
-            if i >= 12:  # Limit to 12 sprites
-                break
-            success, msg = matrix.set_sprite(
-                i, center_x, center_y, frame.width, frame.height, frame.tobytes()
-            )
-            print(f"Set sprite {i}: {success} - {msg}")
-            time.sleep(0.1)
+        handles = [
+            manager.add(frame.width, frame.height, frame.tobytes()) for frame in frames
+        ]
+        uploaded = manager.prefetch(handles)
+        print(f"Uploaded {uploaded} of {len(handles)} frames")
 
         # Run the animation
         while True:
-            for frame in range(len(frames)):
-                if frame >= 12:  # Limit to 12 sprites
-                    break
-
+            for handle in handles:
                 # Draw the current frame
-                success, msg = matrix.draw_sprite(frame, center_x, center_y)
+                success, msg = manager.draw(handle, x, y)
 
                 time.sleep(frame_delay)
 
     except Exception as e:
         print(f"Error in animation: {e}")
+    finally:
+        stats = manager.stats
+        print(
+            f"Sprite slots: {stats.hits} hits, {stats.misses} misses, "
+            f"{stats.evictions} evictions, {stats.uploads} uploads"
+        )
 
 
 def run_sprite_animation(matrix: MatrixDisplay):
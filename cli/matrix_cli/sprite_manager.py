@@ -0,0 +1,289 @@
+"""
+Virtual sprite handles on top of the device's sprite slots.
+
+The firmware has MAX_SPRITES sprite slots sharing a fixed amount of sprite
+memory. A SpriteManager hands out any number of sprite handles and keeps the
+most useful of them resident in the slots, uploading a sprite again when a
+draw needs one that was evicted.
+"""
+
+import time
+from concurrent.futures import Future
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from .matrix import MatrixDisplay
+
+# Eviction policies
+LRU = "lru"
+LFU = "lfu"
+
+
+class _VirtualSprite:
+    """A sprite image, ready to upload, and where it currently lives."""
+
+    __slots__ = ("cmd", "header", "payload", "key", "slot", "last_used", "uses")
+
+    def __init__(self, cmd: int, header: bytes, payload: bytes, key: Tuple[int, int, int, int]):
+        self.cmd = cmd
+        # WIDTH HEIGHT, then BPP COLORS for an indexed sprite
+        self.header = header
+        self.payload = payload
+        # (CRC-32, width, height, bpp), computed once for every upload
+        self.key = key
+        self.slot: Optional[int] = None
+        self.last_used = 0
+        self.uses = 0
+
+
+class SpriteStats:
+    """Slot usage counters of a SpriteManager."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.uploads = 0
+        self.reuses = 0
+        self.prefetches = 0
+        # Time spent uploading sprites, prefetches included
+        self.upload_time = 0.0
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of draws that found their sprite resident."""
+        draws = self.hits + self.misses
+        return self.hits / draws if draws else 0.0
+
+
+class SpriteManager:
+    """Maps virtual sprite handles onto the device's sprite slots.
+
+        manager = SpriteManager(matrix)
+        frames = [manager.add(16, 16, image) for image in images]
+        manager.prefetch(frames)
+        for handle in frames:
+            manager.draw(handle, 24, 24)
+        print(manager.stats.hit_rate)
+
+    Drawing a sprite that is not resident uploads it into a free slot, or
+    evicts the least recently used (LRU) or least frequently used (LFU)
+    sprite. Evicting a sprite clears the area where it was last drawn, as
+    re-setting a slot on the device does. The manager assumes it owns its
+    slots; do not set or clear them directly.
+
+    Sprites are uploaded at the position they are drawn at, and prefetched
+    sprites just off the panel, so that the first draw clears nothing.
+    """
+
+    def __init__(
+        self,
+        matrix: MatrixDisplay,
+        slots: Optional[Iterable[int]] = None,
+        policy: str = LRU,
+    ):
+        """Create a manager.
+
+        Args:
+            matrix: Display to manage the sprites of
+            slots: Sprite slots to use (default: all of them)
+            policy: Eviction policy, "lru" or "lfu"
+        """
+        if policy not in (LRU, LFU):
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        self.matrix = matrix
+        self.policy = policy
+        self.slots = list(range(matrix.MAX_SPRITES) if slots is None else slots)
+        for slot in self.slots:
+            matrix._check_sprite_id(slot)
+        if not self.slots:
+            raise ValueError("At least one sprite slot is needed")
+        self.stats = SpriteStats()
+        self._sprites: Dict[int, _VirtualSprite] = {}
+        self._residents: Dict[int, int] = {}  # slot -> handle
+        self._next_handle = 0
+        self._clock = 0
+        # Where prefetched sprites wait for their first draw
+        self._parked = (min(matrix.width, 255), min(matrix.height, 255))
+
+    def add(
+        self,
+        width: int,
+        height: int,
+        bitmap_data: Any,
+        indexed: bool = False,
+        bpp: Optional[int] = None,
+    ) -> int:
+        """Register a sprite image; it is uploaded when first needed.
+
+        Args:
+            width: Sprite width
+            height: Sprite height
+            bitmap_data: RGB888 data as accepted by MatrixDisplay.set_sprite()
+            indexed: Store the sprite as palette indices (see
+                MatrixDisplay.set_sprite_indexed())
+            bpp: Bits per pixel of an indexed sprite; implies `indexed`
+
+        Returns:
+            Sprite handle
+        """
+        header = bytes([width, height])
+        if indexed or bpp is not None:
+            cmd = self.matrix.CMD_SET_SPRITE_INDEXED
+            palette, payload = self.matrix._indexed_payload(width, height, bitmap_data, bpp)
+            header += palette
+            bpp = palette[0]
+        else:
+            cmd = self.matrix.CMD_SET_SPRITE
+            payload = self.matrix._rgb565_payload(width, height, bitmap_data)
+            bpp = 16
+        key = self.matrix._sprite_key(bytes(3) + header, payload, bpp)
+
+        handle = self._next_handle
+        self._next_handle += 1
+        self._sprites[handle] = _VirtualSprite(cmd, header, payload, key)
+        return handle
+
+    def remove(self, handle: int) -> None:
+        """Forget a sprite and free its slot, clearing it from the screen."""
+        sprite = self._sprites.pop(handle)
+        if sprite.slot is not None:
+            del self._residents[sprite.slot]
+            self.matrix.clear_sprite(sprite.slot)
+
+    def slot_of(self, handle: int) -> Optional[int]:
+        """Slot holding a sprite, or None if it is not resident."""
+        return self._sprites[handle].slot
+
+    def draw(self, handle: int, x: int, y: int) -> Tuple[bool, str]:
+        """Draw a sprite, uploading it first if it is not resident.
+
+        Args:
+            handle: Sprite handle
+            x: X coordinate
+            y: Y coordinate
+
+        Returns:
+            Tuple of (success, message)
+        """
+        result = self._acquire(handle, x, y)
+        if not result[0]:
+            return result
+        return self.matrix.draw_sprite(self._sprites[handle].slot, x, y)
+
+    def move(self, handle: int, x: int, y: int) -> Tuple[bool, str]:
+        """Move a sprite, uploading it first if it is not resident.
+
+        Args:
+            handle: Sprite handle
+            x: New X coordinate
+            y: New Y coordinate
+
+        Returns:
+            Tuple of (success, message)
+        """
+        result = self._acquire(handle, x, y)
+        if not result[0]:
+            return result
+        return self.matrix.move_sprite(self._sprites[handle].slot, x, y)
+
+    def prefetch(self, handles: Iterable[int]) -> int:
+        """Upload sprites that upcoming draws need into free slots.
+
+        Nothing is evicted: prefetching stops once the free slots run out.
+        The sprites are uploaded just off the panel until they are drawn.
+
+        Args:
+            handles: Sprites in the order they will be drawn
+
+        Returns:
+            Number of sprites uploaded
+        """
+        uploaded = 0
+        for handle in handles:
+            sprite = self._sprites[handle]
+            if sprite.slot is not None:
+                continue
+            slot = self._free_slot(sprite)
+            if slot is None:
+                break
+            if not self._upload(handle, slot, *self._parked)[0]:
+                break
+            self.stats.prefetches += 1
+            uploaded += 1
+        return uploaded
+
+    def _acquire(self, handle: int, x: int, y: int) -> Tuple[bool, str]:
+        """Make a sprite resident, uploading it at (x, y), and count the use."""
+        sprite = self._sprites[handle]
+        self._clock += 1
+        sprite.last_used = self._clock
+        sprite.uses += 1
+        if sprite.slot is not None:
+            self.stats.hits += 1
+            return True, "Sprite resident"
+
+        self.stats.misses += 1
+        slot = self._free_slot(sprite)
+        if slot is None:
+            slot = self._evict()
+        result = self._upload(handle, slot, x, y)
+        # Sprite memory can run out before the slots do
+        while not result[0] and result[1] == "Sprite too large" and self._residents:
+            self.matrix.clear_sprite(self._evict())
+            result = self._upload(handle, slot, x, y)
+        return result
+
+    def _free_slot(self, sprite: _VirtualSprite) -> Optional[int]:
+        """A free slot, preferring one the device says holds the image already."""
+        free = [slot for slot in self.slots if slot not in self._residents]
+        if not free:
+            return None
+        for slot in free:
+            if self.matrix._sprite_hashes.get(slot) == sprite.key:
+                return slot
+        return free[0]
+
+    def _evict(self) -> int:
+        """Evict the sprite chosen by the policy and return its slot."""
+        slot = min(self._residents, key=self._eviction_order)
+        self._sprites[self._residents.pop(slot)].slot = None
+        self.stats.evictions += 1
+        return slot
+
+    def _eviction_order(self, slot: int) -> Tuple[int, ...]:
+        """Sort key putting the sprite to evict first."""
+        sprite = self._sprites[self._residents[slot]]
+        if self.policy == LFU:
+            return sprite.uses, sprite.last_used
+        return (sprite.last_used,)
+
+    def _upload(self, handle: int, slot: int, x: int, y: int) -> Tuple[bool, str]:
+        """Set a slot to a sprite's image, placed at (x, y)."""
+        sprite = self._sprites[handle]
+        started = time.perf_counter()
+        result = self.matrix._upload_sprite(
+            sprite.cmd,
+            bytes([slot, x, y]) + sprite.header,
+            sprite.payload,
+            sprite.key[3],
+            sprite.key,
+        )
+        # Uploads resolve immediately even inside pipelined()
+        if isinstance(result, Future):
+            result = result.result()
+        self.stats.upload_time += time.perf_counter() - started
+        if not result[0]:
+            return result
+
+        # The device may still hold the image (see MatrixDisplay.set_sprite())
+        if result[1] == "Sprite unchanged":
+            self.stats.reuses += 1
+        else:
+            self.stats.uploads += 1
+        sprite.slot = slot
+        self._residents[slot] = handle
+        return result
+
+    @property
+    def resident(self) -> List[int]:
+        """Handles of the sprites currently in a slot."""
+        return list(self._residents.values())
@@ -0,0 +1,395 @@
+"""
+Several matrix displays driven as one video wall.
+
+Each board gets its own MatrixDisplay and its own worker thread. Drawing on
+the wall splits the work into per-panel commands in panel coordinates and
+sends them to every board at the same time, so an update takes as long as
+the slowest board rather than the sum of all of them.
+"""
+
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from PIL import Image
+from .codec import rgb888_size
+from .framebuffer import Rect
+from .matrix import MatrixDisplay
+
+
+def parse_panel(spec: str) -> Tuple[str, Rect]:
+    """Parse a panel given as PORT=X,Y or PORT=X,Y,WxH (64x64 by default).
+
+    Args:
+        spec: Panel specification, e.g. "/dev/ttyUSB1=64,0,64x32"
+
+    Returns:
+        Tuple of (port, (x, y, width, height))
+    """
+    port, sep, placement = spec.rpartition("=")
+    fields = placement.split(",")
+    try:
+        if not sep or not port or len(fields) not in (2, 3):
+            raise ValueError
+        x, y = int(fields[0]), int(fields[1])
+        width, height = map(int, fields[2].split("x")) if len(fields) == 3 else (64, 64)
+    except ValueError:
+        raise ValueError(f"Invalid panel {spec!r}, expected PORT=X,Y or PORT=X,Y,WxH")
+    return port, (x, y, width, height)
+
+
+def _intersect(a: Rect, b: Rect) -> Optional[Rect]:
+    """Overlap of two rectangles, or None."""
+    x0, y0 = max(a[0], b[0]), max(a[1], b[1])
+    x1, y1 = min(a[0] + a[2], b[0] + b[2]), min(a[1] + a[3], b[1] + b[3])
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return x0, y0, x1 - x0, y1 - y0
+
+
+def _line_points(x0: int, y0: int, x1: int, y1: int) -> List[Tuple[int, int]]:
+    """Pixels of a line, in the order Adafruit_GFX::writeLine() draws them."""
+    steep = abs(y1 - y0) > abs(x1 - x0)
+    if steep:
+        x0, y0, x1, y1 = y0, x0, y1, x1
+    if x0 > x1:
+        x0, x1, y0, y1 = x1, x0, y1, y0
+    dx, dy = x1 - x0, abs(y1 - y0)
+    err = dx // 2
+    ystep = 1 if y0 < y1 else -1
+    points = []
+    for x in range(x0, x1 + 1):
+        points.append((y0, x) if steep else (x, y0))
+        err -= dy
+        if err < 0:
+            y0 += ystep
+            err += dx
+    return points
+
+
+def _line_runs(points: List[Tuple[int, int]]) -> List[Rect]:
+    """The rows (or, for a steep line, columns) of pixels making up a line,
+    as (x, y, width, height)."""
+    runs: List[Rect] = []
+    for x, y in points:
+        if runs:
+            rx, ry, rw, rh = runs[-1]
+            if rh == 1 and y == ry and x == rx + rw:
+                runs[-1] = (rx, ry, rw + 1, 1)
+                continue
+            if rw == 1 and x == rx and y == ry + rh:
+                runs[-1] = (rx, ry, 1, rh + 1)
+                continue
+        runs.append((x, y, 1, 1))
+    return runs
+
+
+def _as_image(data: Any, width: int, height: int) -> Image.Image:
+    """RGB888 data in any form MatrixDisplay accepts, as a PIL image."""
+    if isinstance(data, Image.Image):
+        return data.convert("RGB")
+    if hasattr(data, "shape"):
+        return Image.fromarray(data.astype("uint8").reshape(height, width, 3), "RGB")
+    return Image.frombytes("RGB", (width, height), bytes(data))
+
+
+class MatrixWall:
+    """Panels on several serial ports drawn as one display.
+
+        wall = MatrixWall({
+            "/dev/ttyUSB0": (0, 0, 64, 64),
+            "/dev/ttyUSB1": (64, 0, 64, 64),
+        })
+        with wall:
+            wall.draw_bitmap(0, 0, 128, 64, image)
+            wall.fill_rect(48, 16, 32, 32, 255, 0, 0)
+
+    Coordinates are in the wall's global space; each panel covers the
+    rectangle given in the layout. Every method waits for all boards and
+    returns (success, message), failing if any board failed; `timings`
+    holds how long each board took for the last call.
+    """
+
+    def __init__(
+        self,
+        layout: Dict[str, Rect],
+        baudrate: int = 115200,
+        shadow: bool = False,
+        **kwargs: Any,
+    ):
+        """Create a display per panel.
+
+        Args:
+            layout: Serial port -> (x, y, width, height) of its panel
+            baudrate: Serial baudrate of every board
+            shadow: Keep a mirror of every panel, needed by push_frame()
+            **kwargs: Other MatrixDisplay options, applied to every board
+        """
+        if not layout:
+            raise ValueError("A wall needs at least one panel")
+        self.layout = dict(layout)
+        self.displays = {
+            port: MatrixDisplay(
+                port, baudrate, shadow=shadow, width=rect[2], height=rect[3], **kwargs
+            )
+            for port, rect in self.layout.items()
+        }
+        self.width = max(x + w for x, _, w, _ in self.layout.values())
+        self.height = max(y + h for _, y, _, h in self.layout.values())
+        self.timings: Dict[str, float] = {}
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def __enter__(self) -> "MatrixWall":
+        return self.open()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        self.close()
+
+    def open(self) -> "MatrixWall":
+        """Open a persistent session on every board.
+
+        Returns:
+            The wall itself, so it can be used as a context manager
+        """
+        self._fan_out(lambda matrix, rect: matrix.open())
+        return self
+
+    def close(self) -> None:
+        """Close every board's session and stop the worker threads."""
+        for matrix in self.displays.values():
+            matrix.close()
+        if self._executor is not None:
+            self._executor.shutdown()
+            self._executor = None
+
+    def _fan_out(
+        self,
+        send: Callable[[MatrixDisplay, Rect], Any],
+        ports: Optional[List[str]] = None,
+    ) -> Tuple[bool, str]:
+        """Run `send(matrix, rect)` for panels in parallel and wait for all.
+
+        Args:
+            send: Sends one panel's share; returns (success, message) or
+                None when it had nothing to send
+            ports: Panels to send to (default: all)
+
+        Returns:
+            Tuple of (success, message)
+        """
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=len(self.displays), thread_name_prefix="matrix-wall"
+            )
+        ports = list(self.displays) if ports is None else ports
+
+        def run(port: str) -> Any:
+            started = time.perf_counter()
+            try:
+                return send(self.displays[port], self.layout[port])
+            finally:
+                self.timings[port] = time.perf_counter() - started
+
+        self.timings = {}
+        futures = {port: self._executor.submit(run, port) for port in ports}
+        errors = []
+        for port, future in futures.items():
+            try:
+                result = future.result()
+            except Exception as e:
+                errors.append(f"{port}: {e}")
+                continue
+            if isinstance(result, tuple) and not result[0]:
+                errors.append(f"{port}: {result[1]}")
+        if errors:
+            return False, "; ".join(errors)
+        return True, "OK"
+
+    def _clip(self, x: int, y: int, width: int, height: int, send: Callable[..., Any]):
+        """Send `send(matrix, rect, local_x, local_y, clipped)` to the panels
+        a rectangle overlaps, where `clipped` is the overlap in wall
+        coordinates."""
+        ports = [
+            port for port, rect in self.layout.items()
+            if _intersect(rect, (x, y, width, height))
+        ]
+        if not ports:
+            return True, "Nothing to draw"
+
+        def panel(matrix: MatrixDisplay, rect: Rect) -> Any:
+            clipped = _intersect(rect, (x, y, width, height))
+            return send(matrix, rect, clipped[0] - rect[0], clipped[1] - rect[1], clipped)
+
+        return self._fan_out(panel, ports)
+
+    def clear(self) -> Tuple[bool, str]:
+        """Clear every panel."""
+        return self._fan_out(lambda matrix, rect: matrix.clear())
+
+    def fill_screen(self, r: int, g: int, b: int) -> Tuple[bool, str]:
+        """Fill every panel with a color."""
+        return self._fan_out(lambda matrix, rect: matrix.fill_screen(r, g, b))
+
+    def set_brightness(self, brightness: int) -> Tuple[bool, str]:
+        """Set the brightness of every panel."""
+        return self._fan_out(lambda matrix, rect: matrix.set_brightness(brightness))
+
+    def ping(self, size: int = 8) -> Tuple[bool, str]:
+        """Check the link to every board."""
+        return self._fan_out(lambda matrix, rect: matrix.ping(size))
+
+    def draw_pixel(self, x: int, y: int, r: int, g: int, b: int) -> Tuple[bool, str]:
+        """Draw a single pixel."""
+        return self._clip(
+            x, y, 1, 1, lambda matrix, rect, lx, ly, _: matrix.draw_pixel(lx, ly, r, g, b)
+        )
+
+    def fill_rect(
+        self, x: int, y: int, width: int, height: int, r: int, g: int, b: int
+    ) -> Tuple[bool, str]:
+        """Fill a rectangle, split across the panels it covers."""
+        return self._clip(
+            x, y, width, height,
+            lambda matrix, rect, lx, ly, c: matrix.fill_rect(lx, ly, c[2], c[3], r, g, b),
+        )
+
+    def draw_fast_hline(
+        self, x: int, y: int, width: int, r: int, g: int, b: int
+    ) -> Tuple[bool, str]:
+        """Draw a horizontal line."""
+        return self._clip(
+            x, y, width, 1,
+            lambda matrix, rect, lx, ly, c: matrix.draw_fast_hline(lx, ly, c[2], r, g, b),
+        )
+
+    def draw_fast_vline(
+        self, x: int, y: int, height: int, r: int, g: int, b: int
+    ) -> Tuple[bool, str]:
+        """Draw a vertical line."""
+        return self._clip(
+            x, y, 1, height,
+            lambda matrix, rect, lx, ly, c: matrix.draw_fast_vline(lx, ly, c[3], r, g, b),
+        )
+
+    def draw_rect(
+        self, x: int, y: int, width: int, height: int, r: int, g: int, b: int
+    ) -> Tuple[bool, str]:
+        """Draw a rectangle outline; each panel draws the edges it shows."""
+        edges = [
+            (x, y, width, 1),
+            (x, y + height - 1, width, 1),
+            (x, y, 1, height),
+            (x + width - 1, y, 1, height),
+        ]
+
+        def panel(matrix: MatrixDisplay, rect: Rect) -> Any:
+            with matrix.batch() as batch:
+                for edge in edges:
+                    clipped = _intersect(rect, edge)
+                    if clipped is None:
+                        continue
+                    lx, ly, w, h = clipped[0] - rect[0], clipped[1] - rect[1], clipped[2], clipped[3]
+                    if h == 1:
+                        matrix.draw_fast_hline(lx, ly, w, r, g, b)
+                    else:
+                        matrix.draw_fast_vline(lx, ly, h, r, g, b)
+            return batch.success, batch.error_message or "OK"
+
+        ports = [
+            port for port, rect in self.layout.items()
+            if any(_intersect(rect, edge) for edge in edges)
+        ]
+        return self._fan_out(panel, ports)
+
+    def draw_line(
+        self, x0: int, y0: int, x1: int, y1: int, r: int, g: int, b: int
+    ) -> Tuple[bool, str]:
+        """Draw a line; each panel draws the part that crosses it.
+
+        The line is traced on the host. A panel holding all of it draws the
+        line itself; the others get the rows or columns of pixels the line
+        covers on them, since a line between a panel's first and last pixel
+        can take a different path than the whole line.
+        """
+        points = _line_points(x0, y0, x1, y1)
+        segments = {}
+        for port, (px, py, pw, ph) in self.layout.items():
+            inside = [
+                (x - px, y - py) for x, y in points
+                if px <= x < px + pw and py <= y < py + ph
+            ]
+            if inside:
+                segments[port] = inside
+
+        def panel(matrix: MatrixDisplay, rect: Rect) -> Any:
+            inside = segments[matrix.port]
+            if len(inside) == len(points):
+                (lx0, ly0), (lx1, ly1) = inside[0], inside[-1]
+                return matrix.draw_line(lx0, ly0, lx1, ly1, r, g, b)
+            with matrix.batch() as batch:
+                for lx, ly, w, h in _line_runs(inside):
+                    if h == 1:
+                        matrix.draw_fast_hline(lx, ly, w, r, g, b)
+                    else:
+                        matrix.draw_fast_vline(lx, ly, h, r, g, b)
+            return batch.success, batch.error_message or "OK"
+
+        if not segments:
+            return True, "Nothing to draw"
+        return self._fan_out(panel, list(segments))
+
+    def draw_bitmap(
+        self, x: int, y: int, width: int, height: int, bitmap_data: Any
+    ) -> Tuple[bool, str]:
+        """Draw a bitmap, sending each panel the part it shows.
+
+        Args:
+            x: X coordinate
+            y: Y coordinate
+            width: Bitmap width
+            height: Bitmap height
+            bitmap_data: RGB888 data (width * height * 3 bytes) as bytes-like
+                object, PIL image or NumPy array
+
+        Returns:
+            Tuple of (success, message)
+        """
+        expected_size = width * height * 3
+        data_size = rgb888_size(bitmap_data)
+        if data_size != expected_size:
+            raise ValueError(
+                f"Bitmap data size mismatch. Expected {expected_size} bytes, got {data_size}"
+            )
+        image = _as_image(bitmap_data, width, height)
+
+        def panel(matrix: MatrixDisplay, rect: Rect, lx: int, ly: int, c: Rect) -> Any:
+            crop = image.crop((c[0] - x, c[1] - y, c[0] - x + c[2], c[1] - y + c[3]))
+            return matrix.draw_bitmap(lx, ly, c[2], c[3], crop)
+
+        return self._clip(x, y, width, height, panel)
+
+    def push_frame(self, frame: Any) -> Tuple[bool, str]:
+        """Show a frame covering the whole wall, sending only what changed.
+
+        Every panel diffs its part of the frame against its own shadow
+        framebuffer (see MatrixDisplay.push_frame()). Requires a wall
+        created with `shadow=True`.
+
+        Args:
+            frame: RGB888 frame of the wall's size as bytes-like object, PIL
+                image or NumPy array
+
+        Returns:
+            Tuple of (success, message)
+        """
+        image = _as_image(frame, self.width, self.height)
+        if image.size != (self.width, self.height):
+            raise ValueError(
+                f"Frame size mismatch. Expected {self.width}x{self.height}, "
+                f"got {image.size[0]}x{image.size[1]}"
+            )
+
+        def panel(matrix: MatrixDisplay, rect: Rect) -> Any:
+            x, y, width, height = rect
+            return matrix.push_frame(image.crop((x, y, x + width, y + height)))
+
+        return self._fan_out(panel)
@@ -0,0 +1,42 @@
+"""
+Shared fixtures: firmware emulators for the clients to talk to.
+"""
+
+import itertools
+from typing import Callable, List
+import numpy as np
+import pytest
+from matrix_cli.emulator import FirmwareEmulator
+
+_names = itertools.count()
+
+
+@pytest.fixture
+def emulators() -> Callable[..., FirmwareEmulator]:
+    """Factory for emulators that deliver bytes at once and run commands in
+    no device time; further URL options (e.g. errors=0.002) are passed on.
+    Every emulator is stopped after the test."""
+    started: List[FirmwareEmulator] = []
+
+    def make(**options) -> FirmwareEmulator:
+        options = {"throttle": 0, "cost": 0, **options}
+        query = "&".join(f"{key}={value}" for key, value in options.items())
+        emulator = FirmwareEmulator.from_url(f"emulator://test{next(_names)}?{query}")
+        started.append(emulator)
+        return emulator
+
+    yield make
+    for emulator in started:
+        emulator.stop()
+
+
+@pytest.fixture
+def emulator(emulators) -> FirmwareEmulator:
+    """A single 64x64 emulator."""
+    return emulators()
+
+
+@pytest.fixture
+def rng() -> np.random.Generator:
+    """Random numbers that are the same in every run."""
+    return np.random.default_rng(1)
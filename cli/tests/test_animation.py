@@ -0,0 +1,59 @@
+import time
+import pytest
+from PIL import Image
+from matrix_cli.animation import Animation
+from matrix_cli.matrix import MatrixDisplay
+
+# Colors RGB565 keeps exactly
+COLORS = [(248, 0, 0), (0, 252, 0), (0, 0, 248)]
+
+
+def frames():
+    return [Image.new("RGB", (8, 8), color) for color in COLORS]
+
+
+def test_animation_loops_on_the_device(emulator):
+    with MatrixDisplay(emulator.url) as matrix:
+        animation = Animation.from_images(matrix, frames(), fps=50, x=10, y=10)
+        assert animation.duration == 60
+        assert animation.start()[0]
+        seen = set()
+        deadline = time.monotonic() + 5
+        while len(seen) < len(COLORS) and time.monotonic() < deadline:
+            seen.add(emulator.image().getpixel((12, 12)))
+            time.sleep(0.005)
+        assert seen == set(COLORS)
+        assert animation.stop(clear=True)[0]
+    assert emulator.image().getpixel((12, 12)) == (0, 0, 0)
+
+
+def test_animation_stops_on_its_last_frame(emulator):
+    with MatrixDisplay(emulator.url) as matrix:
+        animation = Animation.from_images(
+            matrix, frames(), fps=50, first_sprite=4, animation_id=2, x=10, y=10, loop=False
+        )
+        assert animation.frames == [(4, 20), (5, 20), (6, 20)]
+        assert animation.start()[0]
+        time.sleep(0.2)
+        assert emulator.image().getpixel((12, 12)) == COLORS[-1]
+
+        # Moving redraws the frame on screen at once
+        assert animation.move(40, 30)[0]
+        image = emulator.image()
+        assert image.getpixel((12, 12)) == (0, 0, 0)
+        assert image.getpixel((44, 34)) == COLORS[-1]
+
+
+def test_animation_limits(emulator):
+    with MatrixDisplay(emulator.url) as matrix:
+        with pytest.raises(ValueError):
+            Animation.from_images(matrix, [])
+        with pytest.raises(ValueError):
+            Animation.from_images(matrix, frames(), first_sprite=matrix.MAX_SPRITES - 2)
+        with pytest.raises(ValueError):
+            Animation(matrix, animation_id=matrix.MAX_ANIMATIONS)
+        animation = Animation(matrix)
+        for _ in range(matrix.MAX_ANIMATION_FRAMES):
+            animation.add_frame(0, 10)
+        with pytest.raises(ValueError):
+            animation.add_frame(0, 10)
@@ -0,0 +1,111 @@
+import asyncio
+import time
+import pytest
+from matrix_cli.async_matrix import AsyncMatrixDisplay
+from matrix_cli.matrix import MatrixDisplay
+
+
+def run(coroutine):
+    return asyncio.run(asyncio.wait_for(coroutine, 30))
+
+
+def test_concurrent_commands_match_sync_client(emulators, rng):
+    reference, emulator = emulators(), emulators()
+    image = rng.integers(0, 256, (16, 16, 3), dtype="uint8")
+    with MatrixDisplay(reference.url) as matrix:
+        for x in range(64):
+            matrix.draw_pixel(x, 0, 255, 0, 0)
+        matrix.draw_bitmap(8, 8, 16, 16, image)
+        matrix.set_sprite(0, 30, 30, 16, 16, image)
+
+    async def draw():
+        async with AsyncMatrixDisplay(emulator.serve_pty()) as matrix:
+            results = await asyncio.gather(
+                *(matrix.draw_pixel(x, 0, 255, 0, 0) for x in range(64)),
+                matrix.draw_bitmap(8, 8, 16, 16, image),
+                matrix.set_sprite(0, 30, 30, 16, 16, image),
+            )
+            assert all(success for success, _ in results)
+            assert (await matrix.query_sprites()).keys() == {0}
+
+    run(draw())
+    assert emulator.image().tobytes() == reference.image().tobytes()
+
+
+def test_batch_and_pipelined(emulators):
+    reference, emulator = emulators(), emulators()
+    with MatrixDisplay(reference.url) as matrix:
+        for x in range(64):
+            matrix.draw_pixel(x, 1, 0, 0, 255)
+            matrix.draw_pixel(x, 2, 9, 9, 9)
+
+    async def draw():
+        async with AsyncMatrixDisplay(emulator.serve_pty()) as matrix:
+            async with matrix.pipelined(window=4):
+                tasks = [await matrix.draw_pixel(x, 1, 0, 0, 255) for x in range(64)]
+            assert all(task.result()[0] for task in tasks)
+            async with matrix.batch() as batch:
+                for x in range(64):
+                    assert await matrix.draw_pixel(x, 2, 9, 9, 9) == (True, "Queued")
+            assert batch.success and len(batch.results) > 1
+
+    run(draw())
+    assert emulator.image().tobytes() == reference.image().tobytes()
+
+
+def test_set_baudrate(emulator):
+    async def switch():
+        async with AsyncMatrixDisplay(emulator.serve_pty()) as matrix:
+            assert await matrix.set_baudrate(921600) == (True, "Switched to 921600 baud")
+            assert matrix.baudrate == emulator.baud_rate == 921600
+            assert (await matrix.ping())[0]
+
+    run(switch())
+
+
+def test_lost_port_fails_pending_commands(emulator):
+    async def lose():
+        async with AsyncMatrixDisplay(emulator.serve_pty()) as matrix:
+            assert (await matrix.clear())[0]
+            emulator.stop()
+            for _ in range(100):
+                if not matrix.is_open:
+                    break
+                await asyncio.sleep(0.01)
+            assert not matrix.is_open
+            with pytest.raises(RuntimeError):
+                await matrix.clear()
+
+    run(lose())
+
+
+def test_rejected_upload_returns_device_message(emulator):
+    # Longer than the flow control window, so the client waits for credits
+    payload = bytes(8192)
+
+    async def upload():
+        async with AsyncMatrixDisplay(emulator.serve_pty()) as matrix:
+            rejected = [
+                (matrix.CMD_DRAW_BITMAP_INDEXED, [0, 0, 64, 64, 3, 0]),
+                (matrix.CMD_DRAW_BITMAP_RLE, [0, 0, 64]),
+            ]
+            for cmd, header in rejected:
+                started = time.monotonic()
+                result = await matrix._send_bitmap_with_flow_control(cmd, bytes(header), payload)
+                assert result == (False, "Invalid bitmap header")
+                assert time.monotonic() - started < 1
+                assert (await matrix.clear())[0]
+
+    run(upload())
+
+
+def test_timed_acks(emulator):
+    async def timed():
+        async with AsyncMatrixDisplay(emulator.serve_pty()) as matrix:
+            assert (await matrix.set_telemetry(reset=True))[0]
+            assert (await matrix.fill_rect(0, 0, 8, 8, 255, 0, 0))[0]
+            assert matrix.device_timing is not None
+            stats = await matrix.query_stats()
+            assert stats[matrix.CMD_FILL_RECT]["count"] == 1
+
+    run(timed())
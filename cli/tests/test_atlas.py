@@ -0,0 +1,46 @@
+import numpy as np
+import pytest
+from PIL import Image
+from matrix_cli.atlas import Atlas, pack_rects
+from matrix_cli.matrix import MatrixDisplay
+
+
+def test_pack_rects(rng):
+    sizes = [tuple(int(v) for v in size) for size in rng.integers(4, 40, (30, 2))]
+    width, height, positions = pack_rects(sizes)
+    atlas = np.zeros((height, width), dtype=int)
+    for (x, y), (w, h) in zip(positions, sizes):
+        atlas[y : y + h, x : x + w] += 1
+    # Every rectangle fits and none overlap
+    assert atlas.shape == (height, width) and atlas.max() == 1
+    assert atlas.sum() == sum(w * h for w, h in sizes)
+
+    with pytest.raises(ValueError):
+        pack_rects([(200, 200)] * 2)
+    with pytest.raises(ValueError):
+        pack_rects([])
+
+
+def test_atlas_frames_draw_like_bitmaps(emulators, rng):
+    reference, emulator = emulators(), emulators()
+    frames = [
+        Image.fromarray(rng.integers(0, 256, (h, w, 3), dtype=np.uint8))
+        for w, h in [(16, 16), (8, 24), (20, 10)]
+    ]
+    atlas = Atlas(frames + frames[:1])
+    # The repeated frame is stored once
+    assert len(atlas) == 4 and atlas.frames[3] == atlas.frames[0]
+    with pytest.raises(RuntimeError):
+        atlas.draw(0, 0, 0)
+
+    positions = [(0, 0), (20, 4), (30, 30), (40, 0)]
+    with MatrixDisplay(reference.url) as matrix:
+        for frame, (x, y) in zip(frames + frames[:1], positions):
+            assert matrix.draw_bitmap(x, y, frame.width, frame.height, frame)[0]
+    with MatrixDisplay(emulator.url) as matrix:
+        assert atlas.upload(matrix, 3)[0]
+        with matrix.batch() as batch:
+            for frame, (x, y) in enumerate(positions):
+                assert atlas.draw(frame, x, y) == (True, "Queued")
+        assert batch.success
+    assert emulator.image().tobytes() == reference.image().tobytes()
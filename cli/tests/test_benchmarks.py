@@ -0,0 +1,52 @@
+import json
+from click.testing import CliRunner
+from matrix_cli.benchmarks import compare_results, load_results, save_results
+from matrix_cli.cli import cli
+
+
+def test_compare_results():
+    baseline = {"a.cmds_per_s": 100.0, "b.p50_ms": 10.0, "c.p95_ms": 10.0, "d.only_old": 1.0}
+    current = {"a.cmds_per_s": 80.0, "b.p50_ms": 9.0, "c.p95_ms": 20.0, "e.only_new": 1.0}
+    rows = {
+        name: (change, regressed)
+        for name, _, _, change, regressed in compare_results(baseline, current, 0.1)
+    }
+    assert rows.keys() == {"a.cmds_per_s", "b.p50_ms", "c.p95_ms"}
+    assert rows["a.cmds_per_s"] == (-0.2, True)
+    # Lower latency is better
+    assert rows["b.p50_ms"][0] > 0 and not rows["b.p50_ms"][1]
+    # Tail latency is reported but never fails the gate
+    assert rows["c.p95_ms"] == (-1.0, False)
+
+
+def test_results_round_trip(tmp_path):
+    path = str(tmp_path / "results.json")
+    save_results(path, {"a.cmds_per_s": 1.5}, port="emulator://x")
+    assert load_results(path) == {"a.cmds_per_s": 1.5}
+    assert json.loads((tmp_path / "results.json").read_text())["port"] == "emulator://x"
+
+
+def test_suite_compare_gate(emulator, tmp_path):
+    port = emulator.url
+    current = str(tmp_path / "current.json")
+    result = CliRunner().invoke(cli, ["--port", port, "bench", "suite", "--quick", "-o", current])
+    assert result.exit_code == 0, result.output
+    metrics = load_results(current)
+
+    def baseline(factor):
+        """A baseline `factor` times as fast as the current run."""
+        path = str(tmp_path / f"baseline{factor}.json")
+        scaled = {
+            name: value / factor if name.endswith("_ms") else value * factor
+            for name, value in metrics.items()
+        }
+        save_results(path, scaled)
+        return path
+
+    suite = ["--port", port, "bench", "suite", "--quick", "--compare"]
+    slower = CliRunner().invoke(cli, suite + [baseline(0.1)])
+    assert slower.exit_code == 0, slower.output
+    assert "No regressions" in slower.output
+    faster = CliRunner().invoke(cli, suite + [baseline(10)])
+    assert faster.exit_code == 1
+    assert "regressed" in faster.output
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+from matrix_cli.codec import (
+    indexed_to_rgb565,
+    rgb565_rle_decode,
+    rgb565_rle_encode,
+    rgb565_rle_size,
+    rgb888_to_indexed,
+    rgb888_to_rgb565,
+)
+from matrix_cli.matrix import MatrixDisplay
+
+
+def striped(rng, width, height, colors):
+    """RGB888 image of horizontal runs drawn from `colors` random colors."""
+    palette = rng.integers(0, 256, (colors, 3), dtype=np.uint8)
+    runs = rng.integers(0, colors, height * width // 8)
+    return np.repeat(palette[runs], 8, axis=0).reshape(height, width, 3)
+
+
+@pytest.mark.parametrize("use_numpy", [False, True])
+def test_rle_round_trip(rng, use_numpy):
+    data = rgb888_to_rgb565(striped(rng, 64, 64, 5))
+    encoded = rgb565_rle_encode(data, use_numpy)
+    assert len(encoded) == rgb565_rle_size(data, use_numpy) < len(data)
+    assert rgb565_rle_decode(encoded) == data
+
+
+def test_rle_long_runs_round_trip():
+    data = bytes([0x12, 0x34]) * 1000 + bytes([0xAB, 0xCD])
+    assert rgb565_rle_decode(rgb565_rle_encode(data)) == data
+
+
+@pytest.mark.parametrize("bpp", [1, 2, 4, 8])
+def test_indexed_round_trip_keeps_colors(rng, bpp):
+    image = striped(rng, 32, 16, 1 << bpp)
+    used_bpp, palette, indices = rgb888_to_indexed(image, 32, 16, bpp)
+    assert used_bpp == bpp
+    assert indexed_to_rgb565(palette, indices, bpp, 32 * 16) == rgb888_to_rgb565(image)
+
+
+def test_indexed_quantizes_to_palette_size(rng):
+    image = rng.integers(0, 256, (16, 16, 3), dtype=np.uint8)
+    bpp, palette, indices = rgb888_to_indexed(image, 16, 16, 2)
+    assert bpp == 2 and len(palette) <= 4 * 2
+    assert len(indexed_to_rgb565(palette, indices, 2, 256)) == 256 * 2
+
+
+def test_rle_and_indexed_bitmaps_draw_like_raw(emulators, rng):
+    raw, encoded = emulators(), emulators()
+    image = striped(rng, 64, 64, 4)
+    with MatrixDisplay(raw.url, rle=False) as plain, MatrixDisplay(encoded.url) as matrix:
+        cmd, _, _ = matrix._bitmap_command(bytes(4), rgb888_to_rgb565(image))
+        assert cmd == MatrixDisplay.CMD_DRAW_BITMAP_RLE
+        assert plain.draw_bitmap(0, 0, 64, 64, image)[0]
+        assert matrix.draw_bitmap(0, 0, 64, 64, image)[0]
+        assert encoded.image().tobytes() == raw.image().tobytes()
+
+        assert matrix.clear()[0]
+        assert matrix.draw_bitmap_indexed(0, 0, 64, 64, image, 2)[0]
+        assert encoded.image().tobytes() == raw.image().tobytes()
@@ -0,0 +1,42 @@
+import numpy as np
+from matrix_cli.framing import FRAMED_START_BYTE, NAK_BYTE, crc16, framed_packet
+from matrix_cli.matrix import MatrixDisplay
+
+
+def draw_scene(matrix, rng):
+    """Bitmaps, sprites and rectangles; returns whether all succeeded."""
+    results = []
+    for i in range(6):
+        width, height = rng.integers(8, 65, 2)
+        image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        results.append(matrix.draw_bitmap(0, 0, int(width), int(height), image))
+        results.append(matrix.set_sprite(i, 3, 3, int(width), int(height), image))
+        results.append(matrix.draw_bitmap_indexed(0, 0, int(width), int(height), image, 4))
+        for _ in range(10):
+            x, y = rng.integers(0, 64, 2)
+            results.append(matrix.fill_rect(int(x), int(y), 5, 5, i, 2 * i, 3 * i))
+    return [result for result in results if not result[0]]
+
+
+def test_framed_commands_survive_bit_errors(emulators):
+    reference, noisy = emulators(), emulators(errors=0.002, baud=921600)
+    with MatrixDisplay(reference.url) as matrix:
+        assert draw_scene(matrix, np.random.default_rng(3)) == []
+    with MatrixDisplay(noisy.url, 921600, framing=2) as matrix:
+        assert draw_scene(matrix, np.random.default_rng(3)) == []
+    assert noisy.image().tobytes() == reference.image().tobytes()
+
+
+def test_corrupted_length_is_nacked_before_data(emulator):
+    with MatrixDisplay(emulator.url, framing=2) as matrix:
+        assert matrix.clear()[0]
+        packet = bytearray(
+            framed_packet(7, MatrixDisplay.CMD_FILL_RECT, bytes([0, 0, 64, 64, 255, 0, 0]))
+        )
+        packet[4] ^= 0x10  # LEN
+        matrix._ser.write(packet)
+        nak = bytes([NAK_BYTE, 7])
+        expected = bytes([FRAMED_START_BYTE]) + nak + crc16(nak).to_bytes(2, "big")
+        assert matrix._ser.read(5) == expected
+        assert matrix.draw_pixel(1, 1, 0, 0, 255)[0]
+    assert emulator.image().getpixel((30, 30)) == (0, 0, 0)
@@ -0,0 +1,119 @@
+import numpy as np
+import pytest
+from matrix_cli.emulator import EmulatorSerial
+from matrix_cli.matrix import MatrixDisplay
+
+
+def test_commands_are_acknowledged(emulator):
+    with MatrixDisplay(emulator.url) as matrix:
+        assert matrix.clear() == (True, "Screen cleared")
+        assert matrix.fill_rect(0, 0, 8, 8, 255, 0, 0)[0]
+        success, message = matrix.ping(32)
+        assert success and len(message) == 32
+    assert emulator.image().getpixel((7, 7)) == (248, 0, 0)
+    assert emulator.image().getpixel((8, 8)) == (0, 0, 0)
+
+
+def test_pipelined_and_batched_commands(emulators):
+    reference, emulator = emulators(), emulators()
+    with MatrixDisplay(reference.url) as plain, MatrixDisplay(emulator.url) as matrix:
+        for x in range(64):
+            plain.draw_pixel(x, x, 0, 255, 0)
+        with matrix.pipelined(window=8):
+            futures = [matrix.draw_pixel(x, x, 0, 255, 0) for x in range(32)]
+            with matrix.batch() as batch:
+                for x in range(32, 64):
+                    assert matrix.draw_pixel(x, x, 0, 255, 0) == (True, "Queued")
+        assert all(future.result()[0] for future in futures)
+        assert batch.success
+    assert emulator.image().tobytes() == reference.image().tobytes()
+
+
+def test_push_frame_clips_to_panel(emulators, rng):
+    reference, emulator = emulators(), emulators()
+    frame = rng.integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    with MatrixDisplay(reference.url) as plain, MatrixDisplay(emulator.url, shadow=True) as matrix:
+        assert plain.draw_bitmap(10, 10, 64, 64, frame)[0]
+        assert matrix.push_frame(frame, 10, 10) == (True, "Updated 1 regions")
+        assert matrix.push_frame(frame, 10, 10) == (True, "Frame unchanged")
+        assert matrix.push_frame(frame, 70, 0) == (True, "Frame unchanged")
+    assert emulator.image().tobytes() == reference.image().tobytes()
+
+
+def test_rejected_bitmap_payload_is_not_executed(emulator):
+    # A payload made of valid packets, which must not run as commands
+    payload = bytes([0xAA, MatrixDisplay.CMD_FILL_RECT, 7, 0, 0, 64, 64, 255, 0, 0]) * 100
+    with MatrixDisplay(emulator.url) as matrix:
+        rejected = [
+            (MatrixDisplay.CMD_DRAW_BITMAP_INDEXED, [0, 0, 8, 8, 3, 0], "Invalid bitmap header"),
+            (MatrixDisplay.CMD_SET_SPRITE_INDEXED, [1, 0, 0, 8, 8, 3, 0], "Invalid palette format"),
+        ]
+        for cmd, header, message in rejected:
+            header = bytes(header)
+            assert matrix._send_bitmap_with_flow_control(cmd, header, payload) == (False, message)
+            assert matrix.draw_pixel(1, 1, 0, 0, 255)[0]
+    assert emulator.image().getpixel((30, 30)) == (0, 0, 0)
+
+
+def test_flow_control_negotiation(emulator):
+    with MatrixDisplay(emulator.url, flow_window=1024) as matrix:
+        assert matrix.flow_control == (128, 8)
+        assert matrix.rx_buffer_size == 4096
+    # The device grants at most its receive buffer
+    with MatrixDisplay(emulator.url, flow_window=1 << 20) as matrix:
+        assert matrix.flow_control == (128, 32)
+        assert matrix.draw_bitmap(0, 0, 64, 64, bytes(64 * 64 * 3))[0]
+    # Older firmware
+    matrix = MatrixDisplay(emulator.url)
+    assert matrix._parse_flow_reply(True, "chunk=64 credits=2") == (64, 2, 256)
+    assert matrix._parse_flow_reply(False, "Unknown command") == (128, 1, 256)
+
+
+def test_set_baudrate(emulator):
+    with MatrixDisplay(emulator.url) as matrix:
+        assert matrix.set_baudrate(921600) == (True, "Switched to 921600 baud")
+        assert matrix.set_baudrate(921600) == (True, "Already at 921600 baud")
+        assert matrix.baudrate == emulator.baud_rate == 921600
+        assert matrix.fill_rect(0, 0, 8, 8, 255, 0, 0)[0]
+        with pytest.raises(ValueError):
+            matrix.set_baudrate(9000000)
+    assert emulator.image().getpixel((7, 7)) == (248, 0, 0)
+
+
+def test_probe_baudrate_skips_unusable_rates(emulator, monkeypatch):
+    def reconfigure(port, *args):
+        if port.baudrate == 2000000:
+            raise ValueError("Unsupported baud rate")
+
+    # A host adapter that cannot do 2 Mbaud
+    monkeypatch.setattr(EmulatorSerial, "_reconfigure_port", reconfigure)
+    with MatrixDisplay(emulator.url) as matrix:
+        assert matrix.probe_baudrate((115200, 921600, 2000000), pings=2) == 921600
+        assert matrix.baudrate == emulator.baud_rate == 921600
+        assert matrix.ping()[0]
+
+
+def test_sprite_uploads_are_skipped_when_cached(emulators, rng):
+    reference, emulator = emulators(), emulators()
+    image, other = rng.integers(0, 256, (2, 16, 16, 3), dtype=np.uint8)
+    with MatrixDisplay(reference.url) as matrix:
+        assert matrix.set_sprite(0, 8, 8, 16, 16, image)[0]
+        assert matrix.draw_sprite(0, 8, 8)[0]
+
+    with MatrixDisplay(emulator.url) as matrix, MatrixDisplay(emulator.url) as second:
+        assert matrix.set_sprite(0, 0, 0, 16, 16, image) == (True, "Sprite set")
+        assert matrix.set_sprite(0, 8, 8, 16, 16, image) == (True, "Sprite unchanged")
+        assert matrix.find_sprite(16, 16, image) == 0
+
+        # Another client changed the slot, so the device refuses the reuse
+        assert second.set_sprite(0, 0, 0, 16, 16, other) == (True, "Sprite set")
+        assert matrix.set_sprite(0, 8, 8, 16, 16, image) == (True, "Sprite set")
+        # Slots set by an earlier client are found once queried
+        assert second.find_sprite(16, 16, image) is None
+        assert second.query_sprites()[0][1:] == (16, 16, 16)
+        assert second.find_sprite(16, 16, image) == 0
+
+    with MatrixDisplay(emulator.url, sprite_cache=False) as matrix:
+        assert matrix.set_sprite(0, 8, 8, 16, 16, image) == (True, "Sprite set")
+        assert matrix.draw_sprite(0, 8, 8)[0]
+    assert emulator.image().tobytes() == reference.image().tobytes()
@@ -0,0 +1,97 @@
+import urllib.error
+import urllib.request
+import pytest
+from matrix_cli.matrix import MatrixDisplay
+from matrix_cli.metrics import Histogram, MetricsRegistry
+
+
+def test_histogram_quantiles():
+    histogram = Histogram((1.0, 2.0, 4.0))
+    assert histogram.quantile(0.5) == 0.0
+    for value in (0.5, 1.5, 1.5, 3.0):
+        histogram.observe(value)
+    assert histogram.counts == [1, 2, 1, 0]
+    assert histogram.quantile(0.5) == 1.5
+    assert histogram.quantile(1.0) == 4.0
+    # Above the last bound
+    histogram.observe(100.0)
+    assert histogram.quantile(1.0) == 4.0
+    assert (histogram.count, histogram.sum) == (5, 106.5)
+
+
+def test_commands_are_recorded(emulator):
+    metrics = MetricsRegistry()
+    with MatrixDisplay(emulator.url, rle=False, metrics=metrics) as matrix:
+        assert matrix.clear()[0]
+        assert matrix.fill_rect(0, 0, 4, 4, 1, 2, 3)[0]
+        assert matrix.fill_rect(4, 4, 4, 4, 1, 2, 3)[0]
+        assert not matrix.draw_sprite(5, 0, 0)[0]
+        assert matrix.draw_bitmap(0, 0, 64, 64, bytes(64 * 64 * 3))[0]
+
+    snapshot = metrics.snapshot()
+    assert snapshot["clear"]["bytes_written"] == 3
+    fill = snapshot["fill_rect"]
+    assert (fill["count"], fill["bytes_written"], fill["failures"]) == (2, 20, 0)
+    assert 0 < fill["latency_p50"] <= fill["latency_p99"]
+    assert (snapshot["draw_sprite"]["failures"], snapshot["draw_sprite"]["timeouts"]) == (1, 0)
+    # The payload, and the credits read on top of the ACK
+    bitmap = snapshot["draw_bitmap"]
+    assert bitmap["bytes_written"] == 7 + 64 * 64 * 2
+    assert bitmap["bytes_read"] > snapshot["clear"]["bytes_read"]
+
+    metrics.reset()
+    assert metrics.snapshot() == {}
+
+
+def test_prometheus_endpoint(emulator):
+    metrics = MetricsRegistry()
+    with MatrixDisplay(emulator.url, metrics=metrics) as matrix:
+        assert matrix.clear()[0]
+    text = metrics.prometheus()
+    assert "# TYPE matrix_commands_total counter" in text
+    assert 'matrix_commands_total{command="clear"} 1' in text
+    assert 'matrix_ack_latency_seconds_bucket{command="clear",le="+Inf"} 1' in text
+
+    server = metrics.serve(0, "127.0.0.1")
+    try:
+        url = f"http://127.0.0.1:{server.server_address[1]}"
+        with urllib.request.urlopen(url + "/metrics") as response:
+            assert response.read().decode() == text
+        with pytest.raises(urllib.error.HTTPError):
+            urllib.request.urlopen(url + "/other")
+    finally:
+        server.shutdown()
+        server.server_close()
+
+
+def test_device_timing(emulators):
+    # Commands take device time
+    emulator = emulators(cost=1)
+    metrics = MetricsRegistry()
+    with MatrixDisplay(emulator.url, metrics=metrics) as matrix:
+        assert matrix.set_telemetry(reset=True) == (True, "Telemetry on")
+        assert matrix.query_stats().keys() == {matrix.CMD_SET_TELEMETRY}
+        assert matrix.fill_rect(0, 0, 64, 64, 1, 2, 3)[0]
+        receive, render = matrix.device_timing
+        assert render > 0
+        assert not matrix.draw_sprite(5, 0, 0)[0]
+
+        stats = matrix.query_stats()
+        fill = stats[matrix.CMD_FILL_RECT]
+        assert (fill["count"], fill["failures"]) == (1, 0)
+        assert (fill["receive"], fill["render"]) == (round(receive * 1e6), round(render * 1e6))
+        assert fill["max"] == fill["receive"] + fill["render"]
+        sprite = stats[matrix.CMD_DRAW_SPRITE]
+        assert (sprite["count"], sprite["failures"]) == (1, 1)
+
+        assert matrix.set_telemetry(False)[0]
+        assert matrix.clear()[0]
+
+    snapshot = metrics.snapshot()
+    assert snapshot["fill_rect"]["device_count"] == 1
+    assert snapshot["fill_rect"]["device_render_time"] == render
+    assert snapshot["fill_rect"]["other_time"] >= 0
+    # Untimed ACKs once telemetry is off
+    assert "device_count" not in snapshot["clear"]
+    line = f'matrix_device_render_seconds_total{{command="fill_rect"}} {render}'
+    assert line in metrics.prometheus()
@@ -0,0 +1,61 @@
+import io
+import time
+import numpy as np
+from matrix_cli.matrix import MatrixDisplay
+from matrix_cli.player import FramePlayer, raw_rgb_frames
+
+
+class TrickleStream(io.RawIOBase):
+    """A pipe that returns at most 100 bytes per read."""
+
+    def __init__(self, data: bytes):
+        self.data = io.BytesIO(data)
+
+    def read(self, size=-1):
+        return self.data.read(min(size, 100))
+
+
+class SlowDisplay:
+    """A display whose link takes `delay` seconds per frame."""
+
+    width = height = 64
+    shadow = None
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def draw_bitmap_rgb565(self, *args):
+        time.sleep(self.delay)
+        return True, "Bitmap drawn"
+
+
+def test_raw_frames_survive_short_reads():
+    frames = [bytes([i]) * 8 * 8 * 3 for i in range(3)]
+    # A trailing partial frame is dropped
+    stream = TrickleStream(b"".join(frames) + bytes(10))
+    assert list(raw_rgb_frames(stream, 8, 8)) == frames
+
+
+def test_frames_are_shown(emulators, rng):
+    reference, emulator = emulators(), emulators()
+    frames = [rng.integers(0, 256, (32, 32, 3), dtype=np.uint8) for _ in range(5)]
+    with MatrixDisplay(reference.url) as matrix:
+        assert matrix.draw_bitmap(16, 8, 32, 32, frames[-1])[0]
+    with MatrixDisplay(emulator.url) as matrix:
+        stats = FramePlayer(matrix, fps=100, x=16, y=8, width=32, height=32).play(frames)
+    assert (stats.frames_shown, stats.frames_dropped, stats.frames_failed) == (5, 0, 0)
+    assert emulator.image().tobytes() == reference.image().tobytes()
+
+
+def test_slow_link_drops_frames_instead_of_drifting():
+    # Each frame takes 2.5 frame periods to send
+    player = FramePlayer(SlowDisplay(0.05), fps=50)
+    frames = [bytes(64 * 64 * 3)] * 30
+    started = time.perf_counter()
+    stats = player.play(frames)
+    elapsed = time.perf_counter() - started
+    assert stats.frames_shown + stats.frames_dropped == 30
+    assert 0 < stats.frames_shown < 15
+    # 30 periods, plus the last frame running over its slot
+    assert elapsed < 30 / 50 + 0.2
+    assert stats.link_utilization > 0.8
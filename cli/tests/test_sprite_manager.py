@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+from matrix_cli.matrix import MatrixDisplay
+from matrix_cli.sprite_manager import LFU, SpriteManager
+
+
+def images(rng, count):
+    return [rng.integers(0, 256, (8, 8, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def test_first_draw_keeps_the_screen(emulator, rng):
+    with MatrixDisplay(emulator.url) as matrix:
+        assert matrix.fill_screen(255, 0, 0)[0]
+        manager = SpriteManager(matrix, slots=range(2))
+        first, second = (manager.add(8, 8, image) for image in images(rng, 2))
+        assert manager.prefetch([second]) == 1
+        assert manager.draw(first, 30, 30)[0]
+        assert manager.draw(second, 40, 40)[0]
+        assert manager.move(first, 50, 30)[0]
+    image = emulator.image()
+    assert image.getpixel((0, 0)) == (255, 0, 0)
+    # The move cleared where the sprite was
+    assert image.getpixel((30, 30)) == (0, 0, 0)
+    assert image.getpixel((49, 30)) == (255, 0, 0)
+
+
+def test_eviction_policies(emulator, rng):
+    with MatrixDisplay(emulator.url) as matrix:
+        manager = SpriteManager(matrix, slots=range(2))
+        a, b, c = (manager.add(8, 8, image) for image in images(rng, 3))
+        for handle in (a, a, b, c):
+            assert manager.draw(handle, 0, 0)[0]
+        # a was used least recently
+        assert sorted(manager.resident) == [b, c]
+        stats = manager.stats
+        assert (stats.hits, stats.misses, stats.evictions, stats.uploads) == (1, 3, 1, 3)
+
+        manager = SpriteManager(matrix, slots=range(2, 4), policy=LFU)
+        a, b, c = (manager.add(8, 8, image) for image in images(rng, 3))
+        for handle in (a, a, b, c):
+            assert manager.draw(handle, 0, 0)[0]
+        # b was used least often
+        assert sorted(manager.resident) == [a, c]
+
+
+def test_stats_count_successful_uploads(emulator, rng):
+    image = images(rng, 1)[0]
+    with MatrixDisplay(emulator.url) as matrix:
+        manager = SpriteManager(matrix, slots=[0])
+        handle = manager.add(8, 8, image)
+        assert manager.draw(handle, 0, 0)[0]
+        with pytest.raises(ValueError):
+            manager.add(8, 8, bytes(10))
+
+        # Slot 0 already holds the image
+        manager = SpriteManager(matrix, slots=[0, 1])
+        handle = manager.add(8, 8, image)
+        assert manager.draw(handle, 0, 0)[0]
+        assert manager.slot_of(handle) == 0
+        assert (manager.stats.uploads, manager.stats.reuses) == (0, 1)
+
+        # Leave too little sprite memory for the next sprite
+        assert matrix.set_sprite(5, 0, 0, 255, 255, bytes(255 * 255 * 3))[0]
+        manager.remove(handle)
+        handle = manager.add(16, 32, bytes(16 * 32 * 3))
+        assert manager.draw(handle, 0, 0) == (False, "Sprite too large")
+        assert (manager.stats.uploads, manager.stats.reuses) == (0, 1)
@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+from matrix_cli.matrix import MatrixDisplay
+from matrix_cli.wall import MatrixWall, parse_panel
+
+
+def test_parse_panel():
+    assert parse_panel("/dev/ttyUSB1=64,0") == ("/dev/ttyUSB1", (64, 0, 64, 64))
+    assert parse_panel("emulator://a?throttle=0=0,32,64x32") == (
+        "emulator://a?throttle=0",
+        (0, 32, 64, 32),
+    )
+    with pytest.raises(ValueError):
+        parse_panel("/dev/ttyUSB1")
+
+
+def test_drawing_spans_panels(emulators, rng):
+    reference = emulators(width=128)
+    left, right = emulators(), emulators()
+    image = rng.integers(0, 256, (40, 48, 3), dtype=np.uint8)
+    with MatrixDisplay(reference.url, width=128) as matrix:
+        assert matrix.draw_bitmap(40, 10, 48, 40, image)[0]
+        assert matrix.fill_rect(50, 0, 30, 8, 255, 0, 0)[0]
+        assert matrix.draw_line(0, 63, 127, 0, 0, 255, 0)[0]
+
+    with MatrixWall({left.url: (0, 0, 64, 64), right.url: (64, 0, 64, 64)}) as wall:
+        assert (wall.width, wall.height) == (128, 64)
+        assert wall.draw_bitmap(40, 10, 48, 40, image)[0]
+        assert wall.fill_rect(50, 0, 30, 8, 255, 0, 0)[0]
+        assert wall.draw_line(0, 63, 127, 0, 0, 255, 0)[0]
+
+    expected = np.asarray(reference.image())
+    assert np.array_equal(np.asarray(left.image()), expected[:, :64])
+    assert np.array_equal(np.asarray(right.image()), expected[:, 64:])
+
+
+def test_lines_have_no_kinks_at_seams(emulators, rng):
+    reference = emulators(width=128)
+    left, right = emulators(), emulators()
+    lines = [(0, 0, 127, 5), (60, 0, 70, 63), (127, 10, 3, 50)]
+    lines += [tuple(int(v) for v in rng.integers(0, (128, 64), (2, 2)).ravel()) for _ in range(20)]
+    with MatrixDisplay(reference.url, width=128) as matrix:
+        for x0, y0, x1, y1 in lines:
+            assert matrix.draw_line(x0, y0, x1, y1, 255, 255, 0)[0]
+
+    with MatrixWall({left.url: (0, 0, 64, 64), right.url: (64, 0, 64, 64)}) as wall:
+        for x0, y0, x1, y1 in lines:
+            assert wall.draw_line(x0, y0, x1, y1, 255, 255, 0)[0]
+
+    expected = np.asarray(reference.image())
+    assert np.array_equal(np.asarray(left.image()), expected[:, :64])
+    assert np.array_equal(np.asarray(right.image()), expected[:, 64:])
@@ -1,13 +1,14 @@
 #pragma once
 
 #include <SDL.h>
+#include <vector>
 #include "Adafruit_GFX.h"
 
 class SimMatrixPanel : public Adafruit_GFX {
 public:
     SimMatrixPanel(uint16_t width, uint16_t height);
     ~SimMatrixPanel();
-    void begin();
+    void begin(bool headless = false); // Headless: no window, only the framebuffer
     void clearScreen();
     void setBrightness8(uint8_t brightness);
     void fillScreen(uint16_t color);
@@ -21,15 +22,22 @@ public:
     void fillRect(int16_t x, int16_t y, int16_t w, int16_t h, uint16_t color);
     void drawFastVLine(int16_t x, int16_t y, int16_t h, uint16_t color);
     void drawFastHLine(int16_t x, int16_t y, int16_t w, uint16_t color);
+    using Adafruit_GFX::drawRGBBitmap;
+    void drawRGBBitmap(int16_t x, int16_t y, uint16_t *bitmap, int16_t w, int16_t h);
     void setCursor(int16_t x, int16_t y);
     size_t print(const char* text);
     void present();
+    bool savePPM(const char* path); // Write the panel contents as a binary PPM
 
 private:
     SDL_Window* window = nullptr;
     SDL_Renderer* renderer = nullptr;
-    SDL_Texture* canvas = nullptr;
+    SDL_Texture* canvas = nullptr; // Streaming copy of the framebuffer
+    bool headless = false;
+    std::vector<uint8_t> framebuffer; // RGB888, row-major; all drawing goes here
+    bool dirty = true;                // Framebuffer changed since the last present()
     static const int scale = 10;
+    uint8_t* pixelAt(int x, int y) { return &framebuffer[(y * _width + x) * 3]; }
 };
 
 #define MatrixPanel_I2S_DMA SimMatrixPanel
\ No newline at end of file
@@ -4,12 +4,16 @@
 
 class SimSerialClass {
 public:
-    bool begin(unsigned long) { return true; }
+    bool begin(unsigned long baud) { baud_rate = baud; return true; }
+    void updateBaudRate(unsigned long baud) { baud_rate = baud; } // A PTY has no line rate
     int available();
+    bool waitForData(unsigned long timeout_ms); // Block until input arrives or the timeout passes
     int read();
     size_t write(uint8_t b);
     size_t write(const char* message, uint8_t msgLen);
-    size_t readBytes(uint8_t* buffer, uint8_t len);
+    size_t write(const uint8_t* buffer, size_t len);
+    size_t readBytes(uint8_t* buffer, size_t len);
+    void setTimeout(unsigned long timeout_ms) { timeout = timeout_ms; }
     void flush();
     void println(const char* s);
     void print(const char* s);
@@ -21,5 +25,7 @@ private:
     int slave_fd = -1;
     char peek_buffer[256]; // Buffer for peeked bytes
     int peek_count = 0;    // Number of bytes in peek buffer
+    unsigned long timeout = 1000; // readBytes() timeout in ms, as in Arduino's Stream
+    unsigned long baud_rate = 0;
 };
 extern SimSerialClass Serial;
@@ -1,8 +1,9 @@
 #ifdef SIMULATOR
 #include "SimMatrixPanel.h"
+#include <stdio.h>
 
 SimMatrixPanel::SimMatrixPanel(uint16_t width, uint16_t height)
-: Adafruit_GFX(width, height) {
+: Adafruit_GFX(width, height), framebuffer(width * height * 3, 0) {
     // Initialize member variables explicitly
     window = nullptr;
     renderer = nullptr;
@@ -25,7 +26,14 @@ SimMatrixPanel::~SimMatrixPanel() {
     SDL_Quit();
 }
 
-void SimMatrixPanel::begin() {
+void SimMatrixPanel::begin(bool headless) {
+    this->headless = headless;
+    if (headless) {
+        // Drawing only touches the framebuffer, so no SDL is needed at all
+        printf("Rendering headless at %dx%d\n", _width, _height);
+        return;
+    }
+
     SDL_Init(SDL_INIT_VIDEO);
     
     // Debug output to see what dimensions we're working with
@@ -35,19 +43,11 @@ void SimMatrixPanel::begin() {
     window = SDL_CreateWindow("WFx LED Panel Simulator", SDL_WINDOWPOS_CENTERED, SDL_WINDOWPOS_CENTERED, _width * scale, _height * scale, 0);
     renderer = SDL_CreateRenderer(window, -1, SDL_RENDERER_ACCELERATED);
     
-    // Create canvas texture at native resolution
-    canvas = SDL_CreateTexture(renderer, SDL_PIXELFORMAT_RGBA8888, SDL_TEXTUREACCESS_TARGET, _width, _height);
-    
-    // Set render target to canvas
-    SDL_SetRenderTarget(renderer, canvas);
-    SDL_SetRenderDrawColor(renderer, 0, 0, 0, 255);
-    SDL_RenderClear(renderer);
-    
-    // Reset render target to default
-    SDL_SetRenderTarget(renderer, nullptr);
+    // The framebuffer is uploaded into this texture once per present()
+    canvas = SDL_CreateTexture(renderer, SDL_PIXELFORMAT_RGB24, SDL_TEXTUREACCESS_STREAMING, _width, _height);
     
     // Initial present
-    SDL_RenderPresent(renderer);
+    present();
 }
 
 void SimMatrixPanel::clearScreen() {
@@ -63,10 +63,12 @@ void SimMatrixPanel::fillScreen(uint16_t color) {
 }
 
 void SimMatrixPanel::fillScreenRGB888(uint8_t r, uint8_t g, uint8_t b) {
-    SDL_SetRenderTarget(renderer, canvas);
-    SDL_SetRenderDrawColor(renderer, r, g, b, 255);
-    SDL_RenderClear(renderer);
-    SDL_SetRenderTarget(renderer, nullptr);
+    for (size_t i = 0; i < framebuffer.size(); i += 3) {
+        framebuffer[i] = r;
+        framebuffer[i + 1] = g;
+        framebuffer[i + 2] = b;
+    }
+    dirty = true;
 }
 
 uint16_t SimMatrixPanel::color565(uint8_t r, uint8_t g, uint8_t b) {
@@ -95,60 +97,76 @@ void SimMatrixPanel::drawPixel(int16_t x, int16_t y, uint16_t color) {
 
 void SimMatrixPanel::drawPixelRGB888(int16_t x, int16_t y, uint8_t r, uint8_t g, uint8_t b) {
     if (x < 0 || y < 0 || x >= _width || y >= _height) return;
-    SDL_SetRenderTarget(renderer, canvas);
-    SDL_SetRenderDrawColor(renderer, r, g, b, 255);
-    SDL_Rect rect = { x, y, 1, 1 };
-    SDL_RenderFillRect(renderer, &rect);
-    SDL_SetRenderTarget(renderer, nullptr);
+    uint8_t* pixel = pixelAt(x, y);
+    pixel[0] = r;
+    pixel[1] = g;
+    pixel[2] = b;
+    dirty = true;
 }
 
 void SimMatrixPanel::drawLine(int16_t x0, int16_t y0, int16_t x1, int16_t y1, uint16_t color) {
-    uint8_t r, g, b;
-    color565ToRGB888(color, r, g, b);
-    SDL_SetRenderTarget(renderer, canvas);
-    SDL_SetRenderDrawColor(renderer, r, g, b, 255);
-    SDL_RenderDrawLine(renderer, x0, y0, x1, y1);
-    SDL_SetRenderTarget(renderer, nullptr);
+    // Bresenham via drawPixel(), as on the panel
+    Adafruit_GFX::drawLine(x0, y0, x1, y1, color);
 }
 
 void SimMatrixPanel::drawRect(int16_t x, int16_t y, int16_t w, int16_t h, uint16_t color) {
-    uint8_t r, g, b;
-    color565ToRGB888(color, r, g, b);
-    SDL_SetRenderTarget(renderer, canvas);
-    SDL_SetRenderDrawColor(renderer, r, g, b, 255);
-    SDL_Rect rect = { x, y, w, h };
-    SDL_RenderDrawRect(renderer, &rect);
-    SDL_SetRenderTarget(renderer, nullptr);
+    // Outline from drawFastHLine() and drawFastVLine()
+    Adafruit_GFX::drawRect(x, y, w, h, color);
 }
 
 void SimMatrixPanel::fillRect(int16_t x, int16_t y, int16_t w, int16_t h, uint16_t color) {
+    // Normalize negative sizes, then clip to the panel
+    if (w < 0) {
+        x += w + 1;
+        w = -w;
+    }
+    if (h < 0) {
+        y += h + 1;
+        h = -h;
+    }
+    int x0 = x < 0 ? 0 : x;
+    int y0 = y < 0 ? 0 : y;
+    int x1 = x + w > _width ? _width : x + w;
+    int y1 = y + h > _height ? _height : y + h;
+    if (x0 >= x1 || y0 >= y1) return;
+
     uint8_t r, g, b;
     color565ToRGB888(color, r, g, b);
-    SDL_SetRenderTarget(renderer, canvas);
-    SDL_SetRenderDrawColor(renderer, r, g, b, 255);
-    SDL_Rect rect = { x, y, w, h };
-    SDL_RenderFillRect(renderer, &rect);
-    SDL_SetRenderTarget(renderer, nullptr);
+    for (int row = y0; row < y1; row++) {
+        uint8_t* pixel = pixelAt(x0, row);
+        for (int col = x0; col < x1; col++, pixel += 3) {
+            pixel[0] = r;
+            pixel[1] = g;
+            pixel[2] = b;
+        }
+    }
+    dirty = true;
 }
 
 void SimMatrixPanel::drawFastVLine(int16_t x, int16_t y, int16_t h, uint16_t color) {
-    uint8_t r, g, b;
-    color565ToRGB888(color, r, g, b);
-    SDL_SetRenderTarget(renderer, canvas);
-    SDL_SetRenderDrawColor(renderer, r, g, b, 255);
-    SDL_Rect rect = { x, y, 1, h };
-    SDL_RenderFillRect(renderer, &rect);
-    SDL_SetRenderTarget(renderer, nullptr);
+    fillRect(x, y, 1, h, color);
 }
 
 void SimMatrixPanel::drawFastHLine(int16_t x, int16_t y, int16_t w, uint16_t color) {
-    uint8_t r, g, b;
-    color565ToRGB888(color, r, g, b);
-    SDL_SetRenderTarget(renderer, canvas);
-    SDL_SetRenderDrawColor(renderer, r, g, b, 255);
-    SDL_Rect rect = { x, y, w, 1 };
-    SDL_RenderFillRect(renderer, &rect);
-    SDL_SetRenderTarget(renderer, nullptr);
+    fillRect(x, y, w, 1, color);
+}
+
+void SimMatrixPanel::drawRGBBitmap(int16_t x, int16_t y, uint16_t *bitmap, int16_t w, int16_t h) {
+    // Clip to the panel, then convert the block row by row
+    int x0 = x < 0 ? 0 : x;
+    int y0 = y < 0 ? 0 : y;
+    int x1 = x + w > _width ? _width : x + w;
+    int y1 = y + h > _height ? _height : y + h;
+    if (x0 >= x1 || y0 >= y1) return;
+
+    for (int row = y0; row < y1; row++) {
+        const uint16_t* in = &bitmap[(row - y) * w + (x0 - x)];
+        uint8_t* out = pixelAt(x0, row);
+        for (int col = x0; col < x1; col++, out += 3) {
+            color565ToRGB888(*in++, out[0], out[1], out[2]);
+        }
+    }
+    dirty = true;
 }
 
 void SimMatrixPanel::setCursor(int16_t x, int16_t y) {
@@ -189,9 +207,28 @@ size_t SimMatrixPanel::print(const char* text) {
 }
 
 void SimMatrixPanel::present() {
+    if (headless) return; // Nothing to show; savePPM() reads the framebuffer
+
+    // Upload the framebuffer only when something was drawn
+    if (dirty) {
+        SDL_UpdateTexture(canvas, nullptr, framebuffer.data(), _width * 3);
+        dirty = false;
+    }
+
     // Copy canvas to renderer with proper scaling
     SDL_Rect destRect = {0, 0, _width * scale, _height * scale};
     SDL_RenderCopy(renderer, canvas, nullptr, &destRect);
     SDL_RenderPresent(renderer);
 }
-#endif
\ No newline at end of file
+
+bool SimMatrixPanel::savePPM(const char* path) {
+    FILE* file = fopen(path, "wb");
+    if (!file) {
+        perror("Opening the framebuffer dump failed");
+        return false;
+    }
+    fprintf(file, "P6\n%d %d\n255\n", _width, _height);
+    bool written = fwrite(framebuffer.data(), 1, framebuffer.size(), file) == framebuffer.size();
+    return fclose(file) == 0 && written;
+}
+#endif
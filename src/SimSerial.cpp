@@ -6,10 +6,16 @@
 #include <stdio.h>
 #include <sys/ioctl.h>
 #include <sys/stat.h>
+#ifdef __APPLE__
 #include <util.h>
+#else
+#include <pty.h>
+#endif
 #include <cstring>
 #include <errno.h>
 #include <sys/time.h>
+#include <poll.h>
+#include "Arduino.h"
 
 SimSerialClass Serial;
 
@@ -70,35 +76,27 @@ std::string SimSerialClass::init() {
 }
 
 int SimSerialClass::available() {
-    // If we have peeked bytes, return the count
-    if (peek_count > 0) {
-        return peek_count;
-    }
-    
-    // Try to read all available bytes
-    char temp_buffer[256];
-    int total_read = 0;
-    
-    while (total_read < 256) {
-        int n = ::read(master_fd, &temp_buffer[total_read], 1);
+    // Top up the peek buffer with whatever has arrived, so a partial packet
+    // header left in it does not hide the rest of the packet
+    while (peek_count < (int)sizeof(peek_buffer)) {
+        int n = ::read(master_fd, &peek_buffer[peek_count], sizeof(peek_buffer) - peek_count);
         if (n <= 0) {
-            if (errno == EAGAIN || errno == EWOULDBLOCK) {
-                break; // No more data available
+            if (n < 0 && errno != EAGAIN && errno != EWOULDBLOCK) {
+                printf("read error in available(): %s\n", strerror(errno));
             }
-            printf("read error in available(): %s\n", strerror(errno));
-            break;
+            break; // No more data available
         }
-        total_read++;
+        peek_count += n;
     }
-    
-    if (total_read > 0) {
-        // Store all read bytes in peek buffer
-        memcpy(peek_buffer, temp_buffer, total_read);
-        peek_count = total_read;
-        return peek_count;
+    return peek_count;
+}
+
+bool SimSerialClass::waitForData(unsigned long timeout_ms) {
+    if (peek_count > 0) {
+        return true;
     }
-    
-    return 0;
+    struct pollfd pfd = { master_fd, POLLIN, 0 };
+    return poll(&pfd, 1, static_cast<int>(timeout_ms)) > 0;
 }
 
 int SimSerialClass::read() {
@@ -134,30 +132,39 @@ size_t SimSerialClass::write(const char* message, uint8_t msgLen) {
     return ::write(master_fd, message, msgLen);
 }
 
-size_t SimSerialClass::readBytes(uint8_t* buffer, uint8_t len) {
+size_t SimSerialClass::write(const uint8_t* buffer, size_t len) {
+    return ::write(master_fd, buffer, len);
+}
+
+size_t SimSerialClass::readBytes(uint8_t* buffer, size_t len) {
     size_t total_read = 0;
     
     // First, use any bytes from the peek buffer
-    while (total_read < len && peek_count > 0) {
-        buffer[total_read] = static_cast<uint8_t>(peek_buffer[0]);
-        // Shift remaining bytes
-        for (int i = 0; i < peek_count - 1; i++) {
-            peek_buffer[i] = peek_buffer[i + 1];
-        }
-        peek_count--;
-        total_read++;
+    if (peek_count > 0) {
+        total_read = len < (size_t)peek_count ? len : peek_count;
+        memcpy(buffer, peek_buffer, total_read);
+        peek_count -= total_read;
+        memmove(peek_buffer, peek_buffer + total_read, peek_count);
     }
     
-    // If we still need more bytes, read from the file descriptor
+    // If we still need more bytes, wait for them up to the stream timeout
+    unsigned long start_time = millis();
     while (total_read < len) {
         int n = ::read(master_fd, buffer + total_read, len - total_read);
-        if (n <= 0) {
-            if (errno == EAGAIN || errno == EWOULDBLOCK) {
-                break; // No more data available
-            }
+        if (n > 0) {
+            total_read += n;
+            continue;
+        }
+        if (n < 0 && errno != EAGAIN && errno != EWOULDBLOCK) {
             break; // Error
         }
-        total_read += n;
+
+        unsigned long elapsed = millis() - start_time;
+        if (elapsed >= timeout) {
+            break; // Timed out, like Arduino's Stream::readBytes
+        }
+        struct pollfd pfd = { master_fd, POLLIN, 0 };
+        poll(&pfd, 1, static_cast<int>(timeout - elapsed));
     }
 
     return total_read;
@@ -13,50 +13,860 @@ CommandHandler::CommandHandler(MatrixPanel_I2S_DMA *display) : dma_display(displ
         sprites[i].y = 0;
         sprites[i].width = 0;
         sprites[i].height = 0;
+        sprites[i].bpp = 16;
+        sprites[i].palette_size = 0;
+        sprites[i].offset = 0;
+        sprites[i].size = 0;
+        sprites[i].crc = 0;
         sprites[i].last_x = 0;
         sprites[i].last_y = 0;
     }
+    sprite_memory_used = 0;
+    flow_chunk = FLOW_CONTROL_CHUNK;
+    flow_credits = 1;
+    baud_rate = DEFAULT_BAUD_RATE;
+    for (int i = 0; i < MAX_ANIMATIONS; i++)
+    {
+        animations[i].defined = false;
+        animations[i].playing = false;
+        animations[i].drawn_width = 0;
+        animations[i].drawn_height = 0;
+    }
+    telemetry = false;
+    memset(stats, 0, sizeof(stats));
+    framed = false;
+    resync_framed = false;
+    for (int i = 0; i < ACK_HISTORY; i++)
+        acks[i].valid = false;
+    next_ack = 0;
+    chunks_started = false;
+}
+
+// Palette index of pixel `i` in MSB-first packed indices
+static inline uint8_t paletteIndex(const uint8_t *indices, int i, uint8_t bpp)
+{
+    int bit = i * bpp;
+    return (indices[bit >> 3] >> (8 - bpp - (bit & 7))) & ((1 << bpp) - 1);
+}
+
+// Reads BPP and COLORS from an indexed header, returns false if invalid
+static bool readIndexedFormat(const uint8_t *header, uint8_t &bpp, int &colors)
+{
+    bpp = header[0];
+    colors = header[1] + 1;
+    if (bpp != 1 && bpp != 2 && bpp != 4 && bpp != 8)
+        return false;
+    return colors <= (1 << bpp);
+}
+
+// CRC-32 as computed by zlib, so hosts can use zlib.crc32()
+static uint32_t crc32(const uint8_t *data, size_t len)
+{
+    uint32_t crc = 0xFFFFFFFF;
+    for (size_t i = 0; i < len; i++)
+    {
+        crc ^= data[i];
+        for (int bit = 0; bit < 8; bit++)
+            crc = (crc >> 1) ^ (0xEDB88320 & (0 - (crc & 1)));
+    }
+    return ~crc;
+}
+
+// CRC-16/CCITT-FALSE, as computed by binascii.crc_hqx(data, crc) with 0xFFFF
+static uint16_t crc16(const uint8_t *data, size_t len, uint16_t crc = 0xFFFF)
+{
+    for (size_t i = 0; i < len; i++)
+    {
+        crc ^= data[i] << 8;
+        for (int bit = 0; bit < 8; bit++)
+            crc = (crc << 1) ^ (0x1021 & (0 - (crc >> 15)));
+    }
+    return crc;
+}
+
+// CRC-8/SMBUS (poly 0x07, init 0x00) that checks the header of a framed
+// packet or ACK before its length is trusted
+static uint8_t crc8(const uint8_t *data, size_t len)
+{
+    uint8_t crc = 0;
+    for (size_t i = 0; i < len; i++)
+    {
+        crc ^= data[i];
+        for (int bit = 0; bit < 8; bit++)
+            crc = (crc << 1) ^ (0x07 & (0 - (crc >> 7)));
+    }
+    return crc;
+}
+
+// Big-endian CRC-16 that follows a framed packet, ACK or chunk
+static bool readCrc16(uint16_t &crc)
+{
+    uint8_t bytes[2];
+    if (Serial.readBytes(bytes, 2) < 2)
+        return false;
+    crc = (bytes[0] << 8) | bytes[1];
+    return true;
 }
 
 void CommandHandler::sendAck(uint8_t cmd, bool success, const char *message)
 {
-    // Send acknowledgment packet: START_BYTE + ACK_BYTE + CMD + SUCCESS + optional message
-    Serial.write(START_BYTE);
-    Serial.write(0xAC); // ACK byte
-    Serial.write(cmd);
-    Serial.write(success ? 0x01 : 0x00);
+    // Measured before anything is written, so the ACK itself is not counted
+    unsigned long receive_us = 0, render_us = 0;
+    if (telemetry)
+    {
+        unsigned long total_us = micros() - packet_started;
+        receive_us = receive_micros < total_us ? receive_micros : total_us;
+        render_us = total_us - receive_us;
+        if (cmd <= MAX_STATS_OPCODE)
+        {
+            CommandStats &entry = stats[cmd];
+            entry.count++;
+            if (!success)
+                entry.failures++;
+            entry.receive_us += receive_us;
+            entry.render_us += render_us;
+            if (total_us > entry.max_us)
+                entry.max_us = total_us;
+        }
+    }
 
-    if (message != nullptr)
+    // Framed ACKs are built in the history, so a retransmission of the
+    // packet gets the same answer without executing it again
+    uint8_t ack[MAX_ACK_FRAME_SIZE];
+    uint8_t *frame = framed ? acks[next_ack].frame : ack;
+    size_t size = 0;
+
+    // START_BYTE + ACK_BYTE + [SEQ] + CMD + SUCCESS + MSG_LENGTH +
+    // [CRC-8 of ACK_BYTE to MSG_LENGTH] + optional message
+    frame[size++] = framed ? FRAMED_START_BYTE : START_BYTE;
+    frame[size++] = telemetry ? TIMED_ACK_BYTE : ACK_BYTE;
+    if (framed)
+        frame[size++] = framed_seq;
+    frame[size++] = cmd;
+    frame[size++] = success ? 0x01 : 0x00;
+    uint8_t msgLen = message != nullptr ? strlen(message) : 0;
+    frame[size++] = msgLen;
+    if (framed)
     {
-        uint8_t msgLen = strlen(message);
-        Serial.write(msgLen);
-        Serial.write(message, msgLen);
+        frame[size] = crc8(frame + 1, size - 1);
+        size++;
+    }
+    if (msgLen > 0)
+        memcpy(frame + size, message, msgLen);
+    size += msgLen;
+
+    if (telemetry)
+    {
+        // RECEIVE_US + RENDER_US, 4 bytes each, big-endian
+        for (int i = 0; i < 4; i++)
+        {
+            frame[size + i] = receive_us >> (24 - 8 * i);
+            frame[size + 4 + i] = render_us >> (24 - 8 * i);
+        }
+        size += 8;
     }
-    else
+
+    if (framed)
     {
-        Serial.write(0x00); // No message
+        // CRC-16 of everything after the start byte
+        uint16_t crc = crc16(frame + 1, size - 1);
+        frame[size++] = crc >> 8;
+        frame[size++] = crc & 0xFF;
+
+        FramedAck &entry = acks[next_ack];
+        entry.valid = true;
+        entry.seq = framed_seq;
+        entry.packet_crc = framed_crc;
+        entry.size = size;
+        next_ack = (next_ack + 1) % ACK_HISTORY;
     }
+    Serial.write(frame, size);
+}
+
+void CommandHandler::sendNak(uint8_t type, uint16_t number)
+{
+    // FRAMED_START_BYTE + NAK_BYTE + SEQ, or + CHUNK_REQUEST_BYTE + CHUNK
+    // (2 bytes), + CRC-16
+    uint8_t frame[6];
+    size_t size = 0;
+    frame[size++] = FRAMED_START_BYTE;
+    frame[size++] = type;
+    if (type == CHUNK_REQUEST_BYTE)
+        frame[size++] = number >> 8;
+    frame[size++] = number & 0xFF;
+    uint16_t crc = crc16(frame + 1, size - 1);
+    frame[size++] = crc >> 8;
+    frame[size++] = crc & 0xFF;
+    Serial.write(frame, size);
+}
+
+bool CommandHandler::replayAck()
+{
+    // The host resends a packet whose ACK it did not get; the packet CRC
+    // tells a retransmission from a new packet that reuses the SEQ
+    for (int i = 0; i < ACK_HISTORY; i++)
+    {
+        const FramedAck &entry = acks[i];
+        if (entry.valid && entry.seq == framed_seq && entry.packet_crc == framed_crc)
+        {
+            Serial.write(entry.frame, entry.size);
+            return true;
+        }
+    }
+    return false;
+}
+
+void CommandHandler::startTiming()
+{
+    // The packet header has just been read
+    packet_started = micros();
+    receive_micros = 0;
+}
+
+bool CommandHandler::commandPending()
+{
+    return Serial.available() >= 3;
+}
+
+bool CommandHandler::readPacket(uint8_t &cmd, uint8_t *data, uint8_t &len, bool reply)
+{
+    // START_BYTE + CMD + LEN + DATA, or FRAMED_START_BYTE + SEQ + CMD + LEN
+    // + CRC-8 of SEQ to LEN + DATA + CRC-16 of SEQ to DATA
+    uint8_t start = Serial.read();
+    if (start != FRAMED_START_BYTE && (start != START_BYTE || resync_framed))
+    {
+        // Once the rest of a corrupted framed packet is skipped, plain
+        // packets are accepted again
+        if (Serial.available() == 0)
+            resync_framed = false;
+        return false;
+    }
+    framed = start == FRAMED_START_BYTE;
+
+    uint8_t header[4];
+    size_t header_size = framed ? 4 : 2;
+    if (Serial.readBytes(header, header_size) < header_size)
+        return false;
+    if (framed)
+    {
+        framed_seq = header[0];
+        if (crc8(header, 3) != header[3])
+        {
+            // LEN cannot be trusted, so the data is not read: it is skipped
+            // up to the next framed packet, as plain packets in it would be
+            // executed unchecked
+            if (reply)
+                sendNak(NAK_BYTE, framed_seq);
+            resync_framed = true;
+            return false;
+        }
+        resync_framed = false;
+    }
+    cmd = header[framed ? 1 : 0];
+    len = header[framed ? 2 : 1];
+    if (telemetry)
+        startTiming();
+
+    // The header is already consumed, so wait (up to the stream timeout) for
+    // the rest of the packet instead of dropping it when it arrives split.
+    if (Serial.readBytes(data, len) < len)
+    {
+        if (reply && framed)
+            sendNak(NAK_BYTE, framed_seq);
+        else if (reply)
+            sendAck(cmd, false, "Incomplete command data");
+        return false;
+    }
+
+    if (framed)
+    {
+        uint16_t crc;
+        framed_crc = crc16(data, len, crc16(header, header_size));
+        if (!readCrc16(crc) || crc != framed_crc)
+        {
+            if (reply)
+                sendNak(NAK_BYTE, framed_seq);
+            return false;
+        }
+        if (replayAck())
+            return false;
+        chunks_started = false;
+    }
+    if (telemetry)
+        receive_micros = micros() - packet_started;
+    return true;
 }
 
 void CommandHandler::handleCommand()
 {
-    if (Serial.available() < 3)
+    if (!commandPending())
+        return;
+
+    uint8_t cmd, len;
+    uint8_t data[MAX_COMMAND_DATA];
+    if (!readPacket(cmd, data, len))
+        return;
+
+    switch (cmd)
+    {
+    case CMD_DRAW_BITMAP:
+        handleBitmap(data, len);
+        break;
+
+    case CMD_SET_SPRITE:
+    case CMD_SET_SPRITE_INDEXED:
+        handleSetSprite(cmd, data, len);
+        break;
+
+    case CMD_DRAW_BITMAP_INDEXED:
+        handleBitmapIndexed(data, len);
+        break;
+
+    case CMD_BATCH:
+        handleBatch(data, len);
+        break;
+
+    case CMD_DRAW_BITMAP_RLE:
+        handleBitmapRle(data, len);
+        break;
+
+    case CMD_SET_BAUD:
+        handleSetBaud(data, len);
+        break;
+
+    default:
+    {
+        const char *message = nullptr;
+        bool success = executeCommand(cmd, data, len, message);
+        sendAck(cmd, success, message);
+        break;
+    }
+    }
+}
+
+bool CommandHandler::readPayload(PayloadReader &reader, uint8_t *buffer, size_t len)
+{
+    if (framed)
+        return readFramedPayload(reader, buffer, len);
+
+    while (len > 0)
+    {
+        // Read up to the end of the current chunk, then grant a new credit
+        size_t chunk = flow_chunk - reader.received % flow_chunk;
+        if (chunk > len)
+            chunk = len;
+
+        unsigned long read_started = telemetry ? micros() : 0;
+        size_t read = Serial.readBytes(buffer, chunk);
+        if (telemetry)
+            receive_micros += micros() - read_started;
+        if (read < chunk)
+            return false;
+        buffer += chunk;
+        len -= chunk;
+        reader.received += chunk;
+
+        // The sender starts with flow_credits chunks; each 0xFF allows one
+        // more, so it is only sent while the sender has not got all it needs.
+        if (reader.received % flow_chunk == 0 &&
+            reader.received + (size_t)(flow_credits - 1) * flow_chunk < reader.total)
+        {
+            Serial.write(0xFF);
+        }
+    }
+    return true;
+}
+
+bool CommandHandler::readFramedPayload(PayloadReader &reader, uint8_t *buffer, size_t len)
+{
+    // Each chunk is sent as its number (2 bytes, big-endian), its data and
+    // the CRC-16 of both. Every chunk is requested by number instead of
+    // granted with a bare 0xFF, which a corrupted byte could fake or hide;
+    // the sender waits even for the first ones, so a rejected command only
+    // has to send its ACK.
+    if (!chunks_started)
+    {
+        chunks_started = true;
+        chunks_granted = chunks_read = 0;
+        queue_head = queue_count = 0;
+        chunk_retries = 0;
+        chunk_pos = chunk_size = 0;
+        for (int i = 0; i < flow_credits; i++)
+        {
+            chunk_slots[i] = 0xFFFF;
+            grantChunk(reader);
+        }
+    }
+
+    while (len > 0)
+    {
+        if (chunk_pos == chunk_size && !nextChunk(reader))
+            return false;
+
+        size_t count = chunk_size - chunk_pos;
+        if (count > len)
+            count = len;
+        memcpy(buffer, chunk_buffer + chunk_offset + chunk_pos, count);
+        buffer += count;
+        len -= count;
+        chunk_pos += count;
+        reader.received += count;
+
+        // The chunk's slot is free again, so the sender may send one more
+        if (chunk_pos == chunk_size)
+            grantChunk(reader);
+    }
+    return true;
+}
+
+void CommandHandler::grantChunk(const PayloadReader &reader)
+{
+    size_t chunk_count = (reader.total + flow_chunk - 1) / flow_chunk;
+    if (chunks_granted >= chunk_count)
+        return;
+    sendNak(CHUNK_REQUEST_BYTE, chunks_granted);
+    chunk_queue[(queue_head + queue_count++) % MAX_FLOW_CREDITS] = chunks_granted++;
+}
+
+bool CommandHandler::nextChunk(const PayloadReader &reader)
+{
+    // Chunks carry their number, so they are kept whichever order they come
+    // in and retransmissions or duplicates cannot shift the stream. Each
+    // frame is padded to a full chunk, which keeps it the same length even
+    // if the number is corrupted.
+    uint16_t wanted = chunks_read;
+    size_t frame_size = 2 + flow_chunk + 2;
+    while (chunk_slots[wanted % flow_credits] != wanted)
+    {
+        if (!waitForChunk())
+            return false;
+
+        unsigned long read_started = telemetry ? micros() : 0;
+        bool complete = Serial.readBytes(chunk_frame, frame_size) == frame_size;
+        if (telemetry)
+            receive_micros += micros() - read_started;
+        if (!complete)
+            return false;
+
+        uint16_t chunk = (chunk_frame[0] << 8) | chunk_frame[1];
+        uint16_t crc = (chunk_frame[frame_size - 2] << 8) | chunk_frame[frame_size - 1];
+        if (crc == crc16(chunk_frame, frame_size - 2))
+        {
+            chunk_retries = 0;
+            // Anything else is a retransmission that was not needed after all
+            if (chunk >= chunks_read && chunk < chunks_granted && chunk_slots[chunk % flow_credits] != chunk)
+            {
+                memcpy(chunk_buffer + (chunk % flow_credits) * flow_chunk, chunk_frame + 2, flow_chunk);
+                chunk_slots[chunk % flow_credits] = chunk;
+                dropChunk(chunk);
+            }
+            continue;
+        }
+
+        // The number is most likely intact, a chunk that is still due; if
+        // not, it was probably the chunk asked for first. A wrong guess costs
+        // a duplicate, and the corrupted chunk is requested again once the
+        // line goes quiet.
+        if (++chunk_retries > MAX_CHUNK_RETRIES || queue_count == 0)
+            return false;
+        uint16_t expected = chunk_queue[queue_head];
+        for (uint16_t i = 0; i < queue_count; i++)
+            if (chunk_queue[(queue_head + i) % MAX_FLOW_CREDITS] == chunk)
+                expected = chunk;
+        dropChunk(expected);
+        chunk_queue[(queue_head + queue_count++) % MAX_FLOW_CREDITS] = expected;
+        sendNak(CHUNK_REQUEST_BYTE, expected);
+    }
+
+    chunk_offset = (wanted % flow_credits) * flow_chunk;
+    chunk_size = reader.total - (size_t)wanted * flow_chunk;
+    if (chunk_size > flow_chunk)
+        chunk_size = flow_chunk;
+    chunk_pos = 0;
+    chunks_read++;
+    return true;
+}
+
+bool CommandHandler::waitForChunk()
+{
+    // Silence means the sender missed requests, so ask again for every chunk
+    // that is still due now and then until the stream timeout
+    unsigned long started = millis();
+    unsigned long asked = started;
+    while (Serial.available() == 0)
+    {
+        unsigned long now = millis();
+        if (now - started >= STREAM_TIMEOUT_MS)
+            return false;
+        if (now - asked >= CHUNK_RESEND_MS)
+        {
+            for (uint16_t i = 0; i < queue_count; i++)
+                sendNak(CHUNK_REQUEST_BYTE, chunk_queue[(queue_head + i) % MAX_FLOW_CREDITS]);
+            asked = now;
+        }
+        delay(1);
+    }
+    return true;
+}
+
+void CommandHandler::dropChunk(uint16_t chunk)
+{
+    // Remove a chunk from the queue, keeping the order of the others
+    uint16_t kept = 0;
+    for (uint16_t i = 0; i < queue_count; i++)
+    {
+        uint16_t queued = chunk_queue[(queue_head + i) % MAX_FLOW_CREDITS];
+        if (queued != chunk)
+            chunk_queue[(queue_head + kept++) % MAX_FLOW_CREDITS] = queued;
+    }
+    queue_count = kept;
+}
+
+bool CommandHandler::skipPayload(PayloadReader &reader)
+{
+    // Nothing of a framed payload is sent before it is requested
+    if (framed && !chunks_started)
+        return true;
+
+    // Keep the link in sync when a command is rejected after its header
+    uint8_t scratch[FLOW_CONTROL_CHUNK];
+    while (reader.received < reader.total)
+    {
+        size_t chunk = reader.total - reader.received;
+        if (chunk > sizeof(scratch))
+            chunk = sizeof(scratch);
+        if (!readPayload(reader, scratch, chunk))
+            return false;
+    }
+    return true;
+}
+
+void CommandHandler::skipGrantedPayload()
+{
+    // Nothing of a framed payload is sent before it is requested
+    if (framed)
+        return;
+
+    // A rejected header does not tell how long its payload is, but the
+    // sender sends at most its initial credits before it waits for a 0xFF.
+    // Drop what it sends of those, until the line goes quiet.
+    size_t remaining = (size_t)flow_credits * flow_chunk;
+    unsigned long last = millis();
+    while (remaining > 0 && millis() - last < SKIP_QUIET_MS)
+    {
+        if (Serial.available() > 0)
+        {
+            Serial.read();
+            remaining--;
+            last = millis();
+        }
+        else
+        {
+            delay(1);
+        }
+    }
+}
+
+void CommandHandler::update()
+{
+    unsigned long now = millis();
+    for (int i = 0; i < MAX_ANIMATIONS; i++)
+    {
+        Animation &animation = animations[i];
+        if (!animation.playing)
+            continue;
+
+        // Advance by whole frame durations so the timing does not drift
+        bool advanced = false;
+        for (int step = 0; step < animation.frame_count; step++)
+        {
+            uint16_t duration = animation.durations[animation.current];
+            if (now - animation.frame_started < duration)
+                break;
+            animation.frame_started += duration;
+            advanced = true;
+            if (animation.current + 1 < animation.frame_count)
+            {
+                animation.current++;
+            }
+            else if (animation.loop)
+            {
+                animation.current = 0;
+            }
+            else
+            {
+                animation.playing = false; // The last frame stays up
+                break;
+            }
+        }
+
+        if (advanced)
+        {
+            // Skip ahead rather than race to catch up after a long stall
+            if (now - animation.frame_started >= animation.durations[animation.current])
+                animation.frame_started = now;
+            drawAnimationFrame(animation);
+        }
+    }
+}
+
+bool CommandHandler::setAnimation(const uint8_t *data, uint8_t len, const char *&message)
+{
+    // ANIM_ID X Y FLAGS COUNT, then SPRITE_ID + DURATION (2 bytes) per frame
+    if (len < 5 || len < 5 + data[4] * 3)
+    {
+        message = "Invalid animation data";
+        return false;
+    }
+
+    uint8_t animation_id = data[0];
+    uint8_t frame_count = data[4];
+    if (animation_id >= MAX_ANIMATIONS)
+    {
+        message = "Invalid animation ID";
+        return false;
+    }
+    if (frame_count == 0 || frame_count > MAX_ANIMATION_FRAMES)
+    {
+        message = "Invalid frame count";
+        return false;
+    }
+
+    Animation &animation = animations[animation_id];
+    const uint8_t *frame = data + 5;
+    for (int i = 0; i < frame_count; i++, frame += 3)
+    {
+        if (frame[0] >= MAX_SPRITES)
+        {
+            message = "Invalid sprite ID";
+            return false;
+        }
+        animation.sprite_ids[i] = frame[0];
+        uint16_t duration = (frame[1] << 8) | frame[2];
+        animation.durations[i] = duration > 0 ? duration : 1;
+    }
+
+    animation.defined = true;
+    animation.playing = false;
+    animation.loop = data[3] & 0x01;
+    animation.x = data[1];
+    animation.y = data[2];
+    animation.frame_count = frame_count;
+    animation.current = 0;
+    message = "Animation set";
+    return true;
+}
+
+void CommandHandler::drawAnimationFrame(Animation &animation)
+{
+    uint8_t sprite_id = animation.sprite_ids[animation.current];
+    Sprite &sprite = sprites[sprite_id];
+
+    // Frames may differ in size or the animation may have moved
+    if (!sprite.active || animation.drawn_x != animation.x || animation.drawn_y != animation.y ||
+        animation.drawn_width != sprite.width || animation.drawn_height != sprite.height)
+    {
+        clearAnimationArea(animation);
+    }
+    if (!sprite.active)
+        return; // The slot was cleared since the animation was set
+
+    drawSpriteRect(sprite_id, 0, 0, sprite.width, sprite.height, animation.x, animation.y);
+    animation.drawn_x = animation.x;
+    animation.drawn_y = animation.y;
+    animation.drawn_width = sprite.width;
+    animation.drawn_height = sprite.height;
+}
+
+void CommandHandler::clearAnimationArea(Animation &animation)
+{
+    if (animation.drawn_width > 0 && animation.drawn_height > 0)
+    {
+        dma_display->fillRect(animation.drawn_x, animation.drawn_y,
+                              animation.drawn_width, animation.drawn_height, 0x0000);
+    }
+    animation.drawn_width = 0;
+    animation.drawn_height = 0;
+}
+
+void CommandHandler::handleSetBaud(const uint8_t *data, uint8_t len)
+{
+    if (len < 4)
+    {
+        sendAck(CMD_SET_BAUD, false, "Invalid baud rate data");
+        return;
+    }
+
+    uint32_t baud = ((uint32_t)data[0] << 24) | ((uint32_t)data[1] << 16) | (data[2] << 8) | data[3];
+    if (baud < MIN_BAUD_RATE || baud > MAX_BAUD_RATE)
+    {
+        sendAck(CMD_SET_BAUD, false, "Unsupported baud rate");
+        return;
+    }
+
+    // Acknowledge at the old rate, then switch
+    sendAck(CMD_SET_BAUD, true, "Switching baud rate");
+    Serial.flush();
+    uint32_t previous = baud_rate;
+    Serial.updateBaudRate(baud);
+    baud_rate = baud;
+
+    // Keep the new rate only if the host confirms it with a ping
+    if (!waitForPing(BAUD_VERIFY_TIMEOUT_MS))
+    {
+        Serial.updateBaudRate(previous);
+        baud_rate = previous;
+        while (Serial.available() > 0)
+        {
+            Serial.read(); // Discard what arrived at the wrong rate
+        }
+    }
+}
+
+bool CommandHandler::waitForPing(unsigned long timeout_ms)
+{
+    unsigned long start_time = millis();
+    while (millis() - start_time < timeout_ms)
+    {
+        if (Serial.available() < 3)
+        {
+            delay(1);
+            continue;
+        }
+
+        // Skip anything else, e.g. garbage from the rate switch
+        uint8_t cmd, len;
+        uint8_t data[MAX_COMMAND_DATA];
+        if (!readPacket(cmd, data, len, false) || cmd != CMD_PING)
+            continue;
+
+        const char *message = nullptr;
+        bool success = executeCommand(CMD_PING, data, len, message);
+        sendAck(CMD_PING, success, message);
+        return true;
+    }
+    return false;
+}
+
+void CommandHandler::handleBitmap(const uint8_t *data, uint8_t len)
+{
+    if (len < 4)
+    {
+        skipGrantedPayload();
+        sendAck(CMD_DRAW_BITMAP, false, "Invalid bitmap header");
         return;
+    }
+
+    int x = data[0];
+    int y = data[1];
+    int width = data[2];
+    int height = data[3];
+    PayloadReader reader = {(size_t)(width * height * 2), 0}; // RGB565 = 2 bytes per pixel
+
+    // Receive and draw one row at a time. readPayload() grants new credits
+    // while the row is read, so the sender is already transmitting the next
+    // row into the serial receive buffer while this one is drawn.
+    uint8_t *row = reinterpret_cast<uint8_t *>(bitmap_row);
+    for (int row_index = 0; row_index < height; row_index++)
+    {
+        if (!readPayload(reader, row, width * 2))
+        {
+            sendAck(CMD_DRAW_BITMAP, false, "Bitmap data read timeout");
+            return;
+        }
+
+        // Pixels arrive big-endian; convert in place
+        for (int i = 0; i < width; i++)
+        {
+            bitmap_row[i] = (row[2 * i] << 8) | row[2 * i + 1];
+        }
+        dma_display->drawRGBBitmap(x, y + row_index, bitmap_row, width, 1);
+    }
 
-    if (Serial.read() != START_BYTE)
+    sendAck(CMD_DRAW_BITMAP, true, "");
+}
+
+void CommandHandler::handleBitmapRle(const uint8_t *data, uint8_t len)
+{
+    if (len < 6)
+    {
+        skipGrantedPayload();
+        sendAck(CMD_DRAW_BITMAP_RLE, false, "Invalid bitmap header");
         return;
+    }
+
+    int x = data[0];
+    int y = data[1];
+    int width = data[2];
+    int height = data[3];
+    PayloadReader reader = {(size_t)((data[4] << 8) | data[5]), 0};
+
+    // Runs are decoded and drawn as they arrive: a control byte with the high
+    // bit set is followed by one pixel repeated (control & 0x7F) + 1 times,
+    // otherwise by control + 1 literal pixels.
+    int pixel_count = width * height;
+    int pixel_index = 0;
+    while (reader.received < reader.total)
+    {
+        uint8_t control;
+        if (!readPayload(reader, &control, 1))
+        {
+            sendAck(CMD_DRAW_BITMAP_RLE, false, "Bitmap data read timeout");
+            return;
+        }
 
-    uint8_t cmd = Serial.read();
-    uint8_t len = Serial.read();
+        int run = (control & 0x7F) + 1;
+        uint8_t pixel[2];
+        if (control & 0x80)
+        {
+            if (!readPayload(reader, pixel, 2))
+            {
+                sendAck(CMD_DRAW_BITMAP_RLE, false, "Bitmap data read timeout");
+                return;
+            }
+            uint16_t color = (pixel[0] << 8) | pixel[1];
 
-    // Check if we have enough data without blocking
-    if (Serial.available() < len) {
-        return; // Not enough data yet, try again later
+            // Draw the run one row segment at a time
+            while (run > 0 && pixel_index < pixel_count)
+            {
+                int px = pixel_index % width;
+                int py = pixel_index / width;
+                int segment = run < width - px ? run : width - px;
+                dma_display->drawFastHLine(x + px, y + py, segment, color);
+                pixel_index += segment;
+                run -= segment;
+            }
+            pixel_index += run; // Overflow past the bitmap is counted, not drawn
+        }
+        else
+        {
+            for (int i = 0; i < run; i++)
+            {
+                if (!readPayload(reader, pixel, 2))
+                {
+                    sendAck(CMD_DRAW_BITMAP_RLE, false, "Bitmap data read timeout");
+                    return;
+                }
+                if (pixel_index < pixel_count)
+                {
+                    uint16_t color = (pixel[0] << 8) | pixel[1];
+                    dma_display->drawPixel(x + pixel_index % width, y + pixel_index / width, color);
+                }
+                pixel_index++;
+            }
+        }
     }
 
-    uint8_t data[64];
-    Serial.readBytes(data, len);
+    if (pixel_index != pixel_count)
+    {
+        sendAck(CMD_DRAW_BITMAP_RLE, false, "RLE pixel count mismatch");
+        return;
+    }
+    sendAck(CMD_DRAW_BITMAP_RLE, true, "");
+}
 
+bool CommandHandler::executeCommand(uint8_t cmd, const uint8_t *data, uint8_t len, const char *&message)
+{
     switch (cmd)
     {
     case CMD_DRAW_PIXEL:
@@ -68,13 +878,11 @@ void CommandHandler::handleCommand()
             uint8_t g = data[3];
             uint8_t b = data[4];
             dma_display->drawPixelRGB888(x, y, r, g, b);
-            sendAck(cmd, true, "Pixel drawn");
-        }
-        else
-        {
-            sendAck(cmd, false, "Invalid pixel data");
+            message = "Pixel drawn";
+            return true;
         }
-        break;
+        message = "Invalid pixel data";
+        return false;
 
     case CMD_FILL_SCREEN:
         if (len >= 3)
@@ -83,13 +891,11 @@ void CommandHandler::handleCommand()
             uint8_t g = data[1];
             uint8_t b = data[2];
             dma_display->fillScreenRGB888(r, g, b);
-            sendAck(cmd, true, "Screen filled");
+            message = "Screen filled";
+            return true;
         }
-        else
-        {
-            sendAck(cmd, false, "Invalid fill data");
-        }
-        break;
+        message = "Invalid fill data";
+        return false;
 
     case CMD_DRAW_LINE:
         if (len >= 7)
@@ -102,13 +908,11 @@ void CommandHandler::handleCommand()
             uint8_t g = data[5];
             uint8_t b = data[6];
             dma_display->drawLine(x0, y0, x1, y1, dma_display->color565(r, g, b));
-            sendAck(cmd, true, "Line drawn");
+            message = "Line drawn";
+            return true;
         }
-        else
-        {
-            sendAck(cmd, false, "Invalid line data");
-        }
-        break;
+        message = "Invalid line data";
+        return false;
 
     case CMD_DRAW_RECT:
         if (len >= 7)
@@ -121,46 +925,40 @@ void CommandHandler::handleCommand()
             uint8_t g = data[5];
             uint8_t b = data[6];
             dma_display->drawRect(x, y, w, h, dma_display->color565(r, g, b));
-            sendAck(cmd, true, "Rectangle drawn");
+            message = "Rectangle drawn";
+            return true;
         }
-        else
-        {
-            sendAck(cmd, false, "Invalid rectangle data");
-        }
-        break;
+        message = "Invalid rectangle data";
+        return false;
 
     case CMD_CLEAR:
         dma_display->clearScreen();
-        sendAck(cmd, true, "Screen cleared");
-        break;
+        message = "Screen cleared";
+        return true;
 
     case CMD_SET_BRIGHTNESS:
         if (len >= 1)
         {
             uint8_t brightness = data[0];
             dma_display->setBrightness8(brightness);
-            sendAck(cmd, true, "Brightness set");
-        }
-        else
-        {
-            sendAck(cmd, false, "Invalid brightness data");
+            message = "Brightness set";
+            return true;
         }
-        break;
+        message = "Invalid brightness data";
+        return false;
 
     case CMD_PRINT:
         if (len >= 1)
         {
             // Convert the data to a null-terminated string
-            char text[65] = {0}; // 64 chars + null terminator
+            char text[MAX_COMMAND_DATA + 1] = {0}; // Room for the null terminator
             memcpy(text, data, len);
             dma_display->print(text);
-            sendAck(cmd, true, "Text printed");
+            message = "Text printed";
+            return true;
         }
-        else
-        {
-            sendAck(cmd, false, "Invalid text data");
-        }
-        break;
+        message = "Invalid text data";
+        return false;
 
     case CMD_SET_CURSOR:
         if (len >= 2)
@@ -168,13 +966,11 @@ void CommandHandler::handleCommand()
             int x = data[0];
             int y = data[1];
             dma_display->setCursor(x, y);
-            sendAck(cmd, true, "Cursor set");
-        }
-        else
-        {
-            sendAck(cmd, false, "Invalid cursor data");
+            message = "Cursor set";
+            return true;
         }
-        break;
+        message = "Invalid cursor data";
+        return false;
 
     case CMD_FILL_RECT:
         if (len >= 7)
@@ -187,13 +983,11 @@ void CommandHandler::handleCommand()
             uint8_t g = data[5];
             uint8_t b = data[6];
             dma_display->fillRect(x, y, w, h, dma_display->color565(r, g, b));
-            sendAck(cmd, true, "Rectangle filled");
-        }
-        else
-        {
-            sendAck(cmd, false, "Invalid rectangle data");
+            message = "Rectangle filled";
+            return true;
         }
-        break;
+        message = "Invalid rectangle data";
+        return false;
 
     case CMD_DRAW_FAST_VLINE:
         if (len >= 6)
@@ -205,13 +999,11 @@ void CommandHandler::handleCommand()
             uint8_t g = data[4];
             uint8_t b = data[5];
             dma_display->drawFastVLine(x, y, h, dma_display->color565(r, g, b));
-            sendAck(cmd, true, "Vertical line drawn");
-        }
-        else
-        {
-            sendAck(cmd, false, "Invalid vertical line data");
+            message = "Vertical line drawn";
+            return true;
         }
-        break;
+        message = "Invalid vertical line data";
+        return false;
 
     case CMD_DRAW_FAST_HLINE:
         if (len >= 6)
@@ -223,259 +1015,531 @@ void CommandHandler::handleCommand()
             uint8_t g = data[4];
             uint8_t b = data[5];
             dma_display->drawFastHLine(x, y, w, dma_display->color565(r, g, b));
-            sendAck(cmd, true, "Horizontal line drawn");
-        }
-        else
-        {
-            sendAck(cmd, false, "Invalid horizontal line data");
+            message = "Horizontal line drawn";
+            return true;
         }
-        break;
+        message = "Invalid horizontal line data";
+        return false;
 
-    case CMD_DRAW_BITMAP:
-        if (len >= 4)
+    case CMD_CLEAR_SPRITE:
+        if (len >= 1)
         {
-            int x = data[0];
-            int y = data[1];
-            int width = data[2];
-            int height = data[3];
-
-            int payload_size = width * height * 2; // RGB565 = 2 bytes per pixel
-            uint8_t bitmap_data[payload_size];
-
-            // Read and draw bitmap data pixel by pixel as it arrives
-            int total_read = 0;
-            int timeout_ms = 5000; // 5 second timeout
-            unsigned long start_time = millis();
-            uint8_t pixel_buffer[2]; // 2 bytes for RGB565 pixel
-
-            while (total_read < payload_size)
+            uint8_t sprite_id = data[0];
+            if (sprite_id >= MAX_SPRITES)
             {
-                // Check for timeout
-                if (millis() - start_time > timeout_ms)
-                {
-                    sendAck(cmd, false, "Bitmap data read timeout");
-                    break;
-                }
-
-                // Wait for data to be available and manage buffer
-                if (Serial.available() < 2)
-                {
-                    // If buffer is getting full, flush it to make room
-                    if (Serial.available() > 0)
-                    {
-                        Serial.flush();
-                    }
-                    delay(1);
-                    continue;
-                }
+                message = "Invalid sprite ID";
+                return false;
+            }
 
-                // Read one pixel (2 bytes)
-                int read_size = Serial.readBytes(pixel_buffer, 2);
-                if (read_size == 2)
-                {
-                    // Calculate pixel position
-                    int pixel_index = total_read / 2;
-                    int py = pixel_index / width;
-                    int px = pixel_index % width;
-
-                    // Only draw if within bounds
-                    if (py < height && px < width)
-                    {
-                        // Read RGB565 color (2 bytes)
-                        uint16_t color = (pixel_buffer[0] << 8) | pixel_buffer[1];
-                        dma_display->drawPixel(x + px, y + py, color);
-                    }
-                    total_read += 2;
-
-                    // Send simple flow control every 64 pixels to keep data flowing
-                    // But not after the last chunk to avoid interfering with final ACK
-                    if ((total_read / 2) % 64 == 0 && total_read < payload_size - 2)
-                    {
-                        // Send a simple "ready" byte to keep the sender going
-                        Serial.write(0xFF); // Simple ready signal (different from ACK protocol)
-                    }
-                }
+            if (sprites[sprite_id].active)
+            {
+                clearSpriteArea(sprite_id);
+                sprites[sprite_id].active = false;
+                releaseSpriteMemory(sprite_id);
+                message = "Sprite cleared";
+                return true;
+            }
+            else
+            {
+                message = "Sprite not active";
+                return false;
             }
-            sendAck(cmd, true, "");
-        }
-        else
-        {
-            sendAck(cmd, false, "Invalid bitmap header");
         }
-        break;
+        message = "Invalid sprite ID";
+        return false;
 
-    case CMD_SET_SPRITE:
-        if (len >= 4)
+    case CMD_DRAW_SPRITE:
+        if (len >= 3)
         {
             uint8_t sprite_id = data[0];
             int x = data[1];
             int y = data[2];
-            int width = data[3];
-            int height = data[4];
 
             if (sprite_id >= MAX_SPRITES)
             {
-                sendAck(cmd, false, "Invalid sprite ID");
-                break;
+                message = "Invalid sprite ID";
+                return false;
             }
 
-            int payload_size = width * height * 2; // RGB565 = 2 bytes per pixel
-            if (payload_size > MAX_SPRITE_SIZE)
+            if (!sprites[sprite_id].active)
             {
-                sendAck(cmd, false, "Sprite too large");
-                break;
+                message = "Sprite not active";
+                return false;
             }
 
-            // Clear the sprite area if it was previously active
-            if (sprites[sprite_id].active)
-            {
-                clearSpriteArea(sprite_id);
-            }
+            drawSpriteAt(sprite_id, x, y);
+            message = "Sprite drawn";
+            return true;
+        }
+        message = "Invalid draw sprite data";
+        return false;
 
-            // Read sprite data with flow control
-            int total_read = 0;
-            int timeout_ms = 5000;
-            unsigned long start_time = millis();
-            uint8_t pixel_buffer[2];
+    case CMD_MOVE_SPRITE:
+        if (len >= 3)
+        {
+            uint8_t sprite_id = data[0];
+            int x = data[1];
+            int y = data[2];
 
-            while (total_read < payload_size)
+            if (sprite_id >= MAX_SPRITES)
             {
-                if (millis() - start_time > timeout_ms)
-                {
-                    sendAck(cmd, false, "Sprite data read timeout");
-                    break;
-                }
-
-                if (Serial.available() < 2)
-                {
-                    if (Serial.available() > 0)
-                    {
-                        Serial.flush();
-                    }
-                    delay(1);
-                    continue;
-                }
+                message = "Invalid sprite ID";
+                return false;
+            }
 
-                int read_size = Serial.readBytes(pixel_buffer, 2);
-                if (read_size == 2)
-                {
-                    sprites[sprite_id].data[total_read] = pixel_buffer[0];
-                    sprites[sprite_id].data[total_read + 1] = pixel_buffer[1];
-                    total_read += 2;
-
-                    if ((total_read / 2) % 64 == 0 && total_read < payload_size - 2)
-                    {
-                        Serial.write(0xFF);
-                    }
-                }
+            if (!sprites[sprite_id].active)
+            {
+                message = "Sprite not active";
+                return false;
             }
 
-            // Set sprite properties
-            sprites[sprite_id].active = true;
+            drawSpriteAt(sprite_id, x, y);
             sprites[sprite_id].x = x;
             sprites[sprite_id].y = y;
-            sprites[sprite_id].width = width;
-            sprites[sprite_id].height = height;
-            sprites[sprite_id].last_x = x;
-            sprites[sprite_id].last_y = y;
-
-            sendAck(cmd, true, "Sprite set");
-        }
-        else
-        {
-            sendAck(cmd, false, "Invalid sprite data");
+            message = "Sprite moved";
+            return true;
         }
-        break;
+        message = "Invalid move sprite data";
+        return false;
 
-    case CMD_CLEAR_SPRITE:
+    case CMD_QUERY_SPRITE:
         if (len >= 1)
         {
             uint8_t sprite_id = data[0];
             if (sprite_id >= MAX_SPRITES)
             {
-                sendAck(cmd, false, "Invalid sprite ID");
-                break;
+                message = "Invalid sprite ID";
+                return false;
             }
 
-            if (sprites[sprite_id].active)
-            {
-                clearSpriteArea(sprite_id);
-                sprites[sprite_id].active = false;
-                sendAck(cmd, true, "Sprite cleared");
-            }
-            else
+            Sprite &sprite = sprites[sprite_id];
+            if (!sprite.active)
             {
-                sendAck(cmd, false, "Sprite not active");
+                message = "Sprite not active";
+                return false;
             }
+
+            static char reply[48];
+            snprintf(reply, sizeof(reply), "crc=%08lx w=%d h=%d bpp=%u",
+                     (unsigned long)sprite.crc, sprite.width, sprite.height, (unsigned)sprite.bpp);
+            message = reply;
+            return true;
         }
-        else
+        message = "Invalid sprite ID";
+        return false;
+
+    case CMD_REUSE_SPRITE:
+        if (len >= 10)
         {
-            sendAck(cmd, false, "Invalid sprite ID");
+            uint8_t sprite_id = data[0];
+            if (sprite_id >= MAX_SPRITES)
+            {
+                message = "Invalid sprite ID";
+                return false;
+            }
+
+            // Only if the slot already holds this exact image
+            Sprite &sprite = sprites[sprite_id];
+            uint32_t crc = ((uint32_t)data[6] << 24) | ((uint32_t)data[7] << 16) | (data[8] << 8) | data[9];
+            if (!sprite.active || sprite.width != data[3] || sprite.height != data[4] ||
+                sprite.bpp != data[5] || sprite.crc != crc)
+            {
+                message = "Sprite not cached";
+                return false;
+            }
+
+            // Same as CMD_SET_SPRITE, without the upload
+            clearSpriteArea(sprite_id);
+            sprite.x = sprite.last_x = data[1];
+            sprite.y = sprite.last_y = data[2];
+            message = "Sprite unchanged";
+            return true;
         }
-        break;
+        message = "Invalid reuse sprite data";
+        return false;
 
-    case CMD_DRAW_SPRITE:
-        if (len >= 3)
+    case CMD_DRAW_SPRITE_RECT:
+        if (len >= 7)
         {
             uint8_t sprite_id = data[0];
-            int x = data[1];
-            int y = data[2];
-
             if (sprite_id >= MAX_SPRITES)
             {
-                sendAck(cmd, false, "Invalid sprite ID");
-                break;
+                message = "Invalid sprite ID";
+                return false;
             }
 
             if (!sprites[sprite_id].active)
             {
-                sendAck(cmd, false, "Sprite not active");
-                break;
+                message = "Sprite not active";
+                return false;
             }
 
-            drawSpriteAt(sprite_id, x, y);
-            sendAck(cmd, true, "Sprite drawn");
+            // SRC_X SRC_Y WIDTH HEIGHT inside the sprite, then X Y on the panel
+            drawSpriteRect(sprite_id, data[1], data[2], data[3], data[4], data[5], data[6]);
+            message = "Sprite rect drawn";
+            return true;
         }
-        else
+        message = "Invalid sprite rect data";
+        return false;
+
+    case CMD_SET_ANIMATION:
+        return setAnimation(data, len, message);
+
+    case CMD_ANIMATION_CONTROL:
+        if (len >= 2)
         {
-            sendAck(cmd, false, "Invalid draw sprite data");
+            uint8_t animation_id = data[0];
+            if (animation_id >= MAX_ANIMATIONS || !animations[animation_id].defined)
+            {
+                message = "Animation not set";
+                return false;
+            }
+
+            Animation &animation = animations[animation_id];
+            switch (data[1])
+            {
+            case ANIMATION_STOP:
+                animation.playing = false;
+                message = "Animation stopped";
+                return true;
+
+            case ANIMATION_STOP_CLEAR:
+                animation.playing = false;
+                clearAnimationArea(animation);
+                message = "Animation stopped";
+                return true;
+
+            case ANIMATION_START:
+                animation.current = 0;
+                // Fall through
+            case ANIMATION_RESUME:
+                animation.playing = true;
+                animation.frame_started = millis();
+                drawAnimationFrame(animation);
+                message = "Animation started";
+                return true;
+            }
+            message = "Invalid animation action";
+            return false;
         }
-        break;
+        message = "Invalid animation control data";
+        return false;
 
-    case CMD_MOVE_SPRITE:
+    case CMD_MOVE_ANIMATION:
         if (len >= 3)
         {
-            uint8_t sprite_id = data[0];
-            int x = data[1];
-            int y = data[2];
-
-            if (sprite_id >= MAX_SPRITES)
+            uint8_t animation_id = data[0];
+            if (animation_id >= MAX_ANIMATIONS || !animations[animation_id].defined)
             {
-                sendAck(cmd, false, "Invalid sprite ID");
-                break;
+                message = "Animation not set";
+                return false;
             }
 
-            if (!sprites[sprite_id].active)
+            Animation &animation = animations[animation_id];
+            animation.x = data[1];
+            animation.y = data[2];
+            // Redraw right away if the frame is on screen
+            if (animation.drawn_width > 0)
+                drawAnimationFrame(animation);
+            message = "Animation moved";
+            return true;
+        }
+        message = "Invalid move animation data";
+        return false;
+
+    case CMD_FLOW_CONFIG:
+        if (len >= 3)
+        {
+            // Clamp the requested chunk size and credits to the receive buffer
+            size_t chunk = (data[0] << 8) | data[1];
+            size_t credits = data[2];
+            if (chunk < MIN_FLOW_CHUNK)
+                chunk = MIN_FLOW_CHUNK;
+            if (chunk > SERIAL_RX_BUFFER_SIZE)
+                chunk = SERIAL_RX_BUFFER_SIZE;
+            if (credits < 1)
+                credits = 1;
+            if (credits > SERIAL_RX_BUFFER_SIZE / chunk)
+                credits = SERIAL_RX_BUFFER_SIZE / chunk;
+            flow_chunk = chunk;
+            flow_credits = credits;
+
+            static char reply[48];
+            snprintf(reply, sizeof(reply), "chunk=%u credits=%u buffer=%u",
+                     (unsigned)flow_chunk, (unsigned)flow_credits, (unsigned)SERIAL_RX_BUFFER_SIZE);
+            message = reply;
+            return true;
+        }
+        message = "Invalid flow config data";
+        return false;
+
+    case CMD_PING:
+    {
+        // Echo the data back so the host can check the link
+        static char echo[MAX_COMMAND_DATA + 1];
+        memcpy(echo, data, len);
+        echo[len] = '\0';
+        message = echo;
+        return true;
+    }
+
+    case CMD_SET_TELEMETRY:
+        if (len >= 1)
+        {
+            if (data[0] & TELEMETRY_RESET)
+                memset(stats, 0, sizeof(stats));
+            bool enable = data[0] & TELEMETRY_ENABLE;
+            if (enable && !telemetry)
+                startTiming(); // This packet's own ACK is timed from here
+            telemetry = enable;
+            message = telemetry ? "Telemetry on" : "Telemetry off";
+            return true;
+        }
+        message = "Invalid telemetry data";
+        return false;
+
+    case CMD_QUERY_STATS:
+        return queryStats(data, len, message);
+
+    default:
+        message = "Unknown command";
+        return false;
+    }
+}
+
+bool CommandHandler::queryStats(const uint8_t *data, uint8_t len, const char *&message)
+{
+    static char reply[MAX_COMMAND_DATA + 1];
+    if (len == 0)
+    {
+        // List the opcodes that have counters, e.g. "01 0d 12"
+        size_t used = 0;
+        reply[0] = '\0';
+        for (int cmd = 0; cmd <= MAX_STATS_OPCODE && used + 4 <= sizeof(reply); cmd++)
+        {
+            if (stats[cmd].count > 0)
+                used += snprintf(reply + used, sizeof(reply) - used, used ? " %02x" : "%02x", cmd);
+        }
+        message = reply;
+        return true;
+    }
+
+    if (data[0] > MAX_STATS_OPCODE)
+    {
+        message = "Invalid opcode";
+        return false;
+    }
+    const CommandStats &entry = stats[data[0]];
+    snprintf(reply, sizeof(reply), "count=%lu failures=%lu receive=%llu render=%llu max=%lu",
+             (unsigned long)entry.count, (unsigned long)entry.failures,
+             (unsigned long long)entry.receive_us, (unsigned long long)entry.render_us,
+             (unsigned long)entry.max_us);
+    message = reply;
+    return true;
+}
+
+void CommandHandler::handleBatch(const uint8_t *data, uint8_t len)
+{
+    // Sub-commands are packed back to back as CMD + LEN + DATA and executed
+    // in order. Execution stops at the first failure, whose index is
+    // reported in the single ACK for the whole batch.
+    int offset = 0;
+    int index = 0;
+    char error[64];
+
+    while (offset < len)
+    {
+        const char *message = nullptr;
+        bool success = false;
+
+        if (offset + 2 > len || offset + 2 + data[offset + 1] > len)
+        {
+            message = "Truncated sub-command";
+        }
+        else
+        {
+            uint8_t sub_cmd = data[offset];
+            uint8_t sub_len = data[offset + 1];
+            if (sub_cmd == CMD_DRAW_BITMAP || sub_cmd == CMD_SET_SPRITE || sub_cmd == CMD_BATCH)
             {
-                sendAck(cmd, false, "Sprite not active");
-                break;
+                message = "Command not allowed in batch";
             }
+            else
+            {
+                success = executeCommand(sub_cmd, data + offset + 2, sub_len, message);
+            }
+            offset += 2 + sub_len;
+        }
 
-            drawSpriteAt(sprite_id, x, y);
-            sprites[sprite_id].x = x;
-            sprites[sprite_id].y = y;
-            sendAck(cmd, true, "Sprite moved");
+        if (!success)
+        {
+            snprintf(error, sizeof(error), "%d: %s", index, message);
+            sendAck(CMD_BATCH, false, error);
+            return;
         }
-        else
+        index++;
+    }
+
+    sendAck(CMD_BATCH, true, "Batch executed");
+}
+
+void CommandHandler::handleSetSprite(uint8_t cmd, const uint8_t *data, uint8_t len)
+{
+    bool indexed = cmd == CMD_SET_SPRITE_INDEXED;
+    if (len < (indexed ? 7 : 5))
+    {
+        skipGrantedPayload();
+        sendAck(cmd, false, "Invalid sprite data");
+        return;
+    }
+
+    uint8_t sprite_id = data[0];
+    int x = data[1];
+    int y = data[2];
+    int width = data[3];
+    int height = data[4];
+
+    uint8_t bpp = 16;
+    int colors = 0;
+    if (indexed && !readIndexedFormat(data + 5, bpp, colors))
+    {
+        skipGrantedPayload();
+        sendAck(cmd, false, "Invalid palette format");
+        return;
+    }
+
+    // Indexed sprites keep their palette in front of the packed indices
+    uint32_t payload_size = indexed ? colors * 2 + (width * height * bpp + 7) / 8
+                                    : width * height * 2;
+    PayloadReader reader = {payload_size, 0};
+
+    if (sprite_id >= MAX_SPRITES)
+    {
+        skipPayload(reader);
+        sendAck(cmd, false, "Invalid sprite ID");
+        return;
+    }
+
+    // Clear the sprite area and free its memory if it was previously active
+    if (sprites[sprite_id].active)
+    {
+        clearSpriteArea(sprite_id);
+        sprites[sprite_id].active = false;
+    }
+    releaseSpriteMemory(sprite_id);
+
+    if (!allocateSpriteMemory(sprite_id, payload_size))
+    {
+        skipPayload(reader);
+        sendAck(cmd, false, "Sprite too large");
+        return;
+    }
+
+    if (!readPayload(reader, sprite_memory + sprites[sprite_id].offset, payload_size))
+    {
+        releaseSpriteMemory(sprite_id);
+        sendAck(cmd, false, "Sprite data read timeout");
+        return;
+    }
+
+    // Set sprite properties
+    Sprite &sprite = sprites[sprite_id];
+    sprite.active = true;
+    sprite.x = x;
+    sprite.y = y;
+    sprite.width = width;
+    sprite.height = height;
+    sprite.bpp = bpp;
+    sprite.palette_size = colors;
+    sprite.crc = crc32(sprite_memory + sprite.offset, payload_size);
+    sprite.last_x = x;
+    sprite.last_y = y;
+
+    sendAck(cmd, true, "Sprite set");
+}
+
+void CommandHandler::handleBitmapIndexed(const uint8_t *data, uint8_t len)
+{
+    uint8_t bpp;
+    int colors;
+    if (len < 6 || !readIndexedFormat(data + 4, bpp, colors))
+    {
+        skipGrantedPayload();
+        sendAck(CMD_DRAW_BITMAP_INDEXED, false, "Invalid bitmap header");
+        return;
+    }
+
+    int x = data[0];
+    int y = data[1];
+    int width = data[2];
+    int height = data[3];
+    int pixel_count = width * height;
+    PayloadReader reader = {(size_t)(colors * 2 + (pixel_count * bpp + 7) / 8), 0};
+
+    // Palette first, then the packed indices, expanded as they arrive
+    uint8_t palette[512];
+    if (!readPayload(reader, palette, colors * 2))
+    {
+        sendAck(CMD_DRAW_BITMAP_INDEXED, false, "Bitmap data read timeout");
+        return;
+    }
+
+    uint8_t indices[64];
+    int pixels_per_byte = 8 / bpp;
+    int pixel_index = 0;
+    while (reader.received < reader.total)
+    {
+        size_t chunk = reader.total - reader.received;
+        if (chunk > sizeof(indices))
+            chunk = sizeof(indices);
+        if (!readPayload(reader, indices, chunk))
         {
-            sendAck(cmd, false, "Invalid move sprite data");
+            sendAck(CMD_DRAW_BITMAP_INDEXED, false, "Bitmap data read timeout");
+            return;
         }
-        break;
 
-    default:
-        sendAck(cmd, false, "Unknown command");
-        break;
+        int chunk_pixels = chunk * pixels_per_byte;
+        for (int i = 0; i < chunk_pixels && pixel_index < pixel_count; i++, pixel_index++)
+        {
+            uint8_t index = paletteIndex(indices, i, bpp);
+            if (index >= colors)
+                continue;
+            uint16_t color = (palette[index * 2] << 8) | palette[index * 2 + 1];
+            dma_display->drawPixel(x + pixel_index % width, y + pixel_index / width, color);
+        }
+    }
+
+    sendAck(CMD_DRAW_BITMAP_INDEXED, true, "");
+}
+
+void CommandHandler::releaseSpriteMemory(int sprite_id)
+{
+    Sprite &sprite = sprites[sprite_id];
+    if (sprite.size == 0)
+        return;
+
+    // Compact the sprite memory so free space is always at the end
+    uint32_t end = sprite.offset + sprite.size;
+    memmove(sprite_memory + sprite.offset, sprite_memory + end, sprite_memory_used - end);
+    for (int i = 0; i < MAX_SPRITES; i++)
+    {
+        if (sprites[i].size > 0 && sprites[i].offset > sprite.offset)
+            sprites[i].offset -= sprite.size;
     }
+    sprite_memory_used -= sprite.size;
+    sprite.offset = 0;
+    sprite.size = 0;
+}
+
+bool CommandHandler::allocateSpriteMemory(int sprite_id, uint32_t size)
+{
+    if (size > SPRITE_MEMORY_SIZE - sprite_memory_used)
+        return false;
+
+    sprites[sprite_id].offset = sprite_memory_used;
+    sprites[sprite_id].size = size;
+    sprite_memory_used += size;
+    return true;
 }
 
 void CommandHandler::clearSpriteArea(int sprite_id)
@@ -506,20 +1570,49 @@ void CommandHandler::drawSpriteAt(int sprite_id, int x, int y)
     }
 
     // Draw the sprite at the new position
-    for (int py = 0; py < sprite.height; py++)
+    drawSpriteRect(sprite_id, 0, 0, sprite.width, sprite.height, x, y);
+
+    // Update position tracking
+    sprite.last_x = x;
+    sprite.last_y = y;
+}
+
+void CommandHandler::drawSpriteRect(int sprite_id, int src_x, int src_y, int width, int height, int x, int y)
+{
+    Sprite &sprite = sprites[sprite_id];
+
+    // Clip the source rectangle to the sprite
+    if (src_x + width > sprite.width)
+        width = sprite.width - src_x;
+    if (src_y + height > sprite.height)
+        height = sprite.height - src_y;
+
+    const uint8_t *data = sprite_memory + sprite.offset;
+    if (sprite.bpp == 16)
     {
-        for (int px = 0; px < sprite.width; px++)
+        // Opaque: convert each row and draw it in one call
+        for (int py = 0; py < height; py++)
         {
-            int pixel_index = (py * sprite.width + px) * 2;
-            if (pixel_index + 1 < sprite.width * sprite.height * 2)
-            {
-                uint16_t color = (sprite.data[pixel_index] << 8) | sprite.data[pixel_index + 1];
-                dma_display->drawPixel(x + px, y + py, color);
-            }
+            const uint8_t *pixel = data + ((src_y + py) * sprite.width + src_x) * 2;
+            for (int px = 0; px < width; px++, pixel += 2)
+                bitmap_row[px] = (pixel[0] << 8) | pixel[1];
+            dma_display->drawRGBBitmap(x, y + py, bitmap_row, width, 1);
         }
+        return;
     }
 
-    // Update position tracking
-    sprite.last_x = x;
-    sprite.last_y = y;
+    // Indices past the palette are transparent, so draw pixel by pixel
+    const uint8_t *indices = data + sprite.palette_size * 2;
+    for (int py = 0; py < height; py++)
+    {
+        for (int px = 0; px < width; px++)
+        {
+            int pixel_index = (src_y + py) * sprite.width + src_x + px;
+            uint8_t index = paletteIndex(indices, pixel_index, sprite.bpp);
+            if (index >= sprite.palette_size)
+                continue;
+            uint16_t color = (data[index * 2] << 8) | data[index * 2 + 1];
+            dma_display->drawPixel(x + px, y + py, color);
+        }
+    }
 }
\ No newline at end of file
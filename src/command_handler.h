@@ -9,8 +9,36 @@
 #endif
 
 #define START_BYTE 0xAA
-#define MAX_SPRITES 16
-#define MAX_SPRITE_SIZE 64 * 64 * 2 // 64x64 pixels in RGB565 format
+#define ACK_BYTE 0xAC
+#define TIMED_ACK_BYTE 0xAD // ACK followed by receive and render time
+#define FRAMED_START_BYTE 0xAB // Packet with a sequence number and CRC-16 (framing v2)
+#define NAK_BYTE 0xAE          // A framed packet failed its CRC
+#define CHUNK_REQUEST_BYTE 0xAF // Send (again) a chunk of a framed bulk payload
+#define DEFAULT_BAUD_RATE 115200
+#define MIN_BAUD_RATE 9600
+#define MAX_BAUD_RATE 5000000
+#define BAUD_VERIFY_TIMEOUT_MS 1000 // Fall back unless a ping arrives at the new rate
+#define MAX_COMMAND_DATA 255       // Largest data section (LEN is a single byte)
+#define SERIAL_RX_BUFFER_SIZE 4096 // Hosts keep in-flight bytes below this
+#define FLOW_CONTROL_CHUNK 128     // Default bulk payload bytes per 0xFF ready signal
+#define MIN_FLOW_CHUNK 16
+#define MAX_FLOW_CREDITS (SERIAL_RX_BUFFER_SIZE / MIN_FLOW_CHUNK)
+#define ACK_HISTORY 16       // Framed ACKs kept to answer retransmitted packets
+#define MAX_CHUNK_RETRIES 16 // Corrupted chunks in a row before a framed bulk payload is given up
+#define CHUNK_RESEND_MS 100  // Request a chunk again if it has not started to arrive by then
+#define STREAM_TIMEOUT_MS 1000 // Serial.readBytes() timeout (the Arduino default)
+#define SKIP_QUIET_MS 50 // Silence that ends the payload of a rejected bulk header
+#define MAX_ACK_FRAME_SIZE (7 + 255 + 8 + 2) // Framed timed ACK with a 255 byte message
+#define MAX_BITMAP_WIDTH 255 // Bitmap widths are a single byte
+#define MAX_SPRITES 64
+#define SPRITE_MEMORY_SIZE (16 * 64 * 64 * 2) // Shared by all sprites: 16 64x64 RGB565 sprites
+#define MAX_ANIMATIONS 4
+#define MAX_ANIMATION_FRAMES 32
+#define MAX_STATS_OPCODE 0x3F // Telemetry counters cover opcodes up to this
+
+// TELEMETRY_FLAGS of CMD_SET_TELEMETRY
+#define TELEMETRY_ENABLE 0x01 // Time commands and send timed ACKs
+#define TELEMETRY_RESET 0x02  // Zero the per-opcode counters
 
 // Sprite structure
 struct Sprite
@@ -18,8 +46,48 @@ struct Sprite
     bool active;
     int x, y;
     int width, height;
-    uint8_t data[MAX_SPRITE_SIZE];
-    int last_x, last_y; // For tracking position changes
+    uint8_t bpp;           // 16 for RGB565, else bits per palette index
+    uint16_t palette_size; // RGB565 palette entries in front of the indices
+    uint32_t offset;       // Start of the sprite data in sprite memory
+    uint32_t size;         // Bytes of sprite memory in use
+    uint32_t crc;          // CRC-32 of the sprite data, identifies the image
+    int last_x, last_y;    // For tracking position changes
+};
+
+// Cumulative telemetry of one opcode
+struct CommandStats
+{
+    uint32_t count;
+    uint32_t failures;
+    uint64_t receive_us; // Waiting for and reading the packet and its payload
+    uint64_t render_us;  // Everything else up to the ACK
+    uint32_t max_us;     // Slowest receive + render
+};
+
+// ACK of a framed packet, replayed if the same packet arrives again
+struct FramedAck
+{
+    bool valid;
+    uint8_t seq;
+    uint16_t packet_crc; // CRC-16 of the packet it answers
+    uint16_t size;
+    uint8_t frame[MAX_ACK_FRAME_SIZE];
+};
+
+// Sprite frames played by the device itself
+struct Animation
+{
+    bool defined;
+    bool playing;
+    bool loop;
+    int x, y;
+    uint8_t frame_count;
+    uint8_t sprite_ids[MAX_ANIMATION_FRAMES];
+    uint16_t durations[MAX_ANIMATION_FRAMES]; // Milliseconds per frame
+    uint8_t current;
+    unsigned long frame_started;       // millis() when the current frame was due
+    int drawn_x, drawn_y;              // Area of the frame on screen
+    int drawn_width, drawn_height;
 };
 
 enum CommandType : uint8_t
@@ -42,6 +110,46 @@ enum CommandType : uint8_t
     CMD_CLEAR_SPRITE = 0x0F,
     CMD_DRAW_SPRITE = 0x10,
     CMD_MOVE_SPRITE = 0x11,
+    // Several drawing commands in one packet
+    CMD_BATCH = 0x12,
+    // Run-length encoded RGB565 bitmap
+    CMD_DRAW_BITMAP_RLE = 0x13,
+    // Palette-indexed bitmap and sprite
+    CMD_DRAW_BITMAP_INDEXED = 0x14,
+    CMD_SET_SPRITE_INDEXED = 0x15,
+    // Bulk transfer flow control window
+    CMD_FLOW_CONFIG = 0x16,
+    // Link management
+    CMD_SET_BAUD = 0x17,
+    CMD_PING = 0x18,
+    // Sprite cache
+    CMD_QUERY_SPRITE = 0x19,
+    CMD_REUSE_SPRITE = 0x1A,
+    // Part of a sprite, e.g. one frame of a sprite sheet
+    CMD_DRAW_SPRITE_RECT = 0x1B,
+    // Device-side animation playback
+    CMD_SET_ANIMATION = 0x1C,
+    CMD_ANIMATION_CONTROL = 0x1D,
+    CMD_MOVE_ANIMATION = 0x1E,
+    // Execution timing
+    CMD_SET_TELEMETRY = 0x1F,
+    CMD_QUERY_STATS = 0x20,
+};
+
+// ACTION of CMD_ANIMATION_CONTROL
+enum AnimationAction : uint8_t
+{
+    ANIMATION_STOP = 0,       // Stop, leaving the current frame on screen
+    ANIMATION_START = 1,      // Play from the first frame
+    ANIMATION_RESUME = 2,     // Play from the current frame
+    ANIMATION_STOP_CLEAR = 3, // Stop and clear the frame from the screen
+};
+
+// Progress through a bulk payload that is received with flow control
+struct PayloadReader
+{
+    size_t total;
+    size_t received;
 };
 
 class CommandHandler
@@ -49,11 +157,71 @@ class CommandHandler
 public:
     CommandHandler(MatrixPanel_I2S_DMA *display);
     void handleCommand();
+    bool commandPending(); // A packet header is waiting to be handled
+    void update(); // Advance animations; call from loop()
 
 private:
     MatrixPanel_I2S_DMA *dma_display;
     Sprite sprites[MAX_SPRITES];
+    uint8_t sprite_memory[SPRITE_MEMORY_SIZE];
+    uint32_t sprite_memory_used;
+    uint16_t bitmap_row[MAX_BITMAP_WIDTH]; // One bitmap or sprite row, reused
+    uint16_t flow_chunk;  // Bulk payload bytes per credit
+    uint8_t flow_credits; // Chunks the sender may send before the first 0xFF
+    uint32_t baud_rate;
+    Animation animations[MAX_ANIMATIONS];
+    bool telemetry;
+    unsigned long packet_started; // micros() when the packet header was read
+    unsigned long receive_micros; // Spent receiving the current packet
+    CommandStats stats[MAX_STATS_OPCODE + 1];
+    // Framing v2: the current packet's SEQ and the ACKs of recent ones
+    bool framed;
+    bool resync_framed; // A framed header failed its check; skip to the next one
+    uint8_t framed_seq;
+    uint16_t framed_crc;
+    FramedAck acks[ACK_HISTORY];
+    uint8_t next_ack;
+    // Bulk payload of a framed packet: chunks are requested by number,
+    // checked, requested again when corrupted and put back in order before
+    // the command reads them
+    bool chunks_started;
+    uint16_t chunks_granted;                  // Chunks requested so far
+    uint16_t chunks_read;                     // Chunks handed to readPayload()
+    uint16_t chunk_slots[MAX_FLOW_CREDITS];   // Chunk held by each slot of chunk_buffer
+    uint16_t chunk_queue[MAX_FLOW_CREDITS];   // Requested chunks not in yet, in request order
+    uint16_t queue_head, queue_count;
+    uint8_t chunk_retries;
+    size_t chunk_offset, chunk_pos, chunk_size; // Chunk being read
+    uint8_t chunk_buffer[SERIAL_RX_BUFFER_SIZE];
+    uint8_t chunk_frame[2 + SERIAL_RX_BUFFER_SIZE + 2]; // CHUNK + DATA + CRC-16 as received
+    bool readPacket(uint8_t &cmd, uint8_t *data, uint8_t &len, bool reply = true);
     void sendAck(uint8_t cmd, bool success, const char *message = nullptr);
+    void sendNak(uint8_t type, uint16_t number);
+    bool replayAck();
+    bool executeCommand(uint8_t cmd, const uint8_t *data, uint8_t len, const char *&message);
+    void handleBatch(const uint8_t *data, uint8_t len);
+    void handleSetBaud(const uint8_t *data, uint8_t len);
+    bool waitForPing(unsigned long timeout_ms);
+    void handleBitmap(const uint8_t *data, uint8_t len);
+    void handleBitmapRle(const uint8_t *data, uint8_t len);
+    void handleBitmapIndexed(const uint8_t *data, uint8_t len);
+    void handleSetSprite(uint8_t cmd, const uint8_t *data, uint8_t len);
+    void startTiming();
+    bool queryStats(const uint8_t *data, uint8_t len, const char *&message);
+    bool readPayload(PayloadReader &reader, uint8_t *buffer, size_t len);
+    bool readFramedPayload(PayloadReader &reader, uint8_t *buffer, size_t len);
+    void grantChunk(const PayloadReader &reader);
+    bool nextChunk(const PayloadReader &reader);
+    bool waitForChunk();
+    void dropChunk(uint16_t chunk);
+    bool skipPayload(PayloadReader &reader);
+    void skipGrantedPayload();
+    void releaseSpriteMemory(int sprite_id);
+    bool allocateSpriteMemory(int sprite_id, uint32_t size);
     void clearSpriteArea(int sprite_id);
     void drawSpriteAt(int sprite_id, int x, int y);
+    void drawSpriteRect(int sprite_id, int src_x, int src_y, int width, int height, int x, int y);
+    bool setAnimation(const uint8_t *data, uint8_t len, const char *&message);
+    void drawAnimationFrame(Animation &animation);
+    void clearAnimationArea(Animation &animation);
 };
\ No newline at end of file
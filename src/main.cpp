@@ -20,7 +20,14 @@
 #define PANEL_CHAIN 1  // Total number of panels chained one to another
 
 #ifdef SIMULATOR
+#include <signal.h>
+
 SimMatrixPanel *dma_display = nullptr;
+bool headless = false;                     // --headless: no window, no frame delay
+const char *dump_path = "framebuffer.ppm"; // --dump PATH
+bool dump_on_exit = false;
+volatile sig_atomic_t dump_requested = 0; // Set by SIGUSR1
+volatile sig_atomic_t quit_requested = 0; // Set by SIGINT and SIGTERM
 #else
 #if defined(WF1)
 HUB75_I2S_CFG::i2s_pins _pins_x1 = {WF1_R1_PIN, WF1_G1_PIN, WF1_B1_PIN, WF1_R2_PIN, WF1_G2_PIN, WF1_B2_PIN, WF1_A_PIN, WF1_B_PIN, WF1_C_PIN, WF1_D_PIN, WF1_E_PIN, WF1_LAT_PIN, WF1_OE_PIN, WF1_CLK_PIN};
@@ -44,7 +51,7 @@ void setupMatrix()
 {
 #ifdef SIMULATOR
     dma_display = new SimMatrixPanel(PANEL_RES_X, PANEL_RES_Y);
-    dma_display->begin();
+    dma_display->begin(headless);
 #else
     // Module configuration
     HUB75_I2S_CFG mxconfig(
@@ -69,7 +76,12 @@ void setupMatrix()
 
 void setup()
 {
-    Serial.begin(115200);
+#ifndef SIMULATOR
+    Serial.setRxBufferSize(SERIAL_RX_BUFFER_SIZE); // Must be set before begin()
+#else
+    setvbuf(stdout, nullptr, _IOLBF, 0); // Report the serial port at once when piped
+#endif
+    Serial.begin(DEFAULT_BAUD_RATE);
     setupMatrix();
 
 #ifdef SIMULATOR
@@ -128,30 +140,69 @@ void loop()
     }
 #endif
     commandHandler->handleCommand();
+    commandHandler->update();
 }
 
 #ifdef SIMULATOR
-int main() {
+void dumpFramebuffer()
+{
+    if (dma_display->savePPM(dump_path))
+        printf("Framebuffer written to %s\n", dump_path);
+}
+
+int main(int argc, char **argv) {
+    for (int i = 1; i < argc; i++) {
+        if (strcmp(argv[i], "--headless") == 0) {
+            headless = true;
+        } else if (strcmp(argv[i], "--dump") == 0 && i + 1 < argc) {
+            dump_path = argv[++i];
+            dump_on_exit = true;
+        } else {
+            fprintf(stderr, "Usage: %s [--headless] [--dump PATH]\n", argv[0]);
+            return 1;
+        }
+    }
+
+    // SIGUSR1 dumps the framebuffer; SIGINT and SIGTERM exit cleanly so the
+    // final frame can be dumped too
+    signal(SIGUSR1, [](int) { dump_requested = 1; });
+    signal(SIGINT, [](int) { quit_requested = 1; });
+    signal(SIGTERM, [](int) { quit_requested = 1; });
+
     setup();
     
-    while (true) {
+    while (!quit_requested) {
         // Handle SDL events
         SDL_Event event;
-        while (SDL_PollEvent(&event)) {
+        while (!headless && SDL_PollEvent(&event)) {
             if (event.type == SDL_QUIT) {
-                SDL_Quit();
-                return 0;
+                quit_requested = 1;
             }
         }
         
-        // Handle commands (non-blocking)
-        commandHandler->handleCommand();
-        
-        // Present the display regularly
-        dma_display->present();
-        
-        SDL_Delay(16); // ~60 FPS
+        // Handle every packet that has arrived, not one per frame
+        do {
+            commandHandler->handleCommand();
+            commandHandler->update();
+        } while (commandHandler->commandPending() && !quit_requested);
+
+        if (dump_requested) {
+            dump_requested = 0;
+            dumpFramebuffer();
+        }
+
+        if (headless) {
+            Serial.waitForData(1); // Wake for the next packet or animation tick
+        } else {
+            // Present the display regularly
+            dma_display->present();
+            SDL_Delay(16); // ~60 FPS
+        }
     }
+
+    if (dump_on_exit)
+        dumpFramebuffer();
+    delete dma_display;
     return 0;
 }
 #endif